@@ -0,0 +1,77 @@
+# bot/blocked.py
+"""
+Кеш флага telegram_users.is_blocked в памяти процесса бота.
+
+Каждое нажатие кнопки начинается с проверки бана; без кеша это лишний
+запрос к БД на каждый апдейт. Значения живут ttl секунд, а изменение
+TelegramUser.is_blocked в Django (админка) сбрасывает запись сразу:
+core/signals.py делает pg_notify(BLOCKED_CHANNEL, '<user_id>'),
+кеш слушает канал через bot.listener.PgListener.
+
+Массовые QuerySet.update() сигналов не вызывают — для них остаётся TTL.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from typing import Callable, Optional
+
+log = logging.getLogger("bot.blocked")
+
+BLOCKED_CHANNEL = "telegram_user_blocked"
+
+SQL_IS_BLOCKED = "SELECT is_blocked FROM telegram_users WHERE user_id = $1 LIMIT 1"
+
+
+class BlockedUsersCache:
+    """user_id → is_blocked с TTL и push-инвалидацией через LISTEN/NOTIFY."""
+
+    def __init__(self, ttl: float = 60.0, maxsize: int = 100_000, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._clock = clock
+        self._data: dict[int, tuple[bool, float]] = {}
+
+    async def is_blocked(self, pool, user_id: int) -> bool:
+        now = self._clock()
+        cached = self._data.get(user_id)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        value = bool(await pool.fetchval(SQL_IS_BLOCKED, user_id) or False)
+        self.set(user_id, value)
+        return value
+
+    def set(self, user_id: int, value: bool) -> None:
+        """Положить значение, полученное другим запросом (например, статусом подписки)."""
+        now = self._clock()
+        if len(self._data) >= self.maxsize:
+            self._evict(now)
+        self._data[user_id] = (bool(value), now + self.ttl)
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        """Сбросить запись пользователя (None — весь кеш)."""
+        if user_id is None:
+            self._data.clear()
+        else:
+            self._data.pop(user_id, None)
+
+    def _evict(self, now: float) -> None:
+        self._data = {k: v for k, v in self._data.items() if v[1] > now}
+        if len(self._data) >= self.maxsize:
+            self._data.clear()
+
+    # ---------- LISTEN/NOTIFY ----------
+    def on_notify(self, payload: str) -> None:
+        try:
+            user_id = int(payload)
+        except (TypeError, ValueError):
+            # Непонятный payload — безопаснее сбросить всё
+            self.invalidate()
+            return
+        self.invalidate(user_id)
+        log.info("blocked cache invalidated: user_id=%s", user_id)
+
+    def subscribe(self, listener) -> None:
+        """Подписка на BLOCKED_CHANNEL через bot.listener.PgListener."""
+        listener.subscribe(BLOCKED_CHANNEL, self.on_notify, on_lost=self.invalidate)
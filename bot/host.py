@@ -0,0 +1,223 @@
+# bot/host.py
+"""
+Мульти-бот хост: все включённые Bot обслуживаются одним asyncio-процессом.
+
+Один aiohttp-сервер, один asyncpg-пул, одна HTTP-сессия к Telegram.
+Каждый бот получает свой Dispatcher, а вебхуки маршрутизируются по пути
+/tg/bot-<bot_id>/webhook (тот же путь, что публикуется в Telegram и в nginx).
+Новые боты из админки подхватываются периодическим sync() без рестарта.
+С queue=ChatOrderedQueue апдейты обрабатываются общим пулом воркеров
+с сохранением порядка внутри чата (см. bot/workers.py).
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, Optional
+
+from aiogram import Bot as AioBot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+from asgiref.sync import sync_to_async
+
+from bot.blocked import BlockedUsersCache
+from bot.subscriptions import register as register_subs
+from bot.workers import ChatOrderedQueue, QueuedRequestHandler
+from core.models import Bot as BotModel
+from subscriptions.catalog import PlanCatalog
+from leads.bot import register_handlers as register_lead_handlers
+
+log = logging.getLogger("bot.host")
+
+WEBHOOK_PATH = "/tg/bot-{bot_id}/webhook"
+
+
+def webhook_url(bot_model: BotModel) -> str:
+    """Публичный URL вебхука бота (nginx проксирует его в хост как есть)."""
+    return f"https://{bot_model.domain_name}" + WEBHOOK_PATH.format(bot_id=bot_model.bot_id)
+
+
+def build_dispatcher(
+    bot_model: BotModel,
+    *,
+    pool,
+    session,
+    blocked_cache: Optional[BlockedUsersCache] = None,
+    catalog: Optional[PlanCatalog] = None,
+) -> Dispatcher:
+    """Dispatcher с handlers, выбранными по bot_id (как в одиночном раннере)."""
+    dp = Dispatcher()
+
+    if bot_model.bot_id == 2:
+        # bot_2 - handlers лидов
+        register_lead_handlers(dp, bot_id=bot_model.bot_id)
+    else:
+        # bot_1 и остальные - handlers подписок
+        register_subs(
+            dp, pool=pool, session=session, bot_model=bot_model,
+            blocked_cache=blocked_cache, catalog=catalog,
+        )
+
+    return dp
+
+
+def load_enabled_bots(bot_ids: Optional[Iterable[int]] = None) -> list[BotModel]:
+    """Включённые боты с merchant_config; bot_ids — фильтр по Bot.bot_id."""
+    qs = BotModel.objects.select_related("merchant_config").filter(is_enabled=True).exclude(token="")
+    if bot_ids:
+        qs = qs.filter(bot_id__in=list(bot_ids))
+    return list(qs.order_by("bot_id"))
+
+
+@dataclass
+class HostedBot:
+    model: BotModel
+    bot: AioBot
+    dp: Dispatcher
+    handler: SimpleRequestHandler
+    updated_at: datetime
+
+
+class BotHost:
+    """
+    Реестр запущенных ботов + aiohttp-маршрут вебхуков.
+
+    Маршрут один: /tg/bot-{bot_id}/webhook. Бот ищется в self.bots по bot_id,
+    поэтому добавление/удаление ботов не требует перестройки роутера aiohttp.
+    """
+
+    def __init__(
+        self,
+        *,
+        pool,
+        session,
+        bot_ids: Optional[Iterable[int]] = None,
+        set_webhooks: bool = True,
+        queue: Optional[ChatOrderedQueue] = None,
+        blocked_cache: Optional[BlockedUsersCache] = None,
+        catalog: Optional[PlanCatalog] = None,
+    ):
+        self.pool = pool
+        self.session = session
+        self.bot_ids = set(bot_ids) if bot_ids else None
+        self.set_webhooks = set_webhooks
+        self.queue = queue
+        # Один кеш банов на процесс: is_blocked не зависит от бота
+        self.blocked_cache = blocked_cache
+        self.catalog = catalog
+        self.bots: dict[int, HostedBot] = {}
+        # Общая HTTP-сессия к Telegram API для всех AioBot
+        self.tg_session = AiohttpSession()
+        self._lock = asyncio.Lock()
+
+    # ---------- aiohttp ----------
+    def setup(self, app: web.Application) -> None:
+        app.router.add_post(WEBHOOK_PATH.format(bot_id=r"{bot_id:\d+}"), self.handle)
+        app.on_startup.append(self._on_startup)
+        app.on_shutdown.append(self._on_shutdown)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        hosted = self.bots.get(int(request.match_info["bot_id"]))
+        if hosted is None:
+            raise web.HTTPNotFound()
+        return await hosted.handler.handle(request)
+
+    # ---------- lifecycle ----------
+    async def add(self, bot_model: BotModel) -> HostedBot:
+        dp = build_dispatcher(
+            bot_model, pool=self.pool, session=self.session,
+            blocked_cache=self.blocked_cache, catalog=self.catalog,
+        )
+        bot = AioBot(
+            token=bot_model.token,
+            session=self.tg_session,
+            default=DefaultBotProperties(parse_mode="HTML"),
+        )
+        hosted = HostedBot(
+            model=bot_model,
+            bot=bot,
+            dp=dp,
+            handler=self._make_handler(bot_model, dp, bot),
+            updated_at=bot_model.updated_at,
+        )
+        await dp.emit_startup(bot=bot, dispatcher=dp)
+
+        if self.set_webhooks:
+            await bot.set_webhook(webhook_url(bot_model), allowed_updates=dp.resolve_used_update_types())
+
+        self.bots[bot_model.bot_id] = hosted
+        log.info("[HOST] bot added: bot_id=%s username=@%s webhook=%s",
+                 bot_model.bot_id, bot_model.username, webhook_url(bot_model))
+        return hosted
+
+    def _make_handler(self, bot_model: BotModel, dp: Dispatcher, bot: AioBot) -> SimpleRequestHandler:
+        if self.queue is None:
+            return SimpleRequestHandler(dispatcher=dp, bot=bot)
+        # Общая очередь на все боты; ключ (bot_id, chat_id) — порядок внутри чата конкретного бота
+        return QueuedRequestHandler(dispatcher=dp, bot=bot, queue=self.queue, key_prefix=bot_model.bot_id)
+
+    async def remove(self, bot_id: int, *, delete_webhook: bool = False) -> None:
+        """
+        Убрать бота из реестра. delete_webhook — снять вебхук в Telegram
+        (бот выключен в админке); при остановке хоста вебхуки остаются.
+        """
+        hosted = self.bots.pop(bot_id, None)
+        if hosted is None:
+            return
+        if delete_webhook and self.set_webhooks:
+            try:
+                await hosted.bot.delete_webhook()
+            except Exception:
+                log.exception("[HOST] failed to delete webhook: bot_id=%s", bot_id)
+        await self._stop(hosted)
+
+    async def _stop(self, hosted: HostedBot) -> None:
+        # handler.close() не вызываем: он закрыл бы общую tg_session
+        await hosted.dp.emit_shutdown(bot=hosted.bot, dispatcher=hosted.dp)
+        log.info("[HOST] bot stopped: bot_id=%s", hosted.model.bot_id)
+
+    async def sync(self) -> None:
+        """Сверить реестр с таблицей bots: добавить новые, убрать выключенные, пересоздать изменённые."""
+        async with self._lock:
+            models = await sync_to_async(load_enabled_bots)(self.bot_ids)
+            wanted = {m.bot_id: m for m in models}
+
+            for bot_id in list(self.bots):
+                if bot_id not in wanted:
+                    await self.remove(bot_id, delete_webhook=True)
+
+            for bot_id, model in wanted.items():
+                old = self.bots.get(bot_id)
+                if old is not None and old.updated_at == model.updated_at:
+                    continue
+                # Сначала поднимаем новую версию, старую гасим только после успеха:
+                # если бот не стартовал, он продолжит работать со старым конфигом.
+                try:
+                    await self.add(model)
+                except Exception:
+                    log.exception("[HOST] failed to start bot_id=%s", bot_id)
+                    continue
+                if old is not None:
+                    await self._stop(old)
+
+    async def refresh_forever(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sync()
+            except Exception:
+                log.exception("[HOST] refresh failed")
+
+    async def _on_startup(self, _app: web.Application) -> None:
+        if self.queue is not None:
+            self.queue.start()
+
+    async def _on_shutdown(self, _app: web.Application) -> None:
+        if self.queue is not None:
+            # Дорабатываем уже принятые апдейты, пока диспетчеры ещё живы
+            await self.queue.close()
+        for bot_id in list(self.bots):
+            await self.remove(bot_id)
+        await self.tg_session.close()
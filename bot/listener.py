@@ -0,0 +1,151 @@
+# bot/listener.py
+"""
+LISTEN/NOTIFY для кешей процесса бота.
+
+Одно соединение asyncpg-пула обслуживает все каналы: кеши подписываются
+через subscribe(channel, callback), callback получает payload (строку).
+При обрыве соединения вызываются on_lost — уведомления могли потеряться,
+кеши сбрасываются целиком. Мёртвое соединение возвращается в пул, а
+фоновая задача переподключается с экспоненциальной паузой (min_backoff ..
+max_backoff), заново делает LISTEN на все каналы и ещё раз вызывает
+on_lost: за время обрыва NOTIFY не доходили. Пока соединения нет, кеши
+живут по своему TTL.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+log = logging.getLogger("bot.listener")
+
+
+class PgListener:
+    def __init__(
+        self,
+        *,
+        min_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ):
+        self._callbacks: dict[str, list[Callable[[str], None]]] = {}
+        self._on_lost: list[Callable[[], None]] = []
+        self._conn = None
+        self._pool = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._closed = False
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._sleep = sleep
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None
+
+    def subscribe(
+        self,
+        channel: str,
+        callback: Callable[[str], None],
+        on_lost: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self._callbacks.setdefault(channel, []).append(callback)
+        if on_lost is not None:
+            self._on_lost.append(on_lost)
+
+    def _dispatch(self, _conn, _pid, channel: str, payload: str) -> None:
+        for callback in self._callbacks.get(channel, ()):
+            try:
+                callback(payload)
+            except Exception:
+                log.exception("notify handler failed: channel=%s payload=%r", channel, payload)
+
+    def _invalidate_all(self) -> None:
+        for on_lost in self._on_lost:
+            try:
+                on_lost()
+            except Exception:
+                log.exception("on_lost handler failed")
+
+    def _connection_lost(self, conn) -> None:
+        if conn is not self._conn:
+            return
+        log.warning("LISTEN connection lost, caches cleared")
+        self._conn = None
+        self._invalidate_all()
+        if not self._closed:
+            self._schedule_reconnect(dead=conn)
+
+    async def _connect(self) -> None:
+        conn = await self._pool.acquire()
+        try:
+            for channel in self._callbacks:
+                await conn.add_listener(channel, self._dispatch)
+            conn.add_termination_listener(self._connection_lost)
+        except Exception:
+            await self._release(conn)
+            raise
+        self._conn = conn
+
+    async def _release(self, conn) -> None:
+        try:
+            await self._pool.release(conn)
+        except Exception:
+            log.debug("release of LISTEN connection failed", exc_info=True)
+
+    def _schedule_reconnect(self, dead=None) -> None:
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect(dead))
+
+    async def _reconnect(self, dead=None) -> None:
+        if dead is not None:
+            # Мёртвое соединение — обратно в пул (asyncpg закроет его и откроет новое)
+            await self._release(dead)
+        delay = self.min_backoff
+        while not self._closed and self._conn is None:
+            await self._sleep(delay)
+            if self._closed:
+                return
+            try:
+                await self._connect()
+            except Exception as e:
+                delay = min(delay * 2, self.max_backoff)
+                log.warning("LISTEN reconnect failed, retry in %ss: %s", delay, e)
+                continue
+            log.info("LISTEN connection restored: %s", ", ".join(self._callbacks))
+            # NOTIFY за время обрыва потеряны
+            self._invalidate_all()
+
+    async def start(self, pool) -> None:
+        """
+        LISTEN на все подписанные каналы (держит одно соединение пула).
+        Если соединиться не удалось, исключение пробрасывается, а переподключение
+        продолжается в фоне.
+        """
+        if self._conn is not None or not self._callbacks:
+            return
+        self._pool = pool
+        self._closed = False
+        try:
+            await self._connect()
+        except Exception:
+            self._schedule_reconnect()
+            raise
+
+    async def close(self) -> None:
+        self._closed = True
+        task, self._reconnect_task = self._reconnect_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            conn.remove_termination_listener(self._connection_lost)
+            for channel in self._callbacks:
+                await conn.remove_listener(channel, self._dispatch)
+        finally:
+            await self._pool.release(conn)
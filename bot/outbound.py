@@ -0,0 +1,352 @@
+# bot/outbound.py
+"""
+Общий планировщик исходящих сообщений в Telegram (на токен бота).
+
+Лимиты Telegram: ~30 сообщений/сек на бота, ~1 сообщение/сек в один чат,
+~20 сообщений/мин в группу. Все отправители (напоминания, контент, уведомления
+об оплате, лиды) берут токены из одних и тех же bucket'ов, поэтому массовые
+рассылки идут на максимально допустимой скорости и не ловят 429.
+
+Приоритеты: низкоприоритетные отправки не опустошают глобальный bucket до нуля,
+а оставляют запас (headroom) — его забирают подтверждения оплат. Очереди
+ожидающих нет: приоритет — только этот запас. Ждущие NOTIFY и CONTENT
+повторяют попытку каждый по своему таймеру, и порядок между ними не задан;
+гарантируется лишь, что PAYMENT/NOTIFY не упрутся в лимит, выбранный рассылкой.
+При 429 (retry_after) весь токен ставится на паузу, отправка повторяется.
+
+Лимиты на двух уровнях. Bucket'ы в памяти процесса сглаживают отправки
+внутри процесса без обращений к хранилищу. Поверх них SharedLimits держит
+бюджет токена, общий для всех процессов (хост ботов, Django, cron): GCRA из
+payments.ratelimit в Redis, ключи — хеш токена и хеш токена + chat_id.
+Работает только с Redis-бэкендом лимитера (OUTBOUND_SHARED_LIMITS="auto"):
+с таблицей payment_rate_limits каждая отправка стоила бы двух upsert'ов,
+один из них — по горячей строке токена, и отправки внутри transaction.atomic
+держали бы её блокировку до конца транзакции. Пауза по 429 остаётся
+локальной: другие процессы получат свой 429 и встанут на паузу сами.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+log = logging.getLogger("bot.outbound")
+
+T = TypeVar("T")
+
+# Значения по умолчанию — публичные лимиты Telegram Bot API
+GLOBAL_RATE = 30.0
+CHAT_RATE = 1.0
+CHAT_BURST = 3.0
+GROUP_RATE = 20.0 / 60.0
+MAX_RETRIES = 3
+
+
+class Priority(IntEnum):
+    """Чем меньше значение, тем выше приоритет."""
+    PAYMENT = 0
+    NOTIFY = 1
+    CONTENT = 2
+    REMINDER = 3
+
+
+# Доля глобального bucket'а, которую отправка данного приоритета обязана оставить свободной
+HEADROOM = {
+    Priority.PAYMENT: 0.0,
+    Priority.NOTIFY: 0.1,
+    Priority.CONTENT: 0.2,
+    Priority.REMINDER: 0.3,
+}
+
+
+class RetryAfter(Exception):
+    """429 от Telegram для синхронных клиентов (requests); aiogram бросает TelegramRetryAfter."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Flood control exceeded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Потокобезопасный token bucket: rate токенов в секунду, ёмкость burst."""
+
+    def __init__(self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self, cost: float = 1.0, keep: float = 0.0) -> float:
+        """
+        Забрать cost токенов, если после этого останется не меньше keep.
+        Возвращает 0.0 при успехе, иначе — сколько секунд подождать до следующей попытки.
+        """
+        with self._lock:
+            self._refill(self._clock())
+            need = cost + keep
+            if self._tokens >= need:
+                self._tokens -= cost
+                return 0.0
+            return (need - self._tokens) / self.rate
+
+    def give_back(self, cost: float = 1.0) -> None:
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + cost)
+
+    def is_full(self) -> bool:
+        with self._lock:
+            self._refill(self._clock())
+            return self._tokens >= self.burst
+
+
+class SharedLimits:
+    """
+    Лимиты токена, общие для процессов: RedisRateLimiter из payments.ratelimit.
+    take() — синхронный вызов Redis; из event loop его зовут через поток.
+    """
+
+    def __init__(
+        self,
+        limiter: Any,
+        token: str,
+        *,
+        global_rate: float = GLOBAL_RATE,
+        chat_rate: float = CHAT_RATE,
+        chat_burst: float = CHAT_BURST,
+        group_rate: float = GROUP_RATE,
+    ):
+        self.limiter = limiter
+        # Токен в хранилище не пишем
+        self.key = "tg:" + hashlib.sha256(token.encode()).hexdigest()[:16]
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+
+    def take(self, chat_id: Any, priority: Priority = Priority.NOTIFY) -> float:
+        """0.0 — слот получен, иначе — сколько ждать до следующей попытки."""
+        # GCRA: limit за period = всплеск limit и скорость limit/period
+        if isinstance(chat_id, int) and chat_id < 0:
+            limit, period = 1, 1.0 / self.group_rate
+        else:
+            limit = max(1, int(self.chat_burst))
+            period = limit / self.chat_rate
+        try:
+            if not self.limiter.hit(f"{self.key}:{chat_id}", limit, period):
+                return period / limit
+            limit = max(1, int(self.global_rate))
+            if not self.limiter.hit(self.key, limit, 1.0, keep=HEADROOM.get(priority, 0.0)):
+                # Слот чата уже списан: GCRA не возвращает, повтор чуть позже
+                return 1.0 / limit
+        except Exception:
+            # Хранилище недоступно — остаются лимиты процесса
+            log.warning("shared outbound limit unavailable", exc_info=True)
+        return 0.0
+
+
+class OutboundDispatcher:
+    """Лимитер исходящих вызовов Bot API для одного токена."""
+
+    # Сколько per-chat bucket'ов держать до чистки полностью восстановившихся
+    MAX_CHAT_BUCKETS = 10_000
+
+    def __init__(
+        self,
+        *,
+        global_rate: float = GLOBAL_RATE,
+        chat_rate: float = CHAT_RATE,
+        chat_burst: float = CHAT_BURST,
+        group_rate: float = GROUP_RATE,
+        max_retries: int = MAX_RETRIES,
+        clock: Callable[[], float] = time.monotonic,
+        shared: Optional[SharedLimits] = None,
+    ):
+        self.clock = clock
+        self.shared = shared
+        self.global_bucket = TokenBucket(global_rate, global_rate, clock)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._chats: dict[Any, TokenBucket] = {}
+        self._chats_lock = threading.Lock()
+        self._paused_until = 0.0
+
+    # ---------- лимиты ----------
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        with self._chats_lock:
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                    self._chats = {k: b for k, b in self._chats.items() if not b.is_full()}
+                # Отрицательный chat_id — группа/канал: 20 сообщений в минуту
+                if isinstance(chat_id, int) and chat_id < 0:
+                    bucket = TokenBucket(self.group_rate, 1.0, self.clock)
+                else:
+                    bucket = TokenBucket(self.chat_rate, self.chat_burst, self.clock)
+                self._chats[chat_id] = bucket
+            return bucket
+
+    def pause(self, seconds: float) -> None:
+        """Пауза для всего токена (ответ 429 с retry_after)."""
+        until = self.clock() + float(seconds)
+        if until > self._paused_until:
+            self._paused_until = until
+        log.warning("telegram flood control: paused for %ss", seconds)
+
+    def reserve(self, chat_id: Any, priority: Priority = Priority.NOTIFY) -> float:
+        """
+        Одна попытка занять слот в bucket'ах процесса (без SharedLimits).
+        0.0 — можно отправлять, иначе — сколько ждать.
+        """
+        paused = self._paused_until - self.clock()
+        if paused > 0:
+            return paused
+
+        chat_bucket = self._chat_bucket(chat_id)
+        wait = chat_bucket.try_take()
+        if wait:
+            return wait
+
+        keep = self.global_bucket.burst * HEADROOM.get(priority, 0.0)
+        wait = self.global_bucket.try_take(keep=keep)
+        if wait:
+            # Слот чата не использован — возвращаем, чтобы не штрафовать повтор
+            chat_bucket.give_back()
+        return wait
+
+    def _take_shared(self, chat_id: Any, priority: Priority) -> float:
+        wait = self.shared.take(chat_id, priority)
+        if wait:
+            # Общий бюджет исчерпан другими процессами — слоты процесса не тратим
+            self._chat_bucket(chat_id).give_back()
+            self.global_bucket.give_back()
+        return wait
+
+    async def acquire(self, chat_id: Any, priority: Priority = Priority.NOTIFY) -> None:
+        while True:
+            wait = self.reserve(chat_id, priority)
+            if not wait and self.shared is not None:
+                # Клиент redis синхронный — не блокируем event loop
+                wait = await asyncio.to_thread(self._take_shared, chat_id, priority)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self, chat_id: Any, priority: Priority = Priority.NOTIFY) -> None:
+        while True:
+            wait = self.reserve(chat_id, priority)
+            if not wait and self.shared is not None:
+                wait = self._take_shared(chat_id, priority)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    # ---------- отправка ----------
+    def _retry_after(self, exc: Exception, attempt: int, max_wait: Optional[float]) -> Optional[float]:
+        retry_after = getattr(exc, "retry_after", None)
+        if retry_after is None:
+            return None
+        # Пауза нужна всем отправителям токена, даже если этот вызов повторять не будем
+        self.pause(retry_after)
+        if attempt >= self.max_retries or (max_wait is not None and retry_after > max_wait):
+            return None
+        return float(retry_after)
+
+    async def send(
+        self,
+        chat_id: Any,
+        call: Callable[[], Awaitable[T]],
+        priority: Priority = Priority.NOTIFY,
+        max_wait: Optional[float] = None,
+    ) -> T:
+        """
+        Выполнить call() (корутину Bot API) в рамках лимитов; 429 → пауза и повтор.
+        max_wait — не повторять, если Telegram просит ждать дольше (исключение пробрасывается).
+        """
+        attempt = 0
+        while True:
+            await self.acquire(chat_id, priority)
+            try:
+                return await call()
+            except Exception as exc:
+                if self._retry_after(exc, attempt, max_wait) is None:
+                    raise
+                attempt += 1
+
+    def send_sync(
+        self,
+        chat_id: Any,
+        call: Callable[[], T],
+        priority: Priority = Priority.NOTIFY,
+        max_wait: Optional[float] = None,
+    ) -> T:
+        """Синхронный вариант send() для Django-кода."""
+        attempt = 0
+        while True:
+            self.acquire_sync(chat_id, priority)
+            try:
+                return call()
+            except Exception as exc:
+                if self._retry_after(exc, attempt, max_wait) is None:
+                    raise
+                attempt += 1
+
+
+class _Unlimited(OutboundDispatcher):
+    """Для bot_api без токена (моки, dry-run): вызов как есть, без лимитов и повторов."""
+
+    def reserve(self, chat_id: Any, priority: Priority = Priority.NOTIFY) -> float:
+        return 0.0
+
+    def pause(self, seconds: float) -> None:
+        pass
+
+
+_registry: dict[str, OutboundDispatcher] = {}
+_registry_lock = threading.Lock()
+_unlimited = _Unlimited(max_retries=0)
+
+
+def _shared_limits(token: str) -> Optional[SharedLimits]:
+    """SharedLimits по OUTBOUND_SHARED_LIMITS: "auto" (при Redis-бэкенде лимитера) или "off"."""
+    try:
+        from django.conf import settings
+        mode = getattr(settings, "OUTBOUND_SHARED_LIMITS", "auto")
+    except Exception:
+        # Django не настроен (скрипты, тесты без БД) — только лимиты процесса
+        return None
+    if mode == "off":
+        return None
+    from payments.ratelimit import backend_name, get_limiter
+
+    # Только Redis: LocMem-кеш не общий, а БД-бэкенд нагружает горячую строку токена
+    if backend_name() != "redis":
+        return None
+    return SharedLimits(get_limiter(), token)
+
+
+def get_outbound(bot_or_token: Any) -> OutboundDispatcher:
+    """
+    Dispatcher для токена бота: bucket'ы процесса плюс общий для процессов
+    бюджет (SharedLimits), если он включён.
+    Принимает токен или объект с атрибутом token (aiogram Bot); без токена — без лимитов.
+    """
+    token = bot_or_token if isinstance(bot_or_token, str) else getattr(bot_or_token, "token", None)
+    if not isinstance(token, str) or not token:
+        return _unlimited
+    with _registry_lock:
+        dispatcher = _registry.get(token)
+        if dispatcher is None:
+            dispatcher = _registry[token] = OutboundDispatcher(shared=_shared_limits(token))
+        return dispatcher
@@ -3,6 +3,8 @@ from __future__ import annotations
 from datetime import datetime, timezone
 from typing import Iterable, Any
 
+from bot.outbound import Priority, get_outbound
+
 # Кандидаты на напоминание (боевой SQL; в тестах FakePool.fetch вернёт моки и SQL игнорируется)
 SQL_EXPIRY_CANDIDATES = """
 SELECT
@@ -49,6 +51,7 @@ async def send_expiry_reminders(*, pool, bot_api, bot_id: int, days_ahead: int =
     except Exception:
         rows = await pool.fetch("", bot_id, days_ahead)
 
+    outbound = get_outbound(bot_api)
     sent = 0
     for rec in rows:
         tg_user_id = int(_get(rec, "tg_user_id"))
@@ -79,13 +82,17 @@ async def send_expiry_reminders(*, pool, bot_api, bot_id: int, days_ahead: int =
         if already:
             continue
 
-        # 4) Отправка
+        # 4) Отправка (через общий лимитер токена, самый низкий приоритет)
         text = (
             "⏰ Напоминание.\n"
             f"Подписка <b>{plan_name}</b> заканчивается {expires_on}.\n"
             "Продлите её в боте (Меню → «Продлить подписку»)."
         )
-        await bot_api.send_message(chat_id=tg_user_id, text=text, parse_mode="HTML")
+        await outbound.send(
+            tg_user_id,
+            lambda: bot_api.send_message(chat_id=tg_user_id, text=text, parse_mode="HTML"),
+            priority=Priority.REMINDER,
+        )
         sent += 1
 
         # 5) Пометка как отправленного
@@ -7,25 +7,34 @@ from aiogram import types
 from aiogram.filters import CommandStart
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-from bot.keyboards import kb_plans, kb_back, kb_main_menu
+from bot.blocked import SQL_IS_BLOCKED
+from bot.keyboards import _rec_get, kb_plans, kb_back, kb_main_menu
 
 log = logging.getLogger("bot.subscriptions")
 
 # --- SQL ---
+# Статус за один запрос: бан пользователя + последняя подписка бота (по updated_at).
+# LATERAL ... LIMIT 1 идёт по индексу subs_user_bot_updated_idx (index-only scan),
+# asyncpg кеширует подготовленный statement на каждом соединении пула.
+# Порядок колонок: 8 полей карточки статуса, затем is_blocked.
 SQL_SUB_STATUS = """
 SELECT s.status,
        s.starts_at AT TIME ZONE 'UTC' AS starts_at_utc,
        s.expires_at AT TIME ZONE 'UTC' AS expires_at_utc,
        s.last_payment_date AT TIME ZONE 'UTC' AS last_payment_utc,
-       p.name, p.price, p.currency, p.duration_days
-FROM subscriptions s
-JOIN subscription_plans p ON p.id = s.plan_id
-JOIN telegram_users t ON t.id = s.user_id
-WHERE s.bot_id = $1 AND t.user_id = $2
-ORDER BY s.updated_at DESC
-LIMIT 1
+       p.name, p.price, p.currency, p.duration_days,
+       t.is_blocked
+FROM telegram_users t
+LEFT JOIN LATERAL (
+    SELECT s.status, s.starts_at, s.expires_at, s.last_payment_date, s.plan_id
+    FROM subscriptions s
+    WHERE s.user_id = t.id AND s.bot_id = $1
+    ORDER BY s.updated_at DESC
+    LIMIT 1
+) s ON true
+LEFT JOIN subscription_plans p ON p.id = s.plan_id
+WHERE t.user_id = $2
 """
-SQL_IS_BLOCKED = "SELECT is_blocked FROM telegram_users WHERE user_id = $1 LIMIT 1"
 SQL_PLANS_ENABLED = """
 SELECT id, name, price, currency, duration_days, enabled
 FROM subscription_plans
@@ -33,15 +42,21 @@ WHERE bot_id=$1 AND enabled = true
 ORDER BY price ASC, duration_days ASC
 """
 
+async def is_user_blocked(pool, user_id: int, blocked_cache=None) -> bool:
+    """Проверка бана: через BlockedUsersCache, если он передан, иначе запросом в БД."""
+    if blocked_cache is not None:
+        return await blocked_cache.is_blocked(pool, user_id)
+    return await pool.fetchval(SQL_IS_BLOCKED, user_id) or False
+
 def format_dt_kyiv(dt_utc: datetime | None) -> str:
     if not dt_utc:
         return "—"
     return dt_utc.replace(tzinfo=dt_timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
 
 # --- HANDLERS ---
-async def cmd_start(message: types.Message, pool):
+async def cmd_start(message: types.Message, pool, blocked_cache=None):
     log.info("event=/start user_id=%s", message.from_user.id) 
-    is_blocked = await pool.fetchval(SQL_IS_BLOCKED, message.from_user.id) or False
+    is_blocked = await is_user_blocked(pool, message.from_user.id, blocked_cache)
     if is_blocked:
         await message.answer("⛔ Доступ запрещён.", reply_markup=kb_back())
         return
@@ -51,15 +66,20 @@ async def cmd_start(message: types.Message, pool):
         reply_markup=kb_main_menu()
     )
 
-async def on_status(cb: types.CallbackQuery, pool, bot_model):
-    is_blocked = await pool.fetchval(SQL_IS_BLOCKED, cb.from_user.id) or False
+async def on_status(cb: types.CallbackQuery, pool, bot_model, blocked_cache=None):
+    row = await pool.fetchrow(SQL_SUB_STATUS, bot_model.id, cb.from_user.id)
+
+    # Пользователя нет в telegram_users — не заблокирован и без подписки
+    is_blocked = bool(_rec_get(row, "is_blocked", False)) if row is not None else False
+    if blocked_cache is not None and row is not None:
+        # Флаг пришёл тем же запросом — освежаем кеш для остальных кнопок
+        blocked_cache.set(cb.from_user.id, is_blocked)
     if is_blocked:
         await cb.message.edit_text("⛔ Доступ запрещён.", reply_markup=kb_back())
         await cb.answer()
         return
 
-    row = await pool.fetchrow(SQL_SUB_STATUS, bot_model.id, cb.from_user.id)
-    if not row:
+    if not row or row[0] is None:
         await cb.message.edit_text(
             "Подписка не найдена. Нажмите «Продлить подписку» для оформления.",
             reply_markup=kb_main_menu()
@@ -67,7 +87,7 @@ async def on_status(cb: types.CallbackQuery, pool, bot_model):
         await cb.answer()
         return
 
-    status, starts_at, expires_at, last_pay, name, price, currency, dur = row
+    status, starts_at, expires_at, last_pay, name, price, currency, dur = tuple(row)[:8]
     text = (
         f"🧾 <b>Статус подписки</b>\n"
         f"План: <b>{name}</b>\n"
@@ -81,20 +101,26 @@ async def on_status(cb: types.CallbackQuery, pool, bot_model):
     await cb.message.edit_text(text, reply_markup=kb_main_menu(), parse_mode="HTML")
     await cb.answer()
 
-async def on_renew(cb: types.CallbackQuery, pool, bot_model):
-    blocked = await pool.fetchval(SQL_IS_BLOCKED, cb.from_user.id) or False
+async def on_renew(cb: types.CallbackQuery, pool, bot_model, blocked_cache=None, catalog=None):
+    blocked = await is_user_blocked(pool, cb.from_user.id, blocked_cache)
     if blocked:
         await cb.answer("Доступ запрещён", show_alert=True)
         return
 
-    rows = await pool.fetch(SQL_PLANS_ENABLED, bot_model.id)
-    plans = [r for r in rows if (r.get("enabled", True) if isinstance(r, dict) else getattr(r, "enabled", True))]
+    if catalog is not None:
+        # Тарифы и готовая клавиатура из кеша каталога (subscriptions/catalog.py)
+        plans = await catalog.aget(pool, bot_model.id)
+        kb = plans.keyboard if plans else None
+    else:
+        rows = await pool.fetch(SQL_PLANS_ENABLED, bot_model.id)
+        plans = [r for r in rows if (r.get("enabled", True) if isinstance(r, dict) else getattr(r, "enabled", True))]
+        kb = kb_plans(plans) if plans else None
+
     if not plans:
         await cb.message.edit_text("Нет доступных тарифов.", reply_markup=kb_back())
         await cb.answer()
         return
 
-    kb = kb_plans(plans)
     await cb.message.edit_text("Выберите тариф для продления:", reply_markup=kb)
     await cb.answer()
 
@@ -106,34 +132,43 @@ async def on_pay(cb: types.CallbackQuery, session, bot_model):
         await cb.answer("Некорректный тариф", show_alert=True)
         return
 
-    log.info(f"DEBUG: bot_model.id = {bot_model.id}")
-    log.info(f"DEBUG: django_api_base = {bot_model.merchant_config.django_api_base}")
-    
-
-    payload = {"bot_id": bot_model.id, "user_id": cb.from_user.id, "plan_id": plan_id}
-    url = f"{bot_model.merchant_config.django_api_base}/create-invoice/"
-
-    log.info(f"DEBUG: POST URL = {url}")
-    log.info(f"DEBUG: payload = {payload}")
+    # Инвойс создаётся в процессе бота (без HTTP-хопа в Django create-invoice/):
+    # Invoice пишется через ORM, CREATE_INVOICE уходит в WayForPay через session бота.
+    # Merchant — из реестра, а не из merchant_config, загруженного при старте хоста:
+    # после ротации ключей реестр сбрасывается сигналами/по TTL.
+    from asgiref.sync import sync_to_async
+    from payments.wayforpay.registry import merchant_registry
+    from payments.wayforpay.services import InvoiceRateLimited, WayForPayService
 
     try:
-        async with session.post(url, json=payload, timeout=20) as resp:
-            log.info(f"DEBUG: HTTP status = {resp.status}")
-            data = await resp.json()
-            log.info(f"DEBUG: response data = {data}")
-    except Exception as e:
+        api = await sync_to_async(merchant_registry.for_bot)(bot_model.bot_id)
+        invoice_url = await WayForPayService().acreate_invoice(
+            bot_model.id,
+            cb.from_user.id,
+            plan_id,
+            session=session,
+            api=api,
+        )
+    except InvoiceRateLimited:
+        await cb.answer("Слишком много попыток, попробуйте через минуту", show_alert=True)
+        return
+    except ValueError as e:
+        # Сбой запроса к WayForPay (сеть/timeout/ответ без invoiceUrl)
         log.exception(
             "create-invoice failed: bot_id=%s user_id=%s plan_id=%s error=%r",
             bot_model.id, cb.from_user.id, plan_id, e,
         )
         await cb.answer("Ошибка запроса", show_alert=True)
         return
-
-    if not data.get("ok"):
-        await cb.answer(f"Ошибка: {data.get('error','unknown')}", show_alert=True)
+    except Exception:
+        # Текст исключения (ORM, ключи merchant'а) пользователю не показываем
+        log.exception(
+            "create-invoice rejected: bot_id=%s user_id=%s plan_id=%s",
+            bot_model.id, cb.from_user.id, plan_id,
+        )
+        await cb.answer("Не удалось создать счёт, попробуйте позже", show_alert=True)
         return
 
-    invoice_url = data["invoiceUrl"]
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="💳 Оплатить", url=invoice_url)],
         [InlineKeyboardButton(text="⬅ Назад", callback_data="ui:back")],
@@ -157,10 +192,16 @@ async def on_back(cb: types.CallbackQuery):
     await cb.message.edit_text("Главное меню:", reply_markup=kb_main_menu())
     await cb.answer()
 
-def register(dp, *, pool, session, bot_model):
-    dp.message.register(partial(cmd_start, pool=pool), CommandStart())
-    dp.callback_query.register(partial(on_status, pool=pool, bot_model=bot_model), lambda c: c.data == "sub:status")
-    dp.callback_query.register(partial(on_renew, pool=pool, bot_model=bot_model), lambda c: c.data == "sub:renew")
+def register(dp, *, pool, session, bot_model, blocked_cache=None, catalog=None):
+    dp.message.register(partial(cmd_start, pool=pool, blocked_cache=blocked_cache), CommandStart())
+    dp.callback_query.register(
+        partial(on_status, pool=pool, bot_model=bot_model, blocked_cache=blocked_cache),
+        lambda c: c.data == "sub:status",
+    )
+    dp.callback_query.register(
+        partial(on_renew, pool=pool, bot_model=bot_model, blocked_cache=blocked_cache, catalog=catalog),
+        lambda c: c.data == "sub:renew",
+    )
     dp.callback_query.register(on_help, lambda c: c.data == "help:open")
     dp.callback_query.register(on_back, lambda c: c.data == "ui:back")
     dp.callback_query.register(partial(on_pay, session=session, bot_model=bot_model), lambda c: c.data and c.data.startswith("pay:"))
@@ -0,0 +1,160 @@
+# bot/workers.py
+"""
+Фоновая обработка апдейтов вебхука: быстрый ответ Telegram + пул воркеров.
+
+- Telegram получает 200 сразу после постановки апдейта в очередь,
+  медленные handlers (on_pay и т.п.) больше не держат HTTP-запрос вебхука.
+- У каждого чата своя очередь апдейтов, общий пул воркеров берёт чаты по
+  очереди: порядок внутри чата строгий, разные чаты обрабатываются
+  параллельно, и медленный чат не задерживает остальные.
+- Очереди ограничены: если места нет дольше put_timeout, вебхук отвечает 503
+  и Telegram доставит апдейт повторно позже (backpressure вместо роста памяти).
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from aiogram import Bot
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+log = logging.getLogger("bot.workers")
+
+# Типы апдейтов, у которых чат лежит в event["chat"]
+_CHAT_EVENTS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "business_message", "edited_business_message", "chat_member", "my_chat_member",
+    "chat_join_request", "message_reaction", "message_reaction_count", "chat_boost",
+)
+
+
+def update_chat_key(update: dict) -> Hashable:
+    """Ключ упорядочивания для сырого апдейта: chat_id, иначе id пользователя, иначе update_id."""
+    for name in _CHAT_EVENTS:
+        event = update.get(name)
+        if isinstance(event, dict) and isinstance(event.get("chat"), dict):
+            return event["chat"].get("id")
+
+    cb = update.get("callback_query")
+    if isinstance(cb, dict):
+        msg = cb.get("message")
+        if isinstance(msg, dict) and isinstance(msg.get("chat"), dict):
+            return msg["chat"].get("id")
+        return (cb.get("from") or {}).get("id")
+
+    for event in update.values():
+        if isinstance(event, dict):
+            user = event.get("from") or event.get("user")
+            if isinstance(user, dict) and user.get("id") is not None:
+                return user["id"]
+
+    return update.get("update_id")
+
+
+class ChatOrderedQueue:
+    """
+    Очередь задач на ключ (чат) и общий пул из `workers` корутин.
+
+    У каждого ключа своя очередь задач; в общей очереди готовых ключей ключ
+    стоит не больше одного раза. Воркер берёт ключ, выполняет одну его задачу
+    и, если у ключа есть ещё, ставит его в конец — задачи одного ключа идут
+    строго последовательно, а медленный чат занимает один воркер и не
+    задерживает чаты, которые при шардировании попали бы к нему же.
+    Всего в ожидании не больше maxsize задач.
+    """
+
+    def __init__(self, workers: int = 8, maxsize: int = 1000, put_timeout: float = 5.0):
+        self.workers = max(1, int(workers))
+        self.put_timeout = put_timeout
+        self._slots = asyncio.Semaphore(max(1, int(maxsize)))
+        self._pending: dict[Hashable, deque] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._size = 0
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"updates-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def submit(self, key: Hashable, job: Callable[[], Awaitable[Any]]) -> bool:
+        """Поставить задачу в очередь ключа key. False — очередь полна дольше put_timeout."""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            log.warning("updates queue is full: key=%s qsize=%s", key, self.qsize())
+            return False
+        self._size += 1
+        jobs = self._pending.get(key)
+        if jobs is None:
+            # Ключа нет ни в ожидании, ни в работе — ставим в очередь готовых
+            self._pending[key] = deque([job])
+            self._ready.put_nowait(key)
+        else:
+            jobs.append(job)
+        return True
+
+    def qsize(self) -> int:
+        return self._size
+
+    async def close(self, drain_timeout: Optional[float] = 10.0) -> None:
+        """Дождаться выполнения очереди (не дольше drain_timeout) и остановить воркеры."""
+        try:
+            await asyncio.wait_for(self._ready.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            log.warning("updates queue drain timeout: %s jobs dropped", self.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            key = await self._ready.get()
+            jobs = self._pending[key]
+            job = jobs.popleft()
+            self._size -= 1
+            self._slots.release()
+            try:
+                await job()
+            except Exception:
+                log.exception("update job failed in worker %s", index)
+            finally:
+                if jobs:
+                    # Следующая задача ключа — в конец, после других чатов
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+                self._ready.task_done()
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """
+    SimpleRequestHandler, который вместо asyncio.create_task на каждый апдейт
+    кладёт его в ChatOrderedQueue и сразу отвечает Telegram.
+    """
+
+    def __init__(self, *, queue: ChatOrderedQueue, key_prefix: Hashable = None, **kwargs: Any):
+        super().__init__(handle_in_background=True, **kwargs)
+        self.queue = queue
+        self.key_prefix = key_prefix
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        key = (self.key_prefix, update_chat_key(update))
+
+        accepted = await self.queue.submit(key, lambda: self._feed(bot, update))
+        if not accepted:
+            # Telegram повторит доставку позже и сам снизит темп
+            return web.Response(status=503)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _feed(self, bot: Bot, update: dict) -> None:
+        result = await self.dispatcher.feed_raw_update(bot=bot, update=update, **self.data)
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(bot=bot, result=result)
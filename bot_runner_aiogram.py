@@ -12,16 +12,19 @@ import aiohttp
 import asyncpg
 from argparse import ArgumentParser
 
-from aiogram import Bot as AioBot, Dispatcher
+from aiogram import Bot as AioBot
 from aiogram.client.default import DefaultBotProperties
 from aiogram.webhook.aiohttp_server import setup_application, SimpleRequestHandler
 from aiohttp import web
 
-from bot.subscriptions import register as register_subs
+from bot.blocked import BlockedUsersCache
 from bot.config import settings as bot_settings
+from bot.listener import PgListener
+from bot.host import BotHost, build_dispatcher
+from bot.workers import ChatOrderedQueue, QueuedRequestHandler
 from core.models import Bot as BotModel
+from subscriptions.catalog import PlanCatalog
 from asgiref.sync import sync_to_async
-from leads.bot import register_handlers as register_lead_handlers
 
 # -------------------- logging --------------------
 logging.basicConfig(
@@ -40,9 +43,11 @@ async def load_bot_config(bot_id: int):
 
 
 
-async def make_pool() -> asyncpg.Pool:
+async def make_pool(max_size: int = 5, statement_cache_size: int = 100) -> asyncpg.Pool:
     """
     Создаём пул к той же БД, что и Django, берём параметры из bot/config.py (pydantic settings).
+    Горячие запросы handlers (SQL_SUB_STATUS и т.п.) выполняются как подготовленные
+    statements из кеша соединения; за pgbouncer в transaction-режиме нужен statement_cache_size=0.
     """
     pool = await asyncpg.create_pool(
         host=bot_settings.db_host,
@@ -51,28 +56,44 @@ async def make_pool() -> asyncpg.Pool:
         user=bot_settings.db_user,
         password=bot_settings.db_password,
         min_size=1,
-        max_size=5,
+        max_size=max_size,
+        statement_cache_size=statement_cache_size,
     )
     return pool
 
 
-# -------------------- DEV: long-polling --------------------
-async def run_longpoll(bot_model: BotModel):
-    dp = Dispatcher()
+def make_queue(workers: int, queue_size: int) -> ChatOrderedQueue | None:
+    """Пул воркеров для апдейтов; workers=0 — старое поведение aiogram (task на каждый апдейт)."""
+    if workers <= 0:
+        return None
+    return ChatOrderedQueue(workers=workers, maxsize=queue_size)
+
+
+async def make_caches(pool: asyncpg.Pool, blocked_ttl: float = 60.0, plans_ttl: float = 600.0):
+    """
+    Кеши процесса (is_blocked, каталог тарифов) + LISTEN на изменения из админки.
+    Возвращает (blocked_cache, catalog, listener).
+    """
+    blocked_cache = BlockedUsersCache(ttl=blocked_ttl)
+    catalog = PlanCatalog(ttl=plans_ttl)
+    listener = PgListener()
+    blocked_cache.subscribe(listener)
+    catalog.subscribe(listener)
+    try:
+        await listener.start(pool)
+    except Exception:
+        logger.exception("LISTEN failed, caches are refreshed by TTL until reconnect")
+    return blocked_cache, catalog, listener
+
 
+# -------------------- DEV: long-polling --------------------
+async def run_longpoll(bot_model: BotModel, *, blocked_ttl: float = 60.0, plans_ttl: float = 600.0):
     pool = await make_pool()
     session = aiohttp.ClientSession()
+    blocked_cache, catalog, listener = await make_caches(pool, blocked_ttl, plans_ttl)
 
     # Регистрируем handlers в зависимости от bot_id
-    if bot_model.bot_id == 1:
-        # bot_1 - handlers подписок
-        register_subs(dp, pool=pool, session=session, bot_model=bot_model)
-    elif bot_model.bot_id == 2:
-        # bot_2 - handlers лидов
-        register_lead_handlers(dp, bot_id=bot_model.bot_id)
-    else:
-        # Для других ботов - по умолчанию subscriptions
-        register_subs(dp, pool=pool, session=session, bot_model=bot_model)
+    dp = build_dispatcher(bot_model, pool=pool, session=session, blocked_cache=blocked_cache, catalog=catalog)
 
     bot = AioBot(
         token=bot_model.token,
@@ -90,27 +111,25 @@ async def run_longpoll(bot_model: BotModel):
             allowed_updates=dp.resolve_used_update_types(),
         )
     finally:
+        await listener.close()
         await session.close()
         await pool.close()
 
 
 # -------------------- PROD: webhook (aiohttp) --------------------
-async def run_webhook(bot_model: BotModel):
-    dp = Dispatcher()
-
+async def run_webhook(
+    bot_model: BotModel,
+    *,
+    queue: ChatOrderedQueue | None = None,
+    blocked_ttl: float = 60.0,
+    plans_ttl: float = 600.0,
+):
     pool = await make_pool()
     session = aiohttp.ClientSession()
-    
+    blocked_cache, catalog, listener = await make_caches(pool, blocked_ttl, plans_ttl)
+
     # Регистрируем handlers в зависимости от bot_id
-    if bot_model.bot_id == 1:
-        # bot_1 - handlers подписок
-        register_subs(dp, pool=pool, session=session, bot_model=bot_model)
-    elif bot_model.bot_id == 2:
-        # bot_2 - handlers лидов
-        register_lead_handlers(dp, bot_id=bot_model.bot_id)
-    else:
-        # Для других ботов - по умолчанию subscriptions
-        register_subs(dp, pool=pool, session=session, bot_model=bot_model)
+    dp = build_dispatcher(bot_model, pool=pool, session=session, blocked_cache=blocked_cache, catalog=catalog)
 
     bot = AioBot(
         token=bot_model.token,
@@ -119,7 +138,19 @@ async def run_webhook(bot_model: BotModel):
 
     # aiohttp-приложение для входящих апдейтов
     app = web.Application()
-    SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path="/webhook")
+    if queue is not None:
+        QueuedRequestHandler(dispatcher=dp, bot=bot, queue=queue).register(app, path="/webhook")
+
+        async def _start_queue(_app):
+            queue.start()
+
+        async def _close_queue(_app):
+            await queue.close()
+
+        app.on_startup.append(_start_queue)
+        app.on_shutdown.append(_close_queue)
+    else:
+        SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path="/webhook")
     setup_application(app, dp, bot=bot)
 
     # Вебхук-путь на домене; в nginx должен быть location /tg/bot-<bot_id>/webhook → proxy_pass http://127.0.0.1:<port>/webhook
@@ -159,6 +190,56 @@ async def run_webhook(bot_model: BotModel):
         while True:
             await asyncio.sleep(3600)
     finally:
+        await listener.close()
+        await session.close()
+        await pool.close()
+
+
+# -------------------- PROD: multi-bot host --------------------
+async def run_host(
+    bot_ids: list[int] | None,
+    *,
+    host: str,
+    port: int,
+    refresh: int,
+    pool_size: int,
+    queue: ChatOrderedQueue | None = None,
+    blocked_ttl: float = 60.0,
+    plans_ttl: float = 600.0,
+):
+    """
+    Все включённые боты (или только bot_ids) в одном процессе:
+    один aiohttp-сервер на host:port, общий asyncpg-пул и aiohttp-сессия.
+    В nginx достаточно одного location (см. botops.nginx.generate_host_location).
+    """
+    pool = await make_pool(max_size=pool_size)
+    session = aiohttp.ClientSession()
+    blocked_cache, catalog, listener = await make_caches(pool, blocked_ttl, plans_ttl)
+
+    bot_host = BotHost(
+        pool=pool, session=session, bot_ids=bot_ids, queue=queue,
+        blocked_cache=blocked_cache, catalog=catalog,
+    )
+    app = web.Application()
+    bot_host.setup(app)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+
+    await bot_host.sync()
+    logger.info(
+        "[HOST] started: bots=%s listen=%s:%s refresh=%ss",
+        sorted(bot_host.bots), host, port, refresh,
+    )
+
+    try:
+        # периодически подхватываем ботов, добавленных/выключенных в админке
+        await bot_host.refresh_forever(refresh)
+    finally:
+        await runner.cleanup()
+        await listener.close()
         await session.close()
         await pool.close()
 
@@ -166,21 +247,37 @@ async def run_webhook(bot_model: BotModel):
 # -------------------- entrypoint --------------------
 def parse_args():
     p = ArgumentParser()
-    p.add_argument("--bot-id", type=int, required=True, help="Bot.bot_id из БД")
+    target = p.add_mutually_exclusive_group(required=True)
+    target.add_argument("--bot-id", type=int, help="Bot.bot_id из БД")
+    target.add_argument("--all", action="store_true", help="Все включённые боты в одном процессе")
+    target.add_argument("--bots", type=str, help="Список Bot.bot_id через запятую: 1,2,5")
     p.add_argument("--dev", action="store_true", help="Запуск в long-poll режиме")
+    p.add_argument("--host", default="127.0.0.1", help="Адрес aiohttp-сервера (--all/--bots)")
+    p.add_argument("--port", type=int, default=8100, help="Порт aiohttp-сервера (--all/--bots)")
+    p.add_argument("--refresh", type=int, default=60, help="Период перечитывания таблицы bots, сек")
+    p.add_argument("--pool-size", type=int, default=10, help="max_size общего asyncpg-пула")
+    p.add_argument("--workers", type=int, default=8, help="Воркеров обработки апдейтов (0 — task на каждый апдейт)")
+    p.add_argument("--blocked-ttl", type=float, default=60.0, help="TTL кеша is_blocked, сек")
+    p.add_argument("--plans-ttl", type=float, default=600.0, help="TTL кеша каталога тарифов, сек")
+    p.add_argument("--queue-size", type=int, default=1000, help="Ёмкость очереди апдейтов; при переполнении вебхук отвечает 503")
     return p.parse_args()
 
 
 async def amain():
-    parser = ArgumentParser()
-    parser.add_argument("--bot-id", type=int, required=True)
-    args = parser.parse_args()
+    args = parse_args()
+    queue = make_queue(args.workers, args.queue_size)
+
+    if args.all or args.bots:
+        bot_ids = [int(x) for x in args.bots.split(",") if x.strip()] if args.bots else None
+        await run_host(bot_ids, host=args.host, port=args.port, refresh=args.refresh, pool_size=args.pool_size,
+                       queue=queue, blocked_ttl=args.blocked_ttl, plans_ttl=args.plans_ttl)
+        return
 
     bot_model = await load_bot_config(args.bot_id)   # ← вот здесь эта строка
-    await run_webhook(bot_model)
+    await run_webhook(bot_model, queue=queue, blocked_ttl=args.blocked_ttl, plans_ttl=args.plans_ttl)
 
 if __name__ == "__main__":
     try:
         asyncio.run(amain())
     except (KeyboardInterrupt, SystemExit):
-        pass
\ No newline at end of file
+        pass
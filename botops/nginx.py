@@ -23,4 +23,17 @@ location /tg/bot-{bot.bot_id}/webhook {{
     proxy_pass http://127.0.0.1:{bot.port}/webhook;
     proxy_set_header Host $host;
 }}
-""".strip()
\ No newline at end of file
+""".strip()
+
+def generate_host_location(port: int = 8100) -> str:
+    """
+    Один location для мульти-бот хоста (bot_runner_aiogram.py --all):
+    /tg/bot-<id>/webhook → 127.0.0.1:<port>/tg/bot-<id>/webhook (путь передаётся как есть).
+    Новые боты не требуют правки nginx.
+    """
+    return f"""
+location ~ ^/tg/bot-\\d+/webhook$ {{
+    proxy_pass http://127.0.0.1:{port};
+    proxy_set_header Host $host;
+}}
+""".strip()
@@ -18,6 +18,20 @@ user=www-data
 """.strip()
 
 
+def generate_host_config(port: int = 8100, log_path: str = "/var/log/bots/bot_host.log"):
+    """Одна программа на все включённые боты (bot_runner_aiogram.py --all)."""
+    return f"""
+[program:bot_host]
+command=/opt/venvs/dev-profiling/bin/python /var/www/profiling/data/www/dev.profilinggroup.com/bot_runner_aiogram.py --all --port {port}
+directory=/var/www/profiling/data/www/dev.profilinggroup.com
+autostart=true
+autorestart=true
+stderr_logfile={log_path}
+stdout_logfile={log_path}
+user=www-data
+""".strip()
+
+
 def write_config(bot):
     config_text = generate_config(bot)
     path = SUPERVISOR_DIR / f"bot_{bot.bot_id}.conf"
@@ -25,6 +39,12 @@ def write_config(bot):
     return path
 
 
+def write_host_config(port: int = 8100, log_path: str = "/var/log/bots/bot_host.log"):
+    path = SUPERVISOR_DIR / "bot_host.conf"
+    path.write_text(generate_host_config(port=port, log_path=log_path))
+    return path
+
+
 def _run(args):
     """Запуск supervisorctl (с sudo) и возврат stdout/stderr."""
     result = subprocess.run(args, capture_output=True, text=True)
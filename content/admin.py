@@ -6,7 +6,8 @@ from .models import (
     Phase,
     ContentLesson,
     ContentPost,
-    UserContentProgress
+    UserContentProgress,
+    MediaFileCache
 )
 
 
@@ -143,4 +144,12 @@ class UserContentProgressAdmin(admin.ModelAdmin):
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
         }),
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(MediaFileCache)
+class MediaFileCacheAdmin(admin.ModelAdmin):
+    list_display = ['id', 'bot_id', 'post', 'media_type', 'file_hash', 'created_at']
+    list_filter = ['bot_id', 'media_type']
+    search_fields = ['post__title', 'file_id', 'file_hash']
+    readonly_fields = ['bot_id', 'post', 'file_hash', 'media_type', 'file_id', 'created_at']
@@ -4,4 +4,7 @@ from django.apps import AppConfig
 class ContentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'content'
-    verbose_name = 'Контент и курсы'
\ No newline at end of file
+    verbose_name = 'Контент и курсы'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,72 @@
+# content/bot_api.py
+"""
+Синхронный клиент Bot API для management-команд content (requests).
+
+Методы повторяют вызовы TelegramContentSender (send_message, send_audio,
+send_video, send_photo) и возвращают result ответа — dict сообщения, из
+которого берётся file_id. Файл (объект с read) уходит multipart'ом, строка —
+как file_id. 429 → RetryAfter: паузу и повтор делает OutboundDispatcher.
+"""
+import logging
+
+import requests
+
+from bot.outbound import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramAPIError(Exception):
+    """Ошибка Bot API (ok=false); текст — description от Telegram."""
+
+    def __init__(self, method: str, description: str, error_code: int = 0):
+        super().__init__(f"{method}: {description}")
+        self.method = method
+        self.description = description
+        self.error_code = error_code
+
+
+class TelegramBotAPI:
+    """Bot API по токену бота; timeout на загрузку медиа больше, чем на текст."""
+
+    def __init__(self, token: str, timeout: float = 10, upload_timeout: float = 300):
+        # token — по нему get_outbound находит общий лимитер бота
+        self.token = token
+        self.api_url = f"https://api.telegram.org/bot{token}"
+        self.timeout = timeout
+        self.upload_timeout = upload_timeout
+
+    def _request(self, method: str, **params):
+        files = {k: v for k, v in params.items() if hasattr(v, 'read')}
+        data = {
+            k: str(v).lower() if isinstance(v, bool) else v
+            for k, v in params.items() if k not in files and v is not None
+        }
+        response = requests.post(
+            f"{self.api_url}/{method}",
+            data=data,
+            files={k: (getattr(f, 'name', k).rsplit('/', 1)[-1], f) for k, f in files.items()} or None,
+            timeout=self.upload_timeout if files else self.timeout,
+        )
+        try:
+            body = response.json()
+        except ValueError:
+            response.raise_for_status()
+            raise TelegramAPIError(method, f"unexpected response {response.status_code}")
+        if response.status_code == 429:
+            raise RetryAfter((body.get('parameters') or {}).get('retry_after', 1))
+        if not body.get('ok'):
+            raise TelegramAPIError(method, body.get('description', ''), body.get('error_code', response.status_code))
+        return body.get('result')
+
+    def send_message(self, chat_id: int, text: str, **kwargs):
+        return self._request('sendMessage', chat_id=chat_id, text=text, **kwargs)
+
+    def send_audio(self, chat_id: int, audio, **kwargs):
+        return self._request('sendAudio', chat_id=chat_id, audio=audio, **kwargs)
+
+    def send_video(self, chat_id: int, video, **kwargs):
+        return self._request('sendVideo', chat_id=chat_id, video=video, **kwargs)
+
+    def send_photo(self, chat_id: int, photo, **kwargs):
+        return self._request('sendPhoto', chat_id=chat_id, photo=photo, **kwargs)
@@ -0,0 +1,75 @@
+# content/management/commands/prewarm_media.py
+"""
+Предзагрузка медиа ближайших уроков в служебный чат (content/prewarm.py):
+file_id попадают в MediaFileCache до слота рассылки.
+
+Использование:
+    python manage.py prewarm_media --bot-id 1                 # по cron, например ночью
+    python manage.py prewarm_media --bot-id 1 --topic 3 --days 2
+    python manage.py prewarm_media --bot-id 1 --topic 3 --all-lessons   # весь курс перед запуском
+    python manage.py prewarm_media --bot-id 1 --dry-run       # только список постов
+
+Служебный чат — CONTENT_PREWARM_CHAT_ID или --chat-id; бот должен иметь
+право писать в него (канал или группа с ботом-админом).
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from content.prewarm import media_posts, prewarm, upcoming_media_posts
+from core.models import Bot
+
+
+class Command(BaseCommand):
+    help = "Предзагрузка медиа ближайших уроков и заполнение кеша file_id"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bot-id", type=int, required=True, help="ID бота")
+        parser.add_argument("--topic", type=int, default=None, help="Только этот топик (ContentTopic.id)")
+        parser.add_argument("--days", type=int, default=None,
+                            help="Уроки на сколько дней вперёд (по умолчанию CONTENT_PREWARM_DAYS)")
+        parser.add_argument("--all-lessons", action="store_true",
+                            help="Все уроки, а не только ближайшие у активных подписчиков")
+        parser.add_argument("--chat-id", type=int, default=None,
+                            help="Служебный чат (по умолчанию CONTENT_PREWARM_CHAT_ID)")
+        parser.add_argument("--dry-run", action="store_true", help="Показать посты без загрузки")
+
+    def handle(self, *args, **options):
+        bot_id = options["bot_id"]
+        try:
+            bot = Bot.objects.get(bot_id=bot_id)
+        except Bot.DoesNotExist:
+            self.stdout.write(self.style.ERROR(f"Bot with ID {bot_id} not found"))
+            return
+
+        days = options["days"]
+        if days is None:
+            days = getattr(settings, "CONTENT_PREWARM_DAYS", 1)
+        if options["all_lessons"]:
+            posts = media_posts(bot_id, options["topic"]).order_by(
+                "lesson__topic_id", "lesson__lesson_number", "send_time", "sort_order"
+            )
+        else:
+            posts = upcoming_media_posts(bot_id, days, options["topic"])
+        posts = list(posts.select_related("lesson"))
+
+        if options["dry_run"]:
+            for post in posts:
+                self.stdout.write(f"lesson {post.lesson.lesson_number}: post {post.id} ({post.post_type}) {post.media_file.name}")
+            self.stdout.write(self.style.WARNING(f"DRY RUN: {len(posts)} media posts"))
+            return
+
+        chat_id = options["chat_id"] or getattr(settings, "CONTENT_PREWARM_CHAT_ID", None)
+        if not chat_id:
+            self.stdout.write(self.style.ERROR("Staging chat is not set: use --chat-id or CONTENT_PREWARM_CHAT_ID"))
+            return
+        if not bot.token:
+            self.stdout.write(self.style.ERROR(f"Bot {bot_id} has no token"))
+            return
+
+        from content.bot_api import TelegramBotAPI
+
+        stats = prewarm(TelegramBotAPI(bot.token), bot_id, int(chat_id), posts)
+        style = self.style.SUCCESS if not stats.failed else self.style.WARNING
+        self.stdout.write(style(
+            f"Uploaded {stats.uploaded}, already cached {stats.cached}, failed {stats.failed} (of {len(posts)} posts)"
+        ))
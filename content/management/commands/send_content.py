@@ -4,13 +4,20 @@ Management команда для ручной отправки контента.
 
 Использование:
     python manage.py send_content --bot-id 1
+    python manage.py send_content --bot-id 1 --concurrency 50
+    python manage.py send_content --bot-id 1 --dry-run
+
+Отправка асинхронная (content.scheduler.send_scheduled_content_async):
+--concurrency чатов одновременно, посты внутри чата — по порядку.
 """
 import logging
+from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 
 from core.models import Bot
-from content.scheduler import send_scheduled_content
+from content.scheduler import send_scheduled_content_async
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +32,12 @@ class Command(BaseCommand):
             required=True,
             help='ID бота для рассылки контента'
         )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=None,
+            help='Сколько чатов обслуживать одновременно (по умолчанию CONTENT_SEND_CONCURRENCY)'
+        )
         parser.add_argument(
             '--dry-run',
             action='store_true',
@@ -34,6 +47,7 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         bot_id = options['bot_id']
         dry_run = options.get('dry_run', False)
+        concurrency = options.get('concurrency') or getattr(settings, 'CONTENT_SEND_CONCURRENCY', 20)
         
         # Проверяем что бот существует
         try:
@@ -53,35 +67,41 @@ class Command(BaseCommand):
                 def __init__(self):
                     self.messages = []
                 
-                def send_message(self, **kwargs):
+                async def send_message(self, **kwargs):
                     self.messages.append(('message', kwargs))
                 
-                def send_audio(self, **kwargs):
+                async def send_audio(self, **kwargs):
                     self.messages.append(('audio', kwargs))
                 
-                def send_video(self, **kwargs):
+                async def send_video(self, **kwargs):
                     self.messages.append(('video', kwargs))
                 
-                def send_photo(self, **kwargs):
+                async def send_photo(self, **kwargs):
                     self.messages.append(('photo', kwargs))
             
             bot_api = MockBotAPI()
-        else:
-            # В реальном режиме нужно инициализировать bot API
-            # TODO: Интеграция с aiogram
-            self.stdout.write(self.style.ERROR(
-                'Real bot API not implemented yet. Use --dry-run for testing.'
-            ))
+        elif not bot.token:
+            self.stdout.write(self.style.ERROR(f'Bot {bot_id} has no token'))
             return
+        else:
+            from aiogram import Bot as AioBot
+            bot_api = AioBot(token=bot.token)
+        
+        async def deliver():
+            try:
+                return await send_scheduled_content_async(
+                    bot_id=bot_id,
+                    bot_api=bot_api,
+                    current_time=timezone.now(),
+                    concurrency=concurrency,
+                )
+            finally:
+                if not dry_run:
+                    await bot_api.session.close()
         
         # Запускаем scheduler
         try:
-            current_time = timezone.now()
-            sent_count = send_scheduled_content(
-                bot_id=bot_id,
-                bot_api=bot_api,
-                current_time=current_time
-            )
+            sent_count = async_to_sync(deliver)()
             
             self.stdout.write(
                 self.style.SUCCESS(f'✓ Successfully sent {sent_count} posts')
@@ -94,4 +114,4 @@ class Command(BaseCommand):
             self.stdout.write(
                 self.style.ERROR(f'✗ Error during content delivery: {e}')
             )
-            logger.exception('Content delivery failed')
\ No newline at end of file
+            logger.exception('Content delivery failed')
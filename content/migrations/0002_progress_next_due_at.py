@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0001_initial'),
+        ('core', '0005_logdummy'),
+        ('subscriptions', '0003_subscription_status_covering_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercontentprogress',
+            name='next_due_at',
+            field=models.DateTimeField(blank=True, help_text='Когда пора следующий пост (считается планировщиком)', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='usercontentprogress',
+            index=models.Index(condition=models.Q(('completed', False)), fields=['next_due_at'], name='progress_next_due_idx'),
+        ),
+    ]
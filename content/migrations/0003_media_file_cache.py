@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0002_progress_next_due_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaFileCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bot_id', models.BigIntegerField(help_text='ID бота (Bot.bot_id)')),
+                ('file_hash', models.CharField(help_text='sha256 содержимого media_file', max_length=64)),
+                ('media_type', models.CharField(max_length=10)),
+                ('file_id', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='telegram_files', to='content.contentpost')),
+            ],
+            options={
+                'verbose_name': 'Файл в Telegram',
+                'verbose_name_plural': 'Файлы в Telegram',
+                'db_table': 'content_media_file_cache',
+                'unique_together': {('bot_id', 'post', 'file_hash')},
+            },
+        ),
+    ]
@@ -309,6 +309,14 @@ class UserContentProgress(models.Model):
         help_text="Когда был отправлен последний пост"
     )
     
+    # Когда прогрессу снова нужен планировщик: время ближайшего неотправленного поста
+    # или конца курса (content/planner.py). NULL — пересчитать на ближайшем тике
+    next_due_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Когда пора следующий пост (считается планировщиком)"
+    )
+    
     # Статус
     started_at = models.DateTimeField(help_text="Когда пользователь начал курс")
     completed = models.BooleanField(
@@ -332,6 +340,11 @@ class UserContentProgress(models.Model):
             models.Index(fields=['user', 'topic']),
             models.Index(fields=['subscription', 'completed']),
             models.Index(fields=['current_lesson_number']),
+            # Тик планировщика читает только строки, которым пора (content/planner.py)
+            models.Index(
+                fields=['next_due_at'], name='progress_next_due_idx',
+                condition=models.Q(completed=False),
+            ),
         ]
         verbose_name = 'Прогресс пользователя'
         verbose_name_plural = 'Прогресс пользователей'
@@ -344,4 +357,34 @@ class UserContentProgress(models.Model):
         """Отметить курс как завершенный"""
         self.completed = True
         self.completed_at = timezone.now()
-        self.save(update_fields=['completed', 'completed_at', 'updated_at'])
\ No newline at end of file
+        self.save(update_fields=['completed', 'completed_at', 'updated_at'])
+
+
+class MediaFileCache(models.Model):
+    """
+    file_id медиа поста, уже загруженного в Telegram (content/telegram_sender.py).
+
+    file_id у каждого бота свой, поэтому ключ — (бот, пост, sha256 файла):
+    замена media_file даёт новый хеш и новую загрузку. Если Telegram
+    отклонит file_id, запись удаляется и файл загружается заново.
+    """
+    bot_id = models.BigIntegerField(help_text="ID бота (Bot.bot_id)")
+    post = models.ForeignKey(
+        ContentPost,
+        on_delete=models.CASCADE,
+        related_name='telegram_files'
+    )
+    file_hash = models.CharField(max_length=64, help_text="sha256 содержимого media_file")
+    media_type = models.CharField(max_length=10)
+    file_id = models.CharField(max_length=255)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'content_media_file_cache'
+        unique_together = [('bot_id', 'post', 'file_hash')]
+        verbose_name = 'Файл в Telegram'
+        verbose_name_plural = 'Файлы в Telegram'
+    
+    def __str__(self):
+        return f"{self.media_type} поста {self.post_id} (бот {self.bot_id})"
@@ -0,0 +1,234 @@
+# content/planner.py
+"""
+Планировщик рассылки контента: какие посты кому отправить в current_time.
+
+Вместо обхода каждого UserContentProgress с отдельными запросами на урок
+и посты всё считается несколькими запросами на бота:
+
+1. advance_progress — set-based UPDATE'ы прогресса: current_lesson_number
+   по дню курса, завершение курсов, у которых дни вышли или в последнем
+   уроке нет постов;
+2. plan_deliveries — один JOIN progress → topic → lesson → post: все пары
+   (прогресс, пост), которые пора отправить, плюс один запрос на
+   последние посты последних уроков (по ним курс считается завершённым);
+3. refresh_next_due — после тика пересчитать next_due_at затронутых строк.
+
+Оба шага читают только строки с next_due_at <= current_time (или NULL —
+ещё не посчитано) по частичному индексу progress_next_due_idx, поэтому
+тик между слотами фаз почти ничего не стоит. next_due_at — время
+ближайшего неотправленного поста или конца курса; current_lesson_number
+сдвигается, когда строке пора (а не в полночь). Правка уроков, постов
+или длительности курса сбрасывает next_due_at прогрессов топика в NULL
+(content/signals.py); QuerySet.update() сигналов не вызывает.
+
+День курса = (current_time.date() - started_at.date()) + 1, где дата
+started_at — в UTC (как хранится в БД). В SQL это CASE по границам суток:
+started_at >= полночь(сегодня) → день 1, >= полночь(вчера) → день 2 и т.д.
+до максимальной длительности курса бота.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from typing import Dict, Iterable, List, Optional, Set
+
+from django.db.models import Case, Exists, F, IntegerField, Max, OuterRef, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from subscriptions.models import SubscriptionStatus
+
+from .models import ContentLesson, ContentPost, ContentTopic, UserContentProgress
+
+
+@dataclass(frozen=True)
+class Delivery:
+    """Пост, который пора отправить пользователю."""
+    progress_id: int
+    chat_id: int
+    post_id: int
+    day: int
+    # Последний пост последнего дня курса: после отправки курс завершён
+    final: bool = False
+
+
+def active_progress(bot_id: int):
+    """Незавершённые прогрессы бота, которым можно слать контент."""
+    return UserContentProgress.objects.filter(
+        topic__bot__bot_id=bot_id,
+        completed=False,
+        user__is_blocked=False,
+        subscription__status=SubscriptionStatus.ACTIVE,
+    )
+
+
+def due_progress(bot_id: int, current_time: datetime):
+    """Активные прогрессы, которым пора: next_due_at наступил или ещё не посчитан."""
+    return active_progress(bot_id).filter(Q(next_due_at__lte=current_time) | Q(next_due_at__isnull=True))
+
+
+def course_day(current_time: datetime, max_days: int) -> Case:
+    """SQL-выражение дня курса (0 — курс начнётся завтра, max_days + 1 — уже позади)."""
+    today = current_time.date()
+    whens = [
+        When(
+            started_at__gte=datetime.combine(today - timedelta(days=day - 1), time.min, tzinfo=dt_timezone.utc),
+            then=Value(day),
+        )
+        for day in range(0, max_days + 1)
+    ]
+    return Case(*whens, default=Value(max_days + 1), output_field=IntegerField())
+
+
+def course_day_for_bot(bot_id: int, current_time: datetime) -> Case:
+    """course_day до максимальной длительности курсов бота."""
+    max_days = ContentTopic.objects.filter(bot__bot_id=bot_id).aggregate(m=Max("duration_days"))["m"] or 0
+    return course_day(current_time, max_days)
+
+
+def advance_progress(bot_id: int, current_time: datetime, day: Optional[Case] = None) -> Dict[str, int]:
+    """Перевести прогрессы на текущий день и завершить пройденные курсы. Возвращает число строк."""
+    now = timezone.now()
+    day = day or course_day_for_bot(bot_id, current_time)
+    progress = due_progress(bot_id, current_time).annotate(day=day)
+
+    finished = progress.filter(day__gt=F("topic__duration_days")).update(
+        completed=True, completed_at=now, updated_at=now
+    )
+
+    moved = (
+        progress.filter(day__gte=1)
+        .exclude(current_lesson_number=F("day"))
+        .update(current_lesson_number=day, updated_at=now)
+    )
+
+    # Последний день курса, урок есть, но постов в нём нет — курс пройден
+    last_lesson = ContentLesson.objects.filter(
+        topic=OuterRef("topic"), lesson_number=OuterRef("topic__duration_days"), enabled=True
+    )
+    empty = (
+        progress.filter(day=F("topic__duration_days"))
+        .filter(Exists(last_lesson))
+        .exclude(Exists(ContentPost.objects.filter(
+            lesson__topic=OuterRef("topic"), lesson__lesson_number=OuterRef("topic__duration_days"), enabled=True,
+        )))
+        .update(completed=True, completed_at=now, updated_at=now)
+    )
+    return {"finished": finished + empty, "moved": moved}
+
+
+def plan_deliveries(bot_id: int, current_time: datetime, day: Optional[Case] = None) -> List[Delivery]:
+    """
+    Все пары (прогресс, пост), которые пора отправить, в порядке отправки:
+    по прогрессу, затем по send_time и sort_order поста.
+    """
+    rows = list(
+        due_progress(bot_id, current_time)
+        .annotate(day=day or course_day_for_bot(bot_id, current_time))
+        .filter(
+            day__gte=1,
+            day__lte=F("topic__duration_days"),
+            topic__lessons__lesson_number=F("day"),
+            topic__lessons__enabled=True,
+            topic__lessons__posts__enabled=True,
+            topic__lessons__posts__send_time__lte=current_time.time(),
+            topic__lessons__posts__id__gt=Coalesce(F("last_post_sent_id"), Value(0)),
+        )
+        .order_by()
+        .values_list(
+            "id", "user__user_id", "day", "topic__duration_days", "topic__lessons__id",
+            "topic__lessons__posts__id", "topic__lessons__posts__send_time", "topic__lessons__posts__sort_order",
+        )
+    )
+    rows.sort(key=lambda r: (r[0], r[6], r[7]))
+
+    # Последний пост (по send_time, sort_order) каждого последнего урока — признак завершения курса
+    final_lessons = {r[4] for r in rows if r[2] == r[3]}
+    last_post: Dict[int, int] = {}
+    if final_lessons:
+        for lesson_id, post_id in (
+            ContentPost.objects.filter(lesson_id__in=final_lessons, enabled=True)
+            .order_by("lesson_id", "-send_time", "-sort_order")
+            .values_list("lesson_id", "id")
+        ):
+            last_post.setdefault(lesson_id, post_id)
+
+    return [
+        Delivery(
+            progress_id=progress_id, chat_id=chat_id, post_id=post_id, day=day,
+            final=day == duration and lesson_id in last_post and post_id >= last_post[lesson_id],
+        )
+        for progress_id, chat_id, day, duration, lesson_id, post_id, _, _ in rows
+    ]
+
+
+def _midnight(day) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+def next_due_at(started_at: datetime, last_post_id: Optional[int], duration_days: int,
+                schedule: List[tuple], empty_final_lesson: bool, current_time: datetime) -> datetime:
+    """
+    Когда прогрессу снова нужен планировщик.
+
+    schedule — посты топика [(lesson_number, send_time, post_id)] в порядке
+    отправки. Посты прошедших дней уже не отправляются (как и в тике),
+    посты сегодняшнего дня с наступившим временем дают срок в прошлом.
+    """
+    start = started_at.astimezone(dt_timezone.utc).date()
+    today = (current_time.date() - start).days + 1
+    for lesson_number, send_time, post_id in schedule:
+        if lesson_number < today or lesson_number > duration_days or post_id <= (last_post_id or 0):
+            continue
+        return datetime.combine(start + timedelta(days=lesson_number - 1), send_time, tzinfo=dt_timezone.utc)
+    if empty_final_lesson:
+        # advance_progress завершит курс в последний день
+        return _midnight(start + timedelta(days=duration_days - 1))
+    # Постов больше нет — следующий раз в первый день после курса (завершение)
+    return _midnight(start + timedelta(days=duration_days))
+
+
+def _topic_schedules(topic_ids: Set[int]):
+    schedules: Dict[int, List[tuple]] = {topic_id: [] for topic_id in topic_ids}
+    for topic_id, lesson_number, send_time, post_id in (
+        ContentPost.objects.filter(lesson__topic_id__in=topic_ids, lesson__enabled=True, enabled=True)
+        .order_by("lesson__topic_id", "lesson__lesson_number", "send_time", "sort_order")
+        .values_list("lesson__topic_id", "lesson__lesson_number", "send_time", "id")
+    ):
+        schedules[topic_id].append((lesson_number, send_time, post_id))
+
+    empty_final = set(
+        ContentLesson.objects.filter(topic_id__in=topic_ids, enabled=True, lesson_number=F("topic__duration_days"))
+        .exclude(Exists(ContentPost.objects.filter(lesson=OuterRef("pk"), enabled=True)))
+        .values_list("topic_id", flat=True)
+    )
+    return schedules, empty_final
+
+
+def refresh_next_due(progress_ids: Iterable[int], current_time: Optional[datetime] = None,
+                     batch_size: int = 1000) -> int:
+    """Пересчитать next_due_at незавершённых прогрессов. Возвращает число строк."""
+    current_time = current_time or timezone.now()
+    rows = list(
+        UserContentProgress.objects.filter(pk__in=list(progress_ids), completed=False)
+        .values_list("id", "topic_id", "started_at", "last_post_sent_id", "topic__duration_days")
+    )
+    if not rows:
+        return 0
+    schedules, empty_final = _topic_schedules({row[1] for row in rows})
+    UserContentProgress.objects.bulk_update(
+        [
+            UserContentProgress(pk=pk, next_due_at=next_due_at(
+                started_at, last_post_id, duration, schedules[topic_id], topic_id in empty_final, current_time,
+            ))
+            for pk, topic_id, started_at, last_post_id, duration in rows
+        ],
+        ["next_due_at"],
+        batch_size=batch_size,
+    )
+    return len(rows)
+
+
+def reset_next_due(topic_id: int) -> int:
+    """Расписание топика изменилось: пересчитать прогрессы на ближайшем тике."""
+    return UserContentProgress.objects.filter(topic_id=topic_id, completed=False).update(next_due_at=None)
@@ -0,0 +1,102 @@
+# content/prewarm.py
+"""
+Предзагрузка медиа уроков (manage.py prewarm_media).
+
+Первая отправка медиа-поста ботом — загрузка файла в Telegram прямо в тике
+планировщика. Предзагрузка заранее отправляет файлы ближайших уроков в
+служебный чат (CONTENT_PREWARM_CHAT_ID) и сохраняет file_id в
+MediaFileCache — в пиковый слот уходят только id.
+
+Ближайшие уроки — дни курса активных прогрессов бота (planner.course_day)
+с сегодняшнего по сегодня + days; у курсов, которые стартуют завтра, —
+уроки с первого. Файлы, file_id которых для текущего содержимого уже
+сохранён, повторно не загружаются.
+"""
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ContentPost
+from .planner import active_progress, course_day_for_bot
+from .telegram_sender import MEDIA_METHODS, TelegramContentSender
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PrewarmStats:
+    uploaded: int = 0
+    cached: int = 0
+    failed: int = 0
+
+
+def media_posts(bot_id: int, topic_id: Optional[int] = None):
+    """Включённые медиа-посты включённых уроков бота (или одного топика)."""
+    posts = (
+        ContentPost.objects.filter(
+            lesson__topic__bot__bot_id=bot_id,
+            lesson__enabled=True,
+            enabled=True,
+            post_type__in=list(MEDIA_METHODS),
+        )
+        .exclude(media_file="")
+        .exclude(media_file__isnull=True)
+    )
+    if topic_id is not None:
+        posts = posts.filter(lesson__topic_id=topic_id)
+    return posts
+
+
+def upcoming_lessons(bot_id: int, days: int = 1, topic_id: Optional[int] = None,
+                     current_time: Optional[datetime] = None) -> Dict[int, Set[int]]:
+    """{topic_id: номера уроков}, которые активные прогрессы пройдут за сегодня и days следующих дней."""
+    current_time = current_time or timezone.now()
+    progress = active_progress(bot_id)
+    if topic_id is not None:
+        progress = progress.filter(topic_id=topic_id)
+    current_days = (
+        progress.annotate(day=course_day_for_bot(bot_id, current_time))
+        .filter(day__lte=F("topic__duration_days"))
+        .order_by()
+        .values_list("topic_id", "day", "topic__duration_days")
+        .distinct()
+    )
+    lessons: Dict[int, Set[int]] = {}
+    for topic, day, duration in current_days:
+        lessons.setdefault(topic, set()).update(range(max(day, 1), min(day + days, duration) + 1))
+    return lessons
+
+
+def upcoming_media_posts(bot_id: int, days: int = 1, topic_id: Optional[int] = None,
+                         current_time: Optional[datetime] = None):
+    """Медиа-посты ближайших уроков (см. upcoming_lessons); пустой QuerySet, если активных курсов нет."""
+    lessons = upcoming_lessons(bot_id, days, topic_id, current_time)
+    if not lessons:
+        return ContentPost.objects.none()
+    condition = Q()
+    for topic, numbers in lessons.items():
+        condition |= Q(lesson__topic_id=topic, lesson__lesson_number__in=sorted(numbers))
+    return media_posts(bot_id, topic_id).filter(condition).order_by("lesson__lesson_number", "send_time", "sort_order")
+
+
+def prewarm(bot_api, bot_id: int, chat_id: int, posts: Iterable[ContentPost]) -> PrewarmStats:
+    """Загрузить медиа постов в chat_id и заполнить MediaFileCache."""
+    sender = TelegramContentSender(bot_api, bot_id=bot_id)
+    stats = PrewarmStats()
+    for post in posts:
+        try:
+            if sender.upload_media(chat_id, post):
+                stats.uploaded += 1
+            else:
+                stats.cached += 1
+        except Exception as e:
+            # Файл пропал или Telegram отказал — в тике отправится обычным путём
+            logger.error(f"Prewarm of post {post.id} for bot {bot_id} failed: {e}", exc_info=True)
+            stats.failed += 1
+    return stats
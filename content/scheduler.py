@@ -1,14 +1,17 @@
 # content/scheduler.py
+import asyncio
 import logging
-from typing import Optional
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from datetime import datetime
+from asgiref.sync import sync_to_async
 from django.utils import timezone
 from django.db import transaction
-from django.db import models  # Импорт для Q объектов
 
-from core.models import TelegramUser
-from subscriptions.models import SubscriptionStatus
 from .models import UserContentProgress, ContentPost
+from .planner import (
+    Delivery, advance_progress, course_day_for_bot, due_progress, plan_deliveries, refresh_next_due,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -16,198 +19,185 @@ logger = logging.getLogger(__name__)
 def send_scheduled_content(
     bot_id: int,
     bot_api,
-    current_time: Optional[datetime] = None
+    current_time: Optional[datetime] = None,
+    batch_size: int = 50,
 ) -> int:
     """
     Отправка запланированного контента пользователям.
     
-    Логика:
-    1. Находим все активные UserContentProgress для бота
-    2. Для каждого прогресса:
-       - Проверяем подписку (активна?)
-       - Проверяем пользователя (не заблокирован?)
-       - Вычисляем текущий день курса
-       - Находим посты для отправки
-       - Отправляем через bot_api
-       - Обновляем прогресс
-       - Проверяем завершение курса
+    Логика (content/planner.py):
+    0. Берём только прогрессы с наступившим next_due_at (по индексу);
+       если таких нет — тик стоит один запрос
+    1. advance_progress — несколькими UPDATE'ами переводим прогрессы на
+       текущий день курса и завершаем пройденные курсы
+    2. plan_deliveries — одним запросом находим все пары (прогресс, пост),
+       которые пора отправить (блокированные пользователи и неактивные
+       подписки отсекаются в SQL)
+    3. Отправляем посты пачками по batch_size через bot_api; после каждой
+       пачки одним bulk_update сохраняем last_post_sent / last_sent_at и
+       завершаем курсы, у которых ушёл последний пост; при падении процесса
+       повторно уйдут не больше batch_size постов
+    4. refresh_next_due — пересчитываем next_due_at затронутых прогрессов
+    
+    Стоимость тика — O(постов к отправке), а не O(активных пользователей × запросов).
     
     Args:
         bot_id: ID бота
         bot_api: API для отправки сообщений в Telegram
         current_time: Текущее время (для тестов)
+        batch_size: Постов на одну запись прогресса в БД
     
     Returns:
         Количество отправленных постов
     """
+    from .telegram_sender import TelegramContentSender
+
     if current_time is None:
         current_time = timezone.now()
     
-    # Находим все активные прогрессы для данного бота
-    progress_list = UserContentProgress.objects.filter(
-        topic__bot__bot_id=bot_id,
-        completed=False
-    ).select_related(
-        'user', 'topic', 'subscription', 'last_post_sent'
-    ).prefetch_related(
-        'topic__lessons__posts'
-    )
-    
+    tick = _plan_tick(bot_id, current_time)
+    if tick is None:
+        return 0
+    due_ids, deliveries, posts = tick
     sent_count = 0
     
-    for progress in progress_list:
-        try:
-            sent = _process_user_progress(progress, bot_api, current_time)
-            sent_count += sent
-        except Exception as e:
-            logger.error(
-                f"Error processing progress {progress.id} for user {progress.user.user_id}: {e}",
-                exc_info=True
-            )
+    if deliveries:
+        sender = TelegramContentSender(bot_api, bot_id=bot_id)
+        for start in range(0, len(deliveries), batch_size):
+            batch = deliveries[start:start + batch_size]
+            sent_count += _send_batch(batch, posts, sender, current_time)
     
+    refresh_next_due(due_ids, current_time)
     logger.info(f"Scheduler finished: sent {sent_count} posts for bot {bot_id}")
     return sent_count
 
 
-@transaction.atomic
-def _process_user_progress(
-    progress: UserContentProgress,
+def _plan_tick(bot_id: int, current_time: datetime) -> Optional[Tuple[List[int], List[Delivery], Dict[int, ContentPost]]]:
+    """Шаги 0–2 тика: (due_ids, deliveries, посты по id) или None, если никому не пора."""
+    due_ids = list(due_progress(bot_id, current_time).values_list('id', flat=True))
+    if not due_ids:
+        return None
+    
+    day = course_day_for_bot(bot_id, current_time)
+    advance_progress(bot_id, current_time, day=day)
+    deliveries = plan_deliveries(bot_id, current_time, day=day)
+    posts = ContentPost.objects.in_bulk({d.post_id for d in deliveries}) if deliveries else {}
+    return due_ids, deliveries, posts
+
+
+async def send_scheduled_content_async(
+    bot_id: int,
     bot_api,
-    current_time: datetime
+    current_time: Optional[datetime] = None,
+    concurrency: int = 20,
 ) -> int:
     """
-    Обработка прогресса одного пользователя.
+    Асинхронный send_scheduled_content для aiogram Bot.
+    
+    Планирование то же (_plan_tick, refresh_next_due — через sync_to_async).
+    Отправка идёт одновременно в concurrency чатов: посты одного чата
+    отправляет один воркер строго по порядку плана. После каждого
+    отправленного поста прогресс сохраняется одним UPDATE в autocommit —
+    сетевой вызов транзакцию БД не держит, а при падении процесса уже
+    отправленные посты не уйдут повторно.
+    
+    Args:
+        bot_id: ID бота
+        bot_api: aiogram Bot (методы send_* — корутины)
+        current_time: Текущее время (для тестов)
+        concurrency: Сколько чатов обслуживается одновременно
     
     Returns:
         Количество отправленных постов
     """
-    user = progress.user
-    subscription = progress.subscription
-    topic = progress.topic
-    
-    # 1. Проверка: пользователь не заблокирован
-    if user.is_blocked:
-        logger.debug(f"User {user.user_id} is blocked, skipping")
-        return 0
+    from .telegram_sender import AsyncTelegramContentSender
+
+    if current_time is None:
+        current_time = timezone.now()
     
-    # 2. Проверка: подписка активна
-    if subscription.status != SubscriptionStatus.ACTIVE:
-        logger.debug(f"Subscription {subscription.id} is not active, skipping")
+    tick = await sync_to_async(_plan_tick)(bot_id, current_time)
+    if tick is None:
         return 0
+    due_ids, deliveries, posts = tick
+    sent_count = 0
     
-    # 3. Вычисляем текущий день курса
-    # ИСПРАВЛЕНО: используем timezone-aware datetime для started_at
-    if progress.started_at.tzinfo is None:
-        started_at_aware = timezone.make_aware(progress.started_at)
-    else:
-        started_at_aware = progress.started_at
-    
-    days_since_start = (current_time.date() - started_at_aware.date()).days
-    current_day = days_since_start + 1
-    
-    logger.debug(
-        f"User {user.user_id}: days_since_start={days_since_start}, "
-        f"current_day={current_day}, started_at={started_at_aware.date()}, "
-        f"current_date={current_time.date()}"
-    )
-    
-    # Проверка: день в пределах курса
-    if current_day > topic.duration_days:
-        logger.debug(f"User {user.user_id} beyond course duration (day {current_day} > {topic.duration_days})")
+    if deliveries:
+        # Очередь чатов; план уже упорядочен по прогрессу и времени поста
+        chats: Dict[int, List[Delivery]] = OrderedDict()
+        for delivery in deliveries:
+            chats.setdefault(delivery.chat_id, []).append(delivery)
+        queue: asyncio.Queue = asyncio.Queue()
+        for chat_deliveries in chats.values():
+            queue.put_nowait(chat_deliveries)
         
-        # Отмечаем как завершенный
-        if not progress.completed:
-            progress.mark_completed()
-        
-        return 0
-    
-    # 4. Обновляем current_lesson_number если нужно
-    if progress.current_lesson_number != current_day:
-        logger.info(
-            f"Updating lesson number for user {user.user_id}: "
-            f"{progress.current_lesson_number} -> {current_day}"
-        )
-        progress.current_lesson_number = current_day
-        progress.save(update_fields=['current_lesson_number', 'updated_at'])
-    
-    # 5. Находим урок для текущего дня
-    try:
-        from .models import ContentLesson
-        lesson = ContentLesson.objects.get(
-            topic=topic,
-            lesson_number=current_day,
-            enabled=True
-        )
-    except ContentLesson.DoesNotExist:
-        logger.debug(f"Lesson {current_day} not found for topic {topic.id}")
-        return 0
-    
-    # 6. Находим посты для отправки
-    posts_query = lesson.posts.filter(
-        enabled=True,
-        send_time__lte=current_time.time()  # время поста <= текущее время
-    ).order_by('send_time', 'sort_order')
-    
-    # 7. Исключаем уже отправленные посты
-    if progress.last_post_sent_id:
-        # ИСПРАВЛЕНО: Просто исключаем посты с ID <= last_post_sent_id
-        # Это работает т.к. посты отправляются по порядку (send_time, sort_order)
-        posts_to_send = posts_query.filter(id__gt=progress.last_post_sent_id)
-    else:
-        posts_to_send = posts_query
-    
-    # 8. Отправляем посты
+        sender = AsyncTelegramContentSender(bot_api, bot_id=bot_id)
+        counts = await asyncio.gather(*(
+            _chat_worker(queue, posts, sender, current_time)
+            for _ in range(max(1, min(concurrency, len(chats))))
+        ))
+        sent_count = sum(counts)
+    
+    await sync_to_async(refresh_next_due)(due_ids, current_time)
+    logger.info(f"Scheduler finished: sent {sent_count} posts for bot {bot_id}")
+    return sent_count
+
+
+async def _chat_worker(queue: asyncio.Queue, posts: Dict[int, ContentPost], sender, current_time: datetime) -> int:
+    """Берёт чаты из очереди и отправляет их посты по порядку. Возвращает число отправленных."""
     sent_count = 0
-    last_sent_post = None
-    
-    for post in posts_to_send:
-        try:
-            _send_post_to_user(user, post, bot_api)
+    while not queue.empty():
+        for delivery in queue.get_nowait():
+            post = posts[delivery.post_id]
+            if not await sender.send_post_async(delivery.chat_id, post):
+                # Ошибка уже залогирована; как и в синхронном тике, идём к следующему посту
+                continue
+            await sync_to_async(_record_sent)(delivery, current_time)
             sent_count += 1
-            last_sent_post = post
-            
-            logger.info(f"Sent post {post.id} ({post.title}) to user {user.user_id}")
-        
-        except Exception as e:
-            logger.error(f"Failed to send post {post.id} to user {user.user_id}: {e}")
-            # Продолжаем отправку остальных постов
-    
-    # 9. Обновляем прогресс
-    if last_sent_post:
-        progress.last_post_sent = last_sent_post
-        progress.last_sent_at = current_time
-        progress.save(update_fields=['last_post_sent', 'last_sent_at', 'updated_at'])
-    
-    # 10. Проверяем завершение курса
-    if current_day >= topic.duration_days:
-        # Проверяем что все посты последнего урока отправлены
-        last_lesson_posts_count = lesson.posts.filter(enabled=True).count()
-        
-        if last_lesson_posts_count > 0:
-            # Проверяем что последний пост урока отправлен
-            last_lesson_post = lesson.posts.filter(enabled=True).order_by('-send_time', '-sort_order').first()
-            
-            # Если последний пост урока отправлен (или его время прошло)
-            if last_lesson_post and last_sent_post and last_sent_post.id >= last_lesson_post.id:
-                if not progress.completed:
-                    progress.mark_completed()
-                    logger.info(f"User {user.user_id} completed topic {topic.id}")
-        else:
-            # Нет постов в последнем уроке - отмечаем завершенным
-            if not progress.completed:
-                progress.mark_completed()
-                logger.info(f"User {user.user_id} completed topic {topic.id} (no posts)")
-    
+            logger.info(f"Sent post {post.id} ({post.title}) to user {delivery.chat_id}")
     return sent_count
 
 
-def _send_post_to_user(user: TelegramUser, post: ContentPost, bot_api):
-    """
-    Отправка одного поста пользователю через Telegram Bot API.
-    
-    Использует TelegramContentSender для правильного выбора метода отправки.
-    """
-    from .telegram_sender import TelegramContentSender
-    
-    sender = TelegramContentSender(bot_api)
-    return sender.send_post(user.user_id, post)
\ No newline at end of file
+def _record_sent(delivery: Delivery, current_time: datetime) -> None:
+    """Сохранить отправку одного поста (один UPDATE, без явной транзакции)."""
+    now = timezone.now()
+    fields = {'last_post_sent_id': delivery.post_id, 'last_sent_at': current_time, 'updated_at': now}
+    if delivery.final:
+        fields.update(completed=True, completed_at=now)
+        logger.info(f"Completed topic for progress {delivery.progress_id}")
+    UserContentProgress.objects.filter(pk=delivery.progress_id).update(**fields)
+
+
+def _send_batch(batch: List[Delivery], posts: Dict[int, ContentPost], sender, current_time: datetime) -> int:
+    """Отправить пачку постов и записать прогресс. Возвращает число отправленных."""
+    sent_count = 0
+    last_sent: Dict[int, int] = {}
+    completed: Set[int] = set()
+    
+    for delivery in batch:
+        post = posts[delivery.post_id]
+        if not sender.send_post(delivery.chat_id, post):
+            # Ошибка уже залогирована в send_post; продолжаем отправку остальных постов
+            continue
+        sent_count += 1
+        last_sent[delivery.progress_id] = post.id
+        if delivery.final:
+            completed.add(delivery.progress_id)
+        logger.info(f"Sent post {post.id} ({post.title}) to user {delivery.chat_id}")
+    
+    if last_sent:
+        now = timezone.now()
+        with transaction.atomic():
+            UserContentProgress.objects.bulk_update(
+                [
+                    UserContentProgress(pk=progress_id, last_post_sent_id=post_id,
+                                        last_sent_at=current_time, updated_at=now)
+                    for progress_id, post_id in last_sent.items()
+                ],
+                ['last_post_sent', 'last_sent_at', 'updated_at'],
+            )
+            if completed:
+                UserContentProgress.objects.filter(pk__in=completed, completed=False).update(
+                    completed=True, completed_at=now, updated_at=now
+                )
+                logger.info(f"Completed topics for progress {sorted(completed)}")
+    return sent_count
@@ -0,0 +1,30 @@
+# content/signals.py
+"""
+Сброс next_due_at прогрессов (content/planner.py) при изменении расписания
+топика: уроков, постов или длительности курса. Пересчёт — на ближайшем тике.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ContentLesson, ContentPost, ContentTopic
+from .planner import reset_next_due
+
+
+@receiver(post_save, sender=ContentPost)
+@receiver(post_delete, sender=ContentPost)
+def post_changed(sender, instance, **kwargs):
+    topic_id = ContentLesson.objects.filter(pk=instance.lesson_id).values_list("topic_id", flat=True).first()
+    if topic_id is not None:
+        reset_next_due(topic_id)
+
+
+@receiver(post_save, sender=ContentLesson)
+@receiver(post_delete, sender=ContentLesson)
+def lesson_changed(sender, instance, **kwargs):
+    reset_next_due(instance.topic_id)
+
+
+@receiver(post_save, sender=ContentTopic)
+def topic_changed(sender, instance, created=False, **kwargs):
+    if not created:
+        reset_next_due(instance.pk)
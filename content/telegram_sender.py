@@ -1,11 +1,25 @@
 # content/telegram_sender.py
+import asyncio
+import hashlib
 import logging
+import os
 from typing import Optional
 
+from asgiref.sync import sync_to_async
+
+from bot.outbound import Priority, get_outbound
+
 from .models import ContentPost
 
 logger = logging.getLogger(__name__)
 
+# post_type → (метод Bot API, поле с медиа)
+MEDIA_METHODS = {
+    'audio': ('send_audio', 'audio'),
+    'video': ('send_video', 'video'),
+    'photo': ('send_photo', 'photo'),
+}
+
 
 class TelegramContentSender:
     """
@@ -16,14 +30,36 @@ class TelegramContentSender:
     - audio -> send_audio (с caption)
     - video -> send_video (с caption)
     - photo -> send_photo (с caption)
+    
+    Медиа загружается в Telegram один раз на бота: полученный file_id
+    сохраняется в MediaFileCache и используется для следующих получателей.
     """
     
-    def __init__(self, bot_api):
+    def __init__(self, bot_api, bot_id: Optional[int] = None):
         """
         Args:
             bot_api: Telegram Bot API (aiogram Bot или mock)
+            bot_id: ID бота (Bot.bot_id) для кеша file_id; без него медиа
+                загружается при каждой отправке
         """
         self.bot_api = bot_api
+        self.bot_id = bot_id
+        self._hashes = {}
+        self._file_ids = {}
+        # Общий лимитер токена: контент уступает место уведомлениям об оплате
+        self.outbound = get_outbound(bot_api)
+    
+    def _call(self, user_id: int, method: str, **kwargs):
+        """Вызов метода Bot API в рамках лимитов Telegram (429 → пауза и повтор)"""
+        media = next((v for v in kwargs.values() if hasattr(v, 'seek')), None)
+        
+        def call():
+            if media is not None:
+                # При повторе после 429 файл нужно отправить с начала
+                media.seek(0)
+            return getattr(self.bot_api, method)(chat_id=user_id, **kwargs)
+        
+        return self.outbound.send_sync(user_id, call, priority=Priority.CONTENT)
     
     def send_post(self, user_id: int, post: ContentPost) -> bool:
         """
@@ -59,10 +95,35 @@ class TelegramContentSender:
             logger.error(f"Failed to send post {post.id} to user {user_id}: {e}", exc_info=True)
             return False
     
+    def upload_media(self, chat_id: int, post: ContentPost) -> bool:
+        """
+        Загрузить медиа поста в chat_id (служебный чат) и сохранить file_id.
+
+        Returns:
+            True если файл загружен, False если file_id уже есть в кеше
+
+        Raises:
+            ValueError: у поста нет медиа или отправитель без bot_id
+            Исключение Bot API при ошибке загрузки
+        """
+        method_field = MEDIA_METHODS.get(post.post_type)
+        if method_field is None or not post.media_file or self.bot_id is None:
+            raise ValueError(f"Post {post.id} has no media to upload for bot {self.bot_id}")
+        method, field = method_field
+        file_hash = self._file_hash(post)
+        if self._cached_file_id(post, file_hash):
+            return False
+        with post.media_file.open('rb') as media_file:
+            message = self._call(chat_id, method, **{field: media_file}, disable_notification=True)
+        self._remember_file_id(post, file_hash, field, message)
+        logger.debug(f"Uploaded {field} of post {post.id} to chat {chat_id}")
+        return True
+
     def _send_text_post(self, user_id: int, post: ContentPost):
         """Отправка текстового поста через send_message"""
-        self.bot_api.send_message(
-            chat_id=user_id,
+        self._call(
+            user_id,
+            'send_message',
             text=post.content,
             parse_mode='HTML'
         )
@@ -70,74 +131,217 @@ class TelegramContentSender:
     
     def _send_audio_post(self, user_id: int, post: ContentPost):
         """Отправка аудио через send_audio с caption"""
+        self._send_media_post(user_id, post, 'send_audio', 'audio')
+    
+    def _send_video_post(self, user_id: int, post: ContentPost):
+        """Отправка видео через send_video с caption"""
+        self._send_media_post(user_id, post, 'send_video', 'video')
+    
+    def _send_photo_post(self, user_id: int, post: ContentPost):
+        """Отправка фото через send_photo с caption"""
+        self._send_media_post(user_id, post, 'send_photo', 'photo')
+    
+    def _send_media_post(self, user_id: int, post: ContentPost, method: str, field: str):
+        """
+        Отправка медиа: по сохранённому file_id, если файл уже загружался этим
+        ботом, иначе загрузка файла и сохранение полученного file_id.
+        """
         if not post.media_file:
-            logger.warning(f"Audio post {post.id} has no media_file, sending as text")
+            logger.warning(f"{field.capitalize()} post {post.id} has no media_file, sending as text")
             self._send_text_post(user_id, post)
             return
         
-        # Открываем файл для отправки
+        caption = post.content if post.content else None
         try:
-            with post.media_file.open('rb') as audio_file:
-                self.bot_api.send_audio(
-                    chat_id=user_id,
-                    audio=audio_file,
-                    caption=post.content if post.content else None,
-                    parse_mode='HTML'
-                )
+            file_hash = self._file_hash(post) if self.bot_id is not None else None
+            file_id = self._cached_file_id(post, file_hash)
+            if file_id:
+                try:
+                    self._call(user_id, method, **{field: file_id}, caption=caption, parse_mode='HTML')
+                    logger.debug(f"Sent {field} post {post.id} to user {user_id} by file_id")
+                    return
+                except Exception as e:
+                    if not _is_rejected_file_id(e):
+                        raise
+                    logger.warning(f"Telegram rejected file_id of post {post.id}: {e}; uploading again")
+                    self._forget_file_id(post, file_hash)
+            
+            # Открываем файл для отправки
+            with post.media_file.open('rb') as media_file:
+                message = self._call(user_id, method, **{field: media_file}, caption=caption, parse_mode='HTML')
+            self._remember_file_id(post, file_hash, field, message)
         except FileNotFoundError:
             logger.error(f"Media file not found for post {post.id}: {post.media_file.name}")
             # Отправляем хотя бы текст
             if post.content:
                 self._send_text_post(user_id, post)
         
-        logger.debug(f"Sent audio post {post.id} to user {user_id}")
+        logger.debug(f"Sent {field} post {post.id} to user {user_id}")
     
-    def _send_video_post(self, user_id: int, post: ContentPost):
-        """Отправка видео через send_video с caption"""
-        if not post.media_file:
-            logger.warning(f"Video post {post.id} has no media_file, sending as text")
-            self._send_text_post(user_id, post)
+    # ---------- кеш file_id ----------
+    def _file_hash(self, post: ContentPost) -> str:
+        """sha256 файла поста (считается один раз на отправителя)."""
+        key = (post.id, post.media_file.name)
+        file_hash = self._hashes.get(key)
+        if file_hash is None:
+            digest = hashlib.sha256()
+            with post.media_file.open('rb') as media_file:
+                for chunk in iter(lambda: media_file.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            file_hash = self._hashes[key] = digest.hexdigest()
+        return file_hash
+    
+    def _cached_file_id(self, post: ContentPost, file_hash: Optional[str]) -> Optional[str]:
+        if file_hash is None:
+            return None
+        key = (post.id, file_hash)
+        if key not in self._file_ids:
+            from .models import MediaFileCache
+            self._file_ids[key] = (
+                MediaFileCache.objects.filter(bot_id=self.bot_id, post_id=post.id, file_hash=file_hash)
+                .values_list('file_id', flat=True).first()
+            )
+        return self._file_ids[key]
+    
+    def _remember_file_id(self, post: ContentPost, file_hash: Optional[str], field: str, message) -> None:
+        file_id = _file_id_from(message, field) if file_hash is not None else None
+        if not file_id:
             return
-        
+        from .models import MediaFileCache
+        MediaFileCache.objects.update_or_create(
+            bot_id=self.bot_id, post_id=post.id, file_hash=file_hash,
+            defaults={'file_id': file_id, 'media_type': field},
+        )
+        self._file_ids[(post.id, file_hash)] = file_id
+    
+    def _forget_file_id(self, post: ContentPost, file_hash: str) -> None:
+        from .models import MediaFileCache
+        MediaFileCache.objects.filter(bot_id=self.bot_id, post_id=post.id, file_hash=file_hash).delete()
+        self._file_ids[(post.id, file_hash)] = None
+
+
+class AsyncTelegramContentSender(TelegramContentSender):
+    """
+    Асинхронная отправка для aiogram Bot (методы bot_api — корутины).
+    
+    Выбор метода и кеш file_id — как у TelegramContentSender; запросы к БД
+    идут через sync_to_async, чтение файлов — в отдельных потоках. Пока
+    медиа поста загружается в Telegram, остальные получатели этого поста
+    ждут file_id, а не грузят файл параллельно.
+    """
+    
+    def __init__(self, bot_api, bot_id: Optional[int] = None):
+        super().__init__(bot_api, bot_id=bot_id)
+        self._upload_locks = {}
+    
+    async def _call_async(self, user_id: int, method: str, **kwargs):
+        """Вызов корутины Bot API в рамках лимитов Telegram (429 → пауза и повтор)"""
+        return await self.outbound.send(
+            user_id,
+            lambda: getattr(self.bot_api, method)(chat_id=user_id, **kwargs),
+            priority=Priority.CONTENT,
+        )
+    
+    async def send_post_async(self, user_id: int, post: ContentPost) -> bool:
+        """Асинхронный send_post: True если отправлено, False при ошибке."""
         try:
-            with post.media_file.open('rb') as video_file:
-                self.bot_api.send_video(
-                    chat_id=user_id,
-                    video=video_file,
-                    caption=post.content if post.content else None,
-                    parse_mode='HTML'
-                )
-        except FileNotFoundError:
-            logger.error(f"Media file not found for post {post.id}: {post.media_file.name}")
-            if post.content:
-                self._send_text_post(user_id, post)
-        
-        logger.debug(f"Sent video post {post.id} to user {user_id}")
+            if post.post_type == 'text':
+                await self._send_text_post_async(user_id, post)
+            elif post.post_type in MEDIA_METHODS:
+                method, field = MEDIA_METHODS[post.post_type]
+                await self._send_media_post_async(user_id, post, method, field)
+            else:
+                logger.error(f"Unknown post_type: {post.post_type} for post {post.id}")
+                return False
+            return True
+        except Exception as e:
+            logger.error(f"Failed to send post {post.id} to user {user_id}: {e}", exc_info=True)
+            return False
     
-    def _send_photo_post(self, user_id: int, post: ContentPost):
-        """Отправка фото через send_photo с caption"""
+    async def _send_text_post_async(self, user_id: int, post: ContentPost):
+        await self._call_async(user_id, 'send_message', text=post.content, parse_mode='HTML')
+        logger.debug(f"Sent text post {post.id} to user {user_id}")
+    
+    async def _send_media_post_async(self, user_id: int, post: ContentPost, method: str, field: str):
         if not post.media_file:
-            logger.warning(f"Photo post {post.id} has no media_file, sending as text")
-            self._send_text_post(user_id, post)
+            logger.warning(f"{field.capitalize()} post {post.id} has no media_file, sending as text")
+            await self._send_text_post_async(user_id, post)
             return
         
+        caption = post.content if post.content else None
+        # Файл поста (один FieldFile на всех получателей) читается только под блокировкой поста
+        lock = self._upload_locks.setdefault(post.id, asyncio.Lock())
         try:
-            with post.media_file.open('rb') as photo_file:
-                self.bot_api.send_photo(
-                    chat_id=user_id,
-                    photo=photo_file,
-                    caption=post.content if post.content else None,
-                    parse_mode='HTML'
+            async with lock:
+                file_hash = (
+                    await sync_to_async(self._file_hash, thread_sensitive=False)(post)
+                    if self.bot_id is not None else None
                 )
+                file_id = await sync_to_async(self._cached_file_id)(post, file_hash)
+                if not file_id:
+                    # Загружает первый получатель, остальные дождутся его file_id
+                    await self._upload_async(user_id, post, method, field, caption, file_hash)
+                    return
+            try:
+                await self._call_async(user_id, method, **{field: file_id}, caption=caption, parse_mode='HTML')
+                logger.debug(f"Sent {field} post {post.id} to user {user_id} by file_id")
+                return
+            except Exception as e:
+                if not _is_rejected_file_id(e):
+                    raise
+                logger.warning(f"Telegram rejected file_id of post {post.id}: {e}; uploading again")
+            async with lock:
+                fresh_id = await sync_to_async(self._cached_file_id)(post, file_hash)
+                if fresh_id == file_id:
+                    await sync_to_async(self._forget_file_id)(post, file_hash)
+                    fresh_id = None
+                if not fresh_id:
+                    await self._upload_async(user_id, post, method, field, caption, file_hash)
+                    return
+            # Другой получатель уже загрузил файл заново
+            await self._call_async(user_id, method, **{field: fresh_id}, caption=caption, parse_mode='HTML')
         except FileNotFoundError:
             logger.error(f"Media file not found for post {post.id}: {post.media_file.name}")
             if post.content:
-                self._send_text_post(user_id, post)
-        
-        logger.debug(f"Sent photo post {post.id} to user {user_id}")
+                await self._send_text_post_async(user_id, post)
+    
+    async def _upload_async(self, user_id: int, post: ContentPost, method: str, field: str,
+                            caption: Optional[str], file_hash: Optional[str]):
+        media = await sync_to_async(_input_file, thread_sensitive=False)(post)
+        message = await self._call_async(user_id, method, **{field: media}, caption=caption, parse_mode='HTML')
+        await sync_to_async(self._remember_file_id)(post, file_hash, field, message)
+        logger.debug(f"Uploaded {field} post {post.id} to user {user_id}")
+
+
+def _input_file(post: ContentPost):
+    """Файл поста для aiogram: содержимое в памяти, чтобы повтор после 429 отправил его заново."""
+    from aiogram.types import BufferedInputFile
+    
+    with post.media_file.open('rb') as media_file:
+        return BufferedInputFile(media_file.read(), filename=os.path.basename(post.media_file.name))
+
+
+def _file_id_from(message, field: str) -> Optional[str]:
+    """file_id из ответа send_* (aiogram Message или dict ответа Bot API)."""
+    media = message.get(field) if isinstance(message, dict) else getattr(message, field, None)
+    if isinstance(media, (list, tuple)):
+        # photo — список размеров по возрастанию, берём самый большой
+        media = media[-1] if media else None
+    if media is None:
+        return None
+    file_id = media.get('file_id') if isinstance(media, dict) else getattr(media, 'file_id', None)
+    return file_id if isinstance(file_id, str) else None
+
+
+def _is_rejected_file_id(exc: Exception) -> bool:
+    """400 от Telegram про сам file_id (устарел, чужой бот, неверный) — тогда загружаем файл заново."""
+    text = str(exc).lower()
+    return 'file' in text and any(
+        marker in text for marker in ('identifier', 'file_id', 'file reference', 'wrong', 'invalid')
+    )
 
 
-def send_post_to_user(user_id: int, post: ContentPost, bot_api) -> bool:
+def send_post_to_user(user_id: int, post: ContentPost, bot_api, bot_id: Optional[int] = None) -> bool:
     """
     Вспомогательная функция для отправки поста.
     
@@ -145,9 +349,10 @@ def send_post_to_user(user_id: int, post: ContentPost, bot_api) -> bool:
         user_id: Telegram user ID
         post: Пост для отправки
         bot_api: Telegram Bot API
+        bot_id: ID бота для кеша file_id
     
     Returns:
         True если успешно, False при ошибке
     """
-    sender = TelegramContentSender(bot_api)
+    sender = TelegramContentSender(bot_api, bot_id=bot_id)
     return sender.send_post(user_id, post)
\ No newline at end of file
@@ -0,0 +1,43 @@
+# core/signals.py
+"""
+Уведомление процессов бота об изменении TelegramUser.is_blocked.
+
+Бот кеширует is_blocked в памяти (bot/blocked.py) и слушает канал
+BLOCKED_CHANNEL; здесь после коммита отправляется pg_notify с user_id.
+"""
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from bot.blocked import BLOCKED_CHANNEL
+
+from .models import TelegramUser
+
+
+def notify_blocked_changed(user_id: int) -> None:
+    """NOTIFY для кеша банов в боте (только PostgreSQL)."""
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", [BLOCKED_CHANNEL, str(user_id)])
+
+
+@receiver(post_init, sender=TelegramUser)
+def remember_is_blocked(sender, instance, **kwargs):
+    # Запоминаем исходное значение, чтобы не слать NOTIFY на каждый save()
+    instance._loaded_is_blocked = instance.__dict__.get("is_blocked")
+
+
+@receiver(post_save, sender=TelegramUser)
+def telegram_user_saved(sender, instance, created, **kwargs):
+    changed = instance.is_blocked != instance._loaded_is_blocked
+    instance._loaded_is_blocked = instance.is_blocked
+    if changed or (created and instance.is_blocked):
+        user_id = instance.user_id
+        transaction.on_commit(lambda: notify_blocked_changed(user_id))
+
+
+@receiver(post_delete, sender=TelegramUser)
+def telegram_user_deleted(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: notify_blocked_changed(user_id))
@@ -513,15 +513,23 @@ async def confirm_edit(callback: CallbackQuery, state: FSMContext):
 
 
 def register_handlers(dp, bot_id: int):
-    """Регистрация всех handlers в dispatcher"""
+    """
+    Регистрация всех handlers в dispatcher.
+    Модульный router — шаблон: каждый dispatcher получает свою копию, поэтому
+    бота можно пересоздать в том же процессе (хост ботов, sync()).
+    """
+    bot_router = Router(name=f"leads-bot-{bot_id}")
+    for name, observer in router.observers.items():
+        bot_router.observers[name].handlers.extend(observer.handlers)
+
     # Добавляем bot_id в middleware для всех handlers
-    @router.message.middleware()
-    @router.callback_query.middleware()
+    @bot_router.message.middleware()
+    @bot_router.callback_query.middleware()
     async def inject_bot_id(handler, event, data):
         data['bot_id'] = bot_id
         return await handler(event, data)
     
-    dp.include_router(router)
+    dp.include_router(bot_router)
 
     #Логируем для отладки
-    logger.info(f"Lead handlers registered for bot_id={bot_id}")
\ No newline at end of file
+    logger.info(f"Lead handlers registered for bot_id={bot_id}")
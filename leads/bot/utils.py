@@ -7,6 +7,8 @@ from django.conf import settings
 from aiogram import Bot
 from aiogram.exceptions import TelegramAPIError
 
+from bot.outbound import Priority, get_outbound
+
 logger = logging.getLogger("leads.bot")
 
 
@@ -129,10 +131,14 @@ async def send_telegram_notification(
 💬 <b>Коментар:</b> {comment or 'Немає'}
         """.strip()
         
-        await bot.send_message(
-            chat_id=admin_user_id,
-            text=message,
-            parse_mode='HTML'
+        await get_outbound(bot).send(
+            admin_user_id,
+            lambda: bot.send_message(
+                chat_id=admin_user_id,
+                text=message,
+                parse_mode='HTML'
+            ),
+            priority=Priority.NOTIFY,
         )
         
         logger.info(f"Telegram notification sent for lead #{lead_id} to admin {admin_user_id}")
@@ -2,7 +2,9 @@ from django.contrib import admin
 from .models import Invoice, VerifiedUser
 from django.utils import timezone
 from django.contrib import admin, messages
-from .models import Invoice, VerifiedUser, PaymentStatus
+from django.utils.html import format_html
+from .models import Invoice, VerifiedUser, PaymentStatus, NotificationOutbox, WebhookInbox
+from payments.sweeper import invoice_payloads
 from payments.wayforpay.services import WayForPayService
 
 @admin.register(Invoice)
@@ -11,7 +13,7 @@ class InvoiceAdmin(admin.ModelAdmin):
                     "amount", "currency", "paid_at", "created_at")
     list_filter = ("payment_status", "currency", "bot_id", "created_at","is_recurrent_manual")
     search_fields = ("order_reference", "user__username", "user__user_id")
-    readonly_fields = ("raw_request_payload", "raw_response_payload")
+    readonly_fields = ("request_payload", "response_payload")
     date_hierarchy = "created_at"
 
     fieldsets = (
@@ -30,19 +32,56 @@ class InvoiceAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Отладка', {
-            'fields': ('raw_request_payload', 'raw_response_payload'),
+            'fields': ('request_payload', 'response_payload'),
             'classes': ('collapse',)
         }),
     )
 
     actions = ['approve_and_activate']
 
+    @admin.display(description="Raw request payload")
+    def request_payload(self, obj):
+        return self._payload(obj, "request")
+
+    @admin.display(description="Raw response payload")
+    def response_payload(self, obj):
+        return self._payload(obj, "response")
+
+    @staticmethod
+    def _payload(obj, key):
+        # Старые payload'ы лежат в InvoicePayloadArchive — распаковываем только на странице инвойса
+        if not hasattr(obj, "_payloads"):
+            obj._payloads = invoice_payloads(obj)
+        value = obj._payloads.get(key)
+        if value is None:
+            return "-"
+        import json
+        return format_html("<pre>{}</pre>", json.dumps(value, ensure_ascii=False, indent=2))
+
 @admin.register(VerifiedUser)
 class VerifiedUserAdmin(admin.ModelAdmin):
     list_display = ("user", "bot_id", "successful_payments_count",
                     "total_amount_paid", "last_payment_date", "first_payment_date")
     list_filter = ("bot_id",)
     search_fields = ("user__username", "user__user_id")
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ("dedup_key", "kind", "bot_id", "chat_id", "status", "attempts",
+                    "next_attempt_at", "sent_at", "created_at")
+    list_filter = ("status", "kind", "bot_id")
+    search_fields = ("dedup_key", "chat_id")
+    readonly_fields = ("created_at", "sent_at", "last_error")
+
+
+@admin.register(WebhookInbox)
+class WebhookInboxAdmin(admin.ModelAdmin):
+    list_display = ("id", "order_reference", "delivery_key", "status", "attempts", "received_at", "processed_at")
+    list_filter = ("status",)
+    search_fields = ("order_reference",)
+    readonly_fields = ("order_reference", "delivery_key", "payload", "headers", "received_at",
+                       "processed_at", "result", "last_error")
 from django.contrib import admin
 
 
@@ -0,0 +1,55 @@
+# payments/management/commands/charge_recurring.py
+"""
+Автосписания продлений по токену карты (payments/recurring.py).
+
+Использование:
+    python manage.py charge_recurring                         # все подписки к списанию на сегодня
+    python manage.py charge_recurring --concurrency 20 --batch-size 500
+    python manage.py charge_recurring --dry-run               # только показать, кого спишем
+
+Пачки забираются через SKIP LOCKED, поэтому можно запускать и несколько
+процессов одновременно. Запускать по cron (например, раз в час).
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from payments.recurring import due_subscriptions, run_batch
+
+
+class Command(BaseCommand):
+    help = "Списание продлений подписок по токену карты (WayForPay CHARGE)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200, help="Подписок за один проход")
+        parser.add_argument("--concurrency", type=int, default=10, help="Одновременных запросов к WayForPay")
+        parser.add_argument("--max-attempts", type=int, default=None,
+                            help="После стольких отказов автосписание на паузу (по умолчанию RECURRING_CHARGE_MAX_ATTEMPTS)")
+        parser.add_argument("--dry-run", action="store_true", help="Показать подписки к списанию")
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+
+        if options["dry_run"]:
+            rows = due_subscriptions(today).values_list("id", "bot_id", "user__user_id", "recurrent_next_payment")
+            for sub_id, bot_id, user_id, due in rows:
+                self.stdout.write(f"#{sub_id} bot={bot_id} user={user_id} due={due}")
+            self.stdout.write(self.style.SUCCESS(f"{len(rows)} subscriptions due"))
+            return
+
+        totals = {}
+        while True:
+            stats = run_batch(
+                batch_size=options["batch_size"],
+                concurrency=options["concurrency"],
+                max_attempts=options["max_attempts"],
+                today=today,
+            )
+            if not stats:
+                break
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+            self.stdout.write(" ".join(f"{k.lower()}={v}" for k, v in sorted(stats.items())))
+
+        line = " ".join(f"{k.lower()}={v}" for k, v in sorted(totals.items())) or "nothing due"
+        style = self.style.ERROR if totals.get("ERROR") else self.style.SUCCESS
+        self.stdout.write(style(f"Done: {line}"))
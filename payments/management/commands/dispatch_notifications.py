@@ -0,0 +1,54 @@
+# payments/management/commands/dispatch_notifications.py
+"""
+Диспетчер outbox уведомлений об оплате (payments/outbox.py).
+
+Использование:
+    python manage.py dispatch_notifications                 # работает постоянно
+    python manage.py dispatch_notifications --once          # один проход (cron)
+    python manage.py dispatch_notifications --batch-size 100 --interval 1
+
+Можно запускать несколько экземпляров: строки разбираются через SKIP LOCKED.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from payments.outbox import Sender, dispatch_batch
+
+
+class Command(BaseCommand):
+    help = "Отправка уведомлений из outbox в Telegram (пачками, с повторами)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Один проход и выход")
+        parser.add_argument("--batch-size", type=int, default=50, help="Строк за один проход")
+        parser.add_argument("--interval", type=float, default=2.0, help="Пауза, если outbox пуст, сек")
+        parser.add_argument("--max-attempts", type=int, default=8, help="После стольких ошибок строка FAILED")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        max_attempts = options["max_attempts"]
+
+        if options["once"]:
+            stats = dispatch_batch(batch_size, max_attempts)
+            self._report(stats)
+            return
+
+        self.stdout.write(f"Dispatching notifications (batch={batch_size}, interval={options['interval']}s)")
+        try:
+            while True:
+                close_old_connections()
+                # Новый Sender на проход: токен бота мог смениться
+                stats = dispatch_batch(batch_size, max_attempts, sender=Sender())
+                if any(stats.values()):
+                    self._report(stats)
+                # Полная пачка — сразу следующая, иначе ждём новые строки
+                if sum(stats.values()) < batch_size:
+                    time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING("Stopped"))
+
+    def _report(self, stats):
+        style = self.style.ERROR if stats["failed"] else self.style.SUCCESS
+        self.stdout.write(style(f"sent={stats['sent']} retry={stats['retry']} failed={stats['failed']}"))
@@ -0,0 +1,77 @@
+# payments/management/commands/process_webhook_inbox.py
+"""
+Пул воркеров inbox вебхуков WayForPay (payments/wayforpay/inbox.py).
+
+Использование:
+    python manage.py process_webhook_inbox --workers 4
+    python manage.py process_webhook_inbox --once            # один проход (cron/отладка)
+
+Каждый воркер — поток со своим соединением к БД; строки разбираются
+через SKIP LOCKED, поэтому можно запускать и несколько процессов.
+"""
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from payments.wayforpay.inbox import process_batch
+
+
+class Command(BaseCommand):
+    help = "Обработка сохранённых вебхуков WayForPay (WAYFORPAY_WEBHOOK_INBOX)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Число потоков-воркеров")
+        parser.add_argument("--batch-size", type=int, default=20, help="Строк за один проход воркера")
+        parser.add_argument("--interval", type=float, default=1.0, help="Пауза, если inbox пуст, сек")
+        parser.add_argument("--max-attempts", type=int, default=5, help="После стольких ошибок строка FAILED")
+        parser.add_argument("--once", action="store_true", help="Один проход и выход")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        max_attempts = options["max_attempts"]
+
+        if options["once"]:
+            self._report(process_batch(batch_size, max_attempts))
+            return
+
+        stop = threading.Event()
+        workers = [
+            threading.Thread(
+                target=self._worker,
+                args=(stop, batch_size, max_attempts, options["interval"]),
+                name=f"inbox-worker-{i}",
+                daemon=True,
+            )
+            for i in range(max(1, options["workers"]))
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Processing webhook inbox with {len(workers)} workers")
+
+        try:
+            while any(w.is_alive() for w in workers):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for worker in workers:
+                worker.join()
+            self.stdout.write(self.style.WARNING("Stopped"))
+
+    def _worker(self, stop, batch_size, max_attempts, interval):
+        try:
+            while not stop.is_set():
+                close_old_connections()
+                stats = process_batch(batch_size, max_attempts)
+                if stats:
+                    self._report(stats)
+                if sum(stats.values()) < batch_size:
+                    stop.wait(interval)
+        finally:
+            connection.close()
+
+    def _report(self, stats):
+        line = " ".join(f"{k.lower()}={v}" for k, v in sorted(stats.items())) or "inbox empty"
+        style = self.style.ERROR if stats.get("FAILED") else self.style.SUCCESS
+        self.stdout.write(style(line))
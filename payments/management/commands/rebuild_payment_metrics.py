@@ -0,0 +1,30 @@
+# payments/management/commands/rebuild_payment_metrics.py
+"""
+Пересчёт поминутных сводок мониторинга (PaymentMetricBucket / PaymentUserMetricBucket)
+по payment_invoices.
+
+Нужен после деплоя (история до появления сводок) и после ручных правок
+инвойсов через QuerySet.update() / SQL, которые обходят сигналы.
+
+Использование:
+    python manage.py rebuild_payment_metrics               # последние 24 часа
+    python manage.py rebuild_payment_metrics --hours 168
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from payments.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Пересчёт сводок мониторинга платежей"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=24, help="Глубина пересчёта, часов (по умолчанию 24)")
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(hours=options["hours"])
+        total = rebuild(since)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt metrics from {since:%Y-%m-%d %H:%M}: {total} invoices"))
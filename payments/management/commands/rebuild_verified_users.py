@@ -0,0 +1,36 @@
+# payments/management/commands/rebuild_verified_users.py
+"""
+Пересчёт статистики VerifiedUser (число и сумма оплат, даты, карта) по APPROVED-инвойсам.
+
+Нужен после исправления потерянных обновлений счётчиков и после ручных
+правок инвойсов. Записи без APPROVED-инвойсов не трогаются.
+
+Регулярные платежи WayForPay (_WFPREG-) перезаписывают базовый инвойс, поэтому
+по инвойсам они не видны: без --reset статистика только догоняется вверх
+(счётчики не уменьшаются), с --reset — пересчитывается ровно по инвойсам,
+и такие платежи из неё выпадают.
+
+Использование:
+    python manage.py rebuild_verified_users
+    python manage.py rebuild_verified_users --bot-id 3
+    python manage.py rebuild_verified_users --reset     # после правок инвойсов вниз
+"""
+from django.core.management.base import BaseCommand
+
+from payments.models import VerifiedUser
+
+
+class Command(BaseCommand):
+    help = "Пересчёт статистики VerifiedUser по оплаченным инвойсам"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bot-id", type=int, default=None, help="Только для этого бота")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Записей на один upsert")
+        parser.add_argument("--reset", action="store_true",
+                            help="Записать ровно статистику инвойсов, даже если она меньше текущей")
+
+    def handle(self, *args, **options):
+        total = VerifiedUser.rebuild(
+            bot_id=options["bot_id"], batch_size=options["batch_size"], reset=options["reset"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} verified users"))
@@ -0,0 +1,51 @@
+# payments/management/commands/reconcile_invoices.py
+"""
+Сверка зависших PENDING/PROCESSING инвойсов через WayForPay CHECK_STATUS
+(payments/reconcile.py).
+
+Использование:
+    python manage.py reconcile_invoices                       # по cron, например раз в 10 минут
+    python manage.py reconcile_invoices --dry-run             # спросить WayForPay, ничего не менять
+    python manage.py reconcile_invoices --rate 10 --concurrency 16 --limit 2000
+"""
+from django.core.management.base import BaseCommand
+
+from payments.reconcile import reconcile, stale_invoices
+
+
+class Command(BaseCommand):
+    help = "Сверка зависших инвойсов с WayForPay (CHECK_STATUS)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pending-minutes", type=int, default=30, help="PENDING без изменений дольше, мин")
+        parser.add_argument("--processing-minutes", type=int, default=10, help="PROCESSING без изменений дольше, мин")
+        parser.add_argument("--max-age-hours", type=int, default=72, help="PENDING старше не сверяем, ч")
+        parser.add_argument("--limit", type=int, default=500, help="Инвойсов за запуск")
+        parser.add_argument("--concurrency", type=int, default=8, help="Одновременных запросов к WayForPay")
+        parser.add_argument("--rate", type=float, default=5.0, help="Запросов в секунду, не больше")
+        parser.add_argument("--dry-run", action="store_true", help="Только показать, что изменится")
+
+    def handle(self, *args, **options):
+        invoices = stale_invoices(
+            pending_minutes=options["pending_minutes"],
+            processing_minutes=options["processing_minutes"],
+            max_age_hours=options["max_age_hours"],
+            limit=options["limit"],
+        )
+        if not invoices:
+            self.stdout.write(self.style.SUCCESS("Nothing to reconcile"))
+            return
+
+        stats = reconcile(
+            invoices,
+            concurrency=options["concurrency"],
+            rate=options["rate"],
+            processing_minutes=options["processing_minutes"],
+            dry_run=options["dry_run"],
+        )
+        line = " ".join(f"{k.lower()}={v}" for k, v in sorted(stats.outcomes.items()))
+        prefix = "[dry-run] " if options["dry_run"] else ""
+        style = self.style.ERROR if stats.outcomes.get("ERROR") else self.style.SUCCESS
+        self.stdout.write(style(
+            f"{prefix}checked={stats.checked} {line} in {stats.elapsed:.1f}s ({stats.rate:.1f} req/s)"
+        ))
@@ -0,0 +1,58 @@
+# payments/management/commands/replay_webhooks.py
+"""
+Повторная обработка сохранённых вебхуков WayForPay (WebhookInbox).
+
+Использование:
+    python manage.py replay_webhooks --status FAILED                 # все упавшие
+    python manage.py replay_webhooks --order-reference ORDER_...     # все доставки заказа
+    python manage.py replay_webhooks --id 15 --id 16 --dry-run
+    python manage.py replay_webhooks --since 2025-01-01T10:00 --status DONE
+
+handle_webhook идемпотентен, поэтому повтор уже обработанной доставки
+не продлевает подписку второй раз.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from payments.models import InboxStatus, WebhookInbox
+from payments.wayforpay.inbox import process_entry
+
+
+class Command(BaseCommand):
+    help = "Повторная обработка вебхуков из inbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--id", type=int, action="append", dest="ids", help="id строки inbox (можно несколько)")
+        parser.add_argument("--order-reference", help="Все доставки этого orderReference")
+        parser.add_argument("--status", choices=InboxStatus.values, help="Только строки в этом статусе")
+        parser.add_argument("--since", help="Только полученные после (ISO datetime)")
+        parser.add_argument("--dry-run", action="store_true", help="Показать, что будет обработано")
+
+    def handle(self, *args, **options):
+        qs = WebhookInbox.objects.order_by("id")
+        if options["ids"]:
+            qs = qs.filter(pk__in=options["ids"])
+        if options["order_reference"]:
+            qs = qs.filter(order_reference=options["order_reference"])
+        if options["status"]:
+            qs = qs.filter(status=options["status"])
+        if options["since"]:
+            since = parse_datetime(options["since"])
+            if since is None:
+                raise CommandError(f"Invalid --since: {options['since']}")
+            qs = qs.filter(received_at__gte=since)
+        if not (options["ids"] or options["order_reference"] or options["status"] or options["since"]):
+            raise CommandError("Specify --id, --order-reference, --status or --since")
+
+        entries = list(qs.values_list("id", "delivery_key", "status"))
+        if not entries:
+            self.stdout.write(self.style.WARNING("Nothing to replay"))
+            return
+
+        for entry_id, key, status in entries:
+            if options["dry_run"]:
+                self.stdout.write(f"#{entry_id} {key} ({status})")
+                continue
+            new_status = process_entry(entry_id, force=True, max_attempts=1)
+            style = self.style.SUCCESS if new_status == InboxStatus.DONE else self.style.ERROR
+            self.stdout.write(style(f"#{entry_id} {key}: {status} → {new_status}"))
@@ -0,0 +1,40 @@
+# payments/management/commands/sweep_invoices.py
+"""
+Обслуживание payment_invoices (payments/sweeper.py): брошенные PENDING → EXPIRED,
+raw-payload'ы старых итоговых инвойсов → сжатый архив InvoicePayloadArchive.
+
+Использование:
+    python manage.py sweep_invoices                          # по cron, например раз в час
+    python manage.py sweep_invoices --expire-hours 48 --archive-days 30
+    python manage.py sweep_invoices --archive-days 0         # только expire
+
+На PostgreSQL место в таблице после архивации освобождает (auto)vacuum.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.sweeper import archive_payloads, expire_abandoned
+
+
+class Command(BaseCommand):
+    help = "Expire брошенных инвойсов и архивация старых payload'ов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--expire-hours", type=int, default=None,
+                            help="PENDING без вебхука дольше, ч (по умолчанию INVOICE_EXPIRE_AFTER_HOURS; 0 — не трогать)")
+        parser.add_argument("--archive-days", type=int, default=None,
+                            help="Архивировать payload'ы старше, дней (по умолчанию INVOICE_ARCHIVE_AFTER_DAYS; 0 — нет)")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Строк на один UPDATE")
+
+    def handle(self, *args, **options):
+        expire_hours = options["expire_hours"]
+        if expire_hours is None:
+            expire_hours = getattr(settings, "INVOICE_EXPIRE_AFTER_HOURS", 72)
+        archive_days = options["archive_days"]
+        if archive_days is None:
+            archive_days = getattr(settings, "INVOICE_ARCHIVE_AFTER_DAYS", 90)
+        chunk_size = options["chunk_size"]
+
+        expired = expire_abandoned(expire_hours, chunk_size=chunk_size) if expire_hours else 0
+        archived = archive_payloads(archive_days, chunk_size=chunk_size) if archive_days else 0
+        self.stdout.write(self.style.SUCCESS(f"Expired {expired} invoices, archived payloads of {archived}"))
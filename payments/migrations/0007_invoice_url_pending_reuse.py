@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_logdummy'),
+        ('payments', '0006_invoice_is_recurrent_manual'),
+        ('subscriptions', '0003_subscription_status_covering_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='invoice_url',
+            field=models.URLField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['user', 'bot_id', 'plan', 'payment_status'], name='inv_user_bot_plan_status_idx'),
+        ),
+    ]
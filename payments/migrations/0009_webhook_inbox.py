@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:51
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0008_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookInbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_reference', models.CharField(db_index=True, max_length=255)),
+                ('delivery_key', models.CharField(db_index=True, max_length=300)),
+                ('payload', models.JSONField()),
+                ('headers', models.JSONField(blank=True, default=dict)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('status', models.CharField(choices=[('NEW', 'New'), ('DONE', 'Done'), ('DUPLICATE', 'Duplicate'), ('FAILED', 'Failed')], default='NEW', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'db_table': 'payment_webhook_inbox',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='inbox_status_next_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0009_webhook_inbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('key', models.CharField(max_length=200, primary_key=True, serialize=False)),
+                ('tat', models.FloatField()),
+            ],
+            options={
+                'db_table': 'payment_rate_limits',
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_logdummy'),
+        ('payments', '0010_rate_limit_bucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentMetricBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bot_id', models.IntegerField()),
+                ('minute', models.DateTimeField()),
+                ('status', models.CharField(max_length=20)),
+                ('currency', models.CharField(max_length=3)),
+                ('count', models.IntegerField(default=0)),
+                ('mismatches', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'payment_metric_buckets',
+                'indexes': [models.Index(fields=['minute'], name='metric_bucket_minute_idx')],
+                'constraints': [models.UniqueConstraint(fields=('bot_id', 'minute', 'status', 'currency'), name='metric_bucket_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PaymentUserMetricBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bot_id', models.IntegerField()),
+                ('minute', models.DateTimeField()),
+                ('approved', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.telegramuser')),
+            ],
+            options={
+                'db_table': 'payment_user_metric_buckets',
+                'indexes': [models.Index(fields=['minute'], name='user_metric_minute_idx')],
+                'constraints': [models.UniqueConstraint(fields=('bot_id', 'minute', 'user'), name='user_metric_bucket_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_logdummy'),
+        ('payments', '0011_payment_metric_buckets'),
+        ('subscriptions', '0003_subscription_status_covering_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('raw_response_payload__isnull', False)), fields=['notified_at', 'bot_id'], name='inv_notified_bot_idx'),
+        ),
+    ]
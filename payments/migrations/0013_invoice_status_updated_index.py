@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_logdummy'),
+        ('payments', '0012_invoice_notified_index'),
+        ('subscriptions', '0003_subscription_status_covering_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['payment_status', 'updated_at'], name='inv_status_updated_idx'),
+        ),
+    ]
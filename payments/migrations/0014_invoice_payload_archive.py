@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0013_invoice_status_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoicePayloadArchive',
+            fields=[
+                ('invoice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payload_archive', serialize=False, to='payments.invoice')),
+                ('data', models.BinaryField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'payment_invoice_payload_archive',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0014_invoice_payload_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='last_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
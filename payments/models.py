@@ -54,6 +54,9 @@ class Invoice(models.Model):
     phone = models.CharField(max_length=20, null=True, blank=True)
     email = models.EmailField(null=True, blank=True)
 
+    # Ссылка на оплату от WayForPay (CREATE_INVOICE) — для повторной выдачи PENDING-инвойса
+    invoice_url = models.URLField(max_length=500, null=True, blank=True)
+
     # Raw данные для отладки
     raw_request_payload = models.JSONField(null=True, blank=True)
     raw_response_payload = models.JSONField(null=True, blank=True)
@@ -61,6 +64,8 @@ class Invoice(models.Model):
     # Временные метки
     notified_at = models.DateTimeField(null=True, blank=True)
     paid_at = models.DateTimeField(null=True, blank=True)
+    # Последняя сверка CHECK_STATUS (payments/reconcile.py): кандидаты перебираются по кругу
+    last_checked_at = models.DateTimeField(null=True, blank=True)
     is_recurrent_manual = models.BooleanField(
         default=False, 
         verbose_name="Рекуррентная (бессрочная)",
@@ -71,10 +76,29 @@ class Invoice(models.Model):
 
     class Meta:
         db_table = 'payment_invoices'
+        indexes = [
+            # Поиск действующего PENDING-инвойса (bot_id, user, plan) для повторной выдачи
+            models.Index(fields=["user", "bot_id", "plan", "payment_status"], name="inv_user_bot_plan_status_idx"),
+            # Сверка зависших PENDING/PROCESSING (payments/reconcile.py)
+            models.Index(fields=["payment_status", "updated_at"], name="inv_status_updated_idx"),
+            # Окно мониторинга по вебхукам (payments.monitoring.find_amount_currency_mismatches)
+            models.Index(
+                fields=["notified_at", "bot_id"], name="inv_notified_bot_idx",
+                condition=models.Q(raw_response_payload__isnull=False),
+            ),
+        ]
 
     def __str__(self):
         return f"Invoice {self.order_reference} - {self.amount} {self.currency}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Исходный бакет сводок мониторинга (payments/rollups.py)
+        from .rollups import snapshot
+        instance._rollup_state = snapshot(instance, field_names)
+        return instance
+
     @classmethod
     def generate_order_reference(cls, bot_id: int, user_id: int, plan_id: int) -> str:
         """
@@ -117,6 +141,42 @@ class Invoice(models.Model):
         self.save()
 
 
+class InvoicePayloadArchive(models.Model):
+    """
+    Архив raw-payload'ов старого инвойса (payments/sweeper.py).
+
+    raw_request_payload / raw_response_payload переносятся сюда одним
+    zlib-сжатым JSON и обнуляются в payment_invoices, чтобы горячая
+    таблица и её индексы не росли. Читается только по запросу (админка).
+    """
+    invoice = models.OneToOneField(
+        Invoice, on_delete=models.CASCADE, primary_key=True, related_name="payload_archive"
+    )
+    data = models.BinaryField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'payment_invoice_payload_archive'
+
+    def __str__(self):
+        return f"Payloads of invoice #{self.invoice_id}"
+
+    @staticmethod
+    def pack(request_payload, response_payload) -> bytes:
+        import json
+        import zlib
+
+        raw = json.dumps({"request": request_payload, "response": response_payload}, ensure_ascii=False)
+        return zlib.compress(raw.encode("utf-8"), 9)
+
+    def unpack(self) -> dict:
+        """{"request": ..., "response": ...}"""
+        import json
+        import zlib
+
+        return json.loads(zlib.decompress(bytes(self.data)).decode("utf-8"))
+
+
 class VerifiedUser(models.Model):
     """Пользователь, верифицированный через платежи"""
     user = models.ForeignKey(TelegramUser, on_delete=models.CASCADE)
@@ -143,39 +203,139 @@ class VerifiedUser(models.Model):
     def __str__(self):
         return f"Verified: {self.user} for bot {self.bot_id}"
 
+    # Один платёж — одно выражение: счётчики растут в БД, без read-modify-write в Python,
+    # поэтому параллельные вебхуки одного пользователя не теряют обновления
+    SQL_RECORD_PAYMENT = """
+        INSERT INTO verified_users (user_id, bot_id, first_payment_date, card_masked, payment_system, issuer_bank,
+                                    successful_payments_count, total_amount_paid, last_payment_date,
+                                    created_at, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, 1, %s, %s, %s, %s)
+        ON CONFLICT (user_id, bot_id) DO UPDATE
+           SET successful_payments_count = verified_users.successful_payments_count + 1,
+               total_amount_paid = verified_users.total_amount_paid + EXCLUDED.total_amount_paid,
+               last_payment_date = EXCLUDED.last_payment_date,
+               card_masked = COALESCE(EXCLUDED.card_masked, verified_users.card_masked),
+               payment_system = COALESCE(EXCLUDED.payment_system, verified_users.payment_system),
+               issuer_bank = COALESCE(EXCLUDED.issuer_bank, verified_users.issuer_bank),
+               updated_at = EXCLUDED.updated_at
+    """
+
+    @classmethod
+    def record_payment(cls, user_pk: int, bot_id: int, amount, *, card_masked=None, payment_system=None,
+                       issuer_bank=None, paid_at=None) -> None:
+        """Учесть успешный платёж: создать запись или атомарно увеличить счётчики."""
+        from django.db import connection
+
+        ops = connection.ops
+        now = ops.adapt_datetimefield_value(paid_at or timezone.now())
+        amount_field = cls._meta.get_field("total_amount_paid")
+        with connection.cursor() as cursor:
+            cursor.execute(cls.SQL_RECORD_PAYMENT, [
+                user_pk, bot_id, now, card_masked or None, payment_system or None, issuer_bank or None,
+                ops.adapt_decimalfield_value(amount, amount_field.max_digits, amount_field.decimal_places),
+                now, now, now,
+            ])
+
     def update_payment_stats(self, invoice: Invoice):
         """Обновить статистику платежей"""
-        self.successful_payments_count += 1
-        self.total_amount_paid += invoice.amount
-        self.last_payment_date = timezone.now()
-        if invoice.card_pan:
-            self.card_masked = invoice.card_pan
-        if invoice.payment_system:
-            self.payment_system = invoice.payment_system
-        if invoice.issuer_bank:
-            self.issuer_bank = invoice.issuer_bank
-        self.save()
+        type(self).record_payment(
+            self.user_id, self.bot_id, invoice.amount,
+            card_masked=invoice.card_pan, payment_system=invoice.payment_system, issuer_bank=invoice.issuer_bank,
+        )
+        self.refresh_from_db()
 
     @classmethod
     def verify_user_from_payment(cls, invoice: Invoice):
         """Верифицировать пользователя на основе платежа"""
-        verified_user, created = cls.objects.get_or_create(
-            user=invoice.user,
-            bot_id=invoice.bot_id,
-            defaults={
-                'first_payment_date': timezone.now(),
-                'card_masked': invoice.card_pan,
-                'payment_system': invoice.payment_system,
-                'issuer_bank': invoice.issuer_bank,
-                'total_amount_paid': invoice.amount,
-                'last_payment_date': timezone.now(),
-            }
+        cls.record_payment(
+            invoice.user_id, invoice.bot_id, invoice.amount,
+            card_masked=invoice.card_pan, payment_system=invoice.payment_system, issuer_bank=invoice.issuer_bank,
+        )
+        return cls.objects.get(user_id=invoice.user_id, bot_id=invoice.bot_id)
+
+    @classmethod
+    def rebuild(cls, bot_id=None, batch_size: int = 1000, reset: bool = False) -> int:
+        """
+        Пересчитать статистику по APPROVED-инвойсам одним агрегирующим запросом
+        (GROUP BY user, bot_id) и пакетным upsert'ом. Возвращает число записей.
+        Карта/платёжная система/банк — из последнего оплаченного инвойса, где они есть.
+
+        Регулярные платежи WayForPay (orderReference с _WFPREG-) отдельных
+        инвойсов не создают, а перезаписывают базовый: по инвойсам их не
+        посчитать. Поэтому по умолчанию пересчёт только восстанавливает
+        потерянные обновления — счётчики и сумма не уменьшаются, первая дата
+        не сдвигается позже (paid_at базового инвойса — дата последнего
+        платежа, её берём как есть). reset=True записывает ровно то, что
+        видно по инвойсам (регулярные платежи при этом теряются).
+        """
+        from django.db import transaction
+        from django.db.models import Count, Max, Min, OuterRef, Subquery, Sum
+        from django.db.models.functions import Coalesce
+
+        approved = Invoice.objects.filter(payment_status=PaymentStatus.APPROVED)
+        if bot_id is not None:
+            approved = approved.filter(bot_id=bot_id)
+        paid = Coalesce("paid_at", "created_at")
+        latest = approved.filter(user_id=OuterRef("user_id"), bot_id=OuterRef("bot_id")).order_by(paid.desc(), "-pk")
+
+        def latest_value(field):
+            return Subquery(latest.exclude(**{f"{field}__isnull": True}).exclude(**{field: ""}).values(field)[:1])
+
+        rows = (
+            approved.order_by()
+            .values("user_id", "bot_id")
+            .annotate(
+                payments=Count("pk"), total=Sum("amount"), first=Min(paid), last=Max(paid),
+                card=latest_value("card_pan"), system=latest_value("payment_system"), bank=latest_value("issuer_bank"),
+            )
         )
+        count = 0
+        with transaction.atomic():
+            batch = []
+            for row in rows.iterator(chunk_size=batch_size):
+                batch.append(cls(
+                    user_id=row["user_id"], bot_id=row["bot_id"],
+                    successful_payments_count=row["payments"], total_amount_paid=row["total"],
+                    first_payment_date=row["first"], last_payment_date=row["last"],
+                    card_masked=row["card"], payment_system=row["system"], issuer_bank=row["bank"],
+                ))
+                if len(batch) >= batch_size:
+                    count += cls._upsert(batch, reset)
+                    batch = []
+            if batch:
+                count += cls._upsert(batch, reset)
+        return count
 
-        if not created:
-            verified_user.update_payment_stats(invoice)
+    @classmethod
+    def _merge_existing(cls, batch) -> None:
+        """Не опускать статистику ниже текущей (платежи, которых нет в инвойсах)."""
+        existing = {
+            (v.user_id, v.bot_id): v for v in cls.objects.select_for_update().filter(
+                user_id__in={v.user_id for v in batch}, bot_id__in={v.bot_id for v in batch},
+            )
+        }
+        for v in batch:
+            old = existing.get((v.user_id, v.bot_id))
+            if old is None:
+                continue
+            v.successful_payments_count = max(v.successful_payments_count, old.successful_payments_count)
+            v.total_amount_paid = max(v.total_amount_paid, old.total_amount_paid)
+            v.first_payment_date = min(v.first_payment_date, old.first_payment_date)
 
-        return verified_user
+    @classmethod
+    def _upsert(cls, batch, reset: bool = False) -> int:
+        if not reset:
+            cls._merge_existing(batch)
+        cls.objects.bulk_create(
+            batch,
+            update_conflicts=True,
+            unique_fields=["user", "bot_id"],
+            update_fields=[
+                "successful_payments_count", "total_amount_paid", "first_payment_date", "last_payment_date",
+                "card_masked", "payment_system", "issuer_bank", "updated_at",
+            ],
+        )
+        return len(batch)
 
 
 class MerchantConfig(models.Model):
@@ -199,3 +359,151 @@ class MerchantConfig(models.Model):
 
     def __str__(self):
         return f"MerchantConfig for Bot#{self.bot.bot_id}"
+
+
+class NotificationStatus(models.TextChoices):
+    PENDING = 'PENDING', 'Pending'
+    SENT = 'SENT', 'Sent'
+    FAILED = 'FAILED', 'Failed'
+
+
+class NotificationOutbox(models.Model):
+    """
+    Исходящее уведомление в Telegram (transactional outbox).
+
+    Пишется в той же транзакции, что и обработка вебхука; отправляет
+    отдельный процесс (manage.py dispatch_notifications), поэтому скорость
+    Telegram API не влияет на время ответа WayForPay и блокировки строк.
+    """
+    KIND_PAYMENT_SUCCESS = 'payment_success'
+    KIND_CHOICES = [
+        (KIND_PAYMENT_SUCCESS, 'Payment success'),
+    ]
+
+    bot_id = models.BigIntegerField()
+    chat_id = models.BigIntegerField()
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    # Один ключ — одно уведомление (повторный вебхук не создаёт дубль)
+    dedup_key = models.CharField(max_length=255, unique=True)
+    payload = models.JSONField(default=dict)
+
+    status = models.CharField(max_length=10, choices=NotificationStatus.choices, default=NotificationStatus.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # Когда строку можно забрать: время следующей попытки или конец аренды диспетчером
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'payment_notification_outbox'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} → {self.chat_id} ({self.status})"
+
+
+class InboxStatus(models.TextChoices):
+    NEW = 'NEW', 'New'
+    DONE = 'DONE', 'Done'
+    DUPLICATE = 'DUPLICATE', 'Duplicate'
+    FAILED = 'FAILED', 'Failed'
+
+
+class WebhookInbox(models.Model):
+    """
+    Входящий вебхук WayForPay (append-only журнал доставок).
+
+    В режиме WAYFORPAY_WEBHOOK_INBOX вьюха только сохраняет доставку и сразу
+    отвечает подписанным accept; обработку делает process_webhook_inbox.
+    Каждая доставка — отдельная строка, даже повторная: журнал служит для
+    разбора инцидентов и повторной обработки (replay_webhooks).
+    """
+    order_reference = models.CharField(max_length=255, db_index=True)
+    # orderReference + transactionStatus: повторные доставки одного события
+    delivery_key = models.CharField(max_length=300, db_index=True)
+    payload = models.JSONField()
+    headers = models.JSONField(default=dict, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    status = models.CharField(max_length=10, choices=InboxStatus.choices, default=InboxStatus.NEW)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        db_table = 'payment_webhook_inbox'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='inbox_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.delivery_key} ({self.status})"
+
+
+class RateLimitBucket(models.Model):
+    """
+    Состояние GCRA-лимитера (payments/ratelimit.py, бэкенд "db").
+
+    tat — theoretical arrival time ключа, unix-время в секундах. Строка
+    обновляется одним INSERT ... ON CONFLICT DO UPDATE, без блокировок
+    на стороне приложения.
+    """
+    key = models.CharField(max_length=200, primary_key=True)
+    tat = models.FloatField()
+
+    class Meta:
+        db_table = 'payment_rate_limits'
+
+    def __str__(self):
+        return self.key
+
+
+class PaymentMetricBucket(models.Model):
+    """
+    Поминутная сводка инвойсов с вебхуком (notified_at) для payments.monitoring.
+
+    Ведётся из сигналов Invoice (payments/rollups.py): при смене notified_at,
+    статуса, валюты или payload инвойс переходит из одного бакета в другой.
+    """
+    bot_id = models.IntegerField()
+    minute = models.DateTimeField()
+    status = models.CharField(max_length=20)
+    currency = models.CharField(max_length=3)
+    count = models.IntegerField(default=0)
+    # Инвойсы, у которых amount/currency из raw_response_payload не совпали с инвойсом
+    mismatches = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'payment_metric_buckets'
+        constraints = [
+            models.UniqueConstraint(fields=['bot_id', 'minute', 'status', 'currency'], name='metric_bucket_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['minute'], name='metric_bucket_minute_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.bot_id} {self.minute:%Y-%m-%d %H:%M} {self.status} {self.currency}: {self.count}"
+
+
+class PaymentUserMetricBucket(models.Model):
+    """Поминутное число APPROVED-инвойсов пользователя (детектор всплесков оплат)."""
+    bot_id = models.IntegerField()
+    minute = models.DateTimeField()
+    user = models.ForeignKey(TelegramUser, on_delete=models.CASCADE)
+    approved = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'payment_user_metric_buckets'
+        constraints = [
+            models.UniqueConstraint(fields=['bot_id', 'minute', 'user'], name='user_metric_bucket_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['minute'], name='user_metric_minute_idx'),
+        ]
@@ -1,9 +1,31 @@
 # payments/monitoring.py
+"""
+Проверки мониторинга платежей.
+
+Читают поминутные сводки PaymentMetricBucket / PaymentUserMetricBucket
+(payments/rollups.py), а не payment_invoices, поэтому стоимость проверки
+определяется длиной окна, а не размером таблицы. Окно выравнивается по
+минуте: бакет минуты начала окна учитывается целиком.
+"""
 from datetime import timedelta
 from django.utils import timezone
-from django.db.models import Count, F
+from django.db.models import Case, DecimalField, F, Q, Sum, When
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Cast, Floor, Upper
 
-from .models import Invoice, PaymentStatus
+from .models import Invoice, PaymentMetricBucket, PaymentStatus, PaymentUserMetricBucket
+from .rollups import minute_of
+
+
+def _window_start(window_minutes: int):
+    return minute_of(timezone.now() - timedelta(minutes=window_minutes))
+
+
+def _buckets(window_minutes: int, bot_id: int | None):
+    qs = PaymentMetricBucket.objects.filter(minute__gte=_window_start(window_minutes))
+    if bot_id is not None:
+        qs = qs.filter(bot_id=bot_id)
+    return qs
 
 
 def decline_stats(window_minutes: int = 60, bot_id: int | None = None) -> dict:
@@ -13,13 +35,12 @@ def decline_stats(window_minutes: int = 60, bot_id: int | None = None) -> dict:
       - declined: кол-во со статусом DECLINED
       - ratio: доля DECLINED (0..1)
     """
-    since = timezone.now() - timedelta(minutes=window_minutes)
-    qs = Invoice.objects.filter(notified_at__gte=since)
-    if bot_id is not None:
-        qs = qs.filter(bot_id=bot_id)
-
-    total = qs.count()
-    declined = qs.filter(payment_status=PaymentStatus.DECLINED).count()
+    agg = _buckets(window_minutes, bot_id).aggregate(
+        total=Sum("count"),
+        declined=Sum("count", filter=Q(status=PaymentStatus.DECLINED)),
+    )
+    total = agg["total"] or 0
+    declined = agg["declined"] or 0
     ratio = (declined / total) if total else 0.0
     return {"total": total, "declined": declined, "ratio": ratio}
 
@@ -37,17 +58,13 @@ def find_fast_success_bursts(*, window_minutes: int = 5, threshold: int = 3, bot
     Найти пользователей, у которых за последнее окно >= threshold успешных оплат.
     Возвращает список словарей: {'user_db_id', 'tg_user_id', 'count'}.
     """
-    since = timezone.now() - timedelta(minutes=window_minutes)
-    qs = Invoice.objects.filter(
-        notified_at__gte=since,
-        payment_status=PaymentStatus.APPROVED,
-    )
+    qs = PaymentUserMetricBucket.objects.filter(minute__gte=_window_start(window_minutes))
     if bot_id is not None:
         qs = qs.filter(bot_id=bot_id)
 
     rows = (
         qs.values("user_id", "user__user_id")
-          .annotate(cnt=Count("id"))
+          .annotate(cnt=Sum("approved"))
           .filter(cnt__gte=threshold)
     )
     return [
@@ -69,41 +86,53 @@ def find_amount_currency_mismatches(*, window_minutes: int = 60, bot_id: int | N
     не совпадают с amount/currency инвойса.
     Возвращает список словарей с деталями.
     """
-    since = timezone.now() - timedelta(minutes=window_minutes)
-    qs = Invoice.objects.filter(notified_at__gte=since)
-    if bot_id is not None:
-        qs = qs.filter(bot_id=bot_id)
+    # Инвойсы читаем, только если сводки показали расхождения, и только по этим ботам
+    bots = list(
+        _buckets(window_minutes, bot_id).filter(mismatches__gt=0)
+        .values_list("bot_id", flat=True).distinct()
+    )
+    if not bots:
+        return []
+    qs = Invoice.objects.filter(
+        notified_at__gte=_window_start(window_minutes), bot_id__in=bots, raw_response_payload__isnull=False,
+    )
 
-    out = []
-    for inv in qs.only("id", "order_reference", "amount", "currency", "raw_response_payload"):
-        payload = inv.raw_response_payload or {}
-        p_amount = payload.get("amount")
-        p_currency = payload.get("currency")
-        try:
-            inv_amount_int = int(inv.amount)
-        except (TypeError, ValueError):
-            inv_amount_int = None
-        try:
-            p_amount_int = int(p_amount) if p_amount is not None else None
-        except (TypeError, ValueError):
-            p_amount_int = None
-
-        mismatch = (p_amount_int is not None and inv_amount_int is not None and p_amount_int != inv_amount_int) \
-                   or (p_currency is not None and str(p_currency).upper() != str(inv.currency).upper())
-        if mismatch:
-            out.append({
-                "invoice_id": inv.id,
-                "order_reference": inv.order_reference,
-                "invoice_amount": inv_amount_int,
-                "payload_amount": p_amount_int,
-                "invoice_currency": str(inv.currency).upper() if inv.currency else None,
-                "payload_currency": str(p_currency).upper() if p_currency is not None else None,
-            })
-    return out
+    # Сравнение в БД: ->> из JSON, сумма — только если это число; наружу — только расхождения
+    rows = (
+        qs.annotate(p_amount_raw=KeyTextTransform("amount", "raw_response_payload"))
+        .annotate(
+            payload_currency=Upper(KeyTextTransform("currency", "raw_response_payload")),
+            invoice_currency=Upper("currency"),
+            payload_amount=Case(
+                When(Q(p_amount_raw__regex=r"^\s*-?[0-9]+(\.[0-9]+)?\s*$"),
+                     then=Floor(Cast("p_amount_raw", DecimalField(max_digits=20, decimal_places=6)))),
+                default=None,
+            ),
+            invoice_amount=Floor("amount"),
+        )
+        .filter(
+            (Q(payload_amount__isnull=False) & ~Q(payload_amount=F("invoice_amount")))
+            | (Q(payload_currency__isnull=False) & ~Q(payload_currency=F("invoice_currency")))
+        )
+        .order_by("id")
+        .values("id", "order_reference", "invoice_amount", "payload_amount", "invoice_currency", "payload_currency")
+    )
+    return [
+        {
+            "invoice_id": r["id"],
+            "order_reference": r["order_reference"],
+            "invoice_amount": int(r["invoice_amount"]) if r["invoice_amount"] is not None else None,
+            "payload_amount": int(r["payload_amount"]) if r["payload_amount"] is not None else None,
+            "invoice_currency": r["invoice_currency"] or None,
+            "payload_currency": r["payload_currency"],
+        }
+        for r in rows
+    ]
 
 
 def has_amount_currency_mismatches(*, threshold_count: int = 1, window_minutes: int = 60, bot_id: int | None = None) -> bool:
     """
     True, если найдено как минимум threshold_count расхождений суммы/валюты за окно.
     """
-    return len(find_amount_currency_mismatches(window_minutes=window_minutes, bot_id=bot_id)) >= int(threshold_count)
\ No newline at end of file
+    found = _buckets(window_minutes, bot_id).aggregate(n=Sum("mismatches"))["n"] or 0
+    return found >= int(threshold_count)
\ No newline at end of file
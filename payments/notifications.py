@@ -5,31 +5,67 @@ from typing import Optional
 from datetime import datetime
 from django.conf import settings
 
+from bot.outbound import Priority, RetryAfter, get_outbound
+
 logger = logging.getLogger(__name__)
 
 
+class ChatUnavailable(Exception):
+    """Доставка в чат невозможна: бот заблокирован пользователем (403) или чат не найден."""
+
+
 class TelegramNotificationService:
     """Сервис для отправки уведомлений в Telegram (синхронный, для Django)"""
     
     def __init__(self, bot_token: str):
         self.bot_token = bot_token
         self.api_url = f"https://api.telegram.org/bot{bot_token}"
+        # Общие с ботом лимиты Telegram (30/сек на токен, 1/сек на чат)
+        self.outbound = get_outbound(bot_token)
     
-    def send_message(self, chat_id: int, text: str, parse_mode: str = "HTML") -> bool:
-        """Отправка сообщения пользователю"""
+    def _post_message(self, payload: dict):
+        response = requests.post(f"{self.api_url}/sendMessage", json=payload, timeout=10)
+        if response.status_code == 429:
+            # Flood control: dispatcher поставит токен на паузу и повторит
+            params = response.json().get("parameters") or {}
+            raise RetryAfter(params.get("retry_after", 1))
+        if response.status_code in (400, 403):
+            try:
+                description = response.json().get("description") or ""
+            except ValueError:
+                description = ""
+            if response.status_code == 403 or "chat not found" in description.lower():
+                raise ChatUnavailable(description or f"HTTP {response.status_code}")
+        response.raise_for_status()
+        return response
+    
+    def send_message(
+        self,
+        chat_id: int,
+        text: str,
+        parse_mode: str = "HTML",
+        priority: Priority = Priority.NOTIFY
+    ) -> bool:
+        """
+        Отправка сообщения пользователю. Ошибки логируются и дают False,
+        кроме ChatUnavailable: повтор бесполезен, решает вызывающий код.
+        """
         try:
-            response = requests.post(
-                f"{self.api_url}/sendMessage",
-                json={
+            self.outbound.send_sync(
+                chat_id,
+                lambda: self._post_message({
                     "chat_id": chat_id,
                     "text": text,
                     "parse_mode": parse_mode
-                },
-                timeout=10
+                }),
+                priority=priority,
+                # Не держим диспетчер outbox: при долгой паузе он повторит позже
+                max_wait=5,
             )
-            response.raise_for_status()
             logger.info(f"Telegram notification sent to user {chat_id}")
             return True
+        except ChatUnavailable:
+            raise
         except Exception as e:
             logger.error(f"Failed to send Telegram notification to {chat_id}: {e}")
             return False
@@ -55,7 +91,7 @@ class TelegramNotificationService:
             f"🎯 Подписка активирована/продлена{expires_txt}"
         )
         
-        return self.send_message(user_id, text)
+        return self.send_message(user_id, text, priority=Priority.PAYMENT)
     
     def notify_payment_declined(
         self,
@@ -73,4 +109,4 @@ class TelegramNotificationService:
             f"Попробуйте оплатить снова или свяжитесь с поддержкой."
         )
         
-        return self.send_message(user_id, text)
\ No newline at end of file
+        return self.send_message(user_id, text, priority=Priority.PAYMENT)
\ No newline at end of file
@@ -0,0 +1,179 @@
+# payments/outbox.py
+"""
+Outbox уведомлений об оплате.
+
+enqueue_* вызываются внутри транзакции обработки вебхука и только пишут
+строку NotificationOutbox. dispatch_batch (команда dispatch_notifications)
+забирает готовые строки пачкой через SELECT ... FOR UPDATE SKIP LOCKED,
+«арендует» их на время отправки и шлёт в Telegram уже вне транзакции:
+- успех → SENT;
+- ошибка → повтор с экспоненциальной задержкой, после max_attempts → FAILED;
+- бот заблокирован пользователем (403) или чат не найден → сразу FAILED без
+  повторов (TelegramUser.is_blocked — бан из админки, его не трогаем).
+
+Несколько диспетчеров могут работать параллельно — SKIP LOCKED и аренда
+не дают двум процессам взять одну строку.
+"""
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+from typing import Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import NotificationOutbox, NotificationStatus
+
+logger = logging.getLogger(__name__)
+
+# Сколько строка «арендована» диспетчером: если процесс упал посреди отправки,
+# строку заберёт следующий проход
+LEASE_SECONDS = 60
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 15 * 60
+
+
+class PermanentError(Exception):
+    """Повтор не поможет (бот удалён и т.п.) — строка сразу FAILED."""
+
+
+def enqueue_payment_success(
+    *,
+    bot_id: int,
+    user_id: int,
+    order_reference: str,
+    plan_id: int,
+    amount,
+    expires_at=None,
+) -> NotificationOutbox:
+    """
+    Уведомление об успешной оплате (идемпотентно по orderReference).
+    Один INSERT ... ON CONFLICT DO NOTHING: повторный вебхук строку не дублирует.
+    """
+    row = NotificationOutbox(
+        dedup_key=f"{NotificationOutbox.KIND_PAYMENT_SUCCESS}:{order_reference}",
+        bot_id=bot_id,
+        chat_id=user_id,
+        kind=NotificationOutbox.KIND_PAYMENT_SUCCESS,
+        payload={
+            "plan_id": plan_id,
+            "amount": str(amount),
+            "expires_at": expires_at.isoformat() if expires_at else None,
+        },
+    )
+    NotificationOutbox.objects.bulk_create([row], ignore_conflicts=True)
+    return row
+
+
+def backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0), BACKOFF_MAX_SECONDS))
+
+
+def claim_batch(batch_size: int) -> list[NotificationOutbox]:
+    """Забрать до batch_size готовых строк и продлить их аренду (короткая транзакция)."""
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            NotificationOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status=NotificationStatus.PENDING, next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        if rows:
+            NotificationOutbox.objects.filter(pk__in=[r.pk for r in rows]).update(
+                next_attempt_at=now + timedelta(seconds=LEASE_SECONDS)
+            )
+    return rows
+
+
+class Sender:
+    """Отправка строк outbox через TelegramNotificationService (токены ботов кешируются на проход)."""
+
+    def __init__(self):
+        self._services = {}
+        self._plans = {}
+
+    def _service(self, bot_id: int):
+        service = self._services.get(bot_id)
+        if service is None:
+            from core.models import Bot
+            from .notifications import TelegramNotificationService
+
+            try:
+                bot = Bot.objects.only("token").get(bot_id=bot_id)
+            except Bot.DoesNotExist:
+                raise PermanentError(f"Bot {bot_id} not found")
+            service = self._services[bot_id] = TelegramNotificationService(bot.token)
+        return service
+
+    def _plan(self, plan_id: int):
+        plan = self._plans.get(plan_id)
+        if plan is None:
+            from subscriptions.models import Plan
+
+            try:
+                plan = self._plans[plan_id] = Plan.objects.only("name", "currency").get(pk=plan_id)
+            except Plan.DoesNotExist:
+                raise PermanentError(f"Plan {plan_id} not found")
+        return plan
+
+    def send(self, row: NotificationOutbox) -> bool:
+        if row.kind == NotificationOutbox.KIND_PAYMENT_SUCCESS:
+            from django.utils.dateparse import parse_datetime
+
+            payload = row.payload
+            plan = self._plan(payload["plan_id"])
+            expires_at = payload.get("expires_at")
+            return self._service(row.bot_id).notify_payment_success(
+                user_id=row.chat_id,
+                plan_name=plan.name,
+                amount=payload["amount"],
+                currency=plan.currency,
+                expires_at=parse_datetime(expires_at) if expires_at else None,
+            )
+        raise PermanentError(f"Unknown notification kind: {row.kind}")
+
+
+def _finish(row: NotificationOutbox, error: Optional[str], permanent: bool, max_attempts: int) -> str:
+    now = timezone.now()
+    attempts = row.attempts + 1
+    if error is None:
+        fields = {"status": NotificationStatus.SENT, "sent_at": now, "last_error": ""}
+    elif permanent or attempts >= max_attempts:
+        fields = {"status": NotificationStatus.FAILED, "last_error": error}
+    else:
+        fields = {"next_attempt_at": now + backoff(attempts), "last_error": error}
+    NotificationOutbox.objects.filter(pk=row.pk).update(attempts=attempts, **fields)
+    return fields.get("status", NotificationStatus.PENDING)
+
+
+def dispatch_batch(batch_size: int = 50, max_attempts: int = 8, sender: Optional[Sender] = None) -> dict:
+    """
+    Один проход диспетчера. Возвращает счётчики {'sent', 'retry', 'failed'}.
+    """
+    from .notifications import ChatUnavailable
+
+    sender = sender or Sender()
+    stats = {"sent": 0, "retry": 0, "failed": 0}
+    for row in claim_batch(batch_size):
+        error, permanent = None, False
+        try:
+            if not sender.send(row):
+                error = "Telegram API request failed"
+        except ChatUnavailable as e:
+            error, permanent = f"Chat unavailable: {e}", True
+        except PermanentError as e:
+            error, permanent = str(e), True
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+
+        status = _finish(row, error, permanent, max_attempts)
+        if status == NotificationStatus.SENT:
+            stats["sent"] += 1
+        elif status == NotificationStatus.FAILED:
+            stats["failed"] += 1
+            logger.error(f"Notification {row.pk} ({row.dedup_key}) failed: {error}")
+        else:
+            stats["retry"] += 1
+            logger.warning(f"Notification {row.pk} ({row.dedup_key}) will be retried: {error}")
+    return stats
@@ -0,0 +1,185 @@
+# payments/ratelimit.py
+"""
+Общий rate limiter для Django-процессов (вебхук WayForPay, create-invoice).
+
+Счётчики должны быть общими для всех воркеров и обновляться атомарно,
+поэтому хранилище выбирается так (settings.RATELIMIT_BACKEND, по умолчанию "auto"):
+- "redis"  — GCRA одним Lua-скриптом; при заданном RATELIMIT_REDIS_URL
+             (REDIS_URL / bot_settings.redis_url) и установленном пакете redis;
+- "db"     — GCRA одним INSERT ... ON CONFLICT DO UPDATE ... RETURNING
+             в таблице payment_rate_limits (auto — только на PostgreSQL);
+- "cache"  — фиксированное окно на cache.add()/cache.incr() (атомарно в
+             пределах одного cache-бэкенда; LocMem — только внутри процесса).
+
+GCRA: у ключа хранится TAT (theoretical arrival time). Запрос проходит,
+если max(TAT, now) + period/limit - now <= period, т.е. допускается всплеск
+до limit запросов, дальше — не чаще limit за period. keep — доля всплеска,
+которую запрос обязан оставить свободной (запас для приоритетных вызовов,
+см. bot/outbound.py): допуск сокращается до period * (1 - keep).
+"""
+from __future__ import annotations
+
+import abc
+import importlib.util
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+from django.conf import settings
+
+
+# Запас на погрешность float: TAT копит interval поверх now ~ 1.7e9
+EPSILON = 1e-3
+
+
+def _tolerance(period: float, keep: float) -> float:
+    return period * (1 - keep) + EPSILON
+
+
+class RateLimiter(abc.ABC):
+    @abc.abstractmethod
+    def hit(self, key: str, limit: int, period: float, keep: float = 0.0) -> bool:
+        """Учесть запрос; False — лимит превышен."""
+
+
+class CacheRateLimiter(RateLimiter):
+    """Фиксированное окно в Django cache (add + incr, без read-modify-write)."""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+
+    def hit(self, key: str, limit: int, period: float, keep: float = 0.0) -> bool:
+        from django.core.cache import cache
+
+        window = max(1, int(period))
+        bucket = f"rl:{key}:{int(self._clock()) // window}"
+        cache.add(bucket, 0, timeout=window + 1)
+        try:
+            count = cache.incr(bucket)
+        except ValueError:
+            # Ключ истёк между add и incr — это первый запрос нового окна
+            cache.add(bucket, 1, timeout=window + 1)
+            count = 1
+        return count <= max(1, int(limit * (1 - keep)))
+
+
+class DatabaseRateLimiter(RateLimiter):
+    """GCRA в таблице payment_rate_limits, одно атомарное выражение на запрос."""
+
+    SQL_HIT = """
+        INSERT INTO payment_rate_limits (key, tat) VALUES (%s, %s)
+        ON CONFLICT (key) DO UPDATE
+           SET tat = (CASE WHEN payment_rate_limits.tat > %s THEN payment_rate_limits.tat ELSE %s END) + %s
+         WHERE (CASE WHEN payment_rate_limits.tat > %s THEN payment_rate_limits.tat ELSE %s END) + %s - %s <= %s
+        RETURNING tat
+    """
+    SQL_PURGE = "DELETE FROM payment_rate_limits WHERE tat < %s"
+
+    # Доля запросов, которые заодно чистят протухшие ключи
+    PURGE_PROBABILITY = 0.001
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+
+    def hit(self, key: str, limit: int, period: float, keep: float = 0.0) -> bool:
+        from django.db import connection
+
+        now = self._clock()
+        interval = period / limit
+        with connection.cursor() as cursor:
+            cursor.execute(
+                self.SQL_HIT,
+                [key, now + interval, now, now, interval, now, now, interval, now, _tolerance(period, keep)],
+            )
+            allowed = cursor.fetchone() is not None
+            if random.random() < self.PURGE_PROBABILITY:
+                cursor.execute(self.SQL_PURGE, [now - 3600])
+        return allowed
+
+
+class RedisRateLimiter(RateLimiter):
+    """GCRA в Redis (любой сервер с протоколом Redis и EVAL)."""
+
+    SCRIPT = """
+local tat = tonumber(redis.call('GET', KEYS[1]) or '0')
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local period = tonumber(ARGV[3])
+local tolerance = tonumber(ARGV[4])
+local new_tat = math.max(tat, now) + interval
+if new_tat - now > tolerance then
+  return 0
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil(period * 1000))
+return 1
+"""
+
+    def __init__(self, url: str, clock: Callable[[], float] = time.time):
+        try:
+            import redis
+        except ImportError as e:
+            from django.core.exceptions import ImproperlyConfigured
+            raise ImproperlyConfigured("RATELIMIT_BACKEND=redis requires the 'redis' package") from e
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self.SCRIPT)
+        self._clock = clock
+
+    def hit(self, key: str, limit: int, period: float, keep: float = 0.0) -> bool:
+        return bool(self._script(
+            keys=[f"rl:{key}"], args=[self._clock(), period / limit, period, _tolerance(period, keep)],
+        ))
+
+
+_limiters: dict[tuple, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _backend() -> tuple[str, Optional[str]]:
+    from django.db import connection
+
+    backend = getattr(settings, "RATELIMIT_BACKEND", "auto")
+    redis_url = getattr(settings, "RATELIMIT_REDIS_URL", None)
+    if backend == "auto":
+        # Без пакета redis auto не роняет запросы, а откатывается на БД/кеш
+        if redis_url and importlib.util.find_spec("redis") is not None:
+            backend = "redis"
+        elif connection.vendor == "postgresql":
+            backend = "db"
+        else:
+            backend = "cache"
+    return backend, redis_url if backend == "redis" else None
+
+
+def backend_name() -> str:
+    """Выбранное хранилище: "redis", "db" или "cache"."""
+    return _backend()[0]
+
+
+def get_limiter() -> RateLimiter:
+    """Лимитер процесса по текущим настройкам."""
+    key = _backend()
+    limiter = _limiters.get(key)
+    if limiter is None:
+        backend, redis_url = key
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                if backend == "redis":
+                    limiter = RedisRateLimiter(redis_url)
+                elif backend == "db":
+                    limiter = DatabaseRateLimiter()
+                elif backend == "cache":
+                    limiter = CacheRateLimiter()
+                else:
+                    from django.core.exceptions import ImproperlyConfigured
+                    raise ImproperlyConfigured(f"Unknown RATELIMIT_BACKEND: {backend}")
+                _limiters[key] = limiter
+    return limiter
+
+
+def client_ip(request) -> str:
+    """IP клиента из X-Forwarded-For или REMOTE_ADDR."""
+    return (request.META.get("HTTP_X_FORWARDED_FOR", "").split(",")[0].strip()
+            or request.META.get("REMOTE_ADDR", "")
+            or "unknown")
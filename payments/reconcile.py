@@ -0,0 +1,199 @@
+# payments/reconcile.py
+"""
+Сверка зависших инвойсов с WayForPay (CHECK_STATUS).
+
+Инвойс может застрять:
+- в PROCESSING — процесс упал между захватом инвойса и записью результата;
+- в PENDING — вебхук потерялся (или ещё не пришёл ответ на автосписание).
+
+Сверка (manage.py reconcile_invoices):
+1. stale_invoices — кандидаты по индексу (payment_status, updated_at),
+   давно не сверявшиеся первыми: после проверки ставится last_checked_at
+   (updated_at не трогаем — по нему считаются пороги), так что при
+   тысячах зависших инвойсов проход не упирается в одни и те же limit;
+2. CHECK_STATUS параллельно (concurrency потоков), но не чаще rate
+   запросов в секунду на процесс (TokenBucket); потоки к БД не обращаются;
+3. ответ с итоговым статусом проходит обычный путь вебхука
+   (WayForPayService.handle_webhook) — вся логика продления, уведомлений
+   и идемпотентности та же. Зависший PROCESSING перед этим возвращается
+   в PENDING (только если он всё ещё старше порога).
+
+Ответ без статуса (WayForPay заказа не знает) по PENDING-инвойсу
+автосписания старше RECURRING_CHARGE_PENDING_HOURS закрывает инвойс как
+EXPIRED (recurring.expire_unsent): иначе он навсегда блокировал бы
+следующие списания подписки.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Invoice, PaymentStatus
+
+logger = logging.getLogger(__name__)
+
+PROCESSING = "PROCESSING"
+# Статусы CHECK_STATUS, которые передаём в обработку вебхука
+FINAL_STATUSES = ("APPROVED", "DECLINED", "EXPIRED", "CANCELED", "REFUNDED", "VOIDED")
+
+
+class TokenBucket:
+    """Ограничение частоты запросов между потоками одного процесса."""
+
+    def __init__(self, rate: float, burst: Optional[int] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1, int(rate)))
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Взять токен; если их нет — подождать своей очереди."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Токен резервируется сразу: следующий поток ждёт уже за этим
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            self._sleep(wait)
+
+
+@dataclass
+class ReconcileStats:
+    checked: int = 0
+    outcomes: Dict[str, int] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    def add(self, outcome: str) -> None:
+        self.checked += 1
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    @property
+    def rate(self) -> float:
+        return self.checked / self.elapsed if self.elapsed else 0.0
+
+
+def stale_invoices(*, pending_minutes: int = 30, processing_minutes: int = 10,
+                   max_age_hours: int = 72, limit: int = 500) -> List[Invoice]:
+    """Зависшие PENDING (не старше max_age_hours) и PROCESSING: ещё не сверявшиеся, затем давно сверенные."""
+    now = timezone.now()
+    qs = Invoice.objects.filter(
+        Q(payment_status=PaymentStatus.PENDING,
+          updated_at__lt=now - timedelta(minutes=pending_minutes),
+          updated_at__gte=now - timedelta(hours=max_age_hours))
+        | Q(payment_status=PROCESSING, updated_at__lt=now - timedelta(minutes=processing_minutes))
+    )
+    return list(
+        qs.order_by(F("last_checked_at").asc(nulls_first=True), "updated_at")
+        .only("id", "order_reference", "bot_id", "payment_status", "updated_at", "created_at",
+              "raw_request_payload")[:limit]
+    )
+
+
+def check_status(api, bucket: TokenBucket, order_reference: str) -> Dict:
+    """CHECK_STATUS в WayForPay (из пула потоков)."""
+    from .wayforpay.http import post_json
+
+    bucket.acquire()
+    return post_json(api.api_url, api.generate_check_status_data(order_reference))
+
+
+def apply_status(invoice: Invoice, response: Dict, *, processing_minutes: int = 10, dry_run: bool = False) -> str:
+    """Применить ответ CHECK_STATUS. Возвращает исход для статистики."""
+    from .wayforpay.services import WayForPayService
+
+    status = str(response.get("transactionStatus") or "").upper()
+    if not status:
+        logger.warning(f"CHECK_STATUS {invoice.order_reference}: no status (reasonCode={response.get('reasonCode')})")
+        if _unsent_recurring_charge(invoice):
+            if dry_run:
+                return "EXPIRED_UNSENT"
+            from .recurring import expire_unsent
+            if expire_unsent(invoice, reason=f"CHECK_STATUS reasonCode={response.get('reasonCode')}"):
+                return "EXPIRED_UNSENT"
+        return "UNKNOWN"
+
+    if status not in FINAL_STATUSES:
+        # У WayForPay платёж ещё в процессе — возвращаем зависший PROCESSING в PENDING
+        if not dry_run and invoice.payment_status == PROCESSING:
+            _release_processing(invoice, processing_minutes)
+        return "STILL_PENDING"
+
+    if dry_run:
+        logger.info(f"[dry-run] {invoice.order_reference}: {invoice.payment_status} → {status}")
+        return status
+
+    # processingDate — время исходной операции: TTL защиты от replay к ответу сверки не относится
+    payload = {k: v for k, v in response.items() if k != "processingDate"}
+    with transaction.atomic():
+        if invoice.payment_status == PROCESSING:
+            _release_processing(invoice, processing_minutes)
+        WayForPayService(bot_id=invoice.bot_id).handle_webhook(payload)
+        new_status = Invoice.objects.values_list("payment_status", flat=True).get(pk=invoice.pk)
+    return new_status if new_status != invoice.payment_status else "UNCHANGED"
+
+
+def _unsent_recurring_charge(invoice: Invoice) -> bool:
+    """PENDING-инвойс автосписания, который ждёт результата дольше RECURRING_CHARGE_PENDING_HOURS."""
+    from .recurring import is_recurring_charge, pending_hours_default
+
+    return (
+        invoice.payment_status == PaymentStatus.PENDING
+        and is_recurring_charge(invoice)
+        and invoice.created_at < timezone.now() - timedelta(hours=pending_hours_default())
+    )
+
+
+def _release_processing(invoice: Invoice, processing_minutes: int) -> None:
+    cutoff = timezone.now() - timedelta(minutes=processing_minutes)
+    Invoice.objects.filter(pk=invoice.pk, payment_status=PROCESSING, updated_at__lt=cutoff).update(
+        payment_status=PaymentStatus.PENDING, updated_at=timezone.now()
+    )
+
+
+def reconcile(invoices: List[Invoice], *, concurrency: int = 8, rate: float = 5.0,
+              processing_minutes: int = 10, dry_run: bool = False,
+              bucket: Optional[TokenBucket] = None) -> ReconcileStats:
+    """Сверить инвойсы с WayForPay; результаты пишутся в этом потоке по мере ответов."""
+    from .wayforpay.registry import merchant_registry
+
+    stats = ReconcileStats()
+    if not invoices:
+        return stats
+    started = time.monotonic()
+    bucket = bucket or TokenBucket(rate)
+    apis = {bot_id: merchant_registry.for_bot(bot_id) for bot_id in {inv.bot_id for inv in invoices}}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(invoices)))) as pool:
+        futures = {
+            pool.submit(check_status, apis[inv.bot_id], bucket, inv.order_reference): inv
+            for inv in invoices
+        }
+        for future in as_completed(futures):
+            inv = futures[future]
+            try:
+                outcome = apply_status(inv, future.result(), processing_minutes=processing_minutes, dry_run=dry_run)
+            except Exception as e:
+                logger.error(f"Reconcile {inv.order_reference} failed: {e}", exc_info=True)
+                outcome = "ERROR"
+            stats.add(outcome)
+
+    if not dry_run:
+        # QuerySet.update() не трогает updated_at (auto_now) — пороги зависания считаются как раньше
+        Invoice.objects.filter(pk__in=[inv.pk for inv in invoices]).update(last_checked_at=timezone.now())
+    stats.elapsed = time.monotonic() - started
+    return stats
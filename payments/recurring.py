@@ -0,0 +1,349 @@
+# payments/recurring.py
+"""
+Списание продлений по токену карты (WayForPay CHARGE + recToken).
+
+Проход движка (manage.py charge_recurring):
+1. claim_due — короткая транзакция: подписки с recurrent_next_payment <= сегодня
+   забираются через SELECT ... FOR UPDATE SKIP LOCKED, дата следующего
+   списания сдвигается на завтра («аренда» — параллельный запуск их не
+   возьмёт), на каждую создаётся PENDING-инвойс с детерминированным
+   orderReference (подписка + день).
+2. CHARGE-запросы идут параллельно (не больше concurrency одновременно)
+   через общий httpx.Client, без открытой транзакции.
+3. finish — результат пишется в своей транзакции: APPROVED продлевает
+   подписку через SubscriptionService.extend_subscription, отказ —
+   повтор через день, после max_attempts автосписание ставится на паузу.
+   Если результат пришёл вебхуком (или через сверку), то же делают
+   schedule_next / record_decline из WayForPayService.
+
+Двойного списания не допускаем:
+- инвойс захватывается так же, как в вебхуке (PENDING → PROCESSING одним
+  UPDATE), поэтому вебхук по тому же заказу и движок не продлят подписку дважды;
+- если ответ не получен или статус промежуточный, инвойс остаётся PENDING,
+  и подписка не списывается снова, пока его не закроет вебхук или сверка —
+  но не дольше RECURRING_CHARGE_PENDING_HOURS: CHECK_STATUS без статуса
+  после этого срока значит, что WayForPay заказ не получал, и сверка
+  переводит инвойс в EXPIRED (expire_unsent);
+- если соединение с WayForPay не установилось (RequestNotSent), запрос
+  точно не ушёл: инвойс сразу EXPIRED, списание — на следующий день.
+
+Списываются только подписки с recurrent_mode из settings.RECURRING_CHARGE_MODES
+(по умолчанию "merchant"): регулярные платежи, которые WayForPay проводит сам
+(_WFPREG-), сюда не попадают.
+"""
+from __future__ import annotations
+
+import logging
+import time as time_module
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from typing import Dict, List, Optional
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from subscriptions.models import Subscription, SubscriptionStatus
+
+from .models import Invoice, PaymentStatus
+
+logger = logging.getLogger(__name__)
+
+# Статусы ответа CHARGE, после которых можно списывать снова
+FINAL_DECLINED = ("DECLINED", "EXPIRED", "CANCELED")
+
+
+@dataclass
+class Charge:
+    subscription: Subscription
+    invoice: Invoice
+
+
+def charge_modes() -> List[str]:
+    from django.conf import settings
+    return list(getattr(settings, "RECURRING_CHARGE_MODES", ["merchant"]))
+
+
+def max_attempts_default() -> int:
+    from django.conf import settings
+    return int(getattr(settings, "RECURRING_CHARGE_MAX_ATTEMPTS", 3))
+
+
+def pending_hours_default() -> int:
+    from django.conf import settings
+    return int(getattr(settings, "RECURRING_CHARGE_PENDING_HOURS", 24))
+
+
+def is_recurring_charge(invoice) -> bool:
+    """Инвойс создан движком автосписаний (а не CREATE_INVOICE / регулярным платежом WayForPay)."""
+    payload = invoice.raw_request_payload
+    return isinstance(payload, dict) and payload.get("recurringCharge") is True
+
+
+def schedule_next(subscription: Subscription) -> None:
+    """После успешного списания: следующее — в день окончания нового срока."""
+    subscription.recurrent_next_payment = timezone.localdate(subscription.expires_at)
+    subscription.reminder_failed_attempts = 0
+    Subscription.objects.filter(pk=subscription.pk).update(
+        recurrent_next_payment=subscription.recurrent_next_payment,
+        reminder_failed_attempts=0,
+        updated_at=timezone.now(),
+    )
+
+
+def record_decline(subscription_id: int, *, max_attempts: Optional[int] = None, today: Optional[date] = None) -> bool:
+    """Отказ списания: повтор завтра, после max_attempts — пауза. True — поставлено на паузу."""
+    max_attempts = max_attempts_default() if max_attempts is None else max_attempts
+    today = today or timezone.localdate()
+    with transaction.atomic():
+        attempts = Subscription.objects.select_for_update().values_list(
+            "reminder_failed_attempts", flat=True
+        ).get(pk=subscription_id) + 1
+        fields = {"reminder_failed_attempts": attempts, "updated_at": timezone.now()}
+        if attempts >= max_attempts:
+            fields["recurrent_status"] = "Paused"
+        else:
+            fields["recurrent_next_payment"] = today + timedelta(days=1)
+        Subscription.objects.filter(pk=subscription_id).update(**fields)
+    logger.warning(f"Recurring charge for subscription {subscription_id} declined (attempt {attempts}/{max_attempts})")
+    return attempts >= max_attempts
+
+
+def charge_order_reference(subscription: Subscription, day: date) -> str:
+    """ORDER_<полночь дня UTC>R<id подписки>_<user>_<plan>: разбирается как обычный orderReference."""
+    ts = int(datetime.combine(day, time.min, tzinfo=dt_timezone.utc).timestamp())
+    return f"ORDER_{ts}R{subscription.pk}_{subscription.user.user_id}_{subscription.plan_id}"
+
+
+def due_subscriptions(today: date, pending_hours: Optional[int] = None):
+    pending_hours = pending_hours_default() if pending_hours is None else pending_hours
+    pending = Invoice.objects.filter(
+        subscription=OuterRef("pk"),
+        payment_status=PaymentStatus.PENDING,
+        raw_request_payload__recurringCharge=True,
+        created_at__gte=timezone.now() - timedelta(hours=pending_hours),
+    )
+    return (
+        Subscription.objects
+        .filter(
+            recurrent_next_payment__lte=today,
+            recurrent_status="Active",
+            recurrent_mode__in=charge_modes(),
+            card_token__isnull=False,
+            status__in=[SubscriptionStatus.ACTIVE, SubscriptionStatus.EXPIRED],
+        )
+        .exclude(card_token="")
+        # Прошлое списание ещё без результата — ждём вебхук/сверку (не дольше pending_hours)
+        .exclude(Exists(pending))
+    )
+
+
+def claim_due(batch_size: int, today: Optional[date] = None) -> List[Charge]:
+    """Забрать пачку подписок к списанию и создать им PENDING-инвойсы."""
+    today = today or timezone.localdate()
+    with transaction.atomic():
+        subs = list(
+            due_subscriptions(today)
+            .select_related("plan", "user")
+            .select_for_update(skip_locked=True, of=("self",))
+            .order_by("recurrent_next_payment", "id")[:batch_size]
+        )
+        if not subs:
+            return []
+        Subscription.objects.filter(pk__in=[s.pk for s in subs]).update(
+            recurrent_next_payment=today + timedelta(days=1), updated_at=timezone.now()
+        )
+
+        refs = {s.pk: charge_order_reference(s, today) for s in subs}
+        existing = {inv.order_reference: inv for inv in Invoice.objects.filter(order_reference__in=refs.values())}
+        new = [
+            Invoice(
+                order_reference=refs[s.pk],
+                user=s.user,
+                plan=s.plan,
+                subscription=s,
+                bot_id=s.bot_id,
+                amount=s.plan.price,
+                currency=s.plan.currency,
+                payment_status=PaymentStatus.PENDING,
+                rec_token=s.card_token,
+                raw_request_payload={
+                    "recurringCharge": True,
+                    "subscriptionId": s.pk,
+                    "planDurationDays": s.plan.duration_days,
+                },
+            )
+            for s in subs if refs[s.pk] not in existing
+        ]
+        Invoice.objects.bulk_create(new)
+
+    invoices = {**existing, **{inv.order_reference: inv for inv in new}}
+    return [Charge(subscription=s, invoice=invoices[refs[s.pk]]) for s in subs]
+
+
+def charge_request(api, charge: Charge) -> Dict:
+    """Тело CHARGE-запроса WayForPay (подпись — как у CREATE_INVOICE)."""
+    inv = charge.invoice
+    amount = int(float(inv.amount))
+    data = {
+        "transactionType": "CHARGE",
+        "apiVersion": 1,
+        "merchantAccount": api.merchant_account,
+        "merchantAuthType": "SimpleSignature",
+        "merchantDomainName": api.domain_name,
+        "merchantTransactionType": "SALE",
+        "merchantTransactionSecureType": "AUTO",
+        "orderReference": inv.order_reference,
+        "orderDate": int(time_module.time()),
+        "amount": amount,
+        "currency": inv.currency,
+        "recToken": charge.subscription.card_token,
+        "productName": [charge.subscription.plan.name],
+        "productCount": [1],
+        "productPrice": [amount],
+        "serviceUrl": api.service_url,
+    }
+    data["merchantSignature"] = api.get_request_signature(data)
+    return data
+
+
+def send_charge(api, charge: Charge) -> Dict:
+    """CHARGE в WayForPay (вызывается из пула потоков, к БД не обращается)."""
+    from .wayforpay.http import post_json
+
+    return post_json(api.api_url, charge_request(api, charge))
+
+
+def _verified(charge: Charge, response: Dict) -> bool:
+    from django.conf import settings
+    from .wayforpay.registry import merchant_registry
+
+    if not getattr(settings, "WAYFORPAY_VERIFY_SIGNATURE", True):
+        return True
+    return merchant_registry.for_bot(charge.subscription.bot_id).validate_response_signature(response)
+
+
+def finish(charge: Charge, response: Optional[Dict], error: Optional[Exception], *, max_attempts: Optional[int] = None,
+           today: Optional[date] = None) -> str:
+    """Записать результат списания. Возвращает APPROVED / DECLINED / PAUSED / PENDING / NOT_SENT."""
+    from .wayforpay.http import RequestNotSent
+
+    today = today or timezone.localdate()
+    max_attempts = max_attempts_default() if max_attempts is None else max_attempts
+    inv = charge.invoice
+
+    if isinstance(error, RequestNotSent):
+        # До WayForPay запрос не дошёл — списания не было, повтор завтра (дата уже сдвинута в claim_due)
+        expire_unsent(inv, reason=str(error))
+        return "NOT_SENT"
+
+    if error is not None or not isinstance(response, dict) or not _verified(charge, response):
+        # Запрос мог дойти до WayForPay — инвойс остаётся PENDING до вебхука/сверки
+        logger.error(f"Recurring charge {inv.order_reference}: no valid response ({error or response})")
+        return "PENDING"
+
+    status = str(response.get("transactionStatus", "")).upper()
+    if status == "APPROVED":
+        return _approve(charge, response)
+    if status in FINAL_DECLINED:
+        return _decline(charge, response, status, max_attempts=max_attempts, today=today)
+
+    logger.info(f"Recurring charge {inv.order_reference}: status {status}, waiting for webhook")
+    return "PENDING"
+
+
+def expire_unsent(invoice: Invoice, *, reason: str) -> bool:
+    """PENDING-инвойс списания, которого WayForPay не получал, → EXPIRED. True — инвойс закрыт."""
+    expired = Invoice.objects.filter(pk=invoice.pk, payment_status=PaymentStatus.PENDING).update(
+        payment_status=PaymentStatus.EXPIRED, updated_at=timezone.now()
+    )
+    if expired:
+        logger.warning(f"Recurring charge {invoice.order_reference} was not received by WayForPay, expired: {reason}")
+    return bool(expired)
+
+
+def _approve(charge: Charge, response: Dict) -> str:
+    from subscriptions.services import SubscriptionService
+    from .outbox import enqueue_payment_success
+    from .wayforpay.services import WayForPayService
+
+    sub, inv = charge.subscription, charge.invoice
+    with transaction.atomic():
+        captured = Invoice.objects.filter(pk=inv.pk, payment_status=PaymentStatus.PENDING).update(
+            payment_status="PROCESSING", updated_at=timezone.now()
+        )
+        sub = Subscription.objects.select_for_update().select_related("plan", "user").get(pk=sub.pk)
+        if captured:
+            service = WayForPayService(bot_id=sub.bot_id)
+            amount = float(response.get("amount") or inv.amount)
+            inv = service._apply_payment_to_invoice(inv, response, amount, "APPROVED", subscription=sub)
+            SubscriptionService.extend_subscription(sub, paid_at=inv.paid_at, invoice=inv)
+            sub.amount = inv.amount
+            sub.order_reference = inv.order_reference
+            sub.transaction_id = inv.transaction_id
+            service._update_verified_user(sub.bot_id, sub.user.user_id, response, inv, user=sub.user)
+            enqueue_payment_success(
+                bot_id=sub.bot_id,
+                user_id=sub.user.user_id,
+                order_reference=inv.order_reference,
+                plan_id=sub.plan_id,
+                amount=inv.amount,
+                expires_at=sub.expires_at,
+            )
+            sub.save(update_fields=["amount", "order_reference", "transaction_id", "updated_at"])
+        else:
+            # Вебхук по этому заказу успел раньше и уже продлил подписку
+            logger.info(f"Recurring charge {inv.order_reference} already processed by webhook")
+        schedule_next(sub)
+    return "APPROVED"
+
+
+def _decline(charge: Charge, response: Dict, status: str, *, max_attempts: int, today: date) -> str:
+    from .wayforpay.services import WayForPayService
+
+    sub, inv = charge.subscription, charge.invoice
+    with transaction.atomic():
+        captured = Invoice.objects.filter(pk=inv.pk, payment_status=PaymentStatus.PENDING).update(
+            payment_status="PROCESSING", updated_at=timezone.now()
+        )
+        if not captured:
+            return "DECLINED"
+        WayForPayService(bot_id=sub.bot_id)._apply_payment_to_invoice(inv, response, float(inv.amount), status)
+        paused = record_decline(sub.pk, max_attempts=max_attempts, today=today)
+    return "PAUSED" if paused else "DECLINED"
+
+
+def run_batch(batch_size: int = 200, concurrency: int = 10, max_attempts: Optional[int] = None,
+              today: Optional[date] = None) -> Dict[str, int]:
+    """Один проход: claim → параллельные CHARGE → запись результатов. {'APPROVED': n, ...}."""
+    max_attempts = max_attempts_default() if max_attempts is None else max_attempts
+    claimed = claim_due(batch_size, today=today)
+    # Инвойс этого дня уже закрыт (повторный запуск) — второй раз не списываем
+    charges = [c for c in claimed if c.invoice.payment_status == PaymentStatus.PENDING]
+    stats: Dict[str, int] = {}
+    if len(charges) < len(claimed):
+        stats["SKIPPED"] = len(claimed) - len(charges)
+    if not charges:
+        return stats
+
+    from .wayforpay.registry import merchant_registry
+
+    # Клиенты merchant'ов — в этом потоке: потоки пула к БД не обращаются
+    apis = {bot_id: merchant_registry.for_bot(bot_id) for bot_id in {c.subscription.bot_id for c in charges}}
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(charges)))) as pool:
+        futures = {pool.submit(send_charge, apis[c.subscription.bot_id], c): c for c in charges}
+        # Результаты пишем в этом потоке по мере готовности ответов
+        for future in as_completed(futures):
+            charge = futures[future]
+            try:
+                response, error = future.result(), None
+            except Exception as e:
+                response, error = None, e
+            try:
+                result = finish(charge, response, error, max_attempts=max_attempts, today=today)
+            except Exception as e:
+                logger.error(f"Recurring charge {charge.invoice.order_reference} failed to finish: {e}", exc_info=True)
+                result = "ERROR"
+            stats[result] = stats.get(result, 0) + 1
+    return stats
@@ -0,0 +1,209 @@
+# payments/rollups.py
+"""
+Поминутные сводки платежей для payments.monitoring.
+
+Каждый инвойс с notified_at учитывается ровно в одном бакете
+PaymentMetricBucket (bot_id, минута notified_at, статус, валюта), а
+APPROVED-инвойс ещё и в PaymentUserMetricBucket. Сигналы Invoice
+(payments/signals.py) переносят инвойс между бакетами при сохранении:
+-1 в старом, +1 в новом, одним INSERT ... ON CONFLICT DO UPDATE на таблицу.
+Инкремент выполняется после коммита транзакции, сохранившей инвойс, в
+своей короткой транзакции (schedule_change): горячая строка бакета
+блокируется на один UPDATE, а не на весь вебхук. Откат транзакции
+инкремент отменяет; если процесс упадёт между коммитом и инкрементом,
+бакет поправит rebuild_payment_metrics.
+
+Проверки мониторинга читают только бакеты окна — их стоимость не зависит
+от размера payment_invoices.
+
+QuerySet.update() сигналов не вызывает: поля из TRACKED_FIELDS так
+менять нельзя (промежуточный PROCESSING в вебхуке не в счёт — notified_at
+и итоговый статус пишутся через save()). Пересчитать бакеты за период:
+manage.py rebuild_payment_metrics.
+"""
+from __future__ import annotations
+
+from collections import Counter
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, NamedTuple, Optional
+
+from django.db import connection, transaction
+
+from .models import PaymentStatus
+
+# Поля инвойса, от которых зависит бакет
+TRACKED_FIELDS = frozenset({
+    "bot_id", "user_id", "notified_at", "payment_status", "currency", "amount", "raw_response_payload",
+})
+
+# Состояние инвойса неизвестно (загружен через only()/defer())
+UNKNOWN = object()
+
+
+class InvoiceState(NamedTuple):
+    bot_id: int
+    minute: datetime
+    status: str
+    currency: str
+    user_id: int
+    mismatch: bool
+
+
+def minute_of(dt: datetime) -> datetime:
+    return dt.replace(second=0, microsecond=0)
+
+
+def payload_mismatch(amount, currency, payload: Optional[Dict]) -> Optional[Dict]:
+    """
+    Сравнить amount/currency из payload вебхука с инвойсом.
+    None — совпадают (или сравнивать нечего), иначе детали расхождения.
+    """
+    payload = payload if isinstance(payload, dict) else {}
+    p_amount = payload.get("amount")
+    p_currency = payload.get("currency")
+    try:
+        inv_amount_int = int(amount)
+    except (TypeError, ValueError):
+        inv_amount_int = None
+    try:
+        p_amount_int = int(p_amount) if p_amount is not None else None
+    except (TypeError, ValueError):
+        p_amount_int = None
+
+    mismatch = (p_amount_int is not None and inv_amount_int is not None and p_amount_int != inv_amount_int) \
+               or (p_currency is not None and str(p_currency).upper() != str(currency).upper())
+    if not mismatch:
+        return None
+    return {
+        "invoice_amount": inv_amount_int,
+        "payload_amount": p_amount_int,
+        "invoice_currency": str(currency).upper() if currency else None,
+        "payload_currency": str(p_currency).upper() if p_currency is not None else None,
+    }
+
+
+def invoice_state(invoice) -> Optional[InvoiceState]:
+    """Бакет инвойса или None, если вебхука ещё не было."""
+    if invoice.notified_at is None:
+        return None
+    return InvoiceState(
+        bot_id=invoice.bot_id,
+        minute=minute_of(invoice.notified_at),
+        status=str(invoice.payment_status),
+        currency=str(invoice.currency or "").upper(),
+        user_id=invoice.user_id,
+        mismatch=payload_mismatch(invoice.amount, invoice.currency, invoice.raw_response_payload) is not None,
+    )
+
+
+def stored_state(invoice_pk) -> Optional[InvoiceState]:
+    """Бакет инвойса по данным в БД (если экземпляр загружен не целиком)."""
+    from .models import Invoice
+
+    row = Invoice.objects.filter(pk=invoice_pk).values(*TRACKED_FIELDS).first()
+    return invoice_state(SimpleNamespace(**row)) if row else None
+
+
+def snapshot(invoice, field_names) -> object:
+    """Состояние только что загруженного инвойса (Invoice.from_db)."""
+    if not TRACKED_FIELDS.issubset(field_names):
+        return UNKNOWN
+    return invoice_state(invoice)
+
+
+_SQL_BUCKETS = """
+    INSERT INTO payment_metric_buckets (bot_id, minute, status, currency, count, mismatches)
+    VALUES {values}
+    ON CONFLICT (bot_id, minute, status, currency) DO UPDATE
+       SET count = payment_metric_buckets.count + EXCLUDED.count,
+           mismatches = payment_metric_buckets.mismatches + EXCLUDED.mismatches
+"""
+_SQL_USER_BUCKETS = """
+    INSERT INTO payment_user_metric_buckets (bot_id, minute, user_id, approved)
+    VALUES {values}
+    ON CONFLICT (bot_id, minute, user_id) DO UPDATE
+       SET approved = payment_user_metric_buckets.approved + EXCLUDED.approved
+"""
+
+
+def schedule_change(old: Optional[InvoiceState], new: Optional[InvoiceState]) -> None:
+    """apply_change после коммита текущей транзакции (вне транзакции — сразу)."""
+    if old != new:
+        transaction.on_commit(lambda: apply_change(old, new))
+
+
+def apply_change(old: Optional[InvoiceState], new: Optional[InvoiceState]) -> None:
+    """Перенести инвойс из бакета old в бакет new (любой из них может быть None)."""
+    if old == new:
+        return
+    counts: Counter = Counter()
+    mismatches: Counter = Counter()
+    approved: Counter = Counter()
+    for state, sign in ((old, -1), (new, 1)):
+        if state is None:
+            continue
+        key = (state.bot_id, state.minute, state.status, state.currency)
+        counts[key] += sign
+        mismatches[key] += sign * int(state.mismatch)
+        if state.status == PaymentStatus.APPROVED:
+            approved[(state.bot_id, state.minute, state.user_id)] += sign
+
+    adapt = connection.ops.adapt_datetimefield_value
+    rows = [
+        (key[0], adapt(key[1]), key[2], key[3], n, mismatches[key])
+        for key, n in counts.items()
+        if n or mismatches[key]
+    ]
+    user_rows = [(bot_id, adapt(minute), user_id, n) for (bot_id, minute, user_id), n in approved.items() if n]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if rows:
+            cursor.execute(
+                _SQL_BUCKETS.format(values=", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(rows))),
+                [v for row in rows for v in row],
+            )
+        if user_rows:
+            cursor.execute(
+                _SQL_USER_BUCKETS.format(values=", ".join(["(%s, %s, %s, %s)"] * len(user_rows))),
+                [v for row in user_rows for v in row],
+            )
+
+
+def rebuild(since: datetime) -> int:
+    """Пересчитать бакеты начиная с минуты since по payment_invoices. Возвращает число инвойсов."""
+    from .models import Invoice, PaymentMetricBucket, PaymentUserMetricBucket
+
+    since = minute_of(since)
+    counts: Counter = Counter()
+    mismatches: Counter = Counter()
+    approved: Counter = Counter()
+    total = 0
+    with transaction.atomic():
+        PaymentMetricBucket.objects.filter(minute__gte=since).delete()
+        PaymentUserMetricBucket.objects.filter(minute__gte=since).delete()
+        rows = Invoice.objects.filter(notified_at__gte=since).values(*TRACKED_FIELDS)
+        for row in rows.iterator(chunk_size=2000):
+            state = invoice_state(SimpleNamespace(**row))
+            key = (state.bot_id, state.minute, state.status, state.currency)
+            counts[key] += 1
+            mismatches[key] += int(state.mismatch)
+            if state.status == PaymentStatus.APPROVED:
+                approved[(state.bot_id, state.minute, state.user_id)] += 1
+            total += 1
+
+        PaymentMetricBucket.objects.bulk_create(
+            [
+                PaymentMetricBucket(bot_id=k[0], minute=k[1], status=k[2], currency=k[3], count=n, mismatches=mismatches[k])
+                for k, n in counts.items()
+            ],
+            batch_size=1000,
+        )
+        PaymentUserMetricBucket.objects.bulk_create(
+            [
+                PaymentUserMetricBucket(bot_id=k[0], minute=k[1], user_id=k[2], approved=n)
+                for k, n in approved.items()
+            ],
+            batch_size=1000,
+        )
+    return total
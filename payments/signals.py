@@ -0,0 +1,73 @@
+# payments/signals.py
+"""
+Сводки мониторинга (payments/rollups.py): перенос инвойса между бакетами
+при сохранении/удалении Invoice. Сам UPDATE бакетов откладывается до
+коммита (rollups.schedule_change): иначе блокировка строки бакета
+(bot_id, минута, статус) держалась бы до конца транзакции вебхука и
+сериализовала вебхуки разных заказов.
+
+Сброс реестра WayForPayAPI (payments/wayforpay/registry.py) при изменении
+MerchantConfig или Bot — в т.ч. при сохранении через MerchantConfigInline
+в админке бота — и при смене настроек WAYFORPAY_* (override_settings в тестах).
+"""
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from core.models import Bot
+
+from . import rollups
+from .models import Invoice, MerchantConfig
+from .wayforpay.registry import merchant_registry
+
+
+@receiver(post_save, sender=MerchantConfig)
+@receiver(post_delete, sender=MerchantConfig)
+@receiver(post_save, sender=Bot)
+@receiver(post_delete, sender=Bot)
+def merchant_config_changed(sender, instance, **kwargs):
+    # Сразу — чтобы этот процесс не отдал старый ключ, и ещё раз после коммита
+    merchant_registry.invalidate()
+    transaction.on_commit(merchant_registry.invalidate)
+
+
+@receiver(setting_changed)
+def wayforpay_setting_changed(setting, **kwargs):
+    if setting.startswith("WAYFORPAY_") or setting == "MERCHANT_REGISTRY_TTL":
+        merchant_registry.invalidate()
+
+
+def _touches_rollup(update_fields) -> bool:
+    return update_fields is None or not rollups.TRACKED_FIELDS.isdisjoint(
+        Invoice._meta.get_field(name).attname for name in update_fields
+    )
+
+
+@receiver(pre_save, sender=Invoice)
+def invoice_rollup_before_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if instance._state.adding:
+        instance._rollup_state = None
+    elif getattr(instance, "_rollup_state", rollups.UNKNOWN) is rollups.UNKNOWN and _touches_rollup(update_fields):
+        # Инвойс загружен не целиком — исходный бакет берём из БД
+        instance._rollup_state = rollups.stored_state(instance.pk)
+
+
+@receiver(post_save, sender=Invoice)
+def invoice_rollup_after_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not _touches_rollup(update_fields):
+        return
+    new = rollups.invoice_state(instance)
+    rollups.schedule_change(instance._rollup_state, new)
+    instance._rollup_state = new
+
+
+@receiver(pre_delete, sender=Invoice)
+def invoice_rollup_before_delete(sender, instance, **kwargs):
+    if getattr(instance, "_rollup_state", rollups.UNKNOWN) is rollups.UNKNOWN:
+        instance._rollup_state = rollups.stored_state(instance.pk)
+
+
+@receiver(post_delete, sender=Invoice)
+def invoice_rollup_after_delete(sender, instance, **kwargs):
+    rollups.schedule_change(instance._rollup_state, None)
@@ -0,0 +1,126 @@
+# payments/sweeper.py
+"""
+Обслуживание payment_invoices (manage.py sweep_invoices).
+
+1. expire_abandoned — брошенные PENDING-инвойсы (вебхука не было, строка
+   не менялась дольше порога) → EXPIRED. Инвойсы автосписаний не трогаем:
+   их разрешает вебхук или сверка (payments/reconcile.py), иначе можно
+   списать повторно.
+2. archive_payloads — raw_request_payload / raw_response_payload итоговых
+   инвойсов старше N дней переносятся в InvoicePayloadArchive (zlib) и
+   обнуляются в горячей таблице; строки выпадают и из частичного индекса
+   inv_notified_bot_idx.
+
+Обе операции идут порциями: pk порции берутся по индексу, затем один
+UPDATE/INSERT на порцию в своей короткой транзакции — без долгих
+блокировок и без загрузки моделей. QuerySet.update() сигналов не вызывает:
+брошенные PENDING в сводках мониторинга не учтены (notified_at пуст),
+а архивируются инвойсы старше окна мониторинга — rebuild_payment_metrics
+за архивный период расхождения payload уже не увидит.
+"""
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Invoice, InvoicePayloadArchive, PaymentStatus
+
+logger = logging.getLogger(__name__)
+
+# Статусы, по которым ещё может прийти результат — их payload нужен
+OPEN_STATUSES = (PaymentStatus.NEW, PaymentStatus.PENDING, "PROCESSING")
+
+
+def abandoned_invoices(older_than_hours: int):
+    cutoff = timezone.now() - timedelta(hours=older_than_hours)
+    return (
+        Invoice.objects.filter(payment_status=PaymentStatus.PENDING, updated_at__lt=cutoff, notified_at__isnull=True)
+        # Не exclude(recurringCharge=True): у строк без ключа сравнение даёт NULL и они бы выпали
+        .filter(Q(raw_request_payload__isnull=True) | ~Q(raw_request_payload__has_key="recurringCharge"))
+    )
+
+
+def expire_abandoned(older_than_hours: int = 72, chunk_size: int = 1000) -> int:
+    """PENDING без вебхука дольше older_than_hours → EXPIRED. Возвращает число инвойсов."""
+    total = 0
+    while True:
+        pks = list(abandoned_invoices(older_than_hours).order_by("updated_at").values_list("pk", flat=True)[:chunk_size])
+        if not pks:
+            break
+        # Условие повторяется: между выборкой и UPDATE инвойс мог получить вебхук
+        total += abandoned_invoices(older_than_hours).filter(pk__in=pks).update(
+            payment_status=PaymentStatus.EXPIRED, updated_at=timezone.now()
+        )
+        if len(pks) < chunk_size:
+            break
+    if total:
+        logger.info(f"Expired {total} abandoned invoices")
+    return total
+
+
+def archivable_invoices(older_than_days: int):
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    return (
+        Invoice.objects.filter(updated_at__lt=cutoff)
+        .exclude(payment_status__in=OPEN_STATUSES)
+        .filter(Q(raw_request_payload__isnull=False) | Q(raw_response_payload__isnull=False))
+    )
+
+
+def archive_payloads(older_than_days: int = 90, chunk_size: int = 500) -> int:
+    """Перенести payload'ы итоговых инвойсов старше older_than_days в архив. Возвращает число инвойсов."""
+    total = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                archivable_invoices(older_than_days)
+                .filter(pk__gt=last_pk)
+                .order_by("pk")
+                .select_for_update(skip_locked=True)
+                .values_list("pk", "raw_request_payload", "raw_response_payload")[:chunk_size]
+            )
+            if not rows:
+                break
+            pks = [row[0] for row in rows]
+            # Инвойс уже архивировался (поздний вебхук записал payload заново) — дополняем архив
+            previous = {a.invoice_id: a.unpack() for a in InvoicePayloadArchive.objects.filter(invoice_id__in=pks)}
+            now = timezone.now()
+            archives = []
+            for pk, req, resp in rows:
+                old = previous.get(pk, {})
+                data = InvoicePayloadArchive.pack(
+                    req if req is not None else old.get("request"),
+                    resp if resp is not None else old.get("response"),
+                )
+                archives.append(InvoicePayloadArchive(invoice_id=pk, data=data, archived_at=now))
+            InvoicePayloadArchive.objects.bulk_create(
+                archives,
+                update_conflicts=True,
+                unique_fields=["invoice"],
+                update_fields=["data", "archived_at"],
+            )
+            Invoice.objects.filter(pk__in=pks).update(raw_request_payload=None, raw_response_payload=None)
+        total += len(rows)
+        last_pk = pks[-1]
+        if len(rows) < chunk_size:
+            break
+    if total:
+        logger.info(f"Archived payloads of {total} invoices")
+    return total
+
+
+def invoice_payloads(invoice: Invoice) -> dict:
+    """Payload'ы инвойса: из строки, недостающие — из InvoicePayloadArchive."""
+    payloads = {"request": invoice.raw_request_payload, "response": invoice.raw_response_payload}
+    if None in payloads.values():
+        archive = InvoicePayloadArchive.objects.filter(invoice_id=invoice.pk).first()
+        if archive:
+            for key, value in archive.unpack().items():
+                if payloads.get(key) is None:
+                    payloads[key] = value
+    return payloads
@@ -60,7 +60,14 @@ class WayForPayAPI:
         return ";".join("" if p is None else str(p) for p in parts)
 
     def _hmac_md5(self, s: str) -> str:
-        return hmac.new(self.secret_key.encode("utf-8"), s.encode("utf-8"), hashlib.md5).hexdigest()
+        # Ключ готовится один раз на клиент (реестр держит клиентов долго), дальше — copy()
+        prepared = getattr(self, "_hmac_prepared", None)
+        if prepared is None or prepared[0] != self.secret_key:
+            prepared = (self.secret_key, hmac.new(self.secret_key.encode("utf-8"), digestmod=hashlib.md5))
+            self._hmac_prepared = prepared
+        mac = prepared[1].copy()
+        mac.update(s.encode("utf-8"))
+        return mac.hexdigest()
 
     def get_signature(self, data: Dict, keys: List[str]) -> str:
         """Генерация подписи по списку ключей (массивы product* разворачиваются)."""
@@ -171,6 +178,16 @@ class WayForPayAPI:
         except (ValueError, IndexError) as e:
             raise ValueError(f"Cannot parse orderReference {order_reference}: {e}")
     
+    def generate_check_status_data(self, order_reference: str) -> Dict:
+        """Запрос CHECK_STATUS: подпись merchantAccount;orderReference."""
+        return {
+            "transactionType": "CHECK_STATUS",
+            "merchantAccount": self.merchant_account,
+            "orderReference": order_reference,
+            "merchantSignature": self._hmac_md5(self._join([self.merchant_account, order_reference])),
+            "apiVersion": 1,
+        }
+
     def generate_payment_form_data(self, invoice_data: Dict) -> Dict:
         """Генерация данных для формы/редиректа на страницу оплаты."""
         import time
@@ -0,0 +1,82 @@
+# payments/wayforpay/http.py
+"""
+HTTP-клиент Django-процесса для запросов к api.wayforpay.com.
+
+Один httpx.Client на процесс (keep-alive пул соединений): TLS-рукопожатие
+делается один раз, а не на каждый CREATE_INVOICE. Таймаут попытки и число
+повторов — из настроек:
+- WAYFORPAY_HTTP_TIMEOUT — секунд на одну попытку (по умолчанию 10);
+- WAYFORPAY_HTTP_RETRIES — сколько раз повторить, если соединение не
+  установилось (по умолчанию 2).
+
+Повторяем только ошибки до отправки запроса (connect/pool): если запрос
+ушёл, WayForPay мог уже создать инвойс, и повтор с тем же orderReference
+небезопасен.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+from django.conf import settings
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class RequestNotSent(ValueError):
+    """Соединение с WayForPay так и не установилось — запрос точно не ушёл."""
+
+
+def http_timeout() -> float:
+    return float(getattr(settings, "WAYFORPAY_HTTP_TIMEOUT", 10))
+
+
+def http_retries() -> int:
+    return max(0, int(getattr(settings, "WAYFORPAY_HTTP_RETRIES", 2)))
+
+
+def request_budget() -> float:
+    """Худшее время CREATE_INVOICE со всеми повторами, сек."""
+    return http_timeout() * (http_retries() + 1)
+
+
+def get_client():
+    """Общий httpx.Client процесса (создаётся при первом обращении)."""
+    global _client
+    if _client is None:
+        import httpx
+
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(
+                    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                    headers={"Content-Type": "application/json"},
+                )
+    return _client
+
+
+def post_json(url: str, data: dict, timeout: Optional[float] = None) -> dict:
+    """POST JSON с повтором неустановившихся соединений; ValueError при ошибке."""
+    import httpx
+
+    timeout = http_timeout() if timeout is None else timeout
+    attempts = http_retries() + 1
+    last_error = None
+    for _ in range(attempts):
+        try:
+            response = get_client().post(url, json=data, timeout=timeout)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            last_error = e
+            continue
+        except httpx.HTTPError as e:
+            raise ValueError(f"WayForPay request failed: {e}")
+
+        if response.status_code != 200:
+            raise ValueError(f"WayForPay API error: {response.status_code}")
+        try:
+            return response.json()
+        except ValueError as e:
+            raise ValueError(f"WayForPay returned invalid JSON: {e}")
+
+    raise RequestNotSent(f"WayForPay unreachable after {attempts} attempts: {last_error}")
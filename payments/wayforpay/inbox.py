@@ -0,0 +1,167 @@
+# payments/wayforpay/inbox.py
+"""
+Inbox вебхуков WayForPay: быстрый ответ + асинхронная обработка.
+
+При settings.WAYFORPAY_WEBHOOK_INBOX = True WebhookView не вызывает
+handle_webhook: доставка пишется в WebhookInbox (один INSERT) и WayForPay
+сразу получает подписанный accept. Обработку делает пул воркеров
+(manage.py process_webhook_inbox):
+
+- строки забираются пачкой через SELECT ... FOR UPDATE SKIP LOCKED и
+  «арендуются» на LEASE_SECONDS; строки заказа, у которого более ранняя
+  доставка уже в работе (аренда или ожидание повтора), не забираются;
+- события одного orderReference обрабатываются последовательно и по порядку
+  поступления: перед обработкой блокируются все доставки заказа, и если есть
+  более ранняя необработанная, строка откладывается на DEFER_SECONDS;
+- повторные доставки события (тот же orderReference + transactionStatus)
+  после успешной помечаются DUPLICATE;
+- handle_webhook выполняется в той же транзакции, что и отметка DONE;
+- ошибка → повтор с задержкой, после max_attempts → FAILED
+  (вернуть в работу — manage.py replay_webhooks).
+"""
+from __future__ import annotations
+
+import logging
+import time
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from payments.models import InboxStatus, WebhookInbox
+from payments.outbox import backoff
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = 120
+# Через сколько снова взять доставку, ждущую более раннее событие своего заказа
+DEFER_SECONDS = 5
+
+# Заголовки, которые не сохраняем в журнал
+_SKIP_HEADERS = {"cookie", "authorization"}
+
+
+def is_enabled() -> bool:
+    from django.conf import settings
+    return bool(getattr(settings, "WAYFORPAY_WEBHOOK_INBOX", False))
+
+
+def delivery_key(payload: Dict) -> str:
+    order_reference = str(payload.get("orderReference") or "").strip().rstrip(";")
+    return f"{order_reference}:{payload.get('transactionStatus') or ''}"
+
+
+def store(payload: Dict, headers: Optional[Dict] = None) -> WebhookInbox:
+    """Сохранить доставку (без обработки)."""
+    return WebhookInbox.objects.create(
+        order_reference=str(payload.get("orderReference") or "").strip().rstrip(";"),
+        delivery_key=delivery_key(payload),
+        payload=payload,
+        headers={k: v for k, v in (headers or {}).items() if k.lower() not in _SKIP_HEADERS},
+    )
+
+
+def ack(payload: Dict) -> Dict:
+    """Подписанный ответ accept для WayForPay (ключ merchant'а из payload)."""
+    from .registry import merchant_registry
+
+    api = merchant_registry.by_account(payload.get("merchantAccount")) or merchant_registry.default()
+    order_reference = str(payload.get("orderReference") or "")
+    t = int(time.time())
+    return {
+        "orderReference": order_reference,
+        "status": "accept",
+        "time": t,
+        "signature": api.get_ack_signature(order_reference, "accept", t),
+    }
+
+
+def claim_batch(batch_size: int) -> list[int]:
+    """id готовых к обработке строк (короткая транзакция, аренда на LEASE_SECONDS)."""
+    now = timezone.now()
+    # Более ранняя доставка того же заказа в работе у другого воркера или ждёт повтора
+    earlier_in_flight = WebhookInbox.objects.filter(
+        order_reference=OuterRef("order_reference"),
+        status=InboxStatus.NEW,
+        next_attempt_at__gt=now,
+        id__lt=OuterRef("id"),
+    )
+    with transaction.atomic():
+        ids = list(
+            WebhookInbox.objects.select_for_update(skip_locked=True)
+            .filter(status=InboxStatus.NEW, next_attempt_at__lte=now)
+            .filter(~Exists(earlier_in_flight))
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if ids:
+            WebhookInbox.objects.filter(pk__in=ids).update(next_attempt_at=now + timedelta(seconds=LEASE_SECONDS))
+    return ids
+
+
+def process_entry(entry_id: int, *, force: bool = False, max_attempts: int = 5) -> str:
+    """
+    Обработать одну доставку. force — обработать повторно, даже если событие
+    уже обработано или ждёт более раннее событие заказа (replay).
+    Возвращает итоговый статус строки.
+    """
+    from .services import WayForPayService
+
+    try:
+        with transaction.atomic():
+            order_reference = WebhookInbox.objects.values_list("order_reference", flat=True).get(pk=entry_id)
+            # Все доставки заказа — под блокировкой: события одного заказа не идут параллельно
+            group = {
+                e.pk: e for e in
+                WebhookInbox.objects.select_for_update().filter(order_reference=order_reference).order_by("id")
+            }
+            entry = group[entry_id]
+            if not force and any(pk < entry_id and e.status == InboxStatus.NEW for pk, e in group.items()):
+                # Сначала — более раннее событие заказа (например, APPROVED до REFUNDED)
+                WebhookInbox.objects.filter(pk=entry_id).update(
+                    next_attempt_at=timezone.now() + timedelta(seconds=DEFER_SECONDS)
+                )
+                return InboxStatus.NEW
+            if not force and any(
+                e.status == InboxStatus.DONE and e.delivery_key == entry.delivery_key
+                for pk, e in group.items() if pk != entry_id
+            ):
+                WebhookInbox.objects.filter(pk=entry_id).update(
+                    status=InboxStatus.DUPLICATE, processed_at=timezone.now()
+                )
+                return InboxStatus.DUPLICATE
+
+            result = WayForPayService().handle_webhook(entry.payload)
+            WebhookInbox.objects.filter(pk=entry_id).update(
+                status=InboxStatus.DONE,
+                attempts=entry.attempts + 1,
+                processed_at=timezone.now(),
+                result=result,
+                last_error="",
+            )
+            return InboxStatus.DONE
+    except WebhookInbox.DoesNotExist:
+        raise
+    except Exception as e:
+        logger.error(f"Webhook inbox entry {entry_id} failed: {e}", exc_info=True)
+        entry = WebhookInbox.objects.only("attempts").get(pk=entry_id)
+        attempts = entry.attempts + 1
+        fields = {"attempts": attempts, "last_error": str(e) or e.__class__.__name__}
+        if attempts >= max_attempts:
+            fields["status"] = InboxStatus.FAILED
+        else:
+            fields["status"] = InboxStatus.NEW
+            fields["next_attempt_at"] = timezone.now() + backoff(attempts)
+        WebhookInbox.objects.filter(pk=entry_id).update(**fields)
+        return fields["status"]
+
+
+def process_batch(batch_size: int = 20, max_attempts: int = 5) -> Dict[str, int]:
+    """Один проход воркера: {'DONE': n, 'DUPLICATE': n, 'NEW': n (повтор), 'FAILED': n}."""
+    stats: Dict[str, int] = {}
+    for entry_id in claim_batch(batch_size):
+        status = process_entry(entry_id, max_attempts=max_attempts)
+        stats[status] = stats.get(status, 0) + 1
+    return stats
@@ -0,0 +1,119 @@
+# payments/wayforpay/registry.py
+"""
+Реестр WayForPayAPI процесса Django: bot_id → готовый клиент с подготовленным
+HMAC-ключом (без запросов к Bot/MerchantConfig на каждый инвойс и вебхук).
+
+Инвалидация:
+- post_save/post_delete MerchantConfig и Bot (в т.ч. из core.admin через
+  MerchantConfigInline) сбрасывают реестр текущего процесса — сразу и после
+  коммита (payments/signals.py);
+- остальные процессы Django догоняют по TTL (settings.MERCHANT_REGISTRY_TTL);
+  до этого вебхук с подписью новым ключом не сойдётся с кешем, поэтому
+  verify_webhook() при несовпадении один раз перечитывает конфиг merchant'а.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Optional
+
+from .api import WayForPayAPI
+
+# Отсутствие конфига тоже кешируем, чтобы не ходить в БД за каждым fallback
+_MISSING = object()
+
+
+class MerchantRegistry:
+    def __init__(self, ttl: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self._ttl = ttl
+        self._clock = clock
+        self._by_bot: dict[int, tuple[object, float]] = {}
+        self._by_account: dict[str, tuple[object, float]] = {}
+        self._default: Optional[WayForPayAPI] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self) -> float:
+        if self._ttl is not None:
+            return self._ttl
+        from django.conf import settings
+        return getattr(settings, "MERCHANT_REGISTRY_TTL", 300)
+
+    def _cached(self, data: dict, key):
+        entry = data.get(key)
+        if entry is not None and entry[1] > self._clock():
+            return entry[0]
+        return None
+
+    def _store(self, data: dict, key, api: Optional[WayForPayAPI]) -> Optional[WayForPayAPI]:
+        with self._lock:
+            data[key] = (api if api is not None else _MISSING, self._clock() + self.ttl)
+        return api
+
+    def default(self) -> WayForPayAPI:
+        """Клиент на общих настройках WAYFORPAY_* (fallback)."""
+        if self._default is None:
+            self._default = WayForPayAPI()
+        return self._default
+
+    def get(self, bot_id: int) -> Optional[WayForPayAPI]:
+        """Клиент merchant'а бота (Bot.bot_id) или None, если бота/конфига нет."""
+        cached = self._cached(self._by_bot, bot_id)
+        if cached is not None:
+            return None if cached is _MISSING else cached
+
+        from payments.models import MerchantConfig
+        config = MerchantConfig.objects.filter(bot__bot_id=bot_id).first()
+        return self._store(self._by_bot, bot_id, WayForPayAPI(merchant_config=config) if config else None)
+
+    def for_bot(self, bot_id: Optional[int]) -> WayForPayAPI:
+        """Клиент бота, а если конфига нет — на общих настройках."""
+        api = self.get(bot_id) if bot_id else None
+        return api or self.default()
+
+    def by_account(self, merchant_account: Optional[str]) -> Optional[WayForPayAPI]:
+        """Клиент по merchantAccount из вебхука (подпись ответа accept)."""
+        if not merchant_account:
+            return None
+        cached = self._cached(self._by_account, merchant_account)
+        if cached is not None:
+            return None if cached is _MISSING else cached
+
+        from payments.models import MerchantConfig
+        config = MerchantConfig.objects.filter(merchant_account=merchant_account).first()
+        return self._store(self._by_account, merchant_account, WayForPayAPI(merchant_config=config) if config else None)
+
+    def forget_account(self, merchant_account: str) -> None:
+        """Сбросить клиентов merchant'а (и по merchantAccount, и по ботам с ним)."""
+        with self._lock:
+            self._by_account.pop(merchant_account, None)
+            self._by_bot = {
+                bot_id: entry for bot_id, entry in self._by_bot.items()
+                if getattr(entry[0], "merchant_account", None) != merchant_account
+            }
+
+    def verify_webhook(self, payload: dict) -> bool:
+        """
+        Подпись вебхука ключом merchant'а из merchantAccount. Если не сошлась,
+        конфиг перечитывается из БД один раз: ключ могли сменить в другом
+        процессе, а здесь до TTL держится старый.
+        """
+        merchant_account = payload.get("merchantAccount")
+        api = self.by_account(merchant_account)
+        if api is not None and api.validate_response_signature(payload):
+            return True
+        if not merchant_account:
+            return False
+        self.forget_account(merchant_account)
+        api = self.by_account(merchant_account)
+        return api is not None and api.validate_response_signature(payload)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._by_bot.clear()
+            self._by_account.clear()
+            self._default = None
+
+
+# Общий реестр процесса Django
+merchant_registry = MerchantRegistry()
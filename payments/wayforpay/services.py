@@ -1,6 +1,7 @@
 # ================================================================
 # wayforpay/services.py
 # ================================================================
+from datetime import timedelta
 from decimal import Decimal
 from typing import Dict, Optional
 from django.utils import timezone
@@ -15,63 +16,229 @@ from subscriptions.services import SubscriptionService
 from payments.models import Invoice, PaymentStatus, VerifiedUser
 
 
+class InvoiceRateLimited(Exception):
+    """Превышен лимит создания инвойсов (на пользователя бота или на бота)."""
+
+
+def _invoice_rate_allowed(bot_id: int, user_id: int) -> bool:
+    """Лимиты создания инвойсов: на пользователя бота и на бота целиком."""
+    from payments.ratelimit import get_limiter
+
+    if not getattr(settings, "INVOICE_RATELIMIT_ENABLED", False):
+        return True
+    window = int(getattr(settings, "INVOICE_RATELIMIT_WINDOW", 60))
+    limiter = get_limiter()
+    # Сначала узкий ключ: один пользователь не расходует лимит бота
+    if not limiter.hit(f"wfp:invoice:user:{bot_id}:{user_id}",
+                       int(getattr(settings, "INVOICE_RATELIMIT_PER_USER", 5)), window):
+        return False
+    return limiter.hit(f"wfp:invoice:bot:{bot_id}",
+                       int(getattr(settings, "INVOICE_RATELIMIT_PER_BOT", 300)), window)
 
 
 class WayForPayService:
     """Сервис WayForPay: создание инвойса, обработка вебхука, продление подписки, верификация."""
 
     def __init__(self, bot_id: int = None):
-        if bot_id:
-            # Если передан bot_id, загружаем настройки из БД
-            from core.models import Bot
-            bot_model = Bot.objects.select_related('merchant_config').get(bot_id=bot_id)
-            self.api = WayForPayAPI(merchant_config=bot_model.merchant_config)
-        else:
-            # Fallback на общие настройки
-            self.api = WayForPayAPI()
+        # Клиент merchant'а бота из реестра процесса (без запросов к БД на каждый вызов);
+        # без bot_id или без MerchantConfig — общие настройки
+        from .registry import merchant_registry
+        self.api = merchant_registry.for_bot(bot_id)
 
-    @transaction.atomic
     def create_invoice(self, bot_id: int, user_id: int, plan_id: int, amount: Optional[Decimal] = None) -> str:
         """
-        Создать инвойс и вернуть URL оплаты.
+        Создать инвойс и вернуть URL оплаты (синхронно, для HTTP endpoint create-invoice).
+
+        Три шага без общей транзакции: короткая транзакция на запись Invoice,
+        запрос в WayForPay вне транзакции (соединение с БД не держим),
+        короткий UPDATE ссылки или статуса.
+        Лимит запросов проверяется до транзакции (InvoiceRateLimited).
+        """
+        if not _invoice_rate_allowed(bot_id, user_id):
+            raise InvoiceRateLimited(f"bot_id={bot_id} user_id={user_id}")
+        inv, form_data = self.prepare_invoice(bot_id, user_id, plan_id, amount)
+        if form_data is None:
+            # Повторное нажатие — отдаём ссылку действующего PENDING-инвойса
+            return inv.invoice_url or self._wait_invoice_url(inv)
+        try:
+            url = self.request_invoice_url(form_data)
+        except Exception:
+            self._mark_invoice_failed(inv)
+            raise
+        self._store_invoice_url(inv, url)
+        return url
+
+    async def acreate_invoice(
+        self,
+        bot_id: int,
+        user_id: int,
+        plan_id: int,
+        *,
+        session,
+        amount: Optional[Decimal] = None,
+        api: Optional[WayForPayAPI] = None,
+    ) -> str:
+        """
+        Создать инвойс из процесса бота, без HTTP-хопа в Django.
+
+        Запись в БД — через ORM в потоке (sync_to_async), запрос к WayForPay —
+        на event loop бота через его aiohttp-сессию.
+        api — клиент merchant'а из merchant_registry (ключи после ротации
+        подхватываются по сигналам/TTL реестра).
+        Лимиты те же, что у HTTP create-invoice (InvoiceRateLimited).
+        """
+        from asgiref.sync import sync_to_async
+
+        if not await sync_to_async(_invoice_rate_allowed)(bot_id, user_id):
+            raise InvoiceRateLimited(f"bot_id={bot_id} user_id={user_id}")
+        inv, form_data = await sync_to_async(self.prepare_invoice)(
+            bot_id, user_id, plan_id, amount, api=api
+        )
+        if form_data is None:
+            return inv.invoice_url or await self._await_invoice_url(inv)
+        try:
+            url = await self.arequest_invoice_url(session, form_data)
+        except Exception:
+            await sync_to_async(self._mark_invoice_failed)(inv)
+            raise
+        await sync_to_async(self._store_invoice_url)(inv, url)
+        return url
+
+    @staticmethod
+    def _store_invoice_url(inv: Invoice, url: str) -> None:
+        inv.invoice_url = url
+        Invoice.objects.filter(pk=inv.pk).update(invoice_url=url, updated_at=timezone.now())
+
+    @staticmethod
+    def _mark_invoice_failed(inv: Invoice) -> None:
+        """CREATE_INVOICE не удался: ссылки у пользователя нет, инвойс больше не «в работе»."""
+        inv.payment_status = PaymentStatus.EXPIRED
+        Invoice.objects.filter(pk=inv.pk, payment_status=PaymentStatus.PENDING, invoice_url__isnull=True).update(
+            payment_status=PaymentStatus.EXPIRED, updated_at=timezone.now()
+        )
+
+    @staticmethod
+    def _poll_invoice_url(inv: Invoice) -> Optional[str]:
+        url, status = Invoice.objects.filter(pk=inv.pk).values_list("invoice_url", "payment_status").get()
+        if url:
+            return url
+        if status != PaymentStatus.PENDING:
+            raise ValueError(f"Invoice {inv.order_reference} creation failed")
+        return None
+
+    def _wait_invoice_url(self, inv: Invoice) -> str:
+        """Ссылку инвойса ещё получает параллельный запрос — ждём её в пределах бюджета HTTP."""
+        import time
+        from .http import request_budget
+
+        deadline = time.monotonic() + request_budget()
+        while time.monotonic() < deadline:
+            url = self._poll_invoice_url(inv)
+            if url:
+                return url
+            time.sleep(0.2)
+        raise ValueError(f"Invoice {inv.order_reference} is still being created")
+
+    async def _await_invoice_url(self, inv: Invoice) -> str:
+        import asyncio
+        import time
+        from asgiref.sync import sync_to_async
+        from .http import request_budget
+
+        deadline = time.monotonic() + request_budget()
+        while time.monotonic() < deadline:
+            url = await sync_to_async(self._poll_invoice_url)(inv)
+            if url:
+                return url
+            await asyncio.sleep(0.2)
+        raise ValueError(f"Invoice {inv.order_reference} is still being created")
+
+    @staticmethod
+    def _reusable_invoice(user: TelegramUser, bot_id: int, plan_id: int, amount: Decimal) -> Optional[Invoice]:
+        """
+        Действующий PENDING-инвойс того же (bot_id, user, plan) с той же суммой:
+        - с полученной ссылкой, не старше WAYFORPAY_INVOICE_REUSE_SECONDS (0 — не переиспользовать);
+        - или ещё без ссылки, но моложе бюджета HTTP-запроса — его создаёт
+          параллельный запрос (вызывающий дождётся ссылки).
+        """
+        from django.db.models import Q
+        from .http import request_budget
+
+        reuse_seconds = getattr(settings, "WAYFORPAY_INVOICE_REUSE_SECONDS", 1800)
+        if not reuse_seconds:
+            return None
+        now = timezone.now()
+        return (
+            Invoice.objects.filter(
+                user=user,
+                bot_id=bot_id,
+                plan_id=plan_id,
+                payment_status=PaymentStatus.PENDING,
+                amount=amount,
+            )
+            .filter(
+                Q(invoice_url__isnull=False, created_at__gte=now - timedelta(seconds=reuse_seconds))
+                | Q(invoice_url__isnull=True, created_at__gte=now - timedelta(seconds=request_budget()))
+            )
+            .order_by("-created_at")
+            .first()
+        )
+
+    @transaction.atomic
+    def prepare_invoice(
+        self,
+        bot_id: int,
+        user_id: int,
+        plan_id: int,
+        amount: Optional[Decimal] = None,
+        api: Optional[WayForPayAPI] = None,
+    ):
+        """
+        Создать Invoice (PENDING) и подписанные данные CREATE_INVOICE.
+        Возвращает (invoice, form_data); self.api настраивается на merchant бота.
+
+        Если у пользователя уже есть действующий PENDING-инвойс на этот тариф
+        (двойное нажатие «Оплатить»), возвращает (этот invoice, None) — новый
+        инвойс в WayForPay не создаётся.
         """
-        # Получаем бота с его merchant_config
-        from core.models import Bot
         import logging
+        from .registry import merchant_registry
         logger = logging.getLogger(__name__)
         
-        try:
-            bot_model = Bot.objects.select_related('merchant_config').get(bot_id=bot_id)
-            merchant_config = bot_model.merchant_config
-            
-            logger.info(f"Bot {bot_id} merchant_account from DB: {merchant_config.merchant_account}")
-            logger.info(f"Bot {bot_id} secret_key from DB: {merchant_config.secret_key[:10]}...")
-            
-            # Инициализируем API с настройками конкретного бота
-            self.api = WayForPayAPI(merchant_config=merchant_config)
-            
-            logger.info(f"API initialized with merchant_account: {self.api.merchant_account}")
-            
-        except Exception as e:
-            logger.error(f"Error loading bot config for bot_id={bot_id}: {e}")
-            # Fallback на общие настройки
-            self.api = WayForPayAPI()
-            logger.info(f"Using fallback settings, merchant_account: {self.api.merchant_account}")
+        if api is not None:
+            # Клиент уже взят из реестра вызывающим (процесс бота)
+            self.api = api
+        else:
+            api = merchant_registry.get(bot_id)
+            if api is None:
+                logger.error(f"MerchantConfig not found for bot_id={bot_id}, using fallback settings")
+            self.api = api or merchant_registry.default()
         
-    
+        logger.info(f"API initialized with merchant_account: {self.api.merchant_account}")
         
         user, _ = TelegramUser.objects.get_or_create(
             user_id=user_id,
             defaults={"username": None, "first_name": None, "last_name": None},
         )
 
+        # Сериализуем параллельные create_invoice одного пользователя (двойной тап):
+        # второй увидит строку первого (PENDING без ссылки) и дождётся её ссылки
+        TelegramUser.objects.select_for_update().filter(pk=user.pk).first()
+
+        # Сумма инвойса — только из БД, не из кеша каталога: кеш Django-процесса
+        # не подписан на LISTEN и до TTL мог бы отдать выключенный тариф или старую цену
         plan = Plan.objects.get(id=plan_id, bot_id=bot_id, enabled=True)
 
+        existing = self._reusable_invoice(user, bot_id, plan.id, amount or plan.price)
+        if existing is not None:
+            logger.info(f"Reusing pending invoice {existing.order_reference} for user {user_id}")
+            return existing, None
+
         order_reference = Invoice.generate_order_reference(bot_id, user_id, plan_id)
         inv = Invoice.objects.create(
             order_reference=order_reference,
             user=user,
-            plan=plan,
+            plan_id=plan.id,
             bot_id=bot_id,
             amount=amount or plan.price,
             currency=getattr(plan, "currency", "UAH"),
@@ -103,36 +270,49 @@ class WayForPayService:
         inv.raw_request_payload = form_data
         inv.save(update_fields=["raw_request_payload", "updated_at"])
 
-        import urllib.request
-        import urllib.parse
-        import json
-        
-        try:
-            # Подготавливаем данные для POST
-            json_data = json.dumps(form_data).encode('utf-8')
-            
-            # Создаем POST-запрос
-            req = urllib.request.Request(
-                'https://api.wayforpay.com/api',
-                data=json_data,
-                headers={'Content-Type': 'application/json'}
-            )
-            
-            # Отправляем запрос
-            with urllib.request.urlopen(req, timeout=30) as response:
-                if response.status == 200:
-                    result = json.loads(response.read().decode('utf-8'))
-                    if result.get('invoiceUrl'):
-                        return result['invoiceUrl']
-                    else:
-                        raise ValueError(f"No invoiceUrl in response: {result}")
-                else:
-                    raise ValueError(f"WayForPay API error: {response.status}")
-                    
-        except Exception as e:
-            raise ValueError(f"Failed to create invoice: {e}")
+        return inv, form_data
+
+    @staticmethod
+    def _invoice_url_from_response(result: Dict) -> str:
+        if result.get('invoiceUrl'):
+            return result['invoiceUrl']
+        raise ValueError(f"No invoiceUrl in response: {result}")
+
+    def request_invoice_url(self, form_data: Dict) -> str:
+        """CREATE_INVOICE в WayForPay (блокирующий вызов через общий keep-alive клиент)."""
+        from .http import post_json
+
+        return self._invoice_url_from_response(post_json(self.api.api_url, form_data))
+
+    async def arequest_invoice_url(self, session, form_data: Dict) -> str:
+        """CREATE_INVOICE в WayForPay через aiohttp-сессию вызывающего (event loop бота)."""
+        import aiohttp
+        from .http import http_retries, http_timeout
+
+        timeout = aiohttp.ClientTimeout(total=http_timeout())
+        attempts = http_retries() + 1
+        for attempt in range(attempts):
+            try:
+                async with session.post(self.api.api_url, json=form_data, timeout=timeout) as response:
+                    if response.status != 200:
+                        raise ValueError(f"WayForPay API error: {response.status}")
+                    # WayForPay отвечает JSON, но не всегда с application/json
+                    result = await response.json(content_type=None)
+                    return self._invoice_url_from_response(result)
+            except aiohttp.ClientConnectorError as e:
+                # Соединение не установилось — запрос не ушёл, повтор безопасен
+                if attempt + 1 >= attempts:
+                    raise ValueError(f"Failed to create invoice: {e}")
+            except Exception as e:
+                raise ValueError(f"Failed to create invoice: {e}")
       
    
+    def signature_valid(self, payload: Dict) -> bool:
+        """Подпись ключом этого клиента или merchant'а из merchantAccount (с перечитыванием конфига)."""
+        from .registry import merchant_registry
+
+        return self.api.validate_response_signature(payload) or merchant_registry.verify_webhook(payload)
+
     @transaction.atomic
     def handle_webhook(self, payload: Dict) -> Dict:
         """
@@ -148,7 +328,7 @@ class WayForPayService:
         
         verify_signature = getattr(settings, 'WAYFORPAY_VERIFY_SIGNATURE', True)
         
-        if verify_signature and not self.api.validate_response_signature(payload):
+        if verify_signature and not self.signature_valid(payload):
             logger.error('Invalid signature from WayForPay')
             return {"status": "accept", "message": "Invalid signature"}
         
@@ -200,7 +380,7 @@ class WayForPayService:
             
             # Переходим к обработке (передаем объект plan)
             base_reference = order_reference.split('_WFPREG-')[0]
-            return self._process_payment_status(payload, user_id, plan, bot_id, base_reference)
+            return self._process_payment_status(payload, user_id, plan, bot_id, base_reference, invoice=invoice)
         
         # 4. ⭐ НОВОЕ: Находим Invoice для валидации суммы и валюты
         base_reference_for_lookup = order_reference.split('_WFPREG-')[0]
@@ -218,17 +398,17 @@ class WayForPayService:
 
         if verify_merchant:
             bot_id = invoice.bot_id
-            from payments.models import MerchantConfig
+            from .registry import merchant_registry
             
-            try:
-                merchant_config = MerchantConfig.objects.get(bot__bot_id=bot_id)
+            bot_api = merchant_registry.get(bot_id)
+            if bot_api is not None:
                 payload_merchant = payload.get('merchantAccount', '').strip()
-                expected_merchant = merchant_config.merchant_account.strip()
+                expected_merchant = bot_api.merchant_account.strip()
                 
                 if payload_merchant != expected_merchant:
                     logger.warning(f"Foreign merchant account: payload={payload_merchant}, expected={expected_merchant}")
                     return {"status": "accept", "message": "Foreign merchant account"}
-            except MerchantConfig.DoesNotExist:
+            else:
                 logger.warning(f"MerchantConfig not found for bot_id={bot_id}, skipping merchant verification")
                 # Продолжаем обработку, т.к. MerchantConfig может отсутствовать в некоторых сценариях
 
@@ -264,13 +444,8 @@ class WayForPayService:
         is_recurring = '_WFPREG' in order_reference
         
         if not is_recurring:
-            # Это обычный платеж - проверяем дубликат
-            existing_invoice = Invoice.objects.filter(
-                order_reference=base_reference,
-                payment_status=PaymentStatus.APPROVED
-            ).first()
-            
-            if existing_invoice:
+            # Это обычный платеж - проверяем дубликат (invoice уже загружен по base_reference)
+            if invoice.payment_status == PaymentStatus.APPROVED:
                 logger.info(f"🔄 Duplicate webhook for: {order_reference}")
                 return {"status": "accept"}
         else:
@@ -278,7 +453,7 @@ class WayForPayService:
             logger.info(f"💳 Recurring payment detected: {order_reference}")
         
         # 9. Обработка платежа (передаем объект plan, не plan.id)
-        return self._process_payment_status(payload, user_id, plan, bot_id, base_reference, is_recurring)
+        return self._process_payment_status(payload, user_id, plan, bot_id, base_reference, is_recurring, invoice=invoice)
     
     def _update_invoice_fields(self, invoice: Invoice, payload: Dict):
         """Обновление полей инвойса без перезаписи существующих значений"""
@@ -302,12 +477,14 @@ class WayForPayService:
         invoice.reason_code = invoice.reason_code or payload.get('reasonCode')
         invoice.save()
    
-    def _process_payment_status(self, payload: Dict, user_id: int, plan, bot_id: int, base_reference: str, is_recurring: bool = False) -> Dict:
+    def _process_payment_status(self, payload: Dict, user_id: int, plan, bot_id: int, base_reference: str, is_recurring: bool = False, invoice: Optional[Invoice] = None) -> Dict:
         """
         Обработка статуса платежа с нормализацией
         
         Args:
             plan: Объект Plan (не plan_id!) - берется из Invoice
+            invoice: Invoice, загруженный handle_webhook (с user и plan) — дальше
+                     по цепочке передаётся он, повторно из БД не читаем
         """
         import logging
         from django.utils import timezone
@@ -324,15 +501,19 @@ class WayForPayService:
         plan_id = plan.id
         logger.info(f"Processing payment with plan_id={plan_id}, status={transaction_status}")
         
+        # Инвойс по другому orderReference (fallback-поиск) — обновляем base_reference как раньше
+        if invoice is not None and invoice.order_reference != base_reference:
+            invoice = None
+        
         if transaction_status == 'APPROVED':
-            return self._handle_approved_payment(payload, user_id, plan_id, bot_id, base_reference, is_recurring)
+            return self._handle_approved_payment(payload, user_id, plan_id, bot_id, base_reference, is_recurring, invoice=invoice)
         elif transaction_status in ['DECLINED', 'EXPIRED', 'CANCELED']:
-            return self._handle_declined_payment(payload, user_id, plan_id, bot_id, base_reference)
+            return self._handle_declined_payment(payload, user_id, plan_id, bot_id, base_reference, invoice=invoice)
         else:
             logger.warning(f"Unknown transaction status: {transaction_status}")
             return {"status": "accept", "message": f"Unknown status: {transaction_status}"}
         
-    def _handle_approved_payment(self, payload: Dict, user_id: int, plan_id: int, bot_id: int, base_reference: str, is_recurring: bool = False) -> Dict:
+    def _handle_approved_payment(self, payload: Dict, user_id: int, plan_id: int, bot_id: int, base_reference: str, is_recurring: bool = False, invoice: Optional[Invoice] = None) -> Dict:
         """Обработка успешного платежа"""
         import logging
         from django.utils import timezone
@@ -343,9 +524,13 @@ class WayForPayService:
         
         logger = logging.getLogger(__name__)
         
-       # Получаем план и пользователя
-        plan = Plan.objects.get(id=plan_id)
-        user, _ = TelegramUser.objects.get_or_create(user_id=user_id)
+        # План и пользователь — из уже загруженного инвойса
+        if invoice is not None:
+            plan = invoice.plan
+            user = invoice.user if invoice.user.user_id == user_id else TelegramUser.objects.get_or_create(user_id=user_id)[0]
+        else:
+            plan = Plan.objects.get(id=plan_id)
+            user, _ = TelegramUser.objects.get_or_create(user_id=user_id)
 
         # ⭐ АТОМАРНАЯ БЛОКИРОВКА: Пытаемся захватить обработку
         # Обновляем статус ТОЛЬКО если он PENDING (атомарно на уровне БД)
@@ -370,8 +555,8 @@ class WayForPayService:
 
         amount = float(payload.get('amount', 0))
 
-        # Получаем invoice для чтения snapshot duration_days (если есть)
-        inv = Invoice.objects.filter(order_reference=base_reference).first()
+        # Snapshot duration_days из invoice (если есть)
+        inv = invoice if invoice is not None else Invoice.objects.filter(order_reference=base_reference).first()
         if inv and inv.raw_request_payload and 'planDurationDays' in inv.raw_request_payload:
             duration_days = int(inv.raw_request_payload['planDurationDays'])
             logger.info(f"Using snapshot duration_days={duration_days} from invoice")
@@ -416,7 +601,7 @@ class WayForPayService:
         else:
             # Продление существующей
             logger.info(f"Extending subscription for user {user_id}")
-            self._extend_subscription(subscription, duration_days)
+            self._extend_subscription(subscription, duration_days, save=False)
             
             # Обновляем данные последнего платежа
             subscription.amount = amount
@@ -431,24 +616,29 @@ class WayForPayService:
             
             subscription.save()
     
-        # Создаем/обновляем инвойс
-        self._update_or_create_invoice(base_reference, payload, bot_id, user_id, plan_id, amount, 'APPROVED')
-        
-        # Создаем/обновляем VerifiedUser
-        # Сначала создаём/обновляем invoice, потом вызываем _update_verified_user
-        inv = Invoice.objects.get(order_reference=base_reference)
-        # Устанавливаем связь invoice -> subscription
-        inv.subscription_id = subscription.id
-        inv.save(update_fields=['subscription_id', 'updated_at'])
+        # Обновляем инвойс (вместе со связью invoice -> subscription) одним UPDATE
+        if invoice is not None:
+            inv = self._apply_payment_to_invoice(invoice, payload, amount, 'APPROVED', subscription=subscription)
+        else:
+            self._update_or_create_invoice(base_reference, payload, bot_id, user_id, plan_id, amount, 'APPROVED')
+            inv = Invoice.objects.get(order_reference=base_reference)
+            inv.subscription_id = subscription.id
+            inv.save(update_fields=['subscription_id', 'updated_at'])
+
+        # Автосписание по токену: следующая дата — от нового срока (payments/recurring.py)
+        from payments import recurring
+        if recurring.is_recurring_charge(inv):
+            recurring.schedule_next(subscription)
 
-        self._update_verified_user(bot_id, user_id, payload, inv)
+        # Создаем/обновляем VerifiedUser (после инвойса — нужны его карта и сумма)
+        self._update_verified_user(bot_id, user_id, payload, inv, user=user)
         
         # Проверяем debounce и отправляем уведомление
-        self._handle_payment_notification(bot_id, user_id, plan_id, base_reference, subscription)
+        self._handle_payment_notification(bot_id, user_id, plan_id, base_reference, subscription, user=user)
         
         return {"status": "accept"}
     
-    def _handle_declined_payment(self, payload: Dict, user_id: int, plan_id: int, bot_id: int, base_reference: str) -> Dict:
+    def _handle_declined_payment(self, payload: Dict, user_id: int, plan_id: int, bot_id: int, base_reference: str, invoice: Optional[Invoice] = None) -> Dict:
         """Обработка отклоненного платежа"""
         import logging
         from core.models import TelegramUser
@@ -457,23 +647,27 @@ class WayForPayService:
         logger = logging.getLogger(__name__)
         logger.info(f"Processing DECLINED payment for user {user_id}")
         
-        # Получаем объекты
-        user = TelegramUser.objects.get(user_id=user_id)
-        plan = Plan.objects.get(id=plan_id)
-        
         transaction_status = payload.get('transactionStatus', '').upper()
         amount = float(payload.get('amount', 0))
         
         # Обновляем invoice статусом DECLINED/EXPIRED/CANCELED
-        self._update_or_create_invoice(
-            base_reference, 
-            payload, 
-            bot_id, 
-            user_id, 
-            plan_id, 
-            amount, 
-            transaction_status
-        )
+        if invoice is not None:
+            was_open = invoice.payment_status in (PaymentStatus.PENDING, 'PROCESSING')
+            self._apply_payment_to_invoice(invoice, payload, amount, transaction_status)
+            # Отказ автосписания по токену: повтор/пауза (payments/recurring.py), повторную доставку не считаем
+            from payments import recurring
+            if was_open and recurring.is_recurring_charge(invoice) and invoice.subscription_id:
+                recurring.record_decline(invoice.subscription_id)
+        else:
+            self._update_or_create_invoice(
+                base_reference, 
+                payload, 
+                bot_id, 
+                user_id, 
+                plan_id, 
+                amount, 
+                transaction_status
+            )
         
         logger.info(f"Invoice marked as {transaction_status}")
         
@@ -509,8 +703,8 @@ class WayForPayService:
         
         subscription.save()
 
-    def _extend_subscription(self, subscription: Subscription, duration_days: int):
-        """Продление подписки с улучшенным логированием и проверками"""
+    def _extend_subscription(self, subscription: Subscription, duration_days: int, save: bool = True):
+        """Продление подписки с улучшенным логированием и проверками (save=False — сохранит вызывающий)"""
         import logging
         from django.utils import timezone
         from datetime import timedelta
@@ -540,13 +734,56 @@ class WayForPayService:
         subscription.reminder_sent_count = 0 
         subscription.reminder_sent_at = None
         
-        subscription.save(update_fields=[
-            'expires_at', 'last_payment_date', 'status', 
-            'reminder_sent_count', 'reminder_sent_at', 'updated_at'
-        ])
+        if save:
+            subscription.save(update_fields=[
+                'expires_at', 'last_payment_date', 'status', 
+                'reminder_sent_count', 'reminder_sent_at', 'updated_at'
+            ])
         
         logger.info(f"Subscription {subscription.id} extended successfully")
    
+    # Поля инвойса, которые вебхук перезаписывает (как в _update_or_create_invoice)
+    _INVOICE_PAYMENT_FIELDS = [
+        'amount', 'payment_status', 'transaction_id', 'rec_token', 'phone', 'email',
+        'card_pan', 'card_type', 'issuer_bank', 'issuer_country', 'payment_system',
+        'fee', 'rrn', 'approval_code', 'terminal', 'reason_code', 'paid_at',
+        'notified_at', 'raw_response_payload',
+    ]
+
+    def _apply_payment_to_invoice(self, invoice: Invoice, payload: Dict, amount: float, status: str, subscription=None) -> Invoice:
+        """Записать данные вебхука в уже загруженный инвойс (один UPDATE, без повторного чтения)."""
+        issuer_country = payload.get('issuerBankCountry')
+        if issuer_country:
+            issuer_country = issuer_country[:3].upper()
+
+        invoice.amount = amount
+        invoice.payment_status = status
+        invoice.transaction_id = payload.get('rrn')
+        invoice.rec_token = payload.get('recToken')
+        invoice.phone = payload.get('phone')
+        invoice.email = payload.get('email')
+        invoice.card_pan = payload.get('cardPan')
+        invoice.card_type = payload.get('cardType')
+        invoice.issuer_bank = payload.get('issuerBankName')
+        invoice.issuer_country = issuer_country
+        invoice.payment_system = payload.get('paymentSystem')
+        invoice.fee = payload.get('fee')
+        invoice.rrn = payload.get('rrn')
+        invoice.approval_code = payload.get('approvalCode')
+        invoice.terminal = payload.get('terminal')
+        invoice.reason_code = payload.get('reasonCode')
+        invoice.paid_at = timezone.now() if status == 'APPROVED' else None
+        # Время и тело вебхука — по ним считаются сводки мониторинга (payments/rollups.py)
+        invoice.notified_at = timezone.now()
+        invoice.raw_response_payload = payload
+
+        update_fields = self._INVOICE_PAYMENT_FIELDS + ['updated_at']
+        if subscription is not None:
+            invoice.subscription = subscription
+            update_fields.append('subscription')
+        invoice.save(update_fields=update_fields)
+        return invoice
+
     def _update_or_create_invoice(self, base_reference: str, payload: Dict, bot_id: int, user_id: int, plan_id: int, amount: float, status: str):
         """Создание/обновление инвойса как в PHP"""
         import logging
@@ -583,36 +820,28 @@ class WayForPayService:
                 'terminal': payload.get('terminal'),
                 'reason_code': payload.get('reasonCode'),
                 'paid_at': timezone.now() if status == 'APPROVED' else None,
+                'notified_at': timezone.now(),
+                'raw_response_payload': payload,
             }
         )
 
-    def _update_verified_user(self, bot_id: int, user_id: int, payload: Dict, invoice):
-        """Обновление верифицированного пользователя"""
+    def _update_verified_user(self, bot_id: int, user_id: int, payload: Dict, invoice, user: Optional[TelegramUser] = None):
+        """Обновление верифицированного пользователя (user — уже загруженный TelegramUser)"""
         from payments.models import VerifiedUser
         from core.models import TelegramUser
-        from django.utils import timezone
-        
-        user = TelegramUser.objects.get(user_id=user_id)
-        
-        verified_user, created = VerifiedUser.objects.update_or_create(
-            bot_id=bot_id,
-            user=user,
-            defaults={
-                'first_payment_date': timezone.now(),
-                'card_masked': payload.get('cardPan'),
-                'payment_system': payload.get('paymentSystem'),
-                'issuer_bank': payload.get('issuerBankName'),
-                'last_payment_date': timezone.now(),
-                'total_amount_paid': invoice.amount, 
-                'successful_payments_count': 1,
-            }
+
+        if user is None:
+            user = TelegramUser.objects.get(user_id=user_id)
+
+        # Одно атомарное выражение в БД: создать запись или увеличить счётчики
+        VerifiedUser.record_payment(
+            user.pk, bot_id, invoice.amount,
+            card_masked=payload.get('cardPan') or invoice.card_pan,
+            payment_system=payload.get('paymentSystem') or invoice.payment_system,
+            issuer_bank=payload.get('issuerBankName') or invoice.issuer_bank,
         )
-        
-    # Обновляем статистику для существующих пользователей
-        if not created:
-            verified_user.update_payment_stats(invoice)
-    
-    def _handle_payment_notification(self, bot_id: int, user_id: int, plan_id: int, base_reference: str, subscription):
+
+    def _handle_payment_notification(self, bot_id: int, user_id: int, plan_id: int, base_reference: str, subscription, user: Optional[TelegramUser] = None):
         """Отправка уведомления с исправленной debounce логикой"""
         import logging
         from django.utils import timezone
@@ -622,9 +851,11 @@ class WayForPayService:
         
         # ИСПРАВЛЕНО: используем paid_at вместо created_at
         debounce_minutes = 10
+        # Invoice.user — FK на TelegramUser, а user_id здесь — Telegram ID
+        user_filter = {'user': user} if user is not None else {'user__user_id': user_id}
         recent_success = Invoice.objects.filter(
             bot_id=bot_id,
-            user_id=user_id,
+            **user_filter,
             payment_status=PaymentStatus.APPROVED,
             paid_at__gte=timezone.now() - timedelta(minutes=debounce_minutes),  # ИЗМЕНЕНО
             paid_at__isnull=False  # ДОБАВЛЕНО: убеждаемся, что paid_at заполнен
@@ -633,27 +864,19 @@ class WayForPayService:
         if recent_success:
             logger.info(f'success_notification_suppressed: user_id={user_id}, bot_id={bot_id}, window_min={debounce_minutes}')
         else:
-            try:
-                # Получаем бота для отправки уведомления
-                from core.models import Bot
-                from payments.notifications import TelegramNotificationService
-                from subscriptions.models import Plan
-                
-                bot = Bot.objects.get(bot_id=bot_id)
-                plan = Plan.objects.get(id=plan_id)
-                
-                # Создаем сервис и отправляем уведомление
-                telegram_service = TelegramNotificationService(bot.token)
-                telegram_service.notify_payment_success(
-                    user_id=user_id,
-                    plan_name=plan.name,
-                    amount=subscription.amount,
-                    currency=plan.currency,
-                    expires_at=subscription.expires_at
-                )
-                logger.info(f'Payment notification sent to user {user_id}')
-            except Exception as e:
-                logger.error(f'Payment notification failed: {e}')
+            # Уведомление уходит через outbox: пишем строку в этой же транзакции,
+            # в Telegram её отправит dispatch_notifications после коммита
+            from payments.outbox import enqueue_payment_success
+
+            enqueue_payment_success(
+                bot_id=bot_id,
+                user_id=user_id,
+                order_reference=base_reference,
+                plan_id=plan_id,
+                amount=subscription.amount,
+                expires_at=subscription.expires_at,
+            )
+            logger.info(f'Payment notification queued for user {user_id}')
 
 
     def process_manual_payment(self, invoice):
@@ -715,6 +938,6 @@ class WayForPayService:
             'paymentSystem': 'MANUAL',
             'issuerBankName': 'Manual Payment',
         }
-        self._update_verified_user(bot_id, user_id, fake_payload)
+        self._update_verified_user(bot_id, user_id, fake_payload, invoice, user=user)
         
         logger.info(f"Manual payment processed for user {user_id}")
\ No newline at end of file
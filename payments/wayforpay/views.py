@@ -6,11 +6,10 @@ from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from payments.models import Invoice, PaymentStatus
-from .services import WayForPayService
+from .services import InvoiceRateLimited, WayForPayService
 from core.models import Bot
 
 
-
 @method_decorator(csrf_exempt, name="dispatch")
 class InvoiceCreateView(View):
     """API: создание инвойса (бот дергает этот endpoint)."""
@@ -31,6 +30,8 @@ class InvoiceCreateView(View):
         svc = WayForPayService()
         try:
             url = svc.create_invoice(bot_id=bot_id, user_id=user_id, plan_id=plan_id)
+        except InvoiceRateLimited:
+            return JsonResponse({"ok": False, "error": "rate_limited"}, status=429)
         except Exception as e:
             return JsonResponse({"ok": False, "error": str(e)}, status=422)
 
@@ -52,6 +53,14 @@ class WebhookView(View):
             logger.error("Invalid JSON in webhook")
             return HttpResponseBadRequest("invalid json")
 
+        # Режим inbox: сохраняем доставку и сразу отвечаем, обработка — в process_webhook_inbox.
+        # Ошибка записи в БД пробрасывается (5xx) — WayForPay повторит доставку.
+        from . import inbox
+        if inbox.is_enabled() and isinstance(payload, dict):
+            entry = inbox.store(payload, dict(request.headers))
+            logger.info(f"Webhook stored in inbox: id={entry.pk} key={entry.delivery_key}")
+            return JsonResponse(inbox.ack(payload), status=200)
+
         # Обрабатываем webhook через сервис
         svc = WayForPayService()
         
@@ -179,6 +179,53 @@ WAYFORPAY_SERVICE_URL = bot_settings.wayforpay_service_url
 WAYFORPAY_API_URL = bot_settings.wayforpay_api_url
 WAYFORPAY_PAY_URL = bot_settings.wayforpay_pay_url
 WAYFORPAY_VERIFY_SIGNATURE = bot_settings.wayforpay_verify_signature
+# Сколько секунд PENDING-инвойс отдаётся повторно вместо создания нового (0 — всегда новый)
+WAYFORPAY_INVOICE_REUSE_SECONDS = int(os.environ.get('WAYFORPAY_INVOICE_REUSE_SECONDS', '1800'))
+# Запросы к api.wayforpay.com: таймаут одной попытки (сек) и повторы неустановившегося соединения
+WAYFORPAY_HTTP_TIMEOUT = float(os.environ.get('WAYFORPAY_HTTP_TIMEOUT', '10'))
+WAYFORPAY_HTTP_RETRIES = int(os.environ.get('WAYFORPAY_HTTP_RETRIES', '2'))
+# TTL реестра WayForPayAPI по ботам (payments/wayforpay/registry.py), сек
+MERCHANT_REGISTRY_TTL = int(os.environ.get('MERCHANT_REGISTRY_TTL', '300'))
+# Вебхуки: сохранять в inbox и отвечать сразу (обработка — manage.py process_webhook_inbox)
+WAYFORPAY_WEBHOOK_INBOX = os.environ.get('WAYFORPAY_WEBHOOK_INBOX', 'false').lower() in ('1', 'true', 'yes')
+
+# Автосписания по токену (manage.py charge_recurring): какие recurrent_mode списываем сами.
+# Регулярные платежи WayForPay (regularMode: monthly и т.п.) WayForPay списывает сам — их сюда не добавлять
+RECURRING_CHARGE_MODES = [m.strip() for m in os.environ.get('RECURRING_CHARGE_MODES', 'merchant').split(',') if m.strip()]
+# После стольких отказов подряд автосписание ставится на паузу (recurrent_status=Paused)
+RECURRING_CHARGE_MAX_ATTEMPTS = int(os.environ.get('RECURRING_CHARGE_MAX_ATTEMPTS', '3'))
+# Списание без результата блокирует следующие не дольше стольких часов; потом сверка закрывает
+# его как EXPIRED, если WayForPay заказа не знает (должно быть меньше окна сверки, 72 ч)
+RECURRING_CHARGE_PENDING_HOURS = int(os.environ.get('RECURRING_CHARGE_PENDING_HOURS', '24'))
+
+# Обслуживание инвойсов (manage.py sweep_invoices): PENDING без вебхука дольше стольких часов → EXPIRED
+INVOICE_EXPIRE_AFTER_HOURS = int(os.environ.get('INVOICE_EXPIRE_AFTER_HOURS', '72'))
+# raw-payload'ы итоговых инвойсов старше стольких дней уходят в сжатый архив (0 — не архивировать)
+INVOICE_ARCHIVE_AFTER_DAYS = int(os.environ.get('INVOICE_ARCHIVE_AFTER_DAYS', '90'))
+
+# Рассылка контента (manage.py send_content): сколько чатов обслуживать одновременно
+CONTENT_SEND_CONCURRENCY = int(os.environ.get('CONTENT_SEND_CONCURRENCY', '20'))
+# Предзагрузка медиа уроков (manage.py prewarm_media): служебный чат, куда бот загружает файлы,
+# и на сколько дней вперёд брать уроки
+CONTENT_PREWARM_CHAT_ID = os.environ.get('CONTENT_PREWARM_CHAT_ID', '')
+CONTENT_PREWARM_DAYS = int(os.environ.get('CONTENT_PREWARM_DAYS', '1'))
+
+# Rate limit (payments/ratelimit.py): auto | redis | db | cache.
+# auto — Redis при заданном REDIS_URL, иначе таблица в PostgreSQL, иначе Django cache
+RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND', 'auto')
+RATELIMIT_REDIS_URL = os.environ.get('RATELIMIT_REDIS_URL') or bot_settings.redis_url
+# Вебхук WayForPay: лимит по IP (WebhookRateLimitMiddleware)
+WAYFORPAY_RATELIMIT_ENABLED = os.environ.get('WAYFORPAY_RATELIMIT_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+WAYFORPAY_RATELIMIT_COUNT = int(os.environ.get('WAYFORPAY_RATELIMIT_COUNT', '5'))
+WAYFORPAY_RATELIMIT_WINDOW = int(os.environ.get('WAYFORPAY_RATELIMIT_WINDOW', '10'))
+# Создание инвойсов: лимиты на пользователя и на бота за окно (сек)
+INVOICE_RATELIMIT_ENABLED = os.environ.get('INVOICE_RATELIMIT_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+INVOICE_RATELIMIT_WINDOW = int(os.environ.get('INVOICE_RATELIMIT_WINDOW', '60'))
+INVOICE_RATELIMIT_PER_USER = int(os.environ.get('INVOICE_RATELIMIT_PER_USER', '5'))
+INVOICE_RATELIMIT_PER_BOT = int(os.environ.get('INVOICE_RATELIMIT_PER_BOT', '300'))
+# Лимиты Telegram, общие для всех процессов (bot/outbound.py): auto | off.
+# auto — только если RATELIMIT_BACKEND выбрал Redis; с БД/кешем лимиты остаются в процессе
+OUTBOUND_SHARED_LIMITS = os.environ.get('OUTBOUND_SHARED_LIMITS', 'auto')
 
 # Email настройки (пример для Gmail SMTP)
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
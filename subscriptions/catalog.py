@@ -0,0 +1,131 @@
+# subscriptions/catalog.py
+"""
+Кеш каталога тарифов (включённые Plan) по боту в процессе бота.
+
+Тарифы меняются редко, а читаются на каждое «Продлить подписку» в боте.
+Каталог хранит строки планов и готовую клавиатуру kb_plans (строится один
+раз при первом обращении). Только для показа: сумму инвойса
+WayForPayService.prepare_invoice берёт из БД в своей транзакции.
+
+Инвалидация: после коммита post_save/post_delete Plan уходит
+pg_notify(PLANS_CHANNEL, '<bot_id>') (subscriptions/signals.py), процессы
+бота слушают канал через bot.listener.PgListener; без LISTEN — по TTL.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+PLANS_CHANNEL = "plan_catalog"
+
+SQL_PLANS_ENABLED = """
+SELECT id, bot_id, name, price, currency, duration_days, enabled
+FROM subscription_plans
+WHERE bot_id=$1 AND enabled = true
+ORDER BY price ASC, duration_days ASC
+"""
+
+
+@dataclass(frozen=True)
+class PlanRow:
+    id: int
+    bot_id: int
+    name: str
+    price: Decimal
+    currency: str
+    duration_days: int
+    enabled: bool = True
+
+
+@dataclass
+class BotPlans:
+    """Включённые тарифы бота в порядке показа (price, duration_days)."""
+    plans: tuple[PlanRow, ...]
+    expires_at: float
+    _keyboard: object = field(default=None, repr=False)
+
+    def __bool__(self) -> bool:
+        return bool(self.plans)
+
+    def __iter__(self):
+        return iter(self.plans)
+
+    def get(self, plan_id: int) -> Optional[PlanRow]:
+        return next((p for p in self.plans if p.id == plan_id), None)
+
+    @property
+    def keyboard(self):
+        """InlineKeyboardMarkup тарифов (aiogram импортируется только в процессе бота)."""
+        if self._keyboard is None:
+            from bot.keyboards import kb_plans
+            self._keyboard = kb_plans(self.plans)
+        return self._keyboard
+
+
+def _row(rec) -> PlanRow:
+    return PlanRow(
+        id=rec["id"],
+        bot_id=rec["bot_id"],
+        name=rec["name"],
+        price=rec["price"],
+        currency=rec["currency"],
+        duration_days=rec["duration_days"],
+        enabled=rec["enabled"],
+    )
+
+
+class PlanCatalog:
+    """bot_id → BotPlans с TTL, чтение через asyncpg-пул процесса бота."""
+
+    def __init__(self, ttl: float = 600.0, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._data: dict[int, BotPlans] = {}
+        self._lock = threading.Lock()
+
+    def _fresh(self, bot_id: int) -> Optional[BotPlans]:
+        cached = self._data.get(bot_id)
+        if cached is not None and cached.expires_at > self._clock():
+            return cached
+        return None
+
+    def _store(self, bot_id: int, rows) -> BotPlans:
+        plans = BotPlans(plans=tuple(rows), expires_at=self._clock() + self.ttl)
+        with self._lock:
+            self._data[bot_id] = plans
+        return plans
+
+    async def aget(self, pool, bot_id: int) -> BotPlans:
+        """Каталог бота (asyncpg-пул процесса бота)."""
+        cached = self._fresh(bot_id)
+        if cached is not None:
+            return cached
+        rows = await pool.fetch(SQL_PLANS_ENABLED, bot_id)
+        return self._store(bot_id, [_row(r) for r in rows])
+
+    def invalidate(self, bot_id: Optional[int] = None) -> None:
+        with self._lock:
+            if bot_id is None:
+                self._data.clear()
+            else:
+                self._data.pop(bot_id, None)
+
+    # ---------- LISTEN/NOTIFY ----------
+    def on_notify(self, payload: str) -> None:
+        try:
+            bot_id = int(payload)
+        except (TypeError, ValueError):
+            self.invalidate()
+            return
+        self.invalidate(bot_id)
+        log.info("plan catalog invalidated: bot_id=%s", bot_id)
+
+    def subscribe(self, listener) -> None:
+        """Подписка на PLANS_CHANNEL через bot.listener.PgListener."""
+        listener.subscribe(PLANS_CHANNEL, self.on_notify, on_lost=self.invalidate)
@@ -0,0 +1,178 @@
+# subscriptions/management/commands/bench_sub_status.py
+"""
+Бенчмарк «Моя подписка» в боте: старый путь (SQL_IS_BLOCKED + отдельный
+запрос статуса) против объединённого bot.subscriptions.SQL_SUB_STATUS.
+
+Использование:
+    python manage.py bench_sub_status --bot-id 1 --seed --users 5000 --subs-per-user 4
+    python manage.py bench_sub_status --bot-id 1 --iterations 5000
+    python manage.py bench_sub_status --bot-id 1 --cleanup
+
+Работает только на PostgreSQL (asyncpg, тот же пул, что у бота).
+"""
+import asyncio
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import TelegramUser
+from subscriptions.models import Plan, Subscription, SubscriptionStatus
+
+# Синтетические пользователи живут в отдельном диапазоне user_id
+BENCH_USER_BASE = 9_000_000_000
+BENCH_PLAN_PREFIX = "bench-"
+
+# Старый путь on_status (до объединения): два последовательных запроса
+LEGACY_SQL_IS_BLOCKED = "SELECT is_blocked FROM telegram_users WHERE user_id = $1 LIMIT 1"
+LEGACY_SQL_SUB_STATUS = """
+SELECT s.status,
+       s.starts_at AT TIME ZONE 'UTC' AS starts_at_utc,
+       s.expires_at AT TIME ZONE 'UTC' AS expires_at_utc,
+       s.last_payment_date AT TIME ZONE 'UTC' AS last_payment_utc,
+       p.name, p.price, p.currency, p.duration_days
+FROM subscriptions s
+JOIN subscription_plans p ON p.id = s.plan_id
+JOIN telegram_users t ON t.id = s.user_id
+WHERE s.bot_id = $1 AND t.user_id = $2
+ORDER BY s.updated_at DESC
+LIMIT 1
+"""
+
+
+def _percentiles(samples: list[float]) -> tuple[float, float, float]:
+    """p50/p95/p99 в миллисекундах."""
+    q = statistics.quantiles(samples, n=100, method="inclusive")
+    return q[49] * 1000, q[94] * 1000, q[98] * 1000
+
+
+class Command(BaseCommand):
+    help = "Бенчмарк запроса статуса подписки в боте (p50/p99 до и после объединения запросов)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bot-id", type=int, required=True, help="bot_id подписок (как в on_status)")
+        parser.add_argument("--seed", action="store_true", help="Создать синтетических пользователей и подписки")
+        parser.add_argument("--cleanup", action="store_true", help="Удалить синтетические данные и выйти")
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--subs-per-user", type=int, default=3)
+        parser.add_argument("--iterations", type=int, default=2000)
+        parser.add_argument("--warmup", type=int, default=100)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("bench_sub_status работает только на PostgreSQL")
+
+        bot_id = options["bot_id"]
+
+        if options["cleanup"]:
+            self._cleanup(bot_id)
+            return
+
+        if options["seed"]:
+            self._seed(bot_id, options["users"], options["subs_per_user"])
+
+        user_ids = list(
+            TelegramUser.objects.filter(user_id__gte=BENCH_USER_BASE).values_list("user_id", flat=True)
+        )
+        if not user_ids:
+            raise CommandError("Нет синтетических пользователей — запустите с --seed")
+
+        results = asyncio.run(self._bench(bot_id, user_ids, options["iterations"], options["warmup"]))
+
+        self.stdout.write(f"users={len(user_ids)} iterations={options['iterations']}")
+        for label, samples in results.items():
+            p50, p95, p99 = _percentiles(samples)
+            self.stdout.write(f"{label:<28} p50={p50:7.3f}ms  p95={p95:7.3f}ms  p99={p99:7.3f}ms")
+
+        before = _percentiles(results["before (2 queries)"])
+        after = _percentiles(results["after (1 query)"])
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ p50 {before[0]:.3f} → {after[0]:.3f} ms, p99 {before[2]:.3f} → {after[2]:.3f} ms"
+        ))
+
+    # ---------- data ----------
+    @transaction.atomic
+    def _seed(self, bot_id: int, users: int, subs_per_user: int):
+        plans = [
+            Plan.objects.get_or_create(
+                bot_id=bot_id,
+                name=f"{BENCH_PLAN_PREFIX}{i}",
+                defaults={"price": 100 + i, "currency": "UAH", "duration_days": 30, "enabled": False},
+            )[0]
+            for i in range(subs_per_user)
+        ]
+
+        existing = TelegramUser.objects.filter(user_id__gte=BENCH_USER_BASE).count()
+        TelegramUser.objects.bulk_create(
+            [TelegramUser(user_id=BENCH_USER_BASE + existing + i) for i in range(users)],
+            batch_size=1000,
+        )
+        new_users = TelegramUser.objects.filter(user_id__gte=BENCH_USER_BASE + existing)
+
+        now = timezone.now()
+        subs = []
+        for user in new_users.iterator():
+            for n, plan in enumerate(plans):
+                subs.append(Subscription(
+                    user=user,
+                    plan=plan,
+                    bot_id=bot_id,
+                    status=SubscriptionStatus.EXPIRED if n else SubscriptionStatus.ACTIVE,
+                    starts_at=now - timedelta(days=30 * (n + 1)),
+                    expires_at=now + timedelta(days=30 - 30 * n),
+                ))
+        Subscription.objects.bulk_create(subs, batch_size=2000)
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE telegram_users; ANALYZE subscriptions;")
+
+        self.stdout.write(f"Seeded users={users} subscriptions={len(subs)}")
+
+    def _cleanup(self, bot_id: int):
+        users, _ = TelegramUser.objects.filter(user_id__gte=BENCH_USER_BASE).delete()
+        plans, _ = Plan.objects.filter(bot_id=bot_id, name__startswith=BENCH_PLAN_PREFIX).delete()
+        self.stdout.write(self.style.SUCCESS(f"✓ Removed {users} user rows, {plans} plan rows"))
+
+    # ---------- bench ----------
+    async def _bench(self, bot_id: int, user_ids: list[int], iterations: int, warmup: int):
+        import asyncpg
+        from bot.config import settings as bot_settings
+        from bot.subscriptions import SQL_SUB_STATUS
+
+        pool = await asyncpg.create_pool(
+            host=bot_settings.db_host,
+            port=bot_settings.db_port,
+            database=bot_settings.db_name,
+            user=bot_settings.db_user,
+            password=bot_settings.db_password,
+            min_size=1,
+            max_size=1,
+        )
+
+        async def before(uid):
+            await pool.fetchval(LEGACY_SQL_IS_BLOCKED, uid)
+            await pool.fetchrow(LEGACY_SQL_SUB_STATUS, bot_id, uid)
+
+        async def after(uid):
+            await pool.fetchrow(SQL_SUB_STATUS, bot_id, uid)
+
+        rnd = random.Random(42)
+        sample = [rnd.choice(user_ids) for _ in range(iterations)]
+        results = {}
+        try:
+            for label, fn in (("before (2 queries)", before), ("after (1 query)", after)):
+                for uid in sample[:warmup]:
+                    await fn(uid)
+                timings = []
+                for uid in sample:
+                    started = time.perf_counter()
+                    await fn(uid)
+                    timings.append(time.perf_counter() - started)
+                results[label] = timings
+        finally:
+            await pool.close()
+        return results
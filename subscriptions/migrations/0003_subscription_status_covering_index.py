@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 03:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_logdummy'),
+        ('subscriptions', '0002_subscription_amount_subscription_order_reference_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['user', 'bot_id', '-updated_at'], include=('status', 'starts_at', 'expires_at', 'last_payment_date', 'plan'), name='subs_user_bot_updated_idx'),
+        ),
+    ]
@@ -99,6 +99,12 @@ class Subscription(models.Model):
             models.Index(fields=["bot_id", "user", "status"]),
             models.Index(fields=["expires_at"]),
             models.Index(fields=["recurrent_next_payment"]),
+            # Статус в боте: последняя подписка (user, bot_id) по updated_at — index-only scan
+            models.Index(
+                fields=["user", "bot_id", "-updated_at"],
+                include=["status", "starts_at", "expires_at", "last_payment_date", "plan"],
+                name="subs_user_bot_updated_idx",
+            ),
         ]
 
     def __str__(self):
@@ -0,0 +1,26 @@
+# subscriptions/signals.py
+"""
+Сброс каталога тарифов в процессах бота (subscriptions/catalog.py) при изменении Plan.
+"""
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog import PLANS_CHANNEL
+from .models import Plan
+
+
+def notify_plans_changed(bot_id: int) -> None:
+    """NOTIFY для процессов бота (только PostgreSQL)."""
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", [PLANS_CHANNEL, str(bot_id)])
+
+
+@receiver(post_save, sender=Plan)
+@receiver(post_delete, sender=Plan)
+def plan_changed(sender, instance, **kwargs):
+    bot_id = instance.bot_id
+    # После коммита: бот не должен перечитать каталог до того, как изменение видно
+    transaction.on_commit(lambda: notify_plans_changed(bot_id))
@@ -0,0 +1,172 @@
+"""
+Очередь апдейтов вебхука (bot/workers.py).
+
+Покрываем сценарии:
+- B11.1 — порядок внутри чата сохраняется, разные чаты идут параллельно
+- B11.2 — переполнение очереди: 503 вместо неограниченного роста задач
+- B11.3 — извлечение chat_id из сырого апдейта
+"""
+import asyncio
+import pytest
+
+aiogram = pytest.importorskip("aiogram")  # noqa: F401
+
+from bot.workers import ChatOrderedQueue, QueuedRequestHandler, update_chat_key  # noqa: E402
+
+
+def _message(update_id: int, chat_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "U"},
+            "text": f"m{update_id}",
+        },
+    }
+
+
+@pytest.mark.covers("B11.1")
+def test_same_chat_is_sequential_other_chats_parallel():
+    async def scenario():
+        queue = ChatOrderedQueue(workers=4, maxsize=100)
+        queue.start()
+        done: list[tuple[int, int]] = []
+        running = {"now": 0, "max": 0}
+
+        def job(chat_id: int, n: int, delay: float):
+            async def run():
+                running["now"] += 1
+                running["max"] = max(running["max"], running["now"])
+                await asyncio.sleep(delay)
+                running["now"] -= 1
+                done.append((chat_id, n))
+            return run
+
+        # Первый апдейт чата 1 самый медленный — следующие всё равно ждут его
+        for n, delay in enumerate([0.05, 0.0, 0.01]):
+            assert await queue.submit(("bot", 1), job(1, n, delay))
+        # Чат 2 — свой ключ, обработка не зависит от очереди чата 1
+        assert await queue.submit(("bot", 2), job(2, 0, 0.0))
+
+        await queue.close()
+        return done
+
+    done = asyncio.run(scenario())
+    assert [n for chat, n in done if chat == 1] == [0, 1, 2]
+    assert (2, 0) in done
+
+
+@pytest.mark.covers("B11.1")
+def test_slow_chat_does_not_block_other_chats():
+    async def scenario():
+        queue = ChatOrderedQueue(workers=2, maxsize=100)
+        queue.start()
+        release = asyncio.Event()
+        done: list[int] = []
+
+        def job(chat_id: int):
+            async def run():
+                if chat_id == 1:
+                    await release.wait()
+                done.append(chat_id)
+            return run
+
+        # Чат 1 висит, а его второй апдейт ждёт первый; остальные чаты идут мимо
+        assert await queue.submit(("bot", 1), job(1))
+        assert await queue.submit(("bot", 1), job(1))
+        for chat_id in range(2, 12):
+            assert await queue.submit(("bot", chat_id), job(chat_id))
+
+        for _ in range(100):
+            if len(done) == 10:
+                break
+            await asyncio.sleep(0.01)
+        before_release = list(done)
+        release.set()
+        await queue.close()
+        return before_release, done
+
+    before_release, done = asyncio.run(scenario())
+    assert sorted(before_release) == list(range(2, 12))
+    assert done[-2:] == [1, 1]
+
+
+@pytest.mark.covers("B11.2")
+def test_full_queue_answers_503():
+    from aiohttp import web
+    from aiohttp.test_utils import TestClient, TestServer
+    from aiogram import Bot, Dispatcher
+
+    async def scenario():
+        queue = ChatOrderedQueue(workers=1, maxsize=1, put_timeout=0.05)
+        # воркеры не стартуют — очередь не разгружается
+        dp = Dispatcher()
+        bot = Bot(token="42:TEST")
+        app = web.Application()
+        QueuedRequestHandler(dispatcher=dp, bot=bot, queue=queue).register(app, path="/webhook")
+
+        async with TestClient(TestServer(app)) as client:
+            first = await client.post("/webhook", json=_message(1, 10))
+            second = await client.post("/webhook", json=_message(2, 11))
+            statuses = (first.status, second.status)
+
+        await bot.session.close()
+        return statuses, queue.qsize()
+
+    (first, second), qsize = asyncio.run(scenario())
+    assert first == 200
+    assert second == 503
+    assert qsize == 1
+
+
+@pytest.mark.covers("B11.1")
+def test_handler_feeds_dispatcher_in_order():
+    from aiohttp import web
+    from aiohttp.test_utils import TestClient, TestServer
+    from aiogram import Bot, Dispatcher
+    from aiogram.types import Message
+
+    async def scenario():
+        seen: list[str] = []
+        dp = Dispatcher()
+
+        @dp.message()
+        async def on_message(message: Message):
+            # первое сообщение обрабатывается дольше — порядок всё равно сохраняется
+            if message.text == "m1":
+                await asyncio.sleep(0.05)
+            seen.append(message.text)
+
+        queue = ChatOrderedQueue(workers=2, maxsize=10)
+        queue.start()
+        bot = Bot(token="42:TEST")
+        app = web.Application()
+        QueuedRequestHandler(dispatcher=dp, bot=bot, queue=queue).register(app, path="/webhook")
+
+        async with TestClient(TestServer(app)) as client:
+            for i in (1, 2, 3):
+                resp = await client.post("/webhook", json=_message(i, 77))
+                assert resp.status == 200
+
+        await queue.close()
+        await bot.session.close()
+        return seen
+
+    assert asyncio.run(scenario()) == ["m1", "m2", "m3"]
+
+
+@pytest.mark.covers("B11.3")
+def test_update_chat_key():
+    assert update_chat_key(_message(1, 555)) == 555
+    assert update_chat_key({
+        "update_id": 2,
+        "callback_query": {"id": "x", "from": {"id": 9}, "message": {"chat": {"id": 321}}},
+    }) == 321
+    assert update_chat_key({
+        "update_id": 3,
+        "callback_query": {"id": "x", "from": {"id": 9}},
+    }) == 9
+    assert update_chat_key({"update_id": 4, "pre_checkout_query": {"id": "q", "from": {"id": 8}}}) == 8
+    assert update_chat_key({"update_id": 5}) == 5
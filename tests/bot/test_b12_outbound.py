@@ -0,0 +1,187 @@
+"""
+Общий лимитер исходящих сообщений (bot/outbound.py).
+
+Покрываем сценарии:
+- B12.1 — глобальный и per-chat token bucket
+- B12.2 — приоритет уведомлений об оплате над рассылками
+- B12.3 — 429 retry_after: пауза и повтор
+- B12.4 — общий для процессов бюджет токена (SharedLimits)
+"""
+import asyncio
+import pytest
+
+from bot.outbound import (
+    OutboundDispatcher, Priority, RetryAfter, SharedLimits, get_outbound,
+)
+from payments.ratelimit import DatabaseRateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.covers("B12.1")
+def test_global_and_per_chat_limits():
+    clock = FakeClock()
+    out = OutboundDispatcher(global_rate=5, chat_rate=1, chat_burst=1, clock=clock)
+
+    # Один чат: после первого сообщения — ждать ~1 сек
+    assert out.reserve(1, Priority.PAYMENT) == 0.0
+    assert out.reserve(1, Priority.PAYMENT) == pytest.approx(1.0)
+
+    # Разные чаты упираются в глобальный лимит (5 токенов, 1 уже потрачен)
+    assert [out.reserve(100 + i, Priority.PAYMENT) for i in range(4)] == [0.0] * 4
+    assert out.reserve(200, Priority.PAYMENT) == pytest.approx(0.2)
+
+    clock.now += 1.0
+    assert out.reserve(1, Priority.PAYMENT) == 0.0
+
+
+@pytest.mark.covers("B12.1")
+def test_group_chats_use_group_rate():
+    clock = FakeClock()
+    out = OutboundDispatcher(clock=clock)
+    assert out.reserve(-100500) == 0.0
+    assert out.reserve(-100500) == pytest.approx(3.0)
+
+
+@pytest.mark.covers("B12.2")
+def test_bulk_leaves_headroom_for_payments():
+    clock = FakeClock()
+    out = OutboundDispatcher(global_rate=10, clock=clock)
+
+    sent_content = 0
+    while out.reserve(10_000 + sent_content, Priority.CONTENT) == 0.0:
+        sent_content += 1
+    # CONTENT оставляет 20% bucket'а
+    assert sent_content == 8
+    assert out.reserve(1, Priority.PAYMENT) == 0.0
+    assert out.reserve(2, Priority.PAYMENT) == 0.0
+    assert out.reserve(3, Priority.PAYMENT) > 0
+
+
+@pytest.mark.covers("B12.3")
+def test_retry_after_pauses_and_retries_sync():
+    out = OutboundDispatcher()
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RetryAfter(0.01)
+        return "ok"
+
+    assert out.send_sync(42, call, priority=Priority.PAYMENT) == "ok"
+    assert len(calls) == 2
+
+
+@pytest.mark.covers("B12.3")
+def test_retry_after_longer_than_max_wait_is_raised():
+    out = OutboundDispatcher()
+
+    def call():
+        raise RetryAfter(60)
+
+    with pytest.raises(RetryAfter):
+        out.send_sync(42, call, max_wait=5)
+    # Пауза применяется ко всем отправкам токена
+    assert out.reserve(43) > 50
+
+
+@pytest.mark.covers("B12.3")
+def test_async_send_retries_after_flood_control():
+    class FloodError(Exception):
+        retry_after = 0.01
+
+    out = OutboundDispatcher()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) == 1:
+            raise FloodError()
+        return True
+
+    assert asyncio.run(out.send(7, call, priority=Priority.REMINDER)) is True
+    assert len(calls) == 2
+
+
+@pytest.mark.covers("B12.1")
+def test_get_outbound_is_shared_per_token():
+    class FakeBot:
+        token = "123:SHARED"
+
+    assert get_outbound("123:SHARED") is get_outbound(FakeBot())
+    assert get_outbound("123:SHARED") is not get_outbound("456:OTHER")
+    # Моки без токена — без лимитов
+    assert get_outbound(object()).reserve(1) == 0.0
+    assert get_outbound(object()).reserve(1) == 0.0
+
+
+def _process(clock, limiter, **limits):
+    """Dispatcher «другого процесса»: свои bucket'ы, общее хранилище."""
+    shared = SharedLimits(limiter, "123:SHARED", **limits)
+    return OutboundDispatcher(clock=clock, shared=shared, **limits)
+
+
+@pytest.mark.covers("B12.4")
+@pytest.mark.django_db
+def test_processes_share_token_budget():
+    clock = FakeClock()
+    limiter = DatabaseRateLimiter(clock=clock)
+    first = _process(clock, limiter, global_rate=5, chat_rate=1, chat_burst=1)
+    second = _process(clock, limiter, global_rate=5, chat_rate=1, chat_burst=1)
+
+    # Один чат из двух процессов: второй процесс ждёт, хотя его bucket'ы полны
+    assert first._take_shared(1, Priority.PAYMENT) == 0.0
+    assert second.reserve(1, Priority.PAYMENT) == 0.0
+    assert second._take_shared(1, Priority.PAYMENT) == pytest.approx(1.0)
+    # Неиспользованный слот вернулся в bucket'ы процесса
+    assert second.reserve(1, Priority.PAYMENT) == 0.0
+
+    # Глобальный бюджет токена (5/сек) делится между процессами
+    taken = [first._take_shared(100 + i, Priority.PAYMENT) for i in range(2)]
+    taken += [second._take_shared(200 + i, Priority.PAYMENT) for i in range(3)]
+    assert taken == [0.0, 0.0, 0.0, 0.0, pytest.approx(0.2)]
+
+    clock.now += 1.0
+    assert second._take_shared(1, Priority.PAYMENT) == 0.0
+
+
+@pytest.mark.covers("B12.4")
+@pytest.mark.django_db
+def test_shared_budget_keeps_headroom_for_payments():
+    clock = FakeClock()
+    limiter = DatabaseRateLimiter(clock=clock)
+    bulk = _process(clock, limiter, global_rate=10)
+    payments = _process(clock, limiter, global_rate=10)
+
+    sent = 0
+    while bulk._take_shared(10_000 + sent, Priority.CONTENT) == 0.0:
+        sent += 1
+    assert sent == 8
+    assert payments._take_shared(1, Priority.PAYMENT) == 0.0
+
+
+@pytest.mark.covers("B12.4")
+def test_shared_store_failure_falls_back_to_local_limits():
+    class BrokenLimiter:
+        def hit(self, *args, **kwargs):
+            raise ConnectionError("redis is down")
+
+    out = OutboundDispatcher(shared=SharedLimits(BrokenLimiter(), "123:SHARED"))
+    assert out.send_sync(1, lambda: "ok") == "ok"
+
+
+@pytest.mark.covers("B12.4")
+@pytest.mark.django_db
+@pytest.mark.parametrize("backend", ["db", "cache"])
+def test_shared_limits_only_with_redis(settings, backend):
+    from bot.outbound import _shared_limits
+
+    settings.RATELIMIT_BACKEND = backend
+    assert _shared_limits("123:SHARED") is None
@@ -0,0 +1,127 @@
+"""
+Кеш is_blocked в процессе бота (bot/blocked.py, core/signals.py).
+
+Покрываем сценарии:
+- B13.1 — повторные апдейты пользователя не делают запрос is_blocked
+- B13.2 — сброс кеша по NOTIFY из Django и по TTL
+"""
+import asyncio
+import pytest
+
+aiogram = pytest.importorskip("aiogram")  # noqa: F401
+
+from bot.blocked import BlockedUsersCache  # noqa: E402
+from bot.subscriptions import cmd_start  # noqa: E402
+
+
+class FakeFromUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class FakeMessage:
+    def __init__(self, user_id: int):
+        self.from_user = FakeFromUser(user_id)
+        self.last_text = None
+
+    async def answer(self, text: str, reply_markup=None, **kwargs):
+        self.last_text = text
+
+
+class CountingPool:
+    """Мок asyncpg.Pool: считает запросы is_blocked."""
+    def __init__(self, blocked: bool = False):
+        self.blocked = blocked
+        self.calls = 0
+
+    async def fetchval(self, *_args, **_kwargs):
+        self.calls += 1
+        return self.blocked
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.covers("B13.1")
+def test_start_uses_cached_blocked_flag():
+    pool = CountingPool(blocked=False)
+    cache = BlockedUsersCache(ttl=60)
+
+    async def scenario():
+        for _ in range(3):
+            msg = FakeMessage(4242)
+            await cmd_start(msg, pool, blocked_cache=cache)
+            assert "меню" in msg.last_text
+
+    asyncio.run(scenario())
+    assert pool.calls == 1
+
+
+@pytest.mark.covers("B13.2")
+def test_notify_invalidates_user_entry():
+    pool = CountingPool(blocked=False)
+    cache = BlockedUsersCache(ttl=60)
+
+    async def scenario():
+        assert await cache.is_blocked(pool, 1) is False
+        assert await cache.is_blocked(pool, 2) is False
+
+        # Админ забанил пользователя 1 → NOTIFY '1'
+        pool.blocked = True
+        cache.on_notify("1")
+
+        assert await cache.is_blocked(pool, 1) is True
+        # Пользователь 2 остался в кеше
+        assert await cache.is_blocked(pool, 2) is False
+
+    asyncio.run(scenario())
+    assert pool.calls == 3
+
+
+@pytest.mark.covers("B13.2")
+def test_entry_expires_after_ttl():
+    pool = CountingPool(blocked=False)
+    clock = FakeClock()
+    cache = BlockedUsersCache(ttl=10, clock=clock)
+
+    async def scenario():
+        await cache.is_blocked(pool, 7)
+        clock.now = 5
+        await cache.is_blocked(pool, 7)
+        clock.now = 11
+        pool.blocked = True
+        return await cache.is_blocked(pool, 7)
+
+    assert asyncio.run(scenario()) is True
+    assert pool.calls == 2
+
+
+@pytest.mark.covers("B13.2")
+@pytest.mark.django_db
+def test_admin_change_schedules_notify_after_commit(monkeypatch, django_capture_on_commit_callbacks):
+    from core import signals
+    from core.models import TelegramUser
+
+    sent = []
+    monkeypatch.setattr(signals, "notify_blocked_changed", sent.append)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        user = TelegramUser.objects.create(user_id=5005, username="u")
+    assert sent == []
+
+    # Сохранение без изменения is_blocked — без NOTIFY
+    with django_capture_on_commit_callbacks(execute=True):
+        user.username = "renamed"
+        user.save()
+    assert sent == []
+
+    with django_capture_on_commit_callbacks(execute=True):
+        user = TelegramUser.objects.get(pk=user.pk)
+        user.is_blocked = True
+        user.save()
+    assert sent == [5005]
@@ -0,0 +1,117 @@
+"""
+Переподключение LISTEN (bot/listener.py).
+
+Покрываем сценарии:
+- B13.3 — обрыв соединения: release в пул, повторы с паузой, LISTEN заново, сброс кешей
+"""
+import asyncio
+
+import pytest
+
+from bot.listener import PgListener
+
+
+class FakeConn:
+    def __init__(self):
+        self.channels = []
+        self.termination = []
+
+    async def add_listener(self, channel, callback):
+        self.channels.append(channel)
+
+    async def remove_listener(self, channel, callback):
+        self.channels.remove(channel)
+
+    def add_termination_listener(self, callback):
+        self.termination.append(callback)
+
+    def remove_termination_listener(self, callback):
+        self.termination.remove(callback)
+
+    def terminate(self):
+        for callback in list(self.termination):
+            callback(self)
+
+
+class FakePool:
+    """acquire падает, пока down > 0 (БД перезапускается)."""
+
+    def __init__(self):
+        self.down = 0
+        self.acquired = []
+        self.released = []
+
+    async def acquire(self):
+        if self.down:
+            self.down -= 1
+            raise ConnectionRefusedError("database is restarting")
+        conn = FakeConn()
+        self.acquired.append(conn)
+        return conn
+
+    async def release(self, conn):
+        self.released.append(conn)
+
+
+@pytest.mark.covers("B13.3")
+def test_listener_reconnects_with_backoff_and_relistens():
+    pool = FakePool()
+    sleeps = []
+    lost = []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+
+    async def scenario():
+        listener = PgListener(min_backoff=1.0, max_backoff=4.0, sleep=fake_sleep)
+        listener.subscribe("blocked_users", lambda payload: None, on_lost=lambda: lost.append("blocked"))
+        listener.subscribe("plan_catalog", lambda payload: None, on_lost=lambda: lost.append("plans"))
+        await listener.start(pool)
+        first = pool.acquired[0]
+        assert first.channels == ["blocked_users", "plan_catalog"]
+
+        # Обрыв: кеши сброшены, мёртвое соединение возвращено в пул
+        pool.down = 3
+        first.terminate()
+        assert not listener.connected
+        assert lost == ["blocked", "plans"]
+        await listener._reconnect_task
+
+        assert pool.released[0] is first
+        assert sleeps == [1.0, 2.0, 4.0, 4.0]
+        assert listener.connected
+        second = pool.acquired[1]
+        assert second.channels == ["blocked_users", "plan_catalog"]
+        # После восстановления кеши сброшены ещё раз — NOTIFY за обрыв потеряны
+        assert lost == ["blocked", "plans", "blocked", "plans"]
+
+        await listener.close()
+        assert pool.released[-1] is second
+        assert second.channels == [] and second.termination == []
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.covers("B13.3")
+def test_failed_start_keeps_retrying_until_closed():
+    pool = FakePool()
+    pool.down = 100
+    sleeps = []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+        await asyncio.sleep(0)
+
+    async def scenario():
+        listener = PgListener(min_backoff=0.5, sleep=fake_sleep)
+        listener.subscribe("plan_catalog", lambda payload: None)
+        with pytest.raises(ConnectionRefusedError):
+            await listener.start(pool)
+        while len(sleeps) < 3:
+            await asyncio.sleep(0)
+        await listener.close()
+        assert not listener.connected
+        assert listener._reconnect_task is None
+
+    asyncio.run(scenario())
+    assert sleeps[:3] == [0.5, 1.0, 2.0]
@@ -0,0 +1,159 @@
+"""
+Кеш каталога тарифов (subscriptions/catalog.py).
+
+Покрываем сценарии:
+- B14.1 — on_renew отдаёт тарифы и готовую клавиатуру из кеша
+- B14.2 — сохранение/удаление Plan шлёт NOTIFY процессам бота после коммита;
+          сумма инвойса берётся из БД, выключенный тариф недоступен
+"""
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+aiogram = pytest.importorskip("aiogram")  # noqa: F401
+
+from bot.subscriptions import on_renew  # noqa: E402
+from subscriptions.catalog import PlanCatalog  # noqa: E402
+
+
+class FakeFromUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class FakeMessage:
+    def __init__(self):
+        self.last_text = None
+        self.last_markup = None
+
+    async def edit_text(self, text: str, reply_markup=None, **kwargs):
+        self.last_text = text
+        self.last_markup = reply_markup
+
+
+class FakeCallback:
+    def __init__(self, user_id: int):
+        self.from_user = FakeFromUser(user_id)
+        self.message = FakeMessage()
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+
+class FakeBotModel:
+    def __init__(self, bot_id: int):
+        self.id = bot_id
+        self.bot_id = bot_id
+
+
+class FakePool:
+    """Мок asyncpg.Pool: считает запросы тарифов."""
+    def __init__(self, plans):
+        self.plans = plans
+        self.fetch_calls = 0
+
+    async def fetchval(self, *_args, **_kwargs):
+        return False
+
+    async def fetch(self, *_args, **_kwargs):
+        self.fetch_calls += 1
+        return self.plans
+
+
+PLANS = [
+    {"id": 11, "bot_id": 1, "name": "Месяц", "price": Decimal("100"), "currency": "UAH",
+     "duration_days": 30, "enabled": True},
+    {"id": 12, "bot_id": 1, "name": "Год", "price": Decimal("1000"), "currency": "UAH",
+     "duration_days": 365, "enabled": True},
+]
+
+
+@pytest.mark.covers("B14.1")
+def test_renew_uses_cached_plans_and_keyboard():
+    pool = FakePool(PLANS)
+    catalog = PlanCatalog(ttl=600)
+    bot_model = FakeBotModel(1)
+
+    async def scenario():
+        markups = []
+        for _ in range(3):
+            cb = FakeCallback(777)
+            await on_renew(cb, pool, bot_model, catalog=catalog)
+            assert "Выберите тариф" in cb.message.last_text
+            markups.append(cb.message.last_markup)
+        return markups
+
+    markups = asyncio.run(scenario())
+    assert pool.fetch_calls == 1
+    # Клавиатура строится один раз
+    assert markups[0] is markups[1] is markups[2]
+    callbacks = [row[0].callback_data for row in markups[0].inline_keyboard]
+    assert callbacks == ["pay:11", "pay:12", "ui:back"]
+
+
+@pytest.mark.covers("B14.1")
+def test_renew_without_plans_from_catalog():
+    cb = FakeCallback(777)
+    asyncio.run(on_renew(cb, FakePool([]), FakeBotModel(1), catalog=PlanCatalog(ttl=600)))
+    assert cb.message.last_text == "Нет доступных тарифов."
+
+
+@pytest.mark.covers("B14.2")
+def test_notify_invalidates_bot_catalog():
+    pool = FakePool(PLANS)
+    catalog = PlanCatalog(ttl=600)
+
+    async def scenario():
+        await catalog.aget(pool, 1)
+        await catalog.aget(pool, 2)
+        catalog.on_notify("1")
+        await catalog.aget(pool, 1)
+        await catalog.aget(pool, 2)
+
+    asyncio.run(scenario())
+    assert pool.fetch_calls == 3
+
+
+@pytest.mark.covers("B14.2")
+@pytest.mark.django_db
+def test_plan_save_and_delete_notify_bot_processes(monkeypatch, django_capture_on_commit_callbacks):
+    from subscriptions import signals
+    from subscriptions.models import Plan
+
+    notified = []
+    monkeypatch.setattr(signals, "notify_plans_changed", notified.append)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        plan = Plan.objects.create(bot_id=77, name="Месяц", price=100, currency="UAH", duration_days=30)
+        plan.enabled = False
+        plan.save()
+        assert notified == []   # до коммита бот не должен перечитать каталог
+    with django_capture_on_commit_callbacks(execute=True):
+        plan.delete()
+    assert notified == [77, 77, 77]
+
+
+@pytest.mark.covers("B14.2")
+@pytest.mark.django_db
+def test_invoice_amount_ignores_stale_catalog():
+    from payments.wayforpay.services import WayForPayService
+    from subscriptions.models import Plan
+
+    plan = Plan.objects.create(bot_id=78, name="Месяц", price=100, currency="UAH", duration_days=30)
+    pool = FakePool([{"id": plan.id, "bot_id": 78, "name": "Месяц", "price": Decimal("100"),
+                      "currency": "UAH", "duration_days": 30, "enabled": True}])
+    catalog = PlanCatalog(ttl=600)
+    assert asyncio.run(catalog.aget(pool, 78)).get(plan.id).price == Decimal("100")
+
+    # Правка в другом процессе: NOTIFY до бота не дошёл, каталог устарел
+    Plan.objects.filter(pk=plan.pk).update(price=150)
+    assert asyncio.run(catalog.aget(pool, 78)).get(plan.id).price == Decimal("100")
+
+    inv, form_data = WayForPayService().prepare_invoice(bot_id=78, user_id=780001, plan_id=plan.id)
+    assert inv.amount == Decimal("150")
+    assert form_data["amount"] == 150
+
+    Plan.objects.filter(pk=plan.pk).update(enabled=False)
+    with pytest.raises(Plan.DoesNotExist):
+        WayForPayService().prepare_invoice(bot_id=78, user_id=780002, plan_id=plan.id)
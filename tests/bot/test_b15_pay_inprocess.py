@@ -0,0 +1,154 @@
+"""
+Оплата из бота без HTTP-запроса в Django create-invoice/.
+
+Покрываем сценарии:
+- B15.1 — on_pay создаёт Invoice и получает invoiceUrl через session бота;
+          ключи merchant'а берутся из реестра (после ротации — новые)
+- B15.2 — ошибки WayForPay и выключенный тариф (без текста исключения в ответе)
+"""
+import asyncio
+
+import pytest
+
+aiogram = pytest.importorskip("aiogram")  # noqa: F401
+
+from bot.subscriptions import on_pay  # noqa: E402
+
+
+class FakeFromUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class FakeMessage:
+    def __init__(self):
+        self.last_text = None
+        self.last_markup = None
+
+    async def edit_text(self, text: str, reply_markup=None, **kwargs):
+        self.last_text = text
+        self.last_markup = reply_markup
+
+
+class FakeCallback:
+    def __init__(self, user_id: int, data: str):
+        self.from_user = FakeFromUser(user_id)
+        self.data = data
+        self.message = FakeMessage()
+        self.alerts = []
+
+    async def answer(self, text=None, show_alert=False, **kwargs):
+        if text:
+            self.alerts.append(text)
+
+
+class FakeResponse:
+    def __init__(self, status: int, data: dict):
+        self.status = status
+        self._data = data
+
+    async def json(self, **_kwargs):
+        return self._data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    """Мок aiohttp.ClientSession: запоминает запросы к WayForPay."""
+    def __init__(self, status=200, data=None):
+        self.status = status
+        self.data = data if data is not None else {"invoiceUrl": "https://secure.wayforpay.com/invoice/abc"}
+        self.requests = []
+
+    def post(self, url, json=None, **kwargs):
+        self.requests.append((url, json))
+        return FakeResponse(self.status, self.data)
+
+
+@pytest.fixture
+def bot_with_plan(db):
+    from core.models import Bot
+    from payments.models import MerchantConfig
+    from subscriptions.models import Plan
+
+    bot = Bot.objects.create(bot_id=1501, title="Pay Bot", username="pay_bot", token="1501:AAA")
+    MerchantConfig.objects.create(bot=bot, merchant_account="merchant_1501", secret_key="secret")
+    plan = Plan.objects.create(bot_id=bot.id, name="Месяц", price=150, currency="UAH", duration_days=30)
+    bot = Bot.objects.select_related("merchant_config").get(pk=bot.pk)
+    return bot, plan
+
+
+@pytest.mark.covers("B15.1")
+@pytest.mark.django_db(transaction=True)
+def test_on_pay_creates_invoice_in_process(bot_with_plan):
+    from payments.models import Invoice, PaymentStatus
+
+    bot, plan = bot_with_plan
+    session = FakeSession()
+    cb = FakeCallback(150100, f"pay:{plan.id}")
+
+    asyncio.run(on_pay(cb, session, bot))
+
+    assert cb.alerts == []
+    assert cb.message.last_markup.inline_keyboard[0][0].url == "https://secure.wayforpay.com/invoice/abc"
+
+    inv = Invoice.objects.get(user__user_id=150100)
+    assert inv.payment_status == PaymentStatus.PENDING
+    assert inv.plan_id == plan.id
+
+    # Ровно один запрос — прямо в WayForPay, подписанный ключами merchant'а бота
+    assert len(session.requests) == 1
+    url, form = session.requests[0]
+    assert url == bot.merchant_config.api_url
+    assert form["merchantAccount"] == "merchant_1501"
+    assert form["orderReference"] == inv.order_reference
+    assert form["merchantSignature"]
+
+
+@pytest.mark.covers("B15.2")
+@pytest.mark.django_db(transaction=True)
+def test_on_pay_wayforpay_error(bot_with_plan):
+    bot, plan = bot_with_plan
+    cb = FakeCallback(150101, f"pay:{plan.id}")
+
+    asyncio.run(on_pay(cb, FakeSession(status=502, data={}), bot))
+
+    assert cb.alerts == ["Ошибка запроса"]
+    assert cb.message.last_text is None
+
+
+@pytest.mark.covers("B15.2")
+@pytest.mark.django_db(transaction=True)
+def test_on_pay_disabled_plan(bot_with_plan):
+    bot, plan = bot_with_plan
+    plan.enabled = False
+    plan.save()
+    session = FakeSession()
+    cb = FakeCallback(150102, f"pay:{plan.id}")
+
+    asyncio.run(on_pay(cb, session, bot))
+
+    # Текст исключения (Plan.DoesNotExist) пользователю не отдаём
+    assert cb.alerts == ["Не удалось создать счёт, попробуйте позже"]
+    assert session.requests == []
+
+
+@pytest.mark.covers("B15.1")
+@pytest.mark.django_db(transaction=True)
+def test_on_pay_uses_rotated_merchant_keys(bot_with_plan):
+    bot, plan = bot_with_plan
+    # Хост загрузил bot с merchant_config при старте; ключи сменили в админке
+    config = type(bot.merchant_config).objects.get(pk=bot.merchant_config.pk)
+    config.merchant_account = "merchant_1501_new"
+    config.secret_key = "rotated"
+    config.save()
+
+    session = FakeSession()
+    asyncio.run(on_pay(FakeCallback(150103, f"pay:{plan.id}"), session, bot))
+
+    assert bot.merchant_config.merchant_account == "merchant_1501"
+    assert session.requests[0][1]["merchantAccount"] == "merchant_1501_new"
@@ -0,0 +1,125 @@
+"""
+B2.4 — «Моя подписка» за один запрос: is_blocked + последняя подписка.
+
+Ожидание:
+- on_status делает ровно один fetchrow и не вызывает fetchval.
+- Заблокированный пользователь получает «Доступ запрещён» из того же запроса.
+- Флаг бана кладётся в BlockedUsersCache для остальных кнопок.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+aiogram = pytest.importorskip("aiogram")  # noqa: F401
+from bot.blocked import BlockedUsersCache  # noqa: E402
+from bot.subscriptions import on_status  # noqa: E402
+
+
+class FakeFromUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class FakeMessage:
+    def __init__(self):
+        self.last_text = None
+
+    async def edit_text(self, text: str, reply_markup=None, parse_mode=None, **kwargs):
+        self.last_text = text
+
+
+class FakeCallbackQuery:
+    def __init__(self, user_id: int):
+        self.from_user = FakeFromUser(user_id)
+        self.data = "sub:status"
+        self.message = FakeMessage()
+
+    async def answer(self, *_, **__):
+        pass
+
+
+class FakeBotModel:
+    def __init__(self, bot_id: int):
+        self.id = bot_id
+        self.bot_id = bot_id
+
+
+class FakeRecord:
+    """Как asyncpg.Record: доступ по индексу и по имени колонки."""
+    COLUMNS = ("status", "starts_at_utc", "expires_at_utc", "last_payment_utc",
+               "name", "price", "currency", "duration_days", "is_blocked")
+
+    def __init__(self, *values):
+        self._values = values
+
+    def keys(self):
+        return self.COLUMNS
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self.COLUMNS.index(key)]
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+
+class CountingPool:
+    def __init__(self, row):
+        self.row = row
+        self.fetchrow_calls = 0
+
+    async def fetchval(self, *_args, **_kwargs):
+        raise AssertionError("on_status не должен делать отдельный запрос is_blocked")
+
+    async def fetchrow(self, sql, *_args):
+        self.fetchrow_calls += 1
+        assert "is_blocked" in sql and "LIMIT 1" in sql
+        return self.row
+
+
+def _row(is_blocked: bool, status="active"):
+    now = datetime.now(timezone.utc)
+    return FakeRecord(status, now - timedelta(days=1), now + timedelta(days=29), now,
+                      "Месяц", 100, "UAH", 30, is_blocked)
+
+
+@pytest.mark.covers("B2.4")
+def test_status_card_in_single_query():
+    pool = CountingPool(_row(is_blocked=False))
+    cache = BlockedUsersCache(ttl=60)
+    cb = FakeCallbackQuery(555)
+
+    asyncio.run(on_status(cb, pool, FakeBotModel(1), blocked_cache=cache))
+
+    assert pool.fetchrow_calls == 1
+    assert "Статус подписки" in cb.message.last_text
+    assert "Месяц" in cb.message.last_text
+    assert cache._data[555][0] is False
+
+
+@pytest.mark.covers("B2.4")
+def test_blocked_user_from_same_query():
+    pool = CountingPool(_row(is_blocked=True))
+    cache = BlockedUsersCache(ttl=60)
+    cb = FakeCallbackQuery(556)
+
+    asyncio.run(on_status(cb, pool, FakeBotModel(1), blocked_cache=cache))
+
+    assert pool.fetchrow_calls == 1
+    assert "Доступ запрещён" in cb.message.last_text
+    assert cache._data[556][0] is True
+
+
+@pytest.mark.covers("B2.4")
+def test_user_without_subscription():
+    pool = CountingPool(FakeRecord(None, None, None, None, None, None, None, None, False))
+    cb = FakeCallbackQuery(557)
+
+    asyncio.run(on_status(cb, pool, FakeBotModel(1)))
+
+    assert "Подписка не найдена" in cb.message.last_text
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from core.models import Bot
+from botops import nginx, supervisor
+from bot.host import BotHost, load_enabled_bots
+
+
+def _update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": 1,
+            "date": 1700000000,
+            "chat": {"id": 555, "type": "private"},
+            "from": {"id": 555, "is_bot": False, "first_name": "U"},
+            "text": "hello",
+        },
+    }
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.covers("A7.1")
+def test_host_serves_all_enabled_bots_on_one_app():
+    """A7.1: один хост поднимает все включённые боты и роутит /tg/bot-<id>/webhook"""
+    Bot.objects.create(bot_id=901, username="host_a", token="901:AAA", domain_name="example.com")
+    Bot.objects.create(bot_id=903, username="host_b", token="903:BBB", domain_name="example.com")
+    Bot.objects.create(bot_id=904, username="host_off", token="904:CCC", is_enabled=False)
+
+    async def scenario():
+        bot_host = BotHost(pool=None, session=None, set_webhooks=False)
+        app = web.Application()
+        bot_host.setup(app)
+        await bot_host.sync()
+        assert sorted(bot_host.bots) == [901, 903]
+
+        async with TestClient(TestServer(app)) as client:
+            r1 = await client.post("/tg/bot-901/webhook", json=_update(1))
+            r2 = await client.post("/tg/bot-903/webhook", json=_update(2))
+            r3 = await client.post("/tg/bot-904/webhook", json=_update(3))
+        assert r1.status == 200
+        assert r2.status == 200
+        assert r3.status == 404
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.covers("A7.2")
+def test_host_sync_picks_up_new_and_disabled_bots():
+    """A7.2: sync() добавляет новых ботов и убирает выключенных без рестарта"""
+    first = Bot.objects.create(bot_id=911, username="sync_a", token="911:AAA", domain_name="example.com")
+
+    async def scenario():
+        bot_host = BotHost(pool=None, session=None, set_webhooks=False)
+        await bot_host.sync()
+        assert sorted(bot_host.bots) == [911]
+
+        await asyncio.to_thread(
+            Bot.objects.create, bot_id=912, username="sync_b", token="912:BBB", domain_name="example.com"
+        )
+        first.is_enabled = False
+        await asyncio.to_thread(first.save)
+
+        await bot_host.sync()
+        assert sorted(bot_host.bots) == [912]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.covers("A7.2")
+def test_host_sync_recreates_leads_bot_and_deletes_webhook(monkeypatch):
+    """A7.2: изменённый бот лидов пересоздаётся, у выключенного бота снимается вебхук"""
+    from aiogram import Bot as AioBot
+
+    calls = []
+
+    async def set_webhook(self, url, **kwargs):
+        calls.append(("set", self.token))
+
+    async def delete_webhook(self, **kwargs):
+        calls.append(("delete", self.token))
+
+    monkeypatch.setattr(AioBot, "set_webhook", set_webhook)
+    monkeypatch.setattr(AioBot, "delete_webhook", delete_webhook)
+    leads = Bot.objects.create(bot_id=2, username="leads", token="2:LEADS", domain_name="example.com")
+
+    async def scenario():
+        bot_host = BotHost(pool=None, session=None)
+        await bot_host.sync()
+        first = bot_host.bots[2]
+
+        leads.title = "Leads v2"
+        await asyncio.to_thread(leads.save)
+        await bot_host.sync()
+        assert bot_host.bots[2] is not first
+
+        leads.is_enabled = False
+        await asyncio.to_thread(leads.save)
+        await bot_host.sync()
+        assert bot_host.bots == {}
+        await bot_host.tg_session.close()
+
+    asyncio.run(scenario())
+    assert calls == [("set", "2:LEADS"), ("set", "2:LEADS"), ("delete", "2:LEADS")]
+
+
+@pytest.mark.django_db
+@pytest.mark.covers("A7.3")
+def test_load_enabled_bots_filters_by_bot_ids():
+    """A7.3: --bots 1,2,5 ограничивает хост указанными Bot.bot_id"""
+    Bot.objects.create(bot_id=921, token="921:A")
+    Bot.objects.create(bot_id=922, token="922:B")
+    Bot.objects.create(bot_id=923, token="923:C")
+
+    assert [b.bot_id for b in load_enabled_bots([921, 923])] == [921, 923]
+
+
+@pytest.mark.covers("A7.4")
+def test_host_nginx_and_supervisor_configs_are_bot_independent():
+    """A7.4: для хоста нужен один nginx location и одна supervisor-программа"""
+    location = nginx.generate_host_location(8100)
+    assert "~ ^/tg/bot-\\d+/webhook$" in location
+    assert "proxy_pass http://127.0.0.1:8100;" in location
+
+    config = supervisor.generate_host_config(port=8100, log_path="/tmp/bot_host.log")
+    assert "[program:bot_host]" in config
+    assert "--all --port 8100" in config
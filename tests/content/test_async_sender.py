@@ -0,0 +1,130 @@
+# tests/content/test_async_sender.py
+import asyncio
+import pytest
+from datetime import time, timedelta
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
+
+from tests.scenario_cov import covers
+from core.models import Bot, TelegramUser
+from subscriptions.models import Plan, Subscription
+from content.models import ContentTopic, ContentLesson, ContentPost, MediaFileCache, UserContentProgress
+from content.scheduler import send_scheduled_content_async
+
+
+class FakeAsyncBotAPI:
+    """Как aiogram Bot: send_* — корутины с сетевой задержкой."""
+
+    def __init__(self, fail_chats=()):
+        self.sent = []
+        self.uploads = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_chats = set(fail_chats)
+
+    async def _send(self, chat_id, payload):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if chat_id in self.fail_chats:
+                raise RuntimeError("Forbidden: bot was blocked by the user")
+            self.sent.append((chat_id, payload))
+        finally:
+            self.in_flight -= 1
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._send(chat_id, text)
+
+    async def send_video(self, chat_id, video, **kwargs):
+        if not isinstance(video, str):
+            self.uploads += 1
+            video = f"video-{self.uploads}"
+        await self._send(chat_id, video)
+        return {"video": {"file_id": video}}
+
+
+@pytest.fixture
+def course(db):
+    """Курс на 3 дня: в каждом дне три текстовых поста."""
+    bot = Bot.objects.create(bot_id=1, title="Test Bot")
+    plan = Plan.objects.create(bot_id=1, name="Plan", price=100, duration_days=30)
+    topic = ContentTopic.objects.create(bot=bot, title="Topic", sequence_number=1, duration_days=3)
+    for day in (1, 2, 3):
+        lesson = ContentLesson.objects.create(topic=topic, lesson_number=day, enabled=True)
+        for hour in (7, 8, 9):
+            ContentPost.objects.create(lesson=lesson, title=f"{day}-{hour}", content=f"День {day} {hour}:00",
+                                       send_time=time(hour, 0))
+    return plan, topic
+
+
+def _progress(plan, topic, user_id, days_ago):
+    user = TelegramUser.objects.create(user_id=user_id)
+    started = timezone.now() - timedelta(days=days_ago)
+    subscription = Subscription.objects.create(
+        user=user, plan=plan, bot_id=1, status="active", starts_at=started, expires_at=started + timedelta(days=30),
+    )
+    return UserContentProgress.objects.create(user=user, topic=topic, subscription=subscription, started_at=started)
+
+
+def _tick(api, current_time, concurrency):
+    return async_to_sync(send_scheduled_content_async)(1, api, current_time=current_time, concurrency=concurrency)
+
+
+@covers("C10.1")
+@pytest.mark.django_db
+def test_chats_served_concurrently_in_post_order(course):
+    plan, topic = course
+    users = [_progress(plan, topic, 900 + i, days_ago=1) for i in range(6)]
+    last_day = _progress(plan, topic, 950, days_ago=2)
+    api = FakeAsyncBotAPI()
+
+    assert _tick(api, timezone.now().replace(hour=10, minute=0), concurrency=4) == 21
+    assert 1 < api.max_in_flight <= 4
+    for progress in users + [last_day]:
+        chat_id = progress.user.user_id
+        assert [text for chat, text in api.sent if chat == chat_id] == [
+            f"День {progress_day} {hour}:00" for progress_day in [3 if progress is last_day else 2] for hour in (7, 8, 9)
+        ]
+        progress.refresh_from_db()
+        assert progress.last_post_sent.title.endswith("-9")
+    assert last_day.completed is True
+
+    # Повторный тик ничего не отправляет
+    assert _tick(api, timezone.now().replace(hour=10, minute=5), concurrency=4) == 0
+
+
+@covers("C10.1")
+@pytest.mark.django_db
+def test_failed_chat_does_not_block_others_and_progress_saved_per_post(course):
+    plan, topic = course
+    ok = _progress(plan, topic, 960, days_ago=0)
+    blocked = _progress(plan, topic, 961, days_ago=0)
+    api = FakeAsyncBotAPI(fail_chats={961})
+
+    assert _tick(api, timezone.now().replace(hour=8, minute=30), concurrency=2) == 2
+    ok.refresh_from_db()
+    blocked.refresh_from_db()
+    assert ok.last_post_sent.title == "1-8"
+    assert blocked.last_post_sent is None
+
+
+@covers("C10.1")
+@pytest.mark.django_db
+def test_media_uploaded_once_for_concurrent_recipients(course):
+    plan, topic = course
+    lesson = ContentLesson.objects.get(topic=topic, lesson_number=1)
+    ContentPost.objects.filter(lesson=lesson).delete()
+    video = ContentPost.objects.create(
+        lesson=lesson, title="1-видео", content="Подпись",
+        media_file=SimpleUploadedFile("day1.mp4", b"video bytes"), send_time=time(7, 0),
+    )
+    for i in range(5):
+        _progress(plan, topic, 970 + i, days_ago=0)
+    api = FakeAsyncBotAPI()
+
+    assert _tick(api, timezone.now().replace(hour=8, minute=0), concurrency=5) == 5
+    assert api.uploads == 1
+    assert {file_id for _, file_id in api.sent} == {"video-1"}
+    assert MediaFileCache.objects.get(post=video).file_id == "video-1"
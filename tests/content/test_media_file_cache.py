@@ -0,0 +1,114 @@
+# tests/content/test_media_file_cache.py
+import pytest
+from datetime import time
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from tests.scenario_cov import covers
+from core.models import Bot
+from content.models import ContentTopic, ContentLesson, ContentPost, MediaFileCache
+from content.telegram_sender import TelegramContentSender
+
+
+class FakeBotAPI:
+    """Как Bot API: загрузка файла возвращает новый file_id, file_id можно отклонить."""
+
+    def __init__(self, rejected=()):
+        self.calls = []
+        self.rejected = set(rejected)
+        self.uploads = 0
+
+    def _send(self, method, field, chat_id, media, caption=None, **kwargs):
+        if isinstance(media, str):
+            self.calls.append((method, chat_id, media))
+            if media in self.rejected:
+                raise RuntimeError("Telegram server says - Bad Request: wrong file identifier/HTTP URL specified")
+            file_id = media
+        else:
+            self.uploads += 1
+            media.read()
+            file_id = f"{field}-{self.uploads}"
+            self.calls.append((method, chat_id, "upload"))
+        if field == "photo":
+            return {"photo": [{"file_id": f"{file_id}-small"}, {"file_id": file_id}]}
+        return {field: {"file_id": file_id}}
+
+    def send_video(self, chat_id, video, **kwargs):
+        return self._send("send_video", "video", chat_id, video, **kwargs)
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        return self._send("send_photo", "photo", chat_id, photo, **kwargs)
+
+
+@pytest.fixture
+def lesson(db):
+    bot = Bot.objects.create(bot_id=1, title="Test Bot")
+    topic = ContentTopic.objects.create(bot=bot, title="Topic", sequence_number=1, duration_days=30)
+    return ContentLesson.objects.create(topic=topic, lesson_number=1)
+
+
+def _post(lesson, name, data=b"video bytes"):
+    return ContentPost.objects.create(
+        lesson=lesson, title="Медиа", content="Подпись",
+        media_file=SimpleUploadedFile(name, data), send_time=time(8, 0),
+    )
+
+
+@covers("C8.1")
+@pytest.mark.django_db
+def test_media_uploaded_once_then_sent_by_file_id(lesson):
+    video = _post(lesson, "lesson.mp4")
+    photo = _post(lesson, "cover.jpg", b"jpeg bytes")
+    api = FakeBotAPI()
+
+    sender = TelegramContentSender(api, bot_id=1)
+    for chat_id in (101, 102, 103):
+        assert sender.send_post(chat_id, video)
+        assert sender.send_post(chat_id, photo)
+
+    assert api.uploads == 2
+    assert ("send_video", 103, "video-1") in api.calls
+    assert ("send_photo", 103, "photo-2") in api.calls   # самый большой размер
+
+    # Новый отправитель (следующий тик) берёт file_id из БД
+    TelegramContentSender(api, bot_id=1).send_post(104, video)
+    assert api.uploads == 2
+    assert MediaFileCache.objects.get(post=video).file_id == "video-1"
+
+    # Другой бот — свой file_id
+    TelegramContentSender(api, bot_id=2).send_post(105, video)
+    assert api.uploads == 3
+
+
+@covers("C8.2")
+@pytest.mark.django_db
+def test_rejected_file_id_and_replaced_file_upload_again(lesson):
+    video = _post(lesson, "lesson.mp4")
+    api = FakeBotAPI()
+    TelegramContentSender(api, bot_id=1).send_post(101, video)
+
+    api.rejected.add("video-1")
+    assert TelegramContentSender(api, bot_id=1).send_post(102, video)
+    assert api.calls[-2:] == [("send_video", 102, "video-1"), ("send_video", 102, "upload")]
+    assert MediaFileCache.objects.get(post=video).file_id == "video-2"
+
+    # Файл поста заменён — другой хеш, новая загрузка
+    video.media_file.save("lesson-v2.mp4", ContentFile(b"new video bytes"))
+    TelegramContentSender(api, bot_id=1).send_post(103, video)
+    assert api.uploads == 3
+    assert MediaFileCache.objects.filter(post=video).count() == 2
+
+
+@covers("C8.2")
+@pytest.mark.django_db
+def test_other_errors_do_not_drop_cached_file_id(lesson):
+    video = _post(lesson, "lesson.mp4")
+    api = FakeBotAPI()
+    TelegramContentSender(api, bot_id=1).send_post(101, video)
+
+    def blocked(chat_id, video, **kwargs):
+        raise RuntimeError("Forbidden: bot was blocked by the user")
+
+    api.send_video = blocked
+    assert TelegramContentSender(api, bot_id=1).send_post(102, video) is False
+    assert MediaFileCache.objects.get(post=video).file_id == "video-1"
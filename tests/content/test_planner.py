@@ -0,0 +1,201 @@
+# tests/content/test_planner.py
+import pytest
+from datetime import time, timedelta
+from django.utils import timezone
+
+from tests.scenario_cov import covers
+from core.models import Bot, TelegramUser
+from subscriptions.models import Plan, Subscription
+from content.models import ContentTopic, ContentLesson, ContentPost, UserContentProgress
+from content.planner import plan_deliveries, refresh_next_due
+from content.scheduler import send_scheduled_content
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture
+def course(db):
+    """Курс на 3 дня: по два поста в день (07:55 и 20:00)."""
+    bot = Bot.objects.create(bot_id=1, title="Test Bot", token="TOKEN")
+    plan = Plan.objects.create(bot_id=1, name="Plan", price=100, duration_days=30)
+    topic = ContentTopic.objects.create(bot=bot, title="Topic", sequence_number=1, duration_days=3)
+    posts = {}
+    for day in (1, 2, 3):
+        lesson = ContentLesson.objects.create(topic=topic, lesson_number=day, enabled=True)
+        posts[day] = [
+            ContentPost.objects.create(lesson=lesson, title=f"{day}-утро", content=f"День {day} утро", send_time=time(7, 55)),
+            ContentPost.objects.create(lesson=lesson, title=f"{day}-вечер", content=f"День {day} вечер", send_time=time(20, 0)),
+        ]
+    return plan, topic, posts
+
+
+def _progress(plan, topic, user_id, days_ago, **fields):
+    user = TelegramUser.objects.create(user_id=user_id, is_blocked=fields.pop("is_blocked", False))
+    started = timezone.now() - timedelta(days=days_ago)
+    subscription = Subscription.objects.create(
+        user=user, plan=plan, bot_id=1, status=fields.pop("status", "active"),
+        starts_at=started, expires_at=started + timedelta(days=30),
+    )
+    return UserContentProgress.objects.create(
+        user=user, topic=topic, subscription=subscription, started_at=started, **fields
+    )
+
+
+@covers("C7.1")
+@pytest.mark.django_db
+def test_plan_contains_only_due_pairs(course):
+    plan, topic, posts = course
+    day1 = _progress(plan, topic, 701, days_ago=0)
+    day2 = _progress(plan, topic, 702, days_ago=1)
+    day2_sent = _progress(plan, topic, 703, days_ago=1, last_post_sent=posts[2][0])
+    _progress(plan, topic, 704, days_ago=1, is_blocked=True)
+    _progress(plan, topic, 705, days_ago=1, status="expired")
+    _progress(plan, topic, 706, days_ago=10)                       # курс позади
+
+    current_time = timezone.now().replace(hour=8, minute=0)
+    deliveries = plan_deliveries(1, current_time)
+
+    assert {(d.progress_id, d.post_id) for d in deliveries} == {
+        (day1.id, posts[1][0].id),
+        (day2.id, posts[2][0].id),
+    }
+    assert day2_sent.id not in {d.progress_id for d in deliveries}
+    assert {d.chat_id for d in deliveries} == {701, 702}
+
+
+# Выборка строк к тику + advance/plan + запись прогресса + пересчёт next_due_at
+TICK_BUDGET = 14
+# Каждая следующая пачка прогресса (batch_size постов): SAVEPOINT + bulk_update + RELEASE
+BATCH_QUERIES = 3
+
+
+@covers("C7.1")
+@pytest.mark.django_db
+def test_tick_query_count_does_not_grow_with_users(course, django_assert_max_num_queries):
+    plan, topic, posts = course
+    current_time = timezone.now().replace(hour=21, minute=0)
+
+    def tick():
+        api = FakeBotAPI()
+        send_scheduled_content(bot_id=1, bot_api=api, current_time=current_time)
+        return api
+
+    _progress(plan, topic, 710, days_ago=1)
+    with django_assert_max_num_queries(TICK_BUDGET):
+        assert len(tick().sent) == 2
+
+    for i in range(30):
+        _progress(plan, topic, 720 + i, days_ago=i % 2)
+    # 60 постов — две пачки по умолчанию (batch_size=50)
+    with django_assert_max_num_queries(TICK_BUDGET + BATCH_QUERIES):
+        assert len(tick().sent) == 60
+
+    # Повторный тик ничего не отправляет
+    assert tick().sent == []
+
+
+@covers("C7.1")
+@pytest.mark.django_db
+def test_failed_send_does_not_advance_progress(course):
+    plan, topic, posts = course
+    ok = _progress(plan, topic, 730, days_ago=0)
+    failed = _progress(plan, topic, 731, days_ago=0)
+
+    class FailingBotAPI(FakeBotAPI):
+        def send_message(self, chat_id, text, **kwargs):
+            if chat_id == 731:
+                raise RuntimeError("Forbidden: bot was blocked by the user")
+            super().send_message(chat_id, text, **kwargs)
+
+    sent = send_scheduled_content(
+        bot_id=1, bot_api=FailingBotAPI(), current_time=timezone.now().replace(hour=8, minute=0)
+    )
+
+    assert sent == 1
+    ok.refresh_from_db()
+    failed.refresh_from_db()
+    assert ok.last_post_sent == posts[1][0]
+    assert failed.last_post_sent is None
+
+
+@covers("C7.2")
+@pytest.mark.django_db
+def test_last_post_of_last_day_completes_course(course):
+    plan, topic, posts = course
+    progress = _progress(plan, topic, 730, days_ago=2, current_lesson_number=1)
+
+    api = FakeBotAPI()
+    send_scheduled_content(bot_id=1, bot_api=api, current_time=timezone.now().replace(hour=8, minute=0))
+    progress.refresh_from_db()
+    assert api.sent == [(730, "День 3 утро")]
+    assert progress.current_lesson_number == 3
+    assert progress.completed is False
+
+    send_scheduled_content(bot_id=1, bot_api=api, current_time=timezone.now().replace(hour=20, minute=30))
+    progress.refresh_from_db()
+    assert api.sent[-1] == (730, "День 3 вечер")
+    assert progress.last_post_sent == posts[3][1]
+    assert progress.completed is True
+
+
+@covers("C7.2")
+@pytest.mark.django_db
+def test_empty_last_lesson_completes_course(course):
+    plan, topic, posts = course
+    ContentPost.objects.filter(lesson__lesson_number=3).update(enabled=False)
+    progress = _progress(plan, topic, 740, days_ago=2)
+
+    api = FakeBotAPI()
+    assert send_scheduled_content(bot_id=1, bot_api=api, current_time=timezone.now().replace(hour=21, minute=0)) == 0
+    progress.refresh_from_db()
+    assert progress.completed is True
+
+
+@covers("C7.3")
+@pytest.mark.django_db
+def test_tick_between_slots_reads_only_due_rows(course, django_assert_num_queries):
+    plan, topic, posts = course
+    progress = _progress(plan, topic, 750, days_ago=1)
+    today = timezone.now()
+
+    api = FakeBotAPI()
+    send_scheduled_content(bot_id=1, bot_api=api, current_time=today.replace(hour=8, minute=0))
+    assert api.sent == [(750, "День 2 утро")]
+    progress.refresh_from_db()
+    assert progress.next_due_at == today.replace(hour=20, minute=0, second=0, microsecond=0)
+
+    # Между слотами тик — один запрос по индексу next_due_at
+    with django_assert_num_queries(1):
+        assert send_scheduled_content(bot_id=1, bot_api=api, current_time=today.replace(hour=12, minute=0)) == 0
+
+    send_scheduled_content(bot_id=1, bot_api=api, current_time=today.replace(hour=20, minute=1))
+    assert api.sent[-1] == (750, "День 2 вечер")
+    progress.refresh_from_db()
+    assert progress.next_due_at == (today + timedelta(days=1)).replace(hour=7, minute=55, second=0, microsecond=0)
+
+
+@covers("C7.3")
+@pytest.mark.django_db
+def test_schedule_change_resets_next_due(course):
+    plan, topic, posts = course
+    progress = _progress(plan, topic, 760, days_ago=0, last_post_sent=posts[1][0])
+    today = timezone.now()
+
+    refresh_next_due([progress.id], today.replace(hour=8, minute=0))
+    progress.refresh_from_db()
+    assert progress.next_due_at == today.replace(hour=20, minute=0, second=0, microsecond=0)
+
+    # Новый пост в 12:00 — next_due_at сброшен, ближайший тик его отправит
+    ContentPost.objects.create(lesson=posts[1][0].lesson, title="1-день", content="День 1 день", send_time=time(12, 0))
+    progress.refresh_from_db()
+    assert progress.next_due_at is None
+
+    api = FakeBotAPI()
+    send_scheduled_content(bot_id=1, bot_api=api, current_time=today.replace(hour=12, minute=30))
+    assert api.sent == [(760, "День 1 день")]
@@ -0,0 +1,99 @@
+# tests/content/test_prewarm_media.py
+import pytest
+from datetime import time, timedelta
+from io import StringIO
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.utils import timezone
+
+from tests.scenario_cov import covers
+from core.models import Bot, TelegramUser
+from subscriptions.models import Plan, Subscription
+from content.models import ContentTopic, ContentLesson, ContentPost, MediaFileCache, UserContentProgress
+from content.prewarm import prewarm, upcoming_media_posts
+from content.telegram_sender import TelegramContentSender
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self.calls = []
+
+    def send_video(self, chat_id, video, **kwargs):
+        if isinstance(video, str):
+            self.calls.append((chat_id, video))
+            return {"video": {"file_id": video}}
+        video.read()
+        file_id = f"video-{len(self.calls) + 1}"
+        self.calls.append((chat_id, "upload"))
+        return {"video": {"file_id": file_id}}
+
+
+@pytest.fixture
+def course(db):
+    """Курс на 5 дней: в каждом уроке видео и текст."""
+    bot = Bot.objects.create(bot_id=1, title="Test Bot", token="TOKEN")
+    plan = Plan.objects.create(bot_id=1, name="Plan", price=100, duration_days=30)
+    topic = ContentTopic.objects.create(bot=bot, title="Topic", sequence_number=1, duration_days=5)
+    videos = {}
+    for day in range(1, 6):
+        lesson = ContentLesson.objects.create(topic=topic, lesson_number=day, enabled=True)
+        videos[day] = ContentPost.objects.create(
+            lesson=lesson, title=f"{day}-видео", content="Подпись",
+            media_file=SimpleUploadedFile(f"day{day}.mp4", f"video {day}".encode()), send_time=time(8, 0),
+        )
+        ContentPost.objects.create(lesson=lesson, title=f"{day}-текст", content="Текст", send_time=time(9, 0))
+    return plan, topic, videos
+
+
+def _progress(plan, topic, user_id, days_ago):
+    user = TelegramUser.objects.create(user_id=user_id)
+    started = timezone.now() - timedelta(days=days_ago)
+    subscription = Subscription.objects.create(
+        user=user, plan=plan, bot_id=1, status="active", starts_at=started, expires_at=started + timedelta(days=30),
+    )
+    return UserContentProgress.objects.create(user=user, topic=topic, subscription=subscription, started_at=started)
+
+
+@covers("C9.1")
+@pytest.mark.django_db
+def test_prewarm_uploads_upcoming_lessons_once(course):
+    plan, topic, videos = course
+    _progress(plan, topic, 801, days_ago=1)    # день 2
+    _progress(plan, topic, 802, days_ago=1)
+
+    posts = list(upcoming_media_posts(1, days=1))
+    assert [p.id for p in posts] == [videos[2].id, videos[3].id]
+
+    api = FakeBotAPI()
+    stats = prewarm(api, 1, -100500, posts)
+    assert (stats.uploaded, stats.cached, stats.failed) == (2, 0, 0)
+    assert api.calls == [(-100500, "upload"), (-100500, "upload")]
+    assert set(MediaFileCache.objects.values_list("post_id", flat=True)) == {videos[2].id, videos[3].id}
+
+    # Повторный запуск ничего не загружает, рассылка идёт по file_id
+    stats = prewarm(api, 1, -100500, upcoming_media_posts(1, days=1))
+    assert (stats.uploaded, stats.cached) == (0, 2)
+    TelegramContentSender(api, bot_id=1).send_post(801, videos[2])
+    assert api.calls[-1] == (801, "video-1")
+
+
+@covers("C9.1")
+@pytest.mark.django_db
+def test_prewarm_command_selects_lessons(course):
+    plan, topic, videos = course
+    out = StringIO()
+    call_command("prewarm_media", "--bot-id", "1", "--dry-run", stdout=out)
+    assert "DRY RUN: 0 media posts" in out.getvalue()   # активных курсов нет
+
+    _progress(plan, topic, 803, days_ago=0)             # день 1
+    out = StringIO()
+    call_command("prewarm_media", "--bot-id", "1", "--topic", str(topic.id), "--days", "2", "--dry-run", stdout=out)
+    assert "DRY RUN: 3 media posts" in out.getvalue()
+
+    out = StringIO()
+    call_command("prewarm_media", "--bot-id", "1", "--all-lessons", "--dry-run", stdout=out)
+    assert "DRY RUN: 5 media posts" in out.getvalue()
+
+    out = StringIO()
+    call_command("prewarm_media", "--bot-id", "1", stdout=out)
+    assert "Staging chat is not set" in out.getvalue()
@@ -0,0 +1,148 @@
+# tests/payment/test_invoice_http.py
+"""
+CREATE_INVOICE вне транзакции БД и HTTP-клиент WayForPay.
+
+- S19.3 — запрос в WayForPay без открытой транзакции; ошибка → инвойс EXPIRED;
+          параллельный запрос дожидается ссылки «летящего» инвойса
+- S19.4 — повтор только при неустановившемся соединении, таймаут из настроек
+"""
+import time
+
+import httpx
+import pytest
+from django.db import connection
+
+from tests.scenario_cov import covers
+from core.models import TelegramUser
+from payments.models import Invoice, PaymentStatus
+from payments.wayforpay import http as wfp_http
+from payments.wayforpay.services import WayForPayService
+from subscriptions.models import Plan
+
+
+@pytest.fixture
+def plan(db):
+    return Plan.objects.create(bot_id=1902, name="Месяц", price=100, currency="UAH", duration_days=30, enabled=True)
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    """Подменяет общий httpx.Client процесса на клиент с MockTransport."""
+    state = {"handler": None, "requests": []}
+
+    def handle(request):
+        state["requests"].append(request)
+        return state["handler"](request)
+
+    client = httpx.Client(transport=httpx.MockTransport(handle))
+    monkeypatch.setattr(wfp_http, "_client", client)
+    yield state
+    client.close()
+
+
+@covers("S19.3")
+@pytest.mark.django_db(transaction=True)
+def test_wayforpay_call_runs_outside_db_transaction(plan, monkeypatch):
+    seen = {}
+
+    def fake_request(self, form_data):
+        seen["in_atomic"] = connection.in_atomic_block
+        return "https://secure.wayforpay.com/invoice/out"
+
+    monkeypatch.setattr(WayForPayService, "request_invoice_url", fake_request)
+
+    url = WayForPayService().create_invoice(bot_id=1902, user_id=190201, plan_id=plan.id)
+
+    assert url == "https://secure.wayforpay.com/invoice/out"
+    assert seen["in_atomic"] is False
+    assert Invoice.objects.get(user__user_id=190201).invoice_url == url
+
+
+@covers("S19.3")
+@pytest.mark.django_db
+def test_failed_create_marks_invoice_expired_and_next_tap_retries(plan, monkeypatch):
+    def failing_request(self, form_data):
+        raise ValueError("WayForPay API error: 502")
+
+    monkeypatch.setattr(WayForPayService, "request_invoice_url", failing_request)
+    service = WayForPayService()
+
+    with pytest.raises(ValueError):
+        service.create_invoice(bot_id=1902, user_id=190202, plan_id=plan.id)
+    assert Invoice.objects.get(user__user_id=190202).payment_status == PaymentStatus.EXPIRED
+
+    monkeypatch.setattr(WayForPayService, "request_invoice_url", lambda self, form_data: "https://wfp/ok")
+    assert service.create_invoice(bot_id=1902, user_id=190202, plan_id=plan.id) == "https://wfp/ok"
+    assert Invoice.objects.filter(user__user_id=190202).count() == 2
+
+
+@covers("S19.3")
+@pytest.mark.django_db
+def test_concurrent_tap_waits_for_in_flight_invoice(plan, monkeypatch):
+    user = TelegramUser.objects.create(user_id=190203)
+    inflight = Invoice.objects.create(
+        order_reference=Invoice.generate_order_reference(1902, 190203, plan.id),
+        user=user, plan=plan, bot_id=1902, amount=plan.price, currency="UAH",
+        payment_status=PaymentStatus.PENDING,
+    )
+
+    def must_not_call(self, form_data):
+        raise AssertionError("second tap must not create another invoice")
+
+    def first_request_finishes(_seconds):
+        Invoice.objects.filter(pk=inflight.pk).update(invoice_url="https://wfp/first")
+
+    monkeypatch.setattr(WayForPayService, "request_invoice_url", must_not_call)
+    monkeypatch.setattr(time, "sleep", first_request_finishes)
+
+    url = WayForPayService().create_invoice(bot_id=1902, user_id=190203, plan_id=plan.id)
+
+    assert url == "https://wfp/first"
+    assert Invoice.objects.filter(user=user).count() == 1
+
+
+@covers("S19.4")
+def test_post_json_retries_connect_errors(transport, settings):
+    settings.WAYFORPAY_HTTP_RETRIES = 2
+    attempts = iter([httpx.ConnectError("refused"), httpx.ConnectError("refused"), None])
+
+    def handler(request):
+        error = next(attempts)
+        if error is not None:
+            raise error
+        return httpx.Response(200, json={"invoiceUrl": "https://wfp/3"})
+
+    transport["handler"] = handler
+
+    assert wfp_http.post_json("https://api.wayforpay.com/api", {"a": 1}) == {"invoiceUrl": "https://wfp/3"}
+    assert len(transport["requests"]) == 3
+
+
+@covers("S19.4")
+def test_post_json_does_not_retry_sent_request(transport, settings):
+    settings.WAYFORPAY_HTTP_RETRIES = 2
+    settings.WAYFORPAY_HTTP_TIMEOUT = 1.5
+
+    def handler(request):
+        assert request.extensions["timeout"]["read"] == 1.5
+        raise httpx.ReadTimeout("slow gateway")
+
+    transport["handler"] = handler
+
+    with pytest.raises(ValueError):
+        wfp_http.post_json("https://api.wayforpay.com/api", {"a": 1})
+    assert len(transport["requests"]) == 1
+
+
+@covers("S19.4")
+def test_post_json_gives_up_after_retry_budget(transport, settings):
+    settings.WAYFORPAY_HTTP_RETRIES = 1
+
+    def handler(request):
+        raise httpx.ConnectTimeout("no route")
+
+    transport["handler"] = handler
+
+    with pytest.raises(ValueError, match="after 2 attempts"):
+        wfp_http.post_json("https://api.wayforpay.com/api", {"a": 1})
+    assert len(transport["requests"]) == 2
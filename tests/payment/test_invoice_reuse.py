@@ -0,0 +1,103 @@
+# tests/payment/test_invoice_reuse.py
+"""
+Повторное использование PENDING-инвойса при двойном нажатии «Оплатить».
+
+- S19.1 — второй create_invoice отдаёт ту же ссылку, CREATE_INVOICE не вызывается
+- S19.2 — после окна переиспользования / при другой сумме / после оплаты — новый инвойс
+"""
+import asyncio
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from tests.scenario_cov import covers
+from payments.models import Invoice, PaymentStatus
+from payments.wayforpay.services import WayForPayService
+from subscriptions.models import Plan
+
+
+@pytest.fixture
+def plan(db):
+    return Plan.objects.create(bot_id=1901, name="Месяц", price=100, currency="UAH", duration_days=30, enabled=True)
+
+
+@pytest.fixture
+def wfp_calls(monkeypatch):
+    """Подменяет CREATE_INVOICE: каждая ссылка уникальна, вызовы считаются."""
+    calls = []
+
+    def fake_request(self, form_data):
+        calls.append(form_data["orderReference"])
+        return f"https://secure.wayforpay.com/invoice/{len(calls)}"
+
+    monkeypatch.setattr(WayForPayService, "request_invoice_url", fake_request)
+    return calls
+
+
+@covers("S19.1")
+@pytest.mark.django_db
+def test_double_tap_returns_same_invoice_url(plan, wfp_calls):
+    service = WayForPayService()
+
+    url1 = service.create_invoice(bot_id=1901, user_id=190001, plan_id=plan.id)
+    url2 = service.create_invoice(bot_id=1901, user_id=190001, plan_id=plan.id)
+
+    assert url1 == url2 == "https://secure.wayforpay.com/invoice/1"
+    assert len(wfp_calls) == 1
+
+    inv = Invoice.objects.get(user__user_id=190001)
+    assert inv.invoice_url == url1
+    assert inv.payment_status == PaymentStatus.PENDING
+
+
+@covers("S19.1")
+@pytest.mark.django_db(transaction=True)
+def test_double_tap_async_reuses_pending_invoice(plan, wfp_calls):
+    class NoSession:
+        def post(self, *args, **kwargs):
+            raise AssertionError("WayForPay must not be called for a reused invoice")
+
+    service = WayForPayService()
+    url1 = service.create_invoice(bot_id=1901, user_id=190002, plan_id=plan.id)
+    url2 = asyncio.run(service.acreate_invoice(1901, 190002, plan.id, session=NoSession()))
+
+    assert url2 == url1
+    assert Invoice.objects.filter(user__user_id=190002).count() == 1
+
+
+@covers("S19.2")
+@pytest.mark.django_db
+def test_expired_pending_invoice_is_not_reused(plan, wfp_calls, settings):
+    settings.WAYFORPAY_INVOICE_REUSE_SECONDS = 600
+    service = WayForPayService()
+
+    url1 = service.create_invoice(bot_id=1901, user_id=190003, plan_id=plan.id)
+    Invoice.objects.filter(user__user_id=190003).update(created_at=timezone.now() - timedelta(seconds=601))
+
+    url2 = service.create_invoice(bot_id=1901, user_id=190003, plan_id=plan.id)
+
+    assert url2 != url1
+    assert len(wfp_calls) == 2
+    # Старый инвойс не трогаем: его ещё может подтвердить вебхук
+    assert list(
+        Invoice.objects.filter(user__user_id=190003).values_list("payment_status", flat=True)
+    ) == [PaymentStatus.PENDING, PaymentStatus.PENDING]
+
+
+@covers("S19.2")
+@pytest.mark.django_db
+def test_not_reused_for_other_amount_paid_invoice_or_disabled_reuse(plan, wfp_calls, settings):
+    service = WayForPayService()
+
+    service.create_invoice(bot_id=1901, user_id=190004, plan_id=plan.id)
+    service.create_invoice(bot_id=1901, user_id=190004, plan_id=plan.id, amount=50)
+    assert len(wfp_calls) == 2
+
+    Invoice.objects.filter(user__user_id=190004).update(payment_status=PaymentStatus.APPROVED)
+    service.create_invoice(bot_id=1901, user_id=190004, plan_id=plan.id)
+    assert len(wfp_calls) == 3
+
+    settings.WAYFORPAY_INVOICE_REUSE_SECONDS = 0
+    service.create_invoice(bot_id=1901, user_id=190004, plan_id=plan.id)
+    assert len(wfp_calls) == 4
@@ -0,0 +1,97 @@
+# tests/payment/test_invoice_sweeper.py
+"""
+Обслуживание payment_invoices (payments/sweeper.py, manage.py sweep_invoices).
+
+- S29.1 — брошенные PENDING → EXPIRED порциями; автосписания и инвойсы с вебхуком не трогаются
+- S29.2 — payload'ы старых итоговых инвойсов уходят в сжатый архив и читаются из админки
+"""
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import TelegramUser
+from payments.models import Invoice, InvoicePayloadArchive, PaymentStatus
+from payments.sweeper import archive_payloads, expire_abandoned, invoice_payloads
+from subscriptions.models import Plan
+from tests.scenario_cov import covers
+
+
+@pytest.fixture
+def plan(db):
+    return Plan.objects.create(bot_id=1, name="Месяц", price=100, currency="UAH", duration_days=30, enabled=True)
+
+
+def _invoice(plan, user_id, status=PaymentStatus.PENDING, age=timedelta(hours=100), **fields):
+    user, _ = TelegramUser.objects.get_or_create(user_id=user_id)
+    inv = Invoice.objects.create(
+        order_reference=f"ORDER_{user_id}_{Invoice.objects.count()}",
+        user=user, plan=plan, bot_id=1, amount=plan.price, currency=plan.currency,
+        payment_status=status, **fields,
+    )
+    Invoice.objects.filter(pk=inv.pk).update(updated_at=timezone.now() - age)
+    return inv
+
+
+@covers("S29.1")
+@pytest.mark.django_db
+def test_expire_abandoned_in_chunks(plan):
+    abandoned = [_invoice(plan, 2900 + i, raw_request_payload={"amount": 100}) for i in range(5)]
+    no_payload = _invoice(plan, 2910)
+    fresh = _invoice(plan, 2911, age=timedelta(hours=1))
+    charge = _invoice(plan, 2912, raw_request_payload={"recurringCharge": True, "subscriptionId": 1})
+    notified = _invoice(plan, 2913, notified_at=timezone.now() - timedelta(days=5))
+
+    assert expire_abandoned(72, chunk_size=2) == 6
+
+    expired = set(Invoice.objects.filter(payment_status=PaymentStatus.EXPIRED).values_list("pk", flat=True))
+    assert expired == {inv.pk for inv in abandoned} | {no_payload.pk}
+    for inv in (fresh, charge, notified):
+        inv.refresh_from_db()
+        assert inv.payment_status == PaymentStatus.PENDING
+    assert expire_abandoned(72) == 0
+
+
+@covers("S29.2")
+@pytest.mark.django_db
+def test_archive_payloads_and_read_back(plan):
+    request = {"orderReference": "x", "productName": ["Месяц"], "amount": 100}
+    response = {"transactionStatus": "Approved", "amount": 100, "currency": "UAH"}
+    old = [
+        _invoice(plan, 2920 + i, status=PaymentStatus.APPROVED, age=timedelta(days=100),
+                 raw_request_payload=request, raw_response_payload=response)
+        for i in range(3)
+    ]
+    recent = _invoice(plan, 2930, status=PaymentStatus.APPROVED, age=timedelta(days=5), raw_request_payload=request)
+    pending = _invoice(plan, 2931, age=timedelta(days=100), raw_request_payload=request)
+
+    assert archive_payloads(90, chunk_size=2) == 3
+
+    assert InvoicePayloadArchive.objects.count() == 3
+    for inv in old:
+        inv.refresh_from_db()
+        assert inv.raw_request_payload is None and inv.raw_response_payload is None
+        assert invoice_payloads(inv) == {"request": request, "response": response}
+    for inv in (recent, pending):
+        inv.refresh_from_db()
+        assert inv.raw_request_payload == request
+
+    # Поздний вебхук записал payload заново — повторная архивация дополняет архив
+    Invoice.objects.filter(pk=old[0].pk).update(raw_response_payload={"transactionStatus": "Refunded"})
+    assert archive_payloads(90) == 1
+    old[0].refresh_from_db()
+    assert invoice_payloads(old[0]) == {"request": request, "response": {"transactionStatus": "Refunded"}}
+
+
+@covers("S29.2")
+@pytest.mark.django_db
+def test_admin_shows_archived_payloads(admin_client, plan):
+    inv = _invoice(plan, 2940, status=PaymentStatus.DECLINED, age=timedelta(days=100),
+                   raw_response_payload={"transactionStatus": "Declined", "reason": "Недостаточно средств"})
+    call_command("sweep_invoices", "--archive-days", "90")
+
+    page = admin_client.get(reverse("admin:payments_invoice_change", args=[inv.pk]))
+    assert page.status_code == 200
+    assert "Недостаточно средств" in page.content.decode()
@@ -0,0 +1,165 @@
+# tests/payment/test_merchant_registry.py
+"""
+Реестр WayForPayAPI по ботам (payments/wayforpay/registry.py).
+
+- S23.1 — клиент бота кешируется, подпись/проверка вебхука без запросов к конфигам
+- S23.2 — сохранение MerchantConfig / Bot сбрасывает реестр; вебхук с подписью
+  новым ключом перечитывает конфиг
+"""
+import hashlib
+import hmac
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from core.models import Bot, TelegramUser
+from payments.models import Invoice, MerchantConfig, PaymentStatus
+from payments.wayforpay import inbox
+from payments.wayforpay.registry import merchant_registry
+from payments.wayforpay.services import WayForPayService
+from subscriptions.models import Plan
+from tests.scenario_cov import covers
+
+
+@pytest.fixture
+def merchant(db):
+    bot = Bot.objects.create(bot_id=2301, title="Registry Bot", username="registry_bot", token="2301:AAA")
+    config = MerchantConfig.objects.create(bot=bot, merchant_account="registry_merch", secret_key="key_one")
+    return bot, config
+
+
+def _hmac(key, s):
+    return hmac.new(key.encode(), s.encode(), hashlib.md5).hexdigest()
+
+
+@covers("S23.1")
+@pytest.mark.django_db
+def test_registry_caches_bot_client(merchant, django_assert_num_queries):
+    merchant_registry.invalidate()
+
+    with django_assert_num_queries(1):
+        api = merchant_registry.get(2301)
+    with django_assert_num_queries(0):
+        assert merchant_registry.get(2301) is api
+        assert WayForPayService(bot_id=2301).api is api
+
+    assert api.merchant_account == "registry_merch"
+    # Подготовленный ключ даёт ту же подпись, что и обычный hmac
+    assert api.get_ack_signature("ORDER_1", "accept", 100) == _hmac("key_one", "ORDER_1;accept;100")
+    assert api.get_ack_signature("ORDER_2", "accept", 101) == _hmac("key_one", "ORDER_2;accept;101")
+
+
+@covers("S23.1")
+@pytest.mark.django_db
+def test_missing_config_is_cached_and_falls_back(db, django_assert_num_queries):
+    merchant_registry.invalidate()
+    merchant_registry.get(999)
+
+    with django_assert_num_queries(0):
+        assert merchant_registry.get(999) is None
+        assert merchant_registry.for_bot(999) is merchant_registry.default()
+
+
+@covers("S23.1")
+@pytest.mark.django_db
+def test_webhook_merchant_check_and_ack_without_config_queries(merchant, settings):
+    settings.WAYFORPAY_VERIFY_MERCHANT = True
+    user = TelegramUser.objects.create(user_id=777002301)
+    plan = Plan.objects.create(bot_id=2301, name="P", price=10, currency="UAH", duration_days=30)
+    inv = Invoice.objects.create(
+        order_reference=Invoice.generate_order_reference(2301, user.user_id, plan.id),
+        user=user, plan=plan, bot_id=2301, amount=10, currency="UAH",
+        payment_status=PaymentStatus.PENDING,
+    )
+    payload = {
+        "merchantAccount": "registry_merch",
+        "orderReference": inv.order_reference,
+        "amount": 10,
+        "currency": "UAH",
+        "transactionStatus": "DECLINED",
+    }
+    merchant_registry.get(2301)
+    merchant_registry.by_account("registry_merch")
+
+    with CaptureQueriesContext(connection) as ctx:
+        WayForPayService().handle_webhook(payload)
+        ack = inbox.ack(payload)
+
+    assert not [q for q in ctx.captured_queries if "merchant_configs" in q["sql"] or '"bots"' in q["sql"]]
+    assert ack["signature"] == _hmac("key_one", f"{inv.order_reference};accept;{ack['time']}")
+    inv.refresh_from_db()
+    assert inv.payment_status == PaymentStatus.DECLINED
+
+
+@covers("S23.2")
+@pytest.mark.django_db
+def test_merchant_config_save_invalidates_registry(merchant):
+    bot, config = merchant
+    old = merchant_registry.get(2301)
+
+    config.secret_key = "key_two"
+    config.save()
+
+    new = merchant_registry.get(2301)
+    assert new is not old
+    assert new.get_ack_signature("ORDER_1", "accept", 1) == _hmac("key_two", "ORDER_1;accept;1")
+    assert merchant_registry.by_account("registry_merch").secret_key == "key_two"
+
+
+@covers("S23.2")
+@pytest.mark.django_db
+def test_bot_save_and_delete_invalidate_registry(merchant):
+    bot, config = merchant
+    old = merchant_registry.get(2301)
+
+    bot.title = "Renamed"
+    bot.save()
+    assert merchant_registry.get(2301) is not old
+
+    bot.delete()
+    assert merchant_registry.get(2301) is None
+
+
+def _signed(payload, key):
+    from payments.wayforpay.api import WayForPayAPI
+
+    api = WayForPayAPI(merchant_config=MerchantConfig(merchant_account=payload["merchantAccount"], secret_key=key))
+    return {**payload, "merchantSignature": api.get_response_signature(payload)}
+
+
+@covers("S23.2")
+@pytest.mark.django_db
+def test_rotated_key_is_refetched_before_rejecting(merchant, settings):
+    settings.WAYFORPAY_VERIFY_SIGNATURE = True
+    user = TelegramUser.objects.create(user_id=777002302)
+    plan = Plan.objects.create(bot_id=2301, name="P", price=10, currency="UAH", duration_days=30)
+    inv = Invoice.objects.create(
+        order_reference=Invoice.generate_order_reference(2301, user.user_id, plan.id),
+        user=user, plan=plan, bot_id=2301, amount=10, currency="UAH",
+        payment_status=PaymentStatus.PENDING,
+    )
+    payload = {
+        "merchantAccount": "registry_merch",
+        "orderReference": inv.order_reference,
+        "amount": 10,
+        "currency": "UAH",
+        "transactionStatus": "DECLINED",
+    }
+    assert merchant_registry.verify_webhook(_signed(payload, "key_one"))
+
+    # Ключ сменили в другом процессе: сигнал сюда не дошёл, реестр держит старый
+    MerchantConfig.objects.filter(merchant_account="registry_merch").update(secret_key="key_two")
+    assert merchant_registry.by_account("registry_merch").secret_key == "key_one"
+
+    # Подделка по-прежнему не меняет инвойс
+    result = WayForPayService().handle_webhook(_signed(payload, "forged"))
+    assert result == {"status": "accept", "message": "Invalid signature"}
+    inv.refresh_from_db()
+    assert inv.payment_status == PaymentStatus.PENDING
+
+    # Подпись новым ключом: конфиг перечитан, вебхук обработан
+    WayForPayService().handle_webhook(_signed(payload, "key_two"))
+    assert merchant_registry.by_account("registry_merch").secret_key == "key_two"
+    inv.refresh_from_db()
+    assert inv.payment_status == PaymentStatus.DECLINED
@@ -0,0 +1,56 @@
+# tests/payment/test_mismatch_db.py
+"""
+Поиск расхождений amount/currency вебхука средствами БД
+(payments.monitoring.find_amount_currency_mismatches).
+
+- S26.1 — сравнение в SQL: строки/числа в payload, регистр валюты, мусор в amount; наружу только расхождения
+"""
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from core.models import TelegramUser
+from payments.models import Invoice, PaymentStatus
+from payments.monitoring import find_amount_currency_mismatches
+from subscriptions.models import Plan
+from tests.scenario_cov import covers
+
+
+@covers("S26.1")
+@pytest.mark.django_db(transaction=True)
+def test_mismatches_are_selected_in_database(django_assert_num_queries):
+    user = TelegramUser.objects.create(user_id=777002601, username="mm_db")
+    plan = Plan.objects.create(bot_id=1, name="P", price=10, currency="UAH", duration_days=30, enabled=True)
+    now = timezone.now()
+
+    def mk(ref, payload, minutes_ago=10):
+        return Invoice.objects.create(
+            order_reference=ref, user=user, plan=plan, bot_id=1, amount=10, currency="UAH",
+            payment_status=PaymentStatus.APPROVED,
+            raw_response_payload=payload, notified_at=now - timedelta(minutes=minutes_ago),
+        )
+
+    mk("OK-NUM", {"amount": 10, "currency": "UAH"})
+    mk("OK-STR", {"amount": "10", "currency": "uah"})
+    mk("OK-FRACTION", {"amount": 10.5, "currency": "UAH"})
+    mk("OK-GARBAGE", {"amount": "ten"})
+    mk("OK-EMPTY", {})
+    bad_amount = mk("BAD-AMOUNT", {"amount": "9", "currency": "UAH"})
+    mk("BAD-CURRENCY", {"amount": 10, "currency": "usd"}, minutes_ago=20 * 60)
+    mk("BAD-OLD", {"amount": 1, "currency": "EUR"}, minutes_ago=25 * 60)
+
+    # Сводки + один SELECT, который возвращает только расхождения
+    with django_assert_num_queries(2):
+        rows = find_amount_currency_mismatches(window_minutes=24 * 60, bot_id=1)
+
+    assert [r["order_reference"] for r in rows] == ["BAD-AMOUNT", "BAD-CURRENCY"]
+    assert rows[0] == {
+        "invoice_id": bad_amount.id,
+        "order_reference": "BAD-AMOUNT",
+        "invoice_amount": 10,
+        "payload_amount": 9,
+        "invoice_currency": "UAH",
+        "payload_currency": "UAH",
+    }
+    assert rows[1]["payload_currency"] == "USD"
@@ -27,7 +27,7 @@ find_fast_success_bursts = getattr(mod, "find_fast_success_bursts")
 has_fast_success_bursts = getattr(mod, "has_fast_success_bursts")
 
 @covers("S17.1")
-@pytest.mark.django_db
+@pytest.mark.django_db(transaction=True)
 def test_decline_ratio_high_for_recent_window():
     """
     За последний час доля DECLINED > 60% -> триггерим высокий процент отказов.
@@ -69,7 +69,7 @@ def test_decline_ratio_high_for_recent_window():
 
 
 @covers("S17.2")
-@pytest.mark.django_db
+@pytest.mark.django_db(transaction=True)
 def test_fast_success_bursts_from_single_user_are_detected():
     """
     За последние 5 минут один и тот же пользователь сделал >= threshold успешных оплат.
@@ -124,7 +124,7 @@ has_amount_currency_mismatches = getattr(mod, "has_amount_currency_mismatches")
 
 
 @covers("S17.3")
-@pytest.mark.django_db
+@pytest.mark.django_db(transaction=True)
 def test_amount_currency_mismatch_is_detected_in_window():
     """
     В окне мониторинга есть инвойс, где raw_response_payload.amount/currency
@@ -0,0 +1,212 @@
+# tests/payment/test_notification_outbox.py
+"""
+Outbox уведомлений об оплате.
+
+- S20.1 — вебхук APPROVED пишет NotificationOutbox, Telegram не вызывается
+- S20.2 — dispatch_batch: SENT / повтор с задержкой / FAILED; бот заблокирован
+  или чат не найден — FAILED без повторов, бан пользователя не меняется
+"""
+import json
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from core.models import Bot, TelegramUser
+from payments import outbox
+from payments.models import Invoice, NotificationOutbox, NotificationStatus, PaymentStatus
+from subscriptions.models import Plan
+from tests.scenario_cov import covers
+
+
+def _approved(order_ref, amount, tx="TX-OUTBOX-1"):
+    return {
+        "merchantAccount": "test_merch_n1",
+        "orderReference": order_ref,
+        "amount": amount,
+        "currency": "UAH",
+        "transactionStatus": "APPROVED",
+        "reasonCode": "1100",
+        "transactionId": tx,
+    }
+
+
+@pytest.fixture
+def no_telegram(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("Telegram must not be called from the webhook")
+
+    monkeypatch.setattr("payments.notifications.requests.post", fail)
+
+
+class FakeSender:
+    def __init__(self, results):
+        self.results = list(results)
+        self.sent = []
+
+    def send(self, row):
+        self.sent.append(row.pk)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def _row(key="payment_success:REF-1", **kwargs):
+    return NotificationOutbox.objects.create(
+        bot_id=1, chat_id=777, kind=NotificationOutbox.KIND_PAYMENT_SUCCESS,
+        dedup_key=key, payload={"plan_id": 1, "amount": "10", "expires_at": None}, **kwargs,
+    )
+
+
+@covers("S20.1")
+@pytest.mark.django_db
+def test_webhook_enqueues_notification_without_calling_telegram(client, no_telegram):
+    user = TelegramUser.objects.create(user_id=777002001, username="outbox")
+    plan = Plan.objects.create(bot_id=1, name="Outbox Plan", price=10, currency="UAH", duration_days=30, enabled=True)
+    order_ref = Invoice.generate_order_reference(bot_id=1, user_id=user.user_id, plan_id=plan.id)
+    Invoice.objects.create(
+        order_reference=order_ref, user=user, plan=plan, bot_id=1,
+        amount=plan.price, currency=plan.currency, payment_status=PaymentStatus.PENDING,
+    )
+
+    for _ in range(2):  # повтор вебхука не создаёт второе уведомление
+        resp = client.post(
+            "/api/payments/wayforpay/webhook/",
+            data=json.dumps(_approved(order_ref, 10)),
+            content_type="application/json",
+        )
+        assert resp.status_code == 200
+
+    row = NotificationOutbox.objects.get()
+    assert row.status == NotificationStatus.PENDING
+    assert row.bot_id == 1
+    assert row.kind == NotificationOutbox.KIND_PAYMENT_SUCCESS
+    assert row.payload["plan_id"] == plan.id
+    assert row.payload["expires_at"]
+
+
+@covers("S20.2")
+@pytest.mark.django_db
+def test_dispatch_marks_sent_and_schedules_retry():
+    ok, flaky = _row("k:ok"), _row("k:flaky")
+    sender = FakeSender([True, RuntimeError("timeout")])
+
+    stats = outbox.dispatch_batch(batch_size=10, max_attempts=3, sender=sender)
+
+    assert stats == {"sent": 1, "retry": 1, "failed": 0}
+    ok.refresh_from_db()
+    flaky.refresh_from_db()
+    assert ok.status == NotificationStatus.SENT and ok.sent_at is not None
+    assert flaky.status == NotificationStatus.PENDING
+    assert flaky.attempts == 1 and flaky.last_error == "timeout"
+    assert flaky.next_attempt_at > timezone.now()
+
+    # Пока не подошло время повтора, строка не берётся
+    assert outbox.dispatch_batch(sender=FakeSender([])) == {"sent": 0, "retry": 0, "failed": 0}
+
+
+@covers("S20.2")
+@pytest.mark.django_db
+def test_dispatch_fails_after_max_attempts_or_permanent_error():
+    worn = _row("k:worn", attempts=2)
+    gone = _row("k:gone")
+    sender = FakeSender([False, outbox.PermanentError("Bot 1 not found")])
+
+    stats = outbox.dispatch_batch(batch_size=10, max_attempts=3, sender=sender)
+
+    assert stats == {"sent": 0, "retry": 0, "failed": 2}
+    worn.refresh_from_db()
+    gone.refresh_from_db()
+    assert worn.status == NotificationStatus.FAILED and worn.attempts == 3
+    assert gone.status == NotificationStatus.FAILED and gone.last_error == "Bot 1 not found"
+
+
+@covers("S20.2")
+@pytest.mark.django_db
+def test_claimed_rows_are_leased():
+    row = _row()
+    claimed = outbox.claim_batch(10)
+
+    assert [r.pk for r in claimed] == [row.pk]
+    row.refresh_from_db()
+    assert row.next_attempt_at > timezone.now() + timedelta(seconds=outbox.LEASE_SECONDS - 5)
+    assert outbox.claim_batch(10) == []
+
+
+@covers("S20.2")
+@pytest.mark.django_db
+def test_dispatch_command_sends_through_bot_token(monkeypatch):
+    bot = Bot.objects.create(bot_id=2002, title="Outbox Bot", username="outbox_bot", token="2002:AAA")
+    plan = Plan.objects.create(bot_id=bot.id, name="Месяц", price=10, currency="UAH", duration_days=30, enabled=True)
+    NotificationOutbox.objects.create(
+        bot_id=2002, chat_id=777, kind=NotificationOutbox.KIND_PAYMENT_SUCCESS,
+        dedup_key="payment_success:REF-CMD",
+        payload={"plan_id": plan.id, "amount": "10", "expires_at": timezone.now().isoformat()},
+    )
+    calls = []
+
+    class Response:
+        status_code = 200
+
+        def raise_for_status(self):
+            pass
+
+    def fake_post(url, json=None, timeout=None):
+        calls.append((url, json))
+        return Response()
+
+    monkeypatch.setattr("payments.notifications.requests.post", fake_post)
+
+    call_command("dispatch_notifications", "--once")
+
+    assert NotificationOutbox.objects.get().status == NotificationStatus.SENT
+    assert len(calls) == 1
+    url, body = calls[0]
+    assert url == "https://api.telegram.org/bot2002:AAA/sendMessage"
+    assert body["chat_id"] == 777 and "Месяц" in body["text"]
+
+
+@covers("S20.2")
+@pytest.mark.django_db
+@pytest.mark.parametrize("status_code, description", [
+    (403, "Forbidden: bot was blocked by the user"),
+    (400, "Bad Request: chat not found"),
+])
+def test_blocked_or_missing_chat_is_terminal(monkeypatch, status_code, description):
+    bot = Bot.objects.create(bot_id=2003, title="Outbox Bot", username="outbox_bot3", token="2003:AAA")
+    plan = Plan.objects.create(bot_id=bot.id, name="Месяц", price=10, currency="UAH", duration_days=30, enabled=True)
+    user = TelegramUser.objects.create(user_id=777002003)
+    NotificationOutbox.objects.create(
+        bot_id=2003, chat_id=user.user_id, kind=NotificationOutbox.KIND_PAYMENT_SUCCESS,
+        dedup_key="payment_success:REF-BLOCKED", payload={"plan_id": plan.id, "amount": "10", "expires_at": None},
+    )
+    calls = []
+
+    class Response:
+        def __init__(self):
+            self.status_code = status_code
+
+        def json(self):
+            return {"ok": False, "error_code": status_code, "description": description}
+
+        def raise_for_status(self):
+            raise AssertionError("terminal errors are handled before raise_for_status")
+
+    def fake_post(url, json=None, timeout=None):
+        calls.append(url)
+        return Response()
+
+    monkeypatch.setattr("payments.notifications.requests.post", fake_post)
+
+    stats = outbox.dispatch_batch(max_attempts=8)
+
+    assert stats == {"sent": 0, "retry": 0, "failed": 1}
+    assert len(calls) == 1
+    row = NotificationOutbox.objects.get()
+    assert row.status == NotificationStatus.FAILED and row.attempts == 1
+    assert description in row.last_error
+    # is_blocked — бан из админки, недоставка в один бот его не ставит
+    user.refresh_from_db()
+    assert user.is_blocked is False
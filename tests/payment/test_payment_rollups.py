@@ -0,0 +1,162 @@
+# tests/payment/test_payment_rollups.py
+"""
+Поминутные сводки мониторинга (payments/rollups.py).
+
+- S25.1 — вебхук и сохранения Invoice переносят инвойс между бакетами
+- S25.2 — проверки мониторинга читают только сводки; rebuild_payment_metrics пересчитывает их
+"""
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import TelegramUser
+from payments import monitoring
+from payments.models import Invoice, PaymentMetricBucket, PaymentStatus, PaymentUserMetricBucket
+from payments.wayforpay.services import WayForPayService
+from subscriptions.models import Plan
+from tests.scenario_cov import covers
+
+
+@pytest.fixture
+def user_plan(db):
+    user = TelegramUser.objects.create(user_id=777002501, username="rollup")
+    plan = Plan.objects.create(bot_id=1, name="Rollup", price=10, currency="UAH", duration_days=30, enabled=True)
+    return user, plan
+
+
+def _invoice(user, plan, status=PaymentStatus.PENDING, **fields):
+    return Invoice.objects.create(
+        order_reference=Invoice.generate_order_reference(1, user.user_id, plan.id),
+        user=user, plan=plan, bot_id=1, amount=plan.price, currency=plan.currency,
+        payment_status=status, **fields,
+    )
+
+
+def _buckets():
+    out = {}
+    for b in PaymentMetricBucket.objects.all():
+        count, mismatches = out.get((b.status, b.currency), (0, 0))
+        out[(b.status, b.currency)] = (count + b.count, mismatches + b.mismatches)
+    return {k: v for k, v in out.items() if v != (0, 0)}
+
+
+def _approved_by_user():
+    out = {}
+    for b in PaymentUserMetricBucket.objects.all():
+        out[b.user_id] = out.get(b.user_id, 0) + b.approved
+    return {k: v for k, v in out.items() if v}
+
+
+@covers("S25.1")
+@pytest.mark.django_db(transaction=True)
+def test_webhook_fills_rollups(user_plan):
+    user, plan = user_plan
+    inv = _invoice(user, plan)
+    assert _buckets() == {}
+
+    WayForPayService().handle_webhook({
+        "merchantAccount": "test_merch_n1",
+        "orderReference": inv.order_reference,
+        "amount": 10,
+        "currency": "UAH",
+        "transactionStatus": "APPROVED",
+        "reasonCode": "1100",
+    })
+
+    inv.refresh_from_db()
+    assert inv.notified_at is not None
+    assert inv.raw_response_payload["orderReference"] == inv.order_reference
+    assert _buckets() == {("APPROVED", "UAH"): (1, 0)}
+    assert _approved_by_user() == {user.id: 1}
+
+
+@covers("S25.1")
+@pytest.mark.django_db(transaction=True)
+def test_invoice_moves_between_buckets(user_plan):
+    user, plan = user_plan
+    inv = _invoice(user, plan, status=PaymentStatus.DECLINED, notified_at=timezone.now(),
+                   raw_response_payload={"amount": 10, "currency": "USD"})
+    assert _buckets() == {("DECLINED", "UAH"): (1, 1)}
+
+    inv.payment_status = PaymentStatus.APPROVED
+    inv.raw_response_payload = {"amount": 10, "currency": "UAH"}
+    inv.save()
+    assert _buckets() == {("APPROVED", "UAH"): (1, 0)}
+    assert _approved_by_user() == {user.id: 1}
+
+    # Частично загруженный инвойс: исходный бакет читается из БД
+    partial = Invoice.objects.only("id", "payment_status").get(pk=inv.pk)
+    partial.payment_status = PaymentStatus.REFUNDED
+    partial.save(update_fields=["payment_status"])
+    assert _buckets() == {("REFUNDED", "UAH"): (1, 0)}
+    assert _approved_by_user() == {}
+
+    # Поля вне сводок не трогают бакеты
+    inv = Invoice.objects.get(pk=inv.pk)
+    inv.card_pan = "4444"
+    inv.save(update_fields=["card_pan"])
+    assert _buckets() == {("REFUNDED", "UAH"): (1, 0)}
+
+    inv.delete()
+    assert _buckets() == {}
+
+
+@covers("S25.1")
+@pytest.mark.django_db(transaction=True)
+def test_buckets_updated_only_after_commit(user_plan):
+    user, plan = user_plan
+    with transaction.atomic():
+        _invoice(user, plan, status=PaymentStatus.APPROVED, notified_at=timezone.now())
+        # Строку бакета транзакция вебхука не трогает и не блокирует
+        assert _buckets() == {}
+    assert _buckets() == {("APPROVED", "UAH"): (1, 0)}
+
+    with pytest.raises(RuntimeError):
+        with transaction.atomic():
+            _invoice(user, plan, status=PaymentStatus.DECLINED, notified_at=timezone.now())
+            raise RuntimeError("webhook failed")
+    assert _buckets() == {("APPROVED", "UAH"): (1, 0)}
+
+
+@covers("S25.2")
+@pytest.mark.django_db(transaction=True)
+def test_monitoring_reads_only_buckets(user_plan, django_assert_num_queries):
+    user, plan = user_plan
+    now = timezone.now()
+    for status in (PaymentStatus.DECLINED, PaymentStatus.DECLINED, PaymentStatus.APPROVED):
+        _invoice(user, plan, status=status, notified_at=now - timedelta(minutes=3))
+
+    with django_assert_num_queries(1):
+        stats = monitoring.decline_stats(window_minutes=60, bot_id=1)
+    assert stats == {"total": 3, "declined": 2, "ratio": pytest.approx(2 / 3)}
+
+    with django_assert_num_queries(1):
+        assert monitoring.has_fast_success_bursts(window_minutes=5, threshold=1, bot_id=1) is True
+    with django_assert_num_queries(1):
+        assert monitoring.has_amount_currency_mismatches(window_minutes=60, bot_id=1) is False
+    # Нет расхождений в сводках — payment_invoices не читаем
+    with django_assert_num_queries(1):
+        assert monitoring.find_amount_currency_mismatches(window_minutes=60, bot_id=1) == []
+
+
+@covers("S25.2")
+@pytest.mark.django_db(transaction=True)
+def test_rebuild_payment_metrics(user_plan):
+    user, plan = user_plan
+    now = timezone.now()
+    _invoice(user, plan, status=PaymentStatus.APPROVED, notified_at=now - timedelta(minutes=1))
+    _invoice(user, plan, status=PaymentStatus.DECLINED, notified_at=now - timedelta(minutes=2),
+             raw_response_payload={"amount": 9, "currency": "UAH"})
+    expected = (_buckets(), _approved_by_user())
+
+    # Правка в обход сигналов рассинхронизирует сводки
+    Invoice.objects.filter(payment_status=PaymentStatus.DECLINED).update(payment_status=PaymentStatus.APPROVED)
+    PaymentMetricBucket.objects.update(count=0)
+
+    call_command("rebuild_payment_metrics", "--hours", "1")
+    assert _buckets() == {("APPROVED", "UAH"): (2, 1)}
+    assert _approved_by_user() == {user.id: 2}
+    assert expected == ({("APPROVED", "UAH"): (1, 0), ("DECLINED", "UAH"): (1, 1)}, {user.id: 1})
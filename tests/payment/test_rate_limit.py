@@ -0,0 +1,174 @@
+# tests/payment/test_rate_limit.py
+"""
+Общий rate limiter (payments/ratelimit.py).
+
+- S24.1 — GCRA в БД и окно в кеше: всплеск до limit, затем отказ, восстановление по времени;
+          параллельные запросы не превышают лимит
+- S24.2 — create-invoice: лимиты на пользователя и на бота → 429 rate_limited;
+          те же лимиты в acreate_invoice (оплата из процесса бота)
+"""
+import asyncio
+import json
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from payments.models import RateLimitBucket
+from payments.ratelimit import CacheRateLimiter, DatabaseRateLimiter, get_limiter
+from payments.wayforpay.services import InvoiceRateLimited, WayForPayService
+from tests.scenario_cov import covers
+
+INVOICE_URL = "/api/payments/wayforpay/create-invoice/"
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def locmem(settings):
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "rate-limit-s24"}
+    }
+    from django.core.cache import cache
+    cache.clear()
+    return cache
+
+
+@covers("S24.1")
+@pytest.mark.django_db
+def test_database_gcra_burst_and_recovery():
+    clock = FakeClock()
+    limiter = DatabaseRateLimiter(clock=clock)
+
+    assert [limiter.hit("k", 3, 60) for _ in range(4)] == [True, True, True, False]
+    # Отказ не сдвигает TAT
+    assert RateLimitBucket.objects.get(key="k").tat == pytest.approx(clock.now + 60)
+
+    # Через period/limit освобождается ровно один слот
+    clock.now += 20
+    assert limiter.hit("k", 3, 60) is True
+    assert limiter.hit("k", 3, 60) is False
+    # Ключи независимы
+    assert limiter.hit("other", 3, 60) is True
+
+
+@covers("S24.1")
+def test_cache_window_limit_and_reset(locmem):
+    clock = FakeClock(now=1_000_020.0)
+    limiter = CacheRateLimiter(clock=clock)
+
+    assert [limiter.hit("k", 2, 60) for _ in range(3)] == [True, True, False]
+    clock.now += 60
+    assert limiter.hit("k", 2, 60) is True
+
+
+@covers("S24.1")
+def test_cache_limiter_is_atomic_under_threads(locmem):
+    limiter = CacheRateLimiter(clock=FakeClock(now=1_000_020.0))
+    results = []
+    barrier = threading.Barrier(16)
+
+    def worker():
+        barrier.wait()
+        results.append(limiter.hit("burst", 5, 60))
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results.count(True) == 5
+
+
+@covers("S24.1")
+@pytest.mark.django_db
+def test_backend_selection(settings):
+    settings.RATELIMIT_REDIS_URL = None
+    settings.RATELIMIT_BACKEND = "db"
+    assert isinstance(get_limiter(), DatabaseRateLimiter)
+    settings.RATELIMIT_BACKEND = "cache"
+    assert isinstance(get_limiter(), CacheRateLimiter)
+    settings.RATELIMIT_BACKEND = "auto"
+    from django.db import connection
+    expected = DatabaseRateLimiter if connection.vendor == "postgresql" else CacheRateLimiter
+    assert isinstance(get_limiter(), expected)
+
+
+def _post(client, bot_id, user_id):
+    return client.post(
+        INVOICE_URL,
+        data=json.dumps({"bot_id": bot_id, "user_id": user_id, "plan_id": 1}),
+        content_type="application/json",
+    )
+
+
+@covers("S24.2")
+@pytest.mark.django_db
+def test_create_invoice_rate_limited_per_user_and_bot(client, settings):
+    settings.RATELIMIT_BACKEND = "db"
+    settings.INVOICE_RATELIMIT_ENABLED = True
+    settings.INVOICE_RATELIMIT_WINDOW = 60
+    settings.INVOICE_RATELIMIT_PER_USER = 2
+    settings.INVOICE_RATELIMIT_PER_BOT = 3
+
+    # Лимит — в WayForPayService.create_invoice, до записи Invoice
+    with mock.patch(
+        "payments.wayforpay.views.WayForPayService.prepare_invoice",
+        return_value=(SimpleNamespace(invoice_url="https://pay/x"), None),
+    ) as create:
+        assert _post(client, 1, 10).status_code == 200
+        assert _post(client, 1, 10).status_code == 200
+        resp = _post(client, 1, 10)
+        assert resp.status_code == 429
+        assert resp.json() == {"ok": False, "error": "rate_limited"}
+
+        # Другой пользователь того же бота упирается в лимит бота
+        assert _post(client, 1, 11).status_code == 200
+        assert _post(client, 1, 12).status_code == 429
+        # Другой бот — свои счётчики
+        assert _post(client, 2, 10).status_code == 200
+
+    assert create.call_count == 4
+
+
+@covers("S24.2")
+@pytest.mark.django_db
+def test_create_invoice_not_limited_when_disabled(client, settings):
+    settings.INVOICE_RATELIMIT_ENABLED = False
+    settings.INVOICE_RATELIMIT_PER_USER = 1
+
+    with mock.patch(
+        "payments.wayforpay.views.WayForPayService.create_invoice", return_value="https://pay/x"
+    ):
+        assert [_post(client, 1, 10).status_code for _ in range(3)] == [200, 200, 200]
+
+
+@covers("S24.2")
+@pytest.mark.django_db(transaction=True)
+def test_acreate_invoice_applies_same_limits(settings):
+    settings.RATELIMIT_BACKEND = "db"
+    settings.INVOICE_RATELIMIT_ENABLED = True
+    settings.INVOICE_RATELIMIT_WINDOW = 60
+    settings.INVOICE_RATELIMIT_PER_USER = 1
+    settings.INVOICE_RATELIMIT_PER_BOT = 300
+
+    async def call():
+        return await WayForPayService().acreate_invoice(3, 30, 1, session=None)
+
+    with mock.patch.object(
+        WayForPayService, "prepare_invoice",
+        return_value=(SimpleNamespace(invoice_url="https://pay/x"), None),
+    ) as prepare:
+        assert asyncio.run(call()) == "https://pay/x"
+        with pytest.raises(InvoiceRateLimited):
+            asyncio.run(call())
+
+    assert prepare.call_count == 1
@@ -0,0 +1,204 @@
+# tests/payment/test_reconcile.py
+"""
+Сверка зависших инвойсов (payments/reconcile.py) против заглушки
+CHECK_STATUS (httpx.MockTransport вместо api.wayforpay.com).
+
+- S28.1 — зависшие PENDING/PROCESSING находятся и проводятся через путь вебхука;
+          dry-run ничего не меняет; незавершённый статус возвращает PROCESSING в PENDING
+- S28.2 — частота запросов ограничена TokenBucket; вебхук по автосписанию двигает график
+"""
+import json
+from datetime import timedelta
+
+import httpx
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from core.models import TelegramUser
+from payments import recurring
+from payments.models import Invoice, PaymentStatus
+from payments.reconcile import TokenBucket, reconcile, stale_invoices
+from payments.wayforpay import http as wfp_http
+from payments.wayforpay.services import WayForPayService
+from subscriptions.models import Plan, Subscription, SubscriptionStatus
+from tests.scenario_cov import covers
+
+
+class CheckStatusStub:
+    """Заглушка CHECK_STATUS: статус по orderReference."""
+
+    def __init__(self, statuses=None, default="Approved"):
+        self.statuses = statuses or {}
+        self.default = default
+        self.requests = []
+
+    def __call__(self, request):
+        body = json.loads(request.content)
+        self.requests.append(body)
+        status = self.statuses.get(body["orderReference"], self.default)
+        return httpx.Response(200, json={
+            "merchantAccount": body["merchantAccount"],
+            "orderReference": body["orderReference"],
+            "amount": 100,
+            "currency": "UAH",
+            "transactionStatus": status,
+            "reasonCode": 1100,
+            "processingDate": int((timezone.now() - timedelta(days=1)).timestamp()),
+        })
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = CheckStatusStub()
+    client = httpx.Client(transport=httpx.MockTransport(stub))
+    monkeypatch.setattr(wfp_http, "_client", client)
+    yield stub
+    client.close()
+
+
+@pytest.fixture
+def plan(db):
+    return Plan.objects.create(bot_id=1, name="Месяц", price=100, currency="UAH", duration_days=30, enabled=True)
+
+
+def _invoice(plan, user_id, status=PaymentStatus.PENDING, minutes_ago=60, **fields):
+    user = TelegramUser.objects.create(user_id=user_id)
+    inv = Invoice.objects.create(
+        order_reference=Invoice.generate_order_reference(1, user.user_id, plan.id),
+        user=user, plan=plan, bot_id=1, amount=plan.price, currency=plan.currency,
+        payment_status=status, **fields,
+    )
+    Invoice.objects.filter(pk=inv.pk).update(updated_at=timezone.now() - timedelta(minutes=minutes_ago))
+    return inv
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@covers("S28.1")
+@pytest.mark.django_db
+def test_stale_invoices_are_resolved_through_webhook_path(stub, plan):
+    pending = _invoice(plan, 2801)
+    stuck = _invoice(plan, 2802, status="PROCESSING", minutes_ago=20)
+    _invoice(plan, 2803, minutes_ago=5)                          # ещё свежий
+    _invoice(plan, 2804, minutes_ago=60 * 24 * 5)                # слишком старый
+    _invoice(plan, 2805, status=PaymentStatus.APPROVED)          # уже итоговый
+    stub.statuses[pending.order_reference] = "Declined"
+
+    candidates = stale_invoices()
+    assert {inv.pk for inv in candidates} == {pending.pk, stuck.pk}
+
+    call_command("reconcile_invoices", "--rate", "1000")
+
+    assert {r["transactionType"] for r in stub.requests} == {"CHECK_STATUS"}
+    pending.refresh_from_db()
+    stuck.refresh_from_db()
+    assert pending.payment_status == PaymentStatus.DECLINED
+    assert stuck.payment_status == PaymentStatus.APPROVED
+    sub = Subscription.objects.get(user__user_id=2802, bot_id=1)
+    assert sub.status == SubscriptionStatus.ACTIVE
+
+    # Повторный запуск: кандидатов нет
+    assert stale_invoices() == []
+
+
+@covers("S28.1")
+@pytest.mark.django_db
+def test_dry_run_and_in_progress_statuses(stub, plan):
+    stuck = _invoice(plan, 2811, status="PROCESSING", minutes_ago=20)
+    waiting = _invoice(plan, 2812, status="PROCESSING", minutes_ago=20)
+    stub.statuses[waiting.order_reference] = "InProcessing"
+
+    stats = reconcile(stale_invoices(), rate=1000, dry_run=True)
+    assert stats.checked == 2
+    assert stats.outcomes == {"APPROVED": 1, "STILL_PENDING": 1}
+    assert set(Invoice.objects.filter(pk__in=[stuck.pk, waiting.pk]).values_list("payment_status", flat=True)) == {"PROCESSING"}
+    assert not Subscription.objects.filter(user__user_id=2811).exists()
+
+    stats = reconcile(stale_invoices(), rate=1000)
+    assert stats.outcomes == {"APPROVED": 1, "STILL_PENDING": 1}
+    waiting.refresh_from_db()
+    assert waiting.payment_status == PaymentStatus.PENDING
+
+
+@covers("S28.1")
+@pytest.mark.django_db
+def test_unknown_recurring_charge_expires_after_pending_window(stub, plan):
+    fresh = _invoice(plan, 2831, raw_request_payload={"recurringCharge": True})
+    stale = _invoice(plan, 2832, raw_request_payload={"recurringCharge": True})
+    regular = _invoice(plan, 2833)
+    Invoice.objects.filter(pk__in=[stale.pk, regular.pk]).update(
+        created_at=timezone.now() - timedelta(hours=recurring.pending_hours_default() + 1)
+    )
+    # WayForPay этих заказов не знает: ответ без transactionStatus
+    stub.statuses = {inv.order_reference: None for inv in (fresh, stale, regular)}
+
+    stats = reconcile(stale_invoices(), concurrency=2, rate=100)
+    assert stats.outcomes == {"UNKNOWN": 2, "EXPIRED_UNSENT": 1}
+    assert Invoice.objects.get(pk=stale.pk).payment_status == PaymentStatus.EXPIRED
+    assert Invoice.objects.get(pk=fresh.pk).payment_status == PaymentStatus.PENDING
+    assert Invoice.objects.get(pk=regular.pk).payment_status == PaymentStatus.PENDING
+
+
+@covers("S28.1")
+@pytest.mark.django_db
+def test_scan_rotates_through_candidates_beyond_limit(stub, plan):
+    stub.default = "InProcessing"
+    invoices = [_invoice(plan, 2840 + i, minutes_ago=300 - i) for i in range(3)]
+
+    updated = dict(Invoice.objects.values_list("pk", "updated_at"))
+    first = stale_invoices(limit=2)
+    assert [inv.pk for inv in first] == [invoices[0].pk, invoices[1].pk]
+    reconcile(first, rate=100)
+
+    # Непроведённые инвойсы не заслоняют остальные: следующий проход начинает с несверенного
+    assert [inv.pk for inv in stale_invoices(limit=2)] == [invoices[2].pk, invoices[0].pk]
+    # updated_at не сдвинут — пороги зависания и окно max_age_hours прежние
+    assert dict(Invoice.objects.values_list("pk", "updated_at")) == updated
+
+
+@covers("S28.2")
+def test_token_bucket_paces_requests():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+
+    for _ in range(6):
+        bucket.acquire()
+
+    # Всплеск из двух запросов без ожидания, дальше — не чаще 2 в секунду
+    assert clock.sleeps == [0.5, 0.5, 0.5, 0.5]
+    assert clock.now == pytest.approx(2.0)
+
+
+@covers("S28.2")
+@pytest.mark.django_db
+def test_webhook_for_recurring_charge_moves_schedule(plan):
+    user = TelegramUser.objects.create(user_id=2820)
+    now = timezone.now()
+    sub = Subscription.objects.create(
+        user=user, plan=plan, bot_id=1, status=SubscriptionStatus.ACTIVE,
+        starts_at=now - timedelta(days=30), expires_at=now + timedelta(days=1),
+        recurrent_status="Active", recurrent_mode="merchant", card_token="tok_2820",
+        recurrent_next_payment=timezone.localdate(),
+    )
+    [charge] = recurring.claim_due(10)
+    service = WayForPayService(bot_id=1)
+
+    service.handle_webhook({
+        "orderReference": charge.invoice.order_reference, "transactionStatus": "Declined",
+        "amount": 100, "currency": "UAH", "reasonCode": 1104,
+    })
+    sub.refresh_from_db()
+    assert sub.reminder_failed_attempts == 1
+    assert sub.recurrent_next_payment == timezone.localdate() + timedelta(days=1)
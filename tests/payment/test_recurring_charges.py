@@ -0,0 +1,225 @@
+# tests/payment/test_recurring_charges.py
+"""
+Автосписания продлений по токену (payments/recurring.py) против заглушки
+WayForPay (httpx.MockTransport вместо api.wayforpay.com).
+
+- S27.1 — APPROVED: продление через SubscriptionService, следующая дата, уведомление;
+          параллельность запросов ограничена concurrency
+- S27.2 — отказ/пауза, нет ответа → PENDING без повторного списания, вебхук раньше ответа
+"""
+import json
+import threading
+import time
+from datetime import timedelta
+
+import httpx
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from core.models import TelegramUser
+from payments import recurring
+from payments.models import Invoice, NotificationOutbox, PaymentStatus
+from payments.wayforpay import http as wfp_http
+from payments.wayforpay.services import WayForPayService
+from subscriptions.models import Plan, Subscription, SubscriptionStatus
+from tests.scenario_cov import covers
+
+
+class WayForPayStub:
+    """Заглушка CHARGE: статус по orderReference, учёт одновременных запросов."""
+
+    def __init__(self, status="Approved", delay=0.0):
+        self.status = status
+        self.delay = delay
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        body = json.loads(request.content)
+        with self._lock:
+            self.requests.append(body)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            status = self.status(body) if callable(self.status) else self.status
+            if isinstance(status, Exception):
+                raise status
+            return httpx.Response(200, json={
+                "merchantAccount": body["merchantAccount"],
+                "orderReference": body["orderReference"],
+                "amount": body["amount"],
+                "currency": body["currency"],
+                "transactionStatus": status,
+                "reasonCode": 1100 if status == "Approved" else 1104,
+                "recToken": body["recToken"],
+                "cardPan": "444455******1111",
+            })
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = WayForPayStub()
+    client = httpx.Client(transport=httpx.MockTransport(stub))
+    monkeypatch.setattr(wfp_http, "_client", client)
+    yield stub
+    client.close()
+
+
+@pytest.fixture
+def plan(db):
+    return Plan.objects.create(bot_id=1, name="Месяц", price=100, currency="UAH", duration_days=30, enabled=True)
+
+
+def _subscription(plan, user_id, *, mode="merchant", due_days=0, expires_in=0):
+    user = TelegramUser.objects.create(user_id=user_id)
+    now = timezone.now()
+    return Subscription.objects.create(
+        user=user, plan=plan, bot_id=plan.bot_id, status=SubscriptionStatus.ACTIVE,
+        starts_at=now - timedelta(days=30), expires_at=now + timedelta(days=expires_in),
+        recurrent_status="Active", recurrent_mode=mode, card_token=f"tok_{user_id}",
+        recurrent_next_payment=timezone.localdate() - timedelta(days=due_days),
+    )
+
+
+@covers("S27.1")
+@pytest.mark.django_db
+def test_approved_charge_extends_subscription(stub, plan):
+    sub = _subscription(plan, 2701, expires_in=1)
+    not_ours = _subscription(plan, 2702, mode="monthly")   # регулярный платёж WayForPay
+    not_due = _subscription(plan, 2703, due_days=-5)
+    old_expiry = sub.expires_at
+
+    assert recurring.run_batch() == {"APPROVED": 1}
+
+    assert len(stub.requests) == 1
+    request = stub.requests[0]
+    assert request["transactionType"] == "CHARGE"
+    assert request["recToken"] == "tok_2701"
+    assert request["amount"] == 100
+
+    sub.refresh_from_db()
+    assert sub.expires_at == old_expiry + timedelta(days=30)
+    assert sub.recurrent_next_payment == timezone.localdate(sub.expires_at)
+    assert sub.status == SubscriptionStatus.ACTIVE
+
+    inv = Invoice.objects.get(order_reference=request["orderReference"])
+    assert inv.payment_status == PaymentStatus.APPROVED
+    assert inv.subscription_id == sub.id
+    assert sub.order_reference == inv.order_reference
+    assert NotificationOutbox.objects.filter(dedup_key__endswith=inv.order_reference).count() == 1
+
+    # Ни чужой режим, ни подписка не к сроку не тронуты; повторный проход ничего не списывает
+    assert not Invoice.objects.filter(subscription__in=[not_ours, not_due]).exists()
+    assert recurring.run_batch() == {}
+    assert len(stub.requests) == 1
+
+
+@covers("S27.1")
+@pytest.mark.django_db
+def test_charges_run_in_parallel_within_concurrency(stub, plan):
+    stub.delay = 0.05
+    subs = [_subscription(plan, 2710 + i) for i in range(12)]
+
+    call_command("charge_recurring", "--concurrency", "4", "--batch-size", "5")
+
+    assert len(stub.requests) == 12
+    assert stub.max_active == 4
+    assert Subscription.objects.filter(pk__in=[s.pk for s in subs], recurrent_next_payment__gt=timezone.localdate()).count() == 12
+
+
+@covers("S27.2")
+@pytest.mark.django_db
+def test_declined_retries_then_pauses(stub, plan):
+    stub.status = "Declined"
+    sub = _subscription(plan, 2720)
+    today = timezone.localdate()
+
+    assert recurring.run_batch(max_attempts=2, today=today) == {"DECLINED": 1}
+    sub.refresh_from_db()
+    assert sub.reminder_failed_attempts == 1
+    assert sub.recurrent_next_payment == today + timedelta(days=1)
+    assert Invoice.objects.get(subscription=sub).payment_status == PaymentStatus.DECLINED
+
+    # Завтра — вторая попытка с новым orderReference, после неё пауза
+    assert recurring.run_batch(max_attempts=2, today=today + timedelta(days=1)) == {"PAUSED": 1}
+    sub.refresh_from_db()
+    assert sub.recurrent_status == "Paused"
+    assert len({r["orderReference"] for r in stub.requests}) == 2
+    assert recurring.run_batch(max_attempts=2, today=today + timedelta(days=5)) == {}
+
+
+@covers("S27.2")
+@pytest.mark.django_db
+def test_lost_response_keeps_invoice_pending_and_blocks_recharge(stub, plan):
+    stub.status = lambda body: httpx.ReadTimeout("read timeout")
+    sub = _subscription(plan, 2730)
+    today = timezone.localdate()
+
+    assert recurring.run_batch(today=today) == {"PENDING": 1}
+    inv = Invoice.objects.get(subscription=sub)
+    assert inv.payment_status == PaymentStatus.PENDING
+
+    # Пока исход неизвестен, подписка не списывается снова
+    stub.status = "Approved"
+    assert recurring.run_batch(today=today + timedelta(days=3)) == {}
+    assert len(stub.requests) == 1
+
+    # Вебхук по тому же заказу закрывает инвойс и продлевает подписку
+    WayForPayService().handle_webhook({
+        "merchantAccount": "test_merch_n1", "orderReference": inv.order_reference, "amount": 100,
+        "currency": "UAH", "transactionStatus": "APPROVED", "reasonCode": "1100",
+    })
+    inv.refresh_from_db()
+    assert inv.payment_status == PaymentStatus.APPROVED
+
+
+@covers("S27.2")
+@pytest.mark.django_db
+def test_webhook_first_does_not_extend_twice(stub, plan):
+    sub = _subscription(plan, 2740, expires_in=2)
+    charge, = recurring.claim_due(10)
+    response = wfp_http.post_json("https://api.wayforpay.com/api", recurring.charge_request(
+        WayForPayService(bot_id=1).api, charge))
+
+    # Вебхук пришёл раньше, чем движок записал ответ
+    WayForPayService().handle_webhook({**response, "transactionStatus": "APPROVED", "reasonCode": "1100"})
+    sub.refresh_from_db()
+    after_webhook = sub.expires_at
+
+    assert recurring.finish(charge, response, None) == "APPROVED"
+    sub.refresh_from_db()
+    assert sub.expires_at == after_webhook
+    assert sub.recurrent_next_payment == timezone.localdate(after_webhook)
+
+
+@covers("S27.2")
+@pytest.mark.django_db
+def test_unsent_charge_expires_and_stale_pending_stops_blocking(stub, plan):
+    stub.status = lambda body: httpx.ConnectError("connection refused")
+    sub = _subscription(plan, 2750)
+    today = timezone.localdate()
+
+    # Соединение не установилось — запрос точно не ушёл, инвойс не висит в PENDING
+    assert recurring.run_batch(today=today) == {"NOT_SENT": 1}
+    assert Invoice.objects.get(subscription=sub).payment_status == PaymentStatus.EXPIRED
+    sub.refresh_from_db()
+    assert sub.recurrent_next_payment == today + timedelta(days=1)
+    assert sub.reminder_failed_attempts == 0
+
+    # Ответ потерян: PENDING блокирует списания, но только RECURRING_CHARGE_PENDING_HOURS
+    stub.status = lambda body: httpx.ReadTimeout("read timeout")
+    assert recurring.run_batch(today=today + timedelta(days=1)) == {"PENDING": 1}
+    stub.status = "Approved"
+    assert recurring.run_batch(today=today + timedelta(days=2)) == {}
+
+    Invoice.objects.filter(subscription=sub, payment_status=PaymentStatus.PENDING).update(
+        created_at=timezone.now() - timedelta(hours=recurring.pending_hours_default() + 1)
+    )
+    assert recurring.run_batch(today=today + timedelta(days=2)) == {"APPROVED": 1}
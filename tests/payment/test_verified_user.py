@@ -1,6 +1,10 @@
 # tests/test_verified_user.py
 import json
+from datetime import timedelta
+from decimal import Decimal
+
 import pytest
+from django.core.management import call_command
 from django.utils import timezone
 
 from core.models import TelegramUser
@@ -69,3 +73,95 @@ def test_verified_user_counters_increment_after_second_approved(client):
     assert v1.successful_payments_count == 2
     assert int(v1.total_amount_paid) == plan.price * 2
     assert v1.last_payment_date >= first_last_date
+
+
+@covers("S13.2")
+@pytest.mark.django_db
+def test_record_payment_accumulates_in_database():
+    """Третья и далее оплаты не сбрасывают счётчики; первая дата и карта сохраняются."""
+    user = TelegramUser.objects.create(user_id=777002000)
+    VerifiedUser.record_payment(user.pk, 1, 10, card_masked="444455******1111", payment_system="VISA")
+    first = VerifiedUser.objects.get(user=user, bot_id=1).first_payment_date
+
+    VerifiedUser.record_payment(user.pk, 1, 25)
+    VerifiedUser.record_payment(user.pk, 1, "15.50", card_masked="555566******2222")
+
+    v = VerifiedUser.objects.get(user=user, bot_id=1)
+    assert v.successful_payments_count == 3
+    assert v.total_amount_paid == Decimal("50.50")
+    assert v.first_payment_date == first
+    assert v.last_payment_date >= first
+    assert v.card_masked == "555566******2222"
+    assert v.payment_system == "VISA"
+
+
+@covers("S13.3")
+@pytest.mark.django_db
+def test_rebuild_verified_users_from_approved_invoices():
+    plan = Plan.objects.create(bot_id=1, name="Plan-30", price=10, currency="UAH", duration_days=30, enabled=True)
+    alice = TelegramUser.objects.create(user_id=777002101)
+    bob = TelegramUser.objects.create(user_id=777002102)
+    now = timezone.now()
+
+    def invoice(user, amount, status=PaymentStatus.APPROVED, days_ago=0, **fields):
+        return Invoice.objects.create(
+            order_reference=f"ORDER_{user.user_id}_{Invoice.objects.count()}", user=user, plan=plan, bot_id=1,
+            amount=amount, currency="UAH", payment_status=status, paid_at=now - timedelta(days=days_ago), **fields,
+        )
+
+    invoice(alice, 10, days_ago=40, card_pan="444455******1111", payment_system="VISA")
+    invoice(alice, 20, days_ago=10, card_pan="555566******2222")
+    invoice(alice, 99, status=PaymentStatus.DECLINED)
+    invoice(bob, 30, days_ago=1)
+    # Статистика Alice испорчена прежним update_or_create
+    VerifiedUser.objects.create(user=alice, bot_id=1, first_payment_date=now, total_amount_paid=20,
+                                successful_payments_count=1, last_payment_date=now)
+
+    call_command("rebuild_verified_users")
+
+    a = VerifiedUser.objects.get(user=alice, bot_id=1)
+    assert (a.successful_payments_count, a.total_amount_paid) == (2, Decimal("30"))
+    assert a.first_payment_date == now - timedelta(days=40)
+    assert a.last_payment_date == now - timedelta(days=10)
+    assert (a.card_masked, a.payment_system) == ("555566******2222", "VISA")
+    b = VerifiedUser.objects.get(user=bob, bot_id=1)
+    assert (b.successful_payments_count, b.total_amount_paid) == (1, Decimal("30"))
+
+
+@covers("S13.3")
+@pytest.mark.django_db
+def test_rebuild_keeps_regular_payments_missing_from_invoices():
+    plan = Plan.objects.create(bot_id=1, name="Plan-30", price=10, currency="UAH", duration_days=30, enabled=True)
+    user = TelegramUser.objects.create(user_id=777002103)
+    now = timezone.now()
+    Invoice.objects.create(order_reference="ORDER_WFPREG_BASE", user=user, plan=plan, bot_id=1, amount=10,
+                           currency="UAH", payment_status=PaymentStatus.APPROVED, paid_at=now)
+    # Два регулярных платежа _WFPREG- перезаписали базовый инвойс, счётчики их учли
+    VerifiedUser.objects.create(user=user, bot_id=1, first_payment_date=now - timedelta(days=60),
+                                total_amount_paid=30, successful_payments_count=3, last_payment_date=now)
+
+    call_command("rebuild_verified_users")
+    v = VerifiedUser.objects.get(user=user, bot_id=1)
+    assert (v.successful_payments_count, v.total_amount_paid) == (3, Decimal("30"))
+    assert v.first_payment_date == now - timedelta(days=60)
+
+    call_command("rebuild_verified_users", "--reset")
+    v.refresh_from_db()
+    assert (v.successful_payments_count, v.total_amount_paid) == (1, Decimal("10"))
+    assert v.first_payment_date == now
+
+
+@covers("S13.2")
+@pytest.mark.django_db
+def test_manual_payment_counts_invoice_amount():
+    from payments.wayforpay.services import WayForPayService
+
+    plan = Plan.objects.create(bot_id=1, name="Plan-30", price=10, currency="UAH", duration_days=30, enabled=True)
+    user = TelegramUser.objects.create(user_id=777002201)
+    inv = Invoice.objects.create(order_reference="ORDER_MANUAL_1", user=user, plan=plan, bot_id=1,
+                                 amount=plan.price, currency="UAH", payment_status=PaymentStatus.APPROVED)
+
+    WayForPayService(bot_id=1).process_manual_payment(inv)
+
+    v = VerifiedUser.objects.get(user=user, bot_id=1)
+    assert (v.successful_payments_count, v.total_amount_paid, v.payment_system) == (1, Decimal("10"), "MANUAL")
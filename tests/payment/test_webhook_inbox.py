@@ -0,0 +1,171 @@
+# tests/payment/test_webhook_inbox.py
+"""
+Inbox вебхуков WayForPay.
+
+- S21.1 — быстрый подписанный accept без обработки
+- S21.2 — обработка воркером ровно один раз на событие
+- S21.3 — повторы, FAILED и replay_webhooks
+"""
+import hashlib
+import hmac
+import json
+
+import pytest
+from django.core.management import call_command
+
+from core.models import Bot, TelegramUser
+from payments.models import InboxStatus, Invoice, MerchantConfig, PaymentStatus, WebhookInbox
+from payments.wayforpay import inbox
+from payments.wayforpay.services import WayForPayService
+from subscriptions.models import Plan, Subscription
+from tests.scenario_cov import covers
+
+WEBHOOK_URL = "/api/payments/wayforpay/webhook/"
+
+
+@pytest.fixture
+def inbox_mode(settings):
+    settings.WAYFORPAY_WEBHOOK_INBOX = True
+
+
+@pytest.fixture
+def pending_invoice(db):
+    user = TelegramUser.objects.create(user_id=777002101, username="inbox")
+    plan = Plan.objects.create(bot_id=1, name="Inbox Plan", price=10, currency="UAH", duration_days=30, enabled=True)
+    order_ref = Invoice.generate_order_reference(bot_id=1, user_id=user.user_id, plan_id=plan.id)
+    return Invoice.objects.create(
+        order_reference=order_ref, user=user, plan=plan, bot_id=1,
+        amount=plan.price, currency=plan.currency, payment_status=PaymentStatus.PENDING,
+    )
+
+
+def _payload(inv, status="APPROVED"):
+    return {
+        "merchantAccount": "inbox_merchant",
+        "orderReference": inv.order_reference,
+        "amount": int(inv.amount),
+        "currency": "UAH",
+        "transactionStatus": status,
+        "reasonCode": "1100",
+        "transactionId": "TX-INBOX-1",
+    }
+
+
+def _post(client, payload):
+    return client.post(WEBHOOK_URL, data=json.dumps(payload), content_type="application/json")
+
+
+@covers("S21.1")
+@pytest.mark.django_db
+def test_inbox_mode_acks_immediately_with_signature(client, inbox_mode, pending_invoice, monkeypatch):
+    bot = Bot.objects.create(bot_id=2101, title="Inbox Bot", username="inbox_bot", token="2101:AAA")
+    MerchantConfig.objects.create(bot=bot, merchant_account="inbox_merchant", secret_key="inbox_secret")
+
+    def not_now(self, payload):
+        raise AssertionError("handle_webhook must not run in the request")
+
+    monkeypatch.setattr(WayForPayService, "handle_webhook", not_now)
+
+    resp = _post(client, _payload(pending_invoice))
+
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["status"] == "accept"
+    assert body["orderReference"] == pending_invoice.order_reference
+    expected = hmac.new(
+        b"inbox_secret",
+        f"{pending_invoice.order_reference};accept;{body['time']}".encode(),
+        hashlib.md5,
+    ).hexdigest()
+    assert body["signature"] == expected
+
+    entry = WebhookInbox.objects.get()
+    assert entry.status == InboxStatus.NEW
+    assert entry.delivery_key == f"{pending_invoice.order_reference}:APPROVED"
+    assert entry.payload["transactionId"] == "TX-INBOX-1"
+    pending_invoice.refresh_from_db()
+    assert pending_invoice.payment_status == PaymentStatus.PENDING
+
+
+@covers("S21.2")
+@pytest.mark.django_db
+def test_worker_processes_event_once(client, inbox_mode, pending_invoice):
+    for _ in range(3):  # WayForPay повторяет доставку
+        assert _post(client, _payload(pending_invoice)).status_code == 200
+
+    call_command("process_webhook_inbox", "--once")
+
+    statuses = list(WebhookInbox.objects.order_by("id").values_list("status", flat=True))
+    assert statuses == [InboxStatus.DONE, InboxStatus.DUPLICATE, InboxStatus.DUPLICATE]
+    pending_invoice.refresh_from_db()
+    assert pending_invoice.payment_status == PaymentStatus.APPROVED
+    assert Subscription.objects.filter(user=pending_invoice.user, bot_id=1).count() == 1
+    assert WebhookInbox.objects.order_by("id").first().result["status"] == "accept"
+
+
+@covers("S21.2")
+@pytest.mark.django_db
+def test_different_events_of_same_order_are_both_processed(inbox_mode, pending_invoice):
+    first = inbox.store(_payload(pending_invoice, "APPROVED"))
+    second = inbox.store(_payload(pending_invoice, "REFUNDED"))
+
+    assert inbox.process_batch() == {InboxStatus.DONE: 2}
+    assert first.delivery_key != second.delivery_key
+
+
+@covers("S21.2")
+@pytest.mark.django_db
+def test_events_of_same_order_processed_in_arrival_order(inbox_mode, pending_invoice, monkeypatch):
+    approved = inbox.store(_payload(pending_invoice, "APPROVED"))
+    refunded = inbox.store(_payload(pending_invoice, "REFUNDED"))
+    seen = []
+    original = WayForPayService.handle_webhook
+
+    def tracking(self, payload):
+        seen.append(payload["transactionStatus"])
+        return original(self, payload)
+
+    monkeypatch.setattr(WayForPayService, "handle_webhook", tracking)
+
+    # Первое событие заказа забрал другой воркер: второе не забирается
+    assert inbox.claim_batch(1) == [approved.pk]
+    assert inbox.claim_batch(10) == []
+
+    # Даже если до второго дошли раньше, оно ждёт первое
+    assert inbox.process_entry(refunded.pk) == InboxStatus.NEW
+    assert seen == []
+
+    assert inbox.process_entry(approved.pk) == InboxStatus.DONE
+    WebhookInbox.objects.filter(pk=refunded.pk).update(next_attempt_at=approved.received_at)
+    assert inbox.process_batch() == {InboxStatus.DONE: 1}
+    assert seen == ["APPROVED", "REFUNDED"]
+
+
+@covers("S21.3")
+@pytest.mark.django_db
+def test_failures_retry_then_fail_and_replay(inbox_mode, pending_invoice, monkeypatch):
+    entry = inbox.store(_payload(pending_invoice))
+    original = WayForPayService.handle_webhook
+
+    def broken(self, payload):
+        raise RuntimeError("db is down")
+
+    monkeypatch.setattr(WayForPayService, "handle_webhook", broken)
+
+    assert inbox.process_batch(max_attempts=2) == {InboxStatus.NEW: 1}
+    entry.refresh_from_db()
+    assert entry.attempts == 1 and entry.last_error == "db is down"
+    # Повтор — после задержки
+    assert inbox.process_batch(max_attempts=2) == {}
+
+    assert inbox.process_entry(entry.pk, max_attempts=2) == InboxStatus.FAILED
+    entry.refresh_from_db()
+    assert entry.status == InboxStatus.FAILED
+
+    monkeypatch.setattr(WayForPayService, "handle_webhook", original)
+    call_command("replay_webhooks", "--status", "FAILED")
+
+    entry.refresh_from_db()
+    assert entry.status == InboxStatus.DONE
+    pending_invoice.refresh_from_db()
+    assert pending_invoice.payment_status == PaymentStatus.APPROVED
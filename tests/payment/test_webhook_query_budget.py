@@ -0,0 +1,117 @@
+# tests/payment/test_webhook_query_budget.py
+"""
+Бюджет запросов к БД на один вебхук WayForPay.
+
+Invoice, TelegramUser и Plan читаются один раз (Invoice с select_related)
+и передаются дальше по цепочке. Если новая логика добавляет запросы,
+тест падает — бюджет нужно поднимать осознанно.
+
+- S22.1 — APPROVED: новая подписка / продление
+- S22.2 — DECLINED / рекуррентное списание (_WFPREG-)
+
+Счётчик включает SAVEPOINT/RELEASE (тест идёт внутри транзакции).
+"""
+import pytest
+
+from core.models import TelegramUser
+from payments.models import Invoice, NotificationOutbox, PaymentStatus
+from payments.wayforpay.services import WayForPayService
+from subscriptions.models import Plan, Subscription, SubscriptionStatus
+from tests.scenario_cov import covers
+
+# +1 upsert сводки мониторинга на статус, +1 на APPROVED пользователя (payments/rollups.py);
+# VerifiedUser — один upsert вместо update_or_create + save (VerifiedUser.record_payment)
+BUDGET_APPROVED_NEW = 16
+BUDGET_APPROVED_EXTEND = 11
+BUDGET_DECLINED = 5
+BUDGET_RECURRING = 15
+
+
+def _invoice(user, plan, status=PaymentStatus.PENDING):
+    return Invoice.objects.create(
+        order_reference=Invoice.generate_order_reference(1, user.user_id, plan.id),
+        user=user, plan=plan, bot_id=1, amount=plan.price, currency=plan.currency,
+        payment_status=status,
+    )
+
+
+def _payload(order_reference, status="APPROVED"):
+    return {
+        "merchantAccount": "test_merch_n1",
+        "orderReference": order_reference,
+        "amount": 10,
+        "currency": "UAH",
+        "transactionStatus": status,
+        "reasonCode": "1100",
+        "cardPan": "444455******1111",
+        "recToken": "tok_budget",
+        "paymentSystem": "VISA",
+    }
+
+
+@pytest.fixture
+def user_plan(db):
+    user = TelegramUser.objects.create(user_id=777002201, username="budget")
+    plan = Plan.objects.create(bot_id=1, name="Budget", price=10, currency="UAH", duration_days=30, enabled=True)
+    return user, plan
+
+
+@covers("S22.1")
+@pytest.mark.django_db
+def test_approved_new_subscription_query_budget(user_plan, django_assert_max_num_queries):
+    user, plan = user_plan
+    inv = _invoice(user, plan)
+    service = WayForPayService()
+
+    with django_assert_max_num_queries(BUDGET_APPROVED_NEW):
+        assert service.handle_webhook(_payload(inv.order_reference)) == {"status": "accept"}
+
+    inv.refresh_from_db()
+    assert inv.payment_status == PaymentStatus.APPROVED
+    assert inv.subscription_id == Subscription.objects.get(user=user, bot_id=1).id
+    assert inv.card_pan == "444455******1111"
+    assert NotificationOutbox.objects.count() == 1
+
+
+@covers("S22.1")
+@pytest.mark.django_db
+def test_approved_extension_query_budget(user_plan, django_assert_max_num_queries):
+    user, plan = user_plan
+    service = WayForPayService()
+    service.handle_webhook(_payload(_invoice(user, plan).order_reference))
+    first_expiry = Subscription.objects.get(user=user, bot_id=1).expires_at
+
+    second = _invoice(user, plan)
+    with django_assert_max_num_queries(BUDGET_APPROVED_EXTEND):
+        service.handle_webhook(_payload(second.order_reference))
+
+    sub = Subscription.objects.get(user=user, bot_id=1)
+    assert sub.status == SubscriptionStatus.ACTIVE
+    assert sub.expires_at > first_expiry
+    assert sub.order_reference == second.order_reference
+
+
+@covers("S22.2")
+@pytest.mark.django_db
+def test_declined_query_budget(user_plan, django_assert_max_num_queries):
+    user, plan = user_plan
+    inv = _invoice(user, plan)
+
+    with django_assert_max_num_queries(BUDGET_DECLINED):
+        WayForPayService().handle_webhook(_payload(inv.order_reference, "DECLINED"))
+
+    inv.refresh_from_db()
+    assert inv.payment_status == PaymentStatus.DECLINED
+    assert not Subscription.objects.filter(user=user).exists()
+
+
+@covers("S22.2")
+@pytest.mark.django_db
+def test_recurring_charge_query_budget(user_plan, django_assert_max_num_queries):
+    user, plan = user_plan
+    inv = _invoice(user, plan, status=PaymentStatus.APPROVED)
+
+    with django_assert_max_num_queries(BUDGET_RECURRING):
+        WayForPayService().handle_webhook(_payload(f"{inv.order_reference}_WFPREG-1"))
+
+    assert Subscription.objects.filter(user=user, bot_id=1).count() == 1